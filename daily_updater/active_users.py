@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+import hyperloglog
+
+# --- Active Users from DAU Sketches ---
+# WAU, MAU, rolling-N-day actives and DAU/MAU stickiness for any date range
+# and set of countries, from the `dau_sketch` column of the KPI summary.
+# Each (date, country) sketch is merged into one per day, and days are merged
+# over each window. The raw events are never read. Every number is an
+# estimate within the summary's sketch error (hyperloglog.standard_error).
+
+WAU_DAYS = 7
+MAU_DAYS = 30
+
+
+def _daily_registers(summary, start_date, end_date, countries=None):
+    """The days from start to end, and one merged register row per day."""
+    days = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize())
+    precision = hyperloglog.precision_of(summary['dau_sketch']) or hyperloglog.DEFAULT_PRECISION
+    rows = summary[summary['event_date'].between(days[0], days[-1])] if len(days) else summary.iloc[:0]
+    if countries is not None:
+        rows = rows[rows['country'].isin(countries)]
+    registers = np.zeros((len(days), 2 ** precision), dtype=np.uint8)
+    np.maximum.at(registers, days.get_indexer(rows['event_date']),
+                  hyperloglog.to_registers(rows['dau_sketch'].tolist(), precision))
+    return days, registers
+
+
+def active_users(summary, start_date, end_date, countries=None):
+    """Estimated distinct users active from `start_date` to `end_date` (inclusive)."""
+    _, registers = _daily_registers(summary, start_date, end_date, countries)
+    return hyperloglog.estimate(registers.max(axis=0))
+
+
+def rolling_active_users(summary, start_date, end_date, window, countries=None):
+    """
+    For each day from `start_date` to `end_date`, the estimated distinct users
+    active over the `window` days ending that day (7 is WAU, 30 is MAU).
+    """
+    start = pd.Timestamp(start_date).normalize()
+    days, registers = _daily_registers(summary, start - pd.Timedelta(days=window - 1), end_date, countries)
+    windows = np.stack([registers[i:i + window].max(axis=0) for i in range(len(days) - window + 1)])
+    return pd.DataFrame({
+        'event_date': days[window - 1:],
+        f'active_users_{window}d': hyperloglog.estimate(windows),
+    })
+
+
+def engagement(summary, start_date, end_date, countries=None):
+    """Estimated DAU, WAU, MAU and DAU/MAU stickiness for each day from `start_date` to `end_date`."""
+    report = rolling_active_users(summary, start_date, end_date, 1, countries)
+    report.columns = ['event_date', 'dau']
+    report['wau'] = rolling_active_users(summary, start_date, end_date, WAU_DAYS, countries).iloc[:, 1]
+    report['mau'] = rolling_active_users(summary, start_date, end_date, MAU_DAYS, countries).iloc[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        report['stickiness'] = np.where(report['mau'] > 0, report['dau'] / report['mau'], np.nan)
+    return report
@@ -0,0 +1,306 @@
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+import kpi_summary
+import main as daily
+import session_engine as engine
+import storage
+import user_state
+
+# --- Aggregate Simulation ---
+# A population-level version of the daily simulation for load tests that only
+# need `daily_kpi_summary`-shaped output. No user or event is ever built: the
+# population is a count of users per (age, days since last active, country,
+# persona, install source) cell. Every day draws the cell totals from the
+# distributions the per-event rules imply:
+#
+# * returning users: Binomial(eligible users, retention curve x persona multiplier),
+#   with the same 30-day activity window as `user_state.returning_users`;
+# * installs: the handler's daily install count, split over country, persona and
+#   source with a multinomial;
+# * sessions per user: a multinomial over 1, 2 or 3 sessions, by persona and by
+#   returning vs. new user (the probabilities of `simulate_*_users`);
+# * spins: the sum of the uniform spins of every session (drawn one by one for
+#   small cells, from its normal limit for large ones), split over spin costs
+#   with a multinomial; attacks and raids are 2 of the 5 equally likely outcomes;
+# * purchases: per user, Binomial(sessions, purchase chance), so paying users and
+#   purchases come from one multinomial per session count; prices are multinomial.
+#
+# A day is a few hundred vectorized draws over at most a few thousand cells,
+# so its cost doesn't depend on how many users the population holds.
+# A session that runs past midnight also counts towards the next day's DAU
+# and sessions; its spins and purchases stay on the day it started.
+# What the counts can't reproduce: exact DAU sketches (the summary rows carry
+# none), village levels, targets, and experiments (assigned per user).
+
+COUNTRIES = daily.COUNTRIES
+PERSONAS = engine.PERSONAS
+SOURCES = daily.ATTRIBUTION_SOURCES
+DEFAULT_SOURCE = 'organic'  # for users with no install source on record (e.g. from the BigQuery query)
+
+# Ages 0 .. the retention curve's last day, then one bucket for every older user (main.RETURN_PROBS' rows)
+AGES = len(daily.RETURN_PROBS)
+# Days since last active, 0 .. the returning-user window
+LAGS = user_state.RETURNING_WINDOW_DAYS + 1
+
+# The per-event rules of main.simulate_returning_users / simulate_new_users, indexed by persona code
+INSTALL_SOURCE_PROBS = np.array([0.4, 0.25, 0.25, 0.1])
+# P(1, 2, 3 sessions in the day)
+RETURNING_SESSION_PROBS = np.array([[1.0, 0.0, 0.0], [1 / 2, 1 / 2, 0.0], [1 / 3, 1 / 3, 1 / 3]])
+NEW_USER_SESSION_PROBS = np.array([[1.0, 0.0, 0.0], [0.7, 0.15, 0.15], [0.5, 0.25, 0.25]])
+PURCHASE_PROBS = np.array([0.0, engine.LOW_SPENDER_PURCHASE_PROB, engine.HIGH_SPENDER_PURCHASE_PROB])
+LOW_SPENDER_PRICE = 4.99
+SOCIAL_SHARE = 2 / len(engine.OUTCOME_TYPES)  # attack and raid
+# Every session has two session IDs in the events: the app_open row carries its own
+SESSION_IDS_PER_SESSION = 2
+
+# Chance that a session runs past midnight: its mean length over a day (starts are uniform over the
+# day). The engine's mean delays: 10s to the first spin, 13.5s per spin (3.5 + 2, plus 15s for the 2
+# outcomes in 5 that attack or raid and 20s for the 10% of upgrades), then the payers' end-of-session events
+_SPIN_SECONDS = 3.5 + 2 + SOCIAL_SHARE * 15 + engine.UPGRADE_PROB * 20
+_TAIL_SECONDS = np.array([0.0, 3 + 1.5 + engine.LOW_SPENDER_PURCHASE_PROB * 27.5,
+                          3 + 1.5 + engine.HIGH_SPENDER_PURCHASE_PROB * 20])
+SPILL_PROBS = (10 + _SPIN_SECONDS * (engine.SPINS_LOW + engine.SPINS_HIGH) / 2 + _TAIL_SECONDS) / 86_400
+
+# Spin totals of cells with at most this many sessions are drawn spin by spin
+EXACT_SUM_SESSIONS = 64
+
+CELL_COLUMNS = [
+    'event_date', 'country', 'persona', 'install_source', 'eligible_users', 'returning_users', 'installs',
+    'active_users', 'spilled_sessions', 'sessions', 'spins', 'spins_used', 'social_actions', 'purchases', 'paying_users', 'revenue',
+]
+
+
+# Chance to return for each (age, persona), broadcast over the population counts
+_RETURN_PROBS = np.broadcast_to(np.minimum(daily.RETURN_PROBS, 1.0)[:, None, None, :, None],
+                                (AGES, LAGS, len(COUNTRIES), len(PERSONAS), len(SOURCES))).ravel()
+_INSTALL_MIX = (np.full(len(COUNTRIES), 1 / len(COUNTRIES))[:, None, None]
+                * np.array([daily.PERSONA_DISTRIBUTION[p] for p in PERSONAS])[None, :, None]
+                * INSTALL_SOURCE_PROBS[None, None, :]).ravel()
+
+
+def daily_installs(rng, scale=1.0):
+    """The handler's number of installs for a day (see main.draw_new_users), times `scale`."""
+    if rng.random() <= 0.80:
+        variance = rng.integers(10, 21)
+    else:
+        variance = rng.integers(-15, -7)
+    return int(round(max(daily.BASE_INSTALLS_PER_DAY + variance, 5) * scale))
+
+
+def _sum_uniform(rng, n, low, high):
+    """Per cell, the sum of `n` uniform integers in [low, high]."""
+    n = np.asarray(n, dtype=np.int64)
+    total = np.zeros(len(n), dtype=np.int64)
+    small = np.flatnonzero((n > 0) & (n <= EXACT_SUM_SESSIONS))
+    if len(small):
+        draws = rng.integers(low, high + 1, n[small].sum())
+        total[small] = np.bincount(np.repeat(np.arange(len(small)), n[small]), weights=draws,
+                                   minlength=len(small)).astype(np.int64)
+    large = np.flatnonzero(n > EXACT_SUM_SESSIONS)
+    if len(large):
+        mean = n[large] * (low + high) / 2
+        sd = np.sqrt(n[large] * ((high - low + 1) ** 2 - 1) / 12)
+        total[large] = np.clip(np.round(rng.normal(mean, sd)), n[large] * low, n[large] * high)
+    return total
+
+
+def _activity(rng, users, session_probs):
+    """
+    The day's totals for `users` (counts per country x persona x source) who
+    play with `session_probs` (P(1, 2, 3 sessions) per persona), per cell.
+    """
+    out = {name: np.zeros(users.shape, dtype=np.int64)
+           for name in ('sessions', 'spins', 'spins_used', 'social_actions', 'purchases', 'paying_users')}
+    out['revenue'] = np.zeros(users.shape)
+    for persona in range(len(PERSONAS)):
+        n = users[:, persona, :].ravel()
+        by_sessions = rng.multinomial(n, session_probs[persona])
+        sessions = by_sessions @ np.arange(1, by_sessions.shape[1] + 1)
+        spins = _sum_uniform(rng, sessions, engine.SPINS_LOW[persona], engine.SPINS_HIGH[persona])
+        costs = rng.multinomial(spins, np.full(len(engine.SPIN_COSTS), 1 / len(engine.SPIN_COSTS)))
+        purchases = np.zeros(len(n), dtype=np.int64)
+        paying = np.zeros(len(n), dtype=np.int64)
+        buy = PURCHASE_PROBS[persona]
+        if buy:
+            # Users with k sessions make j ~ Binomial(k, buy) purchases
+            for k in range(1, by_sessions.shape[1] + 1):
+                pmf = [math.comb(k, j) * buy ** j * (1 - buy) ** (k - j) for j in range(k + 1)]
+                by_purchases = rng.multinomial(by_sessions[:, k - 1], pmf)
+                paying += by_sessions[:, k - 1] - by_purchases[:, 0]
+                purchases += by_purchases @ np.arange(k + 1)
+        if persona == engine.HIGH_SPENDER:
+            prices = engine.HIGH_SPENDER_PRICES
+            revenue = rng.multinomial(purchases, np.full(len(prices), 1 / len(prices))) @ prices
+        else:
+            revenue = purchases * LOW_SPENDER_PRICE
+        for name, values in (('sessions', sessions), ('spins', spins), ('spins_used', costs @ engine.SPIN_COSTS),
+                             ('social_actions', rng.binomial(spins, SOCIAL_SHARE)), ('purchases', purchases),
+                             ('paying_users', paying), ('revenue', revenue)):
+            out[name][:, persona, :] = np.asarray(values).reshape(len(COUNTRIES), len(SOURCES))
+    return out
+
+
+class Population:
+    """
+    Users counted per (age, days since last active, country, persona, install
+    source) as of the start of `day`, the next day `step` simulates.
+    """
+
+    def __init__(self, day, counts=None):
+        self.day = pd.Timestamp(day).normalize()
+        shape = (AGES, LAGS, len(COUNTRIES), len(PERSONAS), len(SOURCES))
+        self.counts = np.zeros(shape, dtype=np.int64) if counts is None else counts
+        self.spilled = np.zeros(shape[2:], dtype=np.int64)  # Sessions of the day before still running at midnight
+
+    @classmethod
+    def from_state(cls, state, day, rng=None):
+        """
+        The users of a user-state frame (see user_state.py) who can still
+        return on `day`. Users with no country on record get a random one, as
+        in `simulate_returning_users`, and unknown personas play as Non-Payers.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        population = cls(day)
+        day = population.day
+        state = state[(state['install_date'] < day)
+                      & ((day - state['last_active_date']).dt.days <= user_state.RETURNING_WINDOW_DAYS)]
+        age = np.minimum((day - state['install_date']).dt.days.to_numpy(), AGES - 1)
+        lag = (day - state['last_active_date']).dt.days.to_numpy()
+        country = pd.Categorical(state['country'].fillna(state['install_country']), categories=COUNTRIES).codes.copy()
+        missing = country < 0
+        country[missing] = rng.integers(0, len(COUNTRIES), missing.sum())
+        persona = pd.Categorical(state['persona'], categories=PERSONAS).codes
+        persona = np.where(persona < 0, engine.NON_PAYER, persona)
+        source = pd.Categorical(state['install_source'].fillna(DEFAULT_SOURCE), categories=SOURCES).codes
+        source = np.where(source < 0, SOURCES.index(DEFAULT_SOURCE), source)
+        cells = np.ravel_multi_index((age, lag, country, persona, source), population.counts.shape)
+        population.counts = np.bincount(cells, minlength=population.counts.size).reshape(population.counts.shape)
+        return population
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def step(self, rng, install_scale=1.0):
+        """
+        Simulates `day` and moves the population to the next day. Returns the
+        day's rows: one per (country, persona, install source) cell with users.
+        """
+        counts = self.counts
+        eligible = counts.sum(axis=(0, 1))
+        returned = np.zeros_like(counts)
+        flat = returned.reshape(-1)
+        cells = np.flatnonzero(counts)
+        flat[cells] = rng.binomial(counts.reshape(-1)[cells], _RETURN_PROBS[cells])
+        returning = returned.sum(axis=(0, 1))
+        installs = rng.multinomial(daily_installs(rng, install_scale), _INSTALL_MIX).reshape(returning.shape)
+
+        played = [_activity(rng, returning, RETURNING_SESSION_PROBS), _activity(rng, installs, NEW_USER_SESSION_PROBS)]
+        country, persona, source = np.indices(returning.shape).reshape(3, -1)
+        columns = {
+            'event_date': np.full(len(country), self.day.to_datetime64(), dtype='datetime64[ns]'),
+            'country': np.asarray(COUNTRIES, dtype=object)[country],
+            'persona': np.asarray(PERSONAS, dtype=object)[persona],
+            'install_source': np.asarray(SOURCES, dtype=object)[source],
+            'eligible_users': eligible.ravel(),
+            'returning_users': returning.ravel(),
+            'installs': installs.ravel(),
+            'active_users': (returning + installs).ravel(),
+            'spilled_sessions': self.spilled.ravel(),
+        }
+        for name in CELL_COLUMNS[len(columns):]:
+            columns[name] = (played[0][name] + played[1][name]).ravel()
+        rows = pd.DataFrame(columns)
+        rows = rows[(rows['eligible_users'] > 0) | (rows['installs'] > 0)
+                    | (rows['spilled_sessions'] > 0)].reset_index(drop=True)
+        sessions = played[0]['sessions'] + played[1]['sessions']
+        self.spilled = rng.binomial(sessions, SPILL_PROBS[None, :, None])
+
+        # Tomorrow: everyone is a day older, today's players were last active a day ago,
+        # and users past the returning window never come back
+        lagged = np.zeros_like(counts)
+        lagged[:, 1:] = (counts - returned)[:, :-1]
+        lagged[:, 1] += returned.sum(axis=1)
+        lagged[0, 1] += installs
+        self.counts = np.zeros_like(counts)
+        self.counts[1:-1] = lagged[:-2]
+        self.counts[-1] = lagged[-2] + lagged[-1]
+        self.day += pd.Timedelta(days=1)
+        return rows
+
+    # --- Persistence ---
+    def save(self, path):
+        storage.save_pickle(path, self)
+
+    @staticmethod
+    def load(path):
+        """The population saved at `path`, or None if there is none yet."""
+        return storage.load_pickle(path)
+
+
+def simulate(population, days, rng, install_scale=1.0):
+    """Steps `population` through `days` days; returns the rows of every day."""
+    return pd.concat([population.step(rng, install_scale) for _ in range(days)], ignore_index=True)
+
+
+def to_summary(cells):
+    """daily_kpi_summary rows (see kpi_summary.py) from cell rows. They carry no DAU sketch."""
+    date_codes, dates = pd.factorize(cells['event_date'], sort=True)
+    country_codes, countries = pd.factorize(cells['country'], sort=True)
+    group = date_codes * len(countries) + country_codes
+    n_groups = len(dates) * len(countries)
+
+    def total(*names):
+        return np.bincount(group, weights=sum(cells[name].to_numpy(dtype=np.float64) for name in names),
+                           minlength=n_groups)
+
+    index = pd.MultiIndex.from_product([dates, countries.astype(object)], names=['event_date', 'country'])
+    # A session that ran past midnight adds its player (most don't play again that day) and its second session ID
+    dau = total('active_users', 'spilled_sessions')
+    sessions = total('sessions') * SESSION_IDS_PER_SESSION + total('spilled_sessions')
+    active = dau > 0
+    activity = pd.DataFrame({
+        'dau': dau[active],
+        'dau_sketch': None,
+        'total_sessions': sessions[active],
+        'paying_users': total('paying_users')[active],
+        'daily_revenue': total('revenue')[active],
+        'total_spins_used': total('spins_used')[active],
+        'total_social_actions': total('social_actions')[active],
+    }, index=index[active])
+    installs = total('installs')
+    viral = np.bincount(group, weights=np.where(cells['install_source'] == 'friend_invite', cells['installs'], 0),
+                        minlength=n_groups)
+    installed = installs > 0
+    installs = pd.DataFrame({'daily_installs': installs[installed], 'daily_viral_installs': viral[installed]},
+                            index=index[installed])
+    return kpi_summary.combine(activity, installs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate simulation: daily_kpi_summary rows without events")
+    parser.add_argument('--state', help="User-state snapshot to start from (default: an empty population)")
+    parser.add_argument('--start-date', default=None, help="First simulated day (default: tomorrow)")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--warmup-days', type=int, default=0, help="Days simulated first and not written")
+    parser.add_argument('--install-scale', type=float, default=1.0, help="Multiplies the daily installs")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='daily_kpi_summary.parquet')
+    parser.add_argument('--cells', help="Also write the per-(country, persona, source) rows here")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    start = pd.Timestamp(args.start_date) if args.start_date else pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+    first = start - pd.Timedelta(days=args.warmup_days)
+    population = (Population.from_state(user_state.open_store(args.state).load(), first, rng) if args.state
+                  else Population(first))
+    for _ in range(args.warmup_days):
+        population.step(rng, args.install_scale)
+    cells = simulate(population, args.days, rng, args.install_scale)
+    to_summary(cells).to_parquet(args.output, index=False)
+    if args.cells:
+        cells.to_parquet(args.cells, index=False)
+    print(f"{args.days} days, {cells['active_users'].sum() / args.days:,.0f} DAU on average, "
+          f"{len(population):,} users in the population at the end -> {args.output}")
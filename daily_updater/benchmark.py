@@ -0,0 +1,168 @@
+"""
+Benchmarks for the data generator. Each feature's benchmarks live in the
+benchmarks package; this script runs them by name.
+
+Run from this folder, e.g.:
+    python benchmark.py sessions --sessions 2000
+"""
+import argparse
+
+from benchmarks import aggregate, dashboard, experiment, funnel, generator, handler, league, realtime, suite, summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('suite', help="Every generator and KPI stage at several scales; results to a JSON file")
+    p.add_argument('--scales', type=int, nargs='+', default=suite.SUITE_SCALES, help="Users per run")
+    p.add_argument('--cases', nargs='+', default=list(suite.SUITE_CASES), metavar='CASE')
+    p.add_argument('--output', default='benchmark_results.json')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('compare', help="Compare two `suite` result files and flag regressions")
+    p.add_argument('baseline')
+    p.add_argument('candidate')
+    p.add_argument('--threshold', type=float, default=0.1, help="Relative change that counts as a regression")
+    p = sub.add_parser('startup', help="Import time of the Cloud Function module against a budget")
+    p.add_argument('--module', default='main')
+    p.add_argument('--runs', type=int, default=7)
+    p.add_argument('--budget-ms', type=int, default=handler.STARTUP_BUDGET_MS)
+    p = sub.add_parser('pipeline', help="Handler latency, sequential vs. concurrent I/O, against a slow warehouse")
+    p.add_argument('--users', type=int, default=5000)
+    p.add_argument('--chunks', type=int, default=4)
+    p.add_argument('--query-seconds', type=float, default=0.5)
+    p.add_argument('--upload-seconds', type=float, default=0.2)
+    p.add_argument('--seconds-per-row', type=float, default=2e-5)
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('catchup', help="Multi-day catch-up vs. one run per missed day (cost)")
+    p.add_argument('--users', type=int, default=2_000)
+    p.add_argument('--days', type=int, default=9)
+    p.add_argument('--query-seconds', type=float, default=0.5)
+    p.add_argument('--upload-seconds', type=float, default=0.2)
+    p.add_argument('--seconds-per-row', type=float, default=2e-6)
+    p = sub.add_parser('aggregate', help="Aggregate simulation vs. per-event: statistical agreement and cost per day")
+    p.add_argument('--users', type=int, default=20_000)
+    p.add_argument('--days', type=int, default=7)
+    p.add_argument('--replicates', type=int, default=200)
+    p.add_argument('--event-runs', type=int, default=5)
+    p.add_argument('--timing-users', type=int, nargs='+', default=[100_000, 1_000_000])
+    p.add_argument('--scales', type=float, nargs='+', default=[1, 100, 10_000])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('emitter', help="Real-time emitter: achieved rate and lag against a fast and a slow sink")
+    p.add_argument('--rates', type=float, nargs='+', default=[1000, 4000, 8000], help="Target events/s")
+    p.add_argument('--seconds', type=float, default=15)
+    p.add_argument('--seconds-per-batch', type=float, default=0.01)
+    p.add_argument('--seconds-per-row', type=float, default=2e-4)
+    p.add_argument('--max-pending-batches', type=int, default=2)
+    p.add_argument('--concurrent-users', type=int, default=1000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('sessions', help="Vectorized session engine vs. the per-spin loop")
+    p.add_argument('--sessions', type=int, default=2000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('memory', help="Peak memory of list-of-dicts vs. EventBuffer")
+    p.add_argument('--sessions', type=int, default=15000, help="~15k sessions is a 1,000-user, 30-day backfill")
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('encoding', help="Per-event memory and on-disk size of the dictionary-encoded events")
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--days', type=int, default=30)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('dayloop', help="Full-scan vs. indexed backfill day loop as users and days grow")
+    p.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 50000])
+    p.add_argument('--days', type=int, nargs='+', default=[30, 90, 180])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('returns', help="Returning users' return decision: per-user loop vs. vectorized")
+    p.add_argument('--users', type=int, nargs='+', default=[100_000, 1_000_000])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('targets', help="Social target index: build, update and draw cost")
+    p.add_argument('--users', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    p.add_argument('--draws', type=int, default=100_000)
+    p = sub.add_parser('league', help="Raid League: division build, streaming top-K updates and memory")
+    p.add_argument('--players', type=int, nargs='+', default=[100_000, 1_000_000])
+    p.add_argument('--batches', type=int, default=20)
+    p.add_argument('--batch-size', type=int, default=500_000)
+    p = sub.add_parser('funnel', help="Streaming tutorial funnel: throughput, bounded memory and accuracy")
+    p.add_argument('--rows', type=int, nargs='+', default=[200_000, 2_000_000, 20_000_000])
+    p.add_argument('--chunk-rows', type=int, default=1_000_000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('experiment', help="A/B analysis: batched bootstrap vs. a loop, A/A false positives, simulated lifts")
+    p.add_argument('--users', type=int, default=200_000)
+    p.add_argument('--resamples', type=int, default=2000)
+    p.add_argument('--sim-users', type=int, default=100_000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('kpi', help="Incremental daily_kpi_summary vs. a full rebuild (cost)")
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--days', type=int, default=30)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('sketches', help="DAU/WAU/MAU from HyperLogLog sketches vs. exact counts")
+    p.add_argument('--users', type=int, default=5000)
+    p.add_argument('--days', type=int, default=60)
+    p.add_argument('--errors', type=float, nargs='+', default=[0.05, 0.02, 0.01])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('cache', help="Partition-versioned result cache: warm vs. cold dashboard reads, invalidation, eviction")
+    p.add_argument('--users', type=int, default=2_000)
+    p.add_argument('--days', type=int, default=28)
+    p.add_argument('--backends', nargs='+', default=['parquet', 'duckdb'], choices=['parquet', 'duckdb', 'memory'])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('kpis', help="One-pass main_kpis.sql engine vs. the same SQL in DuckDB, at growing volume")
+    p.add_argument('--users', type=int, default=1000, help="1,000 users over 30 days is today's volume (1x)")
+    p.add_argument('--days', type=int, default=30)
+    p.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('retention', help="Incremental retention matrix vs. a full rebuild (cost)")
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--days', type=int, default=30)
+    p.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        suite.bench_suite(args.scales, args.cases, args.output, args.seed, args.repeat)
+    elif args.command == 'compare':
+        suite.bench_compare(args.baseline, args.candidate, args.threshold)
+    elif args.command == 'startup':
+        handler.bench_startup(args.module, args.runs, args.budget_ms)
+    elif args.command == 'pipeline':
+        handler.bench_pipeline(args.users, args.chunks, args.query_seconds, args.upload_seconds,
+                               args.seconds_per_row, args.repeat, args.seed)
+    elif args.command == 'catchup':
+        handler.bench_catchup(args.users, args.days, args.query_seconds, args.upload_seconds,
+                              args.seconds_per_row)
+    elif args.command == 'aggregate':
+        aggregate.bench_aggregate(args.users, args.days, args.replicates, args.event_runs, args.timing_users,
+                                  args.scales, args.seed)
+    elif args.command == 'emitter':
+        realtime.bench_emitter(args.rates, args.seconds, args.seconds_per_batch, args.seconds_per_row,
+                               args.max_pending_batches, args.concurrent_users, args.seed)
+    elif args.command == 'sessions':
+        generator.bench_sessions(args.sessions, args.seed)
+    elif args.command == 'memory':
+        generator.bench_memory(args.sessions, seed=args.seed)
+    elif args.command == 'encoding':
+        generator.bench_encoding(args.users, args.days, args.seed)
+    elif args.command == 'dayloop':
+        generator.bench_dayloop(args.users, args.days, args.seed)
+    elif args.command == 'returns':
+        generator.bench_returns(args.users, args.seed)
+    elif args.command == 'targets':
+        generator.bench_targets(args.users, args.draws)
+    elif args.command == 'league':
+        league.bench_league(args.players, args.batches, args.batch_size)
+    elif args.command == 'funnel':
+        funnel.bench_funnel(args.rows, args.chunk_rows, seed=args.seed)
+    elif args.command == 'experiment':
+        experiment.bench_experiment(args.users, args.resamples, args.sim_users, args.seed)
+    elif args.command == 'kpi':
+        summaries.bench_kpi(args.users, args.days, args.seed)
+    elif args.command == 'sketches':
+        summaries.bench_sketches(args.users, args.days, args.errors, args.seed)
+    elif args.command == 'cache':
+        dashboard.bench_cache(args.users, args.days, args.backends, args.seed)
+    elif args.command == 'kpis':
+        dashboard.bench_kpis(args.users, args.days, args.scales, args.seed)
+    elif args.command == 'retention':
+        summaries.bench_retention(args.users, args.days, args.seed)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""
+The benchmarks run by benchmark.py, one module per feature. Their synthetic
+inputs and reference code are shared with the tests, in tests/helpers.py and
+tests/legacy.py; common.py has the few only the benchmarks use.
+"""
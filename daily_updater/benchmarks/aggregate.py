@@ -0,0 +1,172 @@
+"""Benchmark for the aggregate simulation (aggregate_sim.py) against the per-event one."""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from tests.helpers import synthetic_state
+
+
+AGGREGATE_METRICS = ['dau', 'daily_installs', 'daily_viral_installs', 'avg_sessions_per_dau', 'total_spins_used',
+                     'total_social_actions', 'paying_users', 'daily_revenue']
+AGGREGATE_MAX_Z = 4  # Largest |z| of a KPI total
+AGGREGATE_MAX_TAIL_SHARE = 0.1  # Largest share of a KPI's (date, country) values in the draws' outer 5%
+
+
+def bench_aggregate(n_users, n_days, replicates=200, event_runs=5, timing_users=(100_000, 1_000_000),
+                    scales=(1, 100, 10_000), seed=0):
+    """
+    The aggregate simulation against the per-event one, from the same user
+    state: `event_runs` seeded per-event catch-ups of `n_days` against
+    `replicates` aggregate runs. Each KPI's total is compared in standard
+    errors of the two means, and each (date, country, KPI) value of the
+    per-event runs gets a two-sided tail probability among the aggregate
+    draws. Exits with status 1 if they disagree. Then the cost of a day's
+    summary rows both ways on states of `timing_users` users, and of
+    aggregate days at growing install `scales`.
+    """
+    import logging
+    import tempfile
+
+    import aggregate_sim
+    import generate_data
+    import kpi_summary
+    import main as daily
+    import storage
+    import user_state
+
+    for name in ('generate_data', 'main', 'storage'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    generate_data.TOTAL_USERS, generate_data.SEED, generate_data.WORKERS = n_users, seed, 1
+    generate_data.STORAGE_BACKEND, generate_data.STORAGE_PATH = 'memory', 'aggregate'
+    generate_data.STREAM_DIR = generate_data.USER_STATE_PATH = None
+    generate_data.KPI_SUMMARY_PATH = generate_data.RETENTION_PATH = None
+    generate_data.main()
+    last = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    first = last - pd.Timedelta(days=n_days - 1)
+    days = pd.date_range(first, last)
+    store = storage.MemoryBackend('aggregate')
+    for day in [day for day in store.partitions if day >= first]:
+        del store.partitions[day]
+    backfill = dict(store.partitions)
+    initial_state = user_state.summarize_events(store.read())
+    # Backfill events carry no persona, and users without one play as Non-Payers
+    # on both paths; without personas only the new installs would ever pay
+    rng = np.random.default_rng(seed)
+    personas = np.asarray(list(daily.PERSONA_DISTRIBUTION), dtype=object)
+    missing = initial_state['persona'].isna().to_numpy()
+    initial_state.loc[missing, 'persona'] = personas[
+        rng.choice(len(personas), missing.sum(), p=list(daily.PERSONA_DISTRIBUTION.values()))]
+
+    # Per-event runs (events, then their summary rows), one seed each
+    daily.STORAGE_BACKEND, daily.STORAGE_PATH = 'memory', 'aggregate'
+    daily.KPI_SUMMARY_PATH = daily.RETENTION_PATH = daily.RAID_LEAGUE_PATH = daily.EXPERIMENT = None
+    daily.CONCURRENT_IO = False
+    keys = ['event_date', 'country']
+    index = pd.MultiIndex.from_product([days, daily.COUNTRIES], names=keys)
+
+    def values(rows):
+        return rows.set_index(keys)[AGGREGATE_METRICS].astype('float64').reindex(index).fillna(0).to_numpy()
+
+    observed = []
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        daily.USER_STATE_PATH = os.path.join(tmp, 'user_state.parquet')
+        for run in range(event_runs):
+            store.partitions.clear()
+            store.partitions.update(backfill)
+            daily.SIMULATION_SEED = seed + run
+            user_state.open_store(daily.USER_STATE_PATH).replace(initial_state)
+            _, status = daily.catch_up(f"{first:%Y-%m-%d}", f"{last:%Y-%m-%d}")
+            assert status == 200, "per-event catch-up failed"
+            observed.append(values(kpi_summary.refresh(kpi_summary.empty_summary(), store.read(first, last),
+                                                       user_state.open_store(daily.USER_STATE_PATH).load(), days)))
+        daily.USER_STATE_PATH = None
+    event_s = (time.perf_counter() - t0) / event_runs / n_days
+    observed = np.stack(observed)
+
+    # The aggregate runs from the same state
+    runs = []
+    t0 = time.perf_counter()
+    for _ in range(replicates):
+        population = aggregate_sim.Population.from_state(initial_state, first, rng)
+        runs.append(aggregate_sim.to_summary(aggregate_sim.simulate(population, n_days, rng)))
+    aggregate_s = (time.perf_counter() - t0) / replicates / n_days
+    draws = np.stack([values(run) for run in runs])
+
+    # Totals: the per-event mean against the aggregate mean. Cells: the share of
+    # draws at least as far out on the observed side, doubled. Rare KPIs are mostly
+    # 0 in a cell, where a z-score against the draws' sd means nothing, but ties count
+    # on both sides here; a single large purchase can still be out past every draw
+    totals, total_draws = observed.sum(axis=1), draws.sum(axis=1)
+    total_sd = total_draws.std(axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_total = ((totals.mean(axis=0) - total_draws.mean(axis=0))
+                   / (total_sd * np.sqrt(1 / event_runs + 1 / replicates)))
+    z_total = np.where(total_sd > 0, z_total, np.where(totals.mean(axis=0) == total_draws.mean(axis=0), 0.0, np.inf))
+    below = (draws[None] <= observed[:, None]).mean(axis=1)
+    above = (draws[None] >= observed[:, None]).mean(axis=1)
+    p = np.minimum(1.0, 2 * np.minimum(below, above))
+    report = pd.DataFrame({
+        'per_event_mean': totals.mean(axis=0),
+        'aggregate_mean': total_draws.mean(axis=0),
+        'aggregate_sd': total_sd,
+        'z_total': z_total,
+        'cells_p_below_5%': (p < 0.05).mean(axis=(0, 1)),
+        'cells_past_all_draws': (p == 0).sum(axis=(0, 1)),
+    }, index=AGGREGATE_METRICS)
+    print(f"{n_users:,}-user backfill, {len(initial_state):,} users in the state; {n_days} days "
+          f"x {len(daily.COUNTRIES)} countries: {event_runs} per-event runs vs. {replicates} aggregate runs")
+    print(report.round(3).to_string())
+    totals_agree = (np.abs(z_total) < AGGREGATE_MAX_Z).all()
+    cells_agree = (report['cells_p_below_5%'] <= AGGREGATE_MAX_TAIL_SHARE).all()
+    print(f"Totals within {AGGREGATE_MAX_Z:g} standard errors: {totals_agree}; at most "
+          f"{AGGREGATE_MAX_TAIL_SHARE:.0%} of each KPI's values in the outer 5% of the draws (~5% expected): "
+          f"{cells_agree} -> {'agree' if totals_agree and cells_agree else 'DISAGREE'}")
+    print(f"Per day, catch-up included: per-event {event_s * 1000:,.0f} ms, aggregate {aggregate_s * 1000:.1f} ms "
+          f"({event_s / aggregate_s:,.0f}x)")
+
+    # A day's summary rows at equal population: simulate + events to summary vs. step + to_summary
+    rows = []
+    for users in timing_users:
+        state = synthetic_state(users, last, seed)
+        t0 = time.perf_counter()
+        returning = user_state.returning_users(state, last)
+        targets, new_user_ids = daily.draw_new_users(returning, last.date(), np.random.default_rng(seed))
+        events, _ = daily.simulate_day(last.to_pydatetime(), returning, new_user_ids, targets,
+                                       np.random.SeedSequence(seed))
+        df = events.to_frame()
+        kpi_summary.refresh(kpi_summary.empty_summary(), df, user_state.summarize_events(df), [last])
+        per_event_s = time.perf_counter() - t0
+        n_events, dau = len(df), df['user_pseudo_id'].nunique()
+        del returning, targets, events, df
+        population = aggregate_sim.Population.from_state(state, last, rng)
+        repeat = 20
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            aggregate_sim.to_summary(population.step(rng))
+        aggregate_s = (time.perf_counter() - t0) / repeat
+        rows.append({'users': users, 'dau': dau, 'events': n_events, 'per_event_s': per_event_s,
+                     'aggregate_ms': aggregate_s * 1000, 'speedup': per_event_s / aggregate_s})
+    print("One day's summary rows, same user state:")
+    print(pd.DataFrame(rows).round(2).to_string(index=False))
+
+    # The aggregate cost doesn't grow with the population
+    rows = []
+    for scale in scales:
+        population = aggregate_sim.Population(first)
+        for _ in range(60):
+            population.step(rng, scale)
+        t0 = time.perf_counter()
+        cells = aggregate_sim.simulate(population, 30, rng, scale)
+        aggregate_sim.to_summary(cells)
+        rows.append({'install_scale': scale, 'users': len(population), 'dau': cells['active_users'].sum() / 30,
+                     'ms_per_day': (time.perf_counter() - t0) / 30 * 1000})
+    print("Aggregate days after a 60-day warm-up, by install scale:")
+    print(pd.DataFrame(rows).round(1).to_string(index=False))
+    if not (totals_agree and cells_agree):
+        sys.exit(1)
@@ -0,0 +1,19 @@
+"""Synthetic inputs for the benchmarks only (those the tests share are in tests/helpers.py)."""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from tests.helpers import make_users
+
+
+def backfill_users(n_users, n_days, seed=0):
+    """Users with install dates spread over `n_days`, and those days, for backfill-style runs."""
+    start = datetime(2025, 1, 1)
+    rng = np.random.default_rng(seed)
+    users = make_users(n_users, seed=seed)
+    for user, offset in zip(users, rng.integers(0, n_days, n_users)):
+        user['install_date'] = (start + timedelta(days=int(offset))).date()
+        user['last_played'] = user['install_date']
+    return users, pd.date_range(start, periods=n_days)
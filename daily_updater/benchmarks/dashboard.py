@@ -0,0 +1,172 @@
+"""Benchmarks for the dashboard reads: the one-pass KPI engine (main_kpis.py) and the result cache."""
+
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import backfill_users
+from tests.helpers import DUCKDB_KPI_QUERIES
+
+
+def _bytes_read(paths, columns):
+    """Compressed size of `columns` across Parquet files: what a projected scan has to read."""
+    import pyarrow.parquet as pq
+
+    total = 0
+    for path in paths:
+        metadata = pq.ParquetFile(path).metadata
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                if chunk.path_in_schema in columns:
+                    total += chunk.total_compressed_size
+    return total
+
+
+def _scaled_store(base, root, scale):
+    """`scale` copies of every partition in `base`, each with its own user and session ids."""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    for path in base.files():
+        table = pq.read_table(path)
+        partition = os.path.join(root, os.path.basename(os.path.dirname(path)))
+        os.makedirs(partition, exist_ok=True)
+        for copy in range(scale):
+            copied = table
+            for col in ('user_pseudo_id', 'session_id'):
+                suffixed = pc.binary_join_element_wise(table.column(col), f"-{copy}", '')
+                copied = copied.set_column(table.schema.get_field_index(col), col, suffixed)
+            pq.write_table(copied, os.path.join(partition, f"part-{copy}.parquet"))
+
+
+def bench_kpis(n_users, n_days, scales, seed=0):
+    """
+    The one-pass KPI engine (main_kpis.py) vs. running main_kpis.sql in DuckDB,
+    over the same Parquet files. A base backfill is simulated once and
+    replicated `scale` times (with fresh ids per copy) for each scale. Reports
+    wall time, bytes read (the compressed size of the Parquet columns each side
+    projects). tests/test_main_kpis.py checks that every KPI table matches.
+    """
+    import tempfile
+
+    import generate_data
+    import main_kpis
+    import storage
+    try:
+        import duckdb
+    except ImportError:
+        duckdb = None
+        print("duckdb is not installed: timing the engine only (pip install duckdb for the SQL side)")
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        base = storage.LocalParquetBackend(os.path.join(tmp, 'base'))
+        for day, events in generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed)):
+            base.replace_partition(day, events)
+
+        for scale in scales:
+            root = os.path.join(tmp, f"x{scale}")
+            _scaled_store(base, root, scale)
+            store = storage.LocalParquetBackend(root)
+            paths = store.files()
+
+            t0 = time.perf_counter()
+            results = main_kpis.compute_from_store(store)
+            engine_s = time.perf_counter() - t0
+            row = {
+                'scale': scale, 'users': int(results['installs_by_country']['total_installs'].sum()), 'engine_s': engine_s,
+                'engine_MB_read': _bytes_read(paths, main_kpis.KPI_COLUMNS) / 1e6,
+            }
+            if duckdb is not None:
+                con = duckdb.connect()
+                con.execute(f"CREATE VIEW events AS SELECT * FROM read_parquet('{root}/*/*.parquet', union_by_name=true)")
+                sql_s, sql_bytes = 0.0, 0
+                for columns, query in DUCKDB_KPI_QUERIES.values():
+                    t0 = time.perf_counter()
+                    con.execute(query).fetchdf()
+                    sql_s += time.perf_counter() - t0
+                    sql_bytes += _bytes_read(paths, columns)
+                con.close()
+                row.update({'duckdb_s': sql_s, 'duckdb_MB_read': sql_bytes / 1e6, 'speedup': sql_s / engine_s})
+            rows.append(row)
+            shutil.rmtree(root)
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+
+
+def bench_cache(n_users, n_days, backends=('parquet', 'duckdb'), seed=0):
+    """
+    The partition-versioned result cache (result_cache.py) in front of the
+    three dashboard queries, over the whole backfill and each week of it.
+    For each backend: cold (computed) vs. warm (cached) time, then the
+    entries dropped and the time to read everything again after one day is
+    rewritten. Last, how many results a cache too small for all of them
+    keeps. tests/test_result_cache.py checks the results, which entries a
+    rewrite drops and the eviction.
+    """
+    import tempfile
+
+    import generate_data
+    import result_cache
+    import storage
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    generated = list(generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed)))
+    ranges = [(None, None)] + [(days[lo], days[min(lo + 6, n_days - 1)]) for lo in range(0, n_days, 7)]
+    lookups = [(name, start, end) for name in result_cache.DASHBOARD_QUERIES for start, end in ranges]
+    rewritten = days[n_days // 2]
+
+    def run_all(cache, backend):
+        t0 = time.perf_counter()
+        results = {lookup: cache.dashboard(backend, *lookup) for lookup in lookups}
+        return results, time.perf_counter() - t0
+
+    rows, stores = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in backends:
+            path = os.path.join(tmp, f"events.{kind}")
+            try:
+                backend = storage.open_backend(kind, path)
+            except ImportError:
+                print(f"{kind}: not installed, skipped")
+                continue
+            for day, events in generated:
+                backend.replace_partition(day, events)
+            cache = result_cache.ResultCache(os.path.join(tmp, f"cache-{kind}"))
+            stores[kind] = backend, cache
+            _, cold_s = run_all(cache, backend)
+            cold_misses = cache.misses
+            _, warm_s = run_all(cache, backend)
+            warm_misses = cache.misses - cold_misses
+
+            # Rewrite one day with fresh events: only the entries that depend on it are stale
+            _, events = next(generate_data.iter_user_days(users, ids, [rewritten], np.random.default_rng(seed + 1)))
+            backend.replace_partition(rewritten, events)
+            dropped = cache.invalidate_dates([rewritten])
+            before = cache.misses
+            _, rewrite_s = run_all(cache, backend)
+            rows.append({
+                'backend': kind, 'lookups': len(lookups), 'cold_s': cold_s, 'warm_s': warm_s,
+                'speedup': cold_s / warm_s, 'warm_scans': warm_misses, 'invalidated': dropped,
+                'rescans': cache.misses - before, 'after_rewrite_s': rewrite_s,
+            })
+        print(f"{n_users:,} users, {n_days} days; {len(lookups)} lookups "
+              f"({len(result_cache.DASHBOARD_QUERIES)} queries x {len(ranges)} date ranges)")
+        print(pd.DataFrame(rows).round(4).to_string(index=False))
+
+        # Eviction: a byte budget of a third of what every result takes
+        if not stores:
+            return
+        backend, cache = next(iter(stores.values()))
+        budget = cache.size_bytes // 3
+        small = result_cache.ResultCache(os.path.join(tmp, 'cache-small'), max_bytes=budget, max_entries=len(lookups))
+        run_all(small, backend)
+        print(f"Eviction: {len(small)} of {len(lookups)} results kept in {small.size_bytes:,} bytes "
+              f"(budget {budget:,})")
@@ -0,0 +1,71 @@
+"""Benchmark for the A/B analysis and the simulated experiment (experiments.py)."""
+
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from tests.helpers import make_users, synthetic_experiment_users
+
+
+def _loop_bootstrap(users, metrics, segments, n_resamples, rng):
+    """The bootstrap written the direct way: resample each variant, then a groupby per segment column."""
+    for _ in range(n_resamples):
+        sample = pd.concat([group.iloc[rng.integers(0, len(group), len(group))]
+                            for _, group in users.groupby('variant')])
+        sample.groupby('variant')[metrics].mean()
+        for col in segments:
+            sample.groupby(['variant', col])[metrics].mean()
+
+
+def bench_experiment(n_users, n_resamples, sim_users=100_000, seed=0):
+    """
+    The A/B analysis on `n_users` synthetic users: a bootstrap of every KPI in
+    every segment (batched Poisson weights) vs. a resample-and-groupby loop,
+    and the false-positive rate of an A/A split. Then the simulator: `sim_users` returning users play one day with the
+    Raid League experiment, and the measured lifts are compared to its settings.
+    """
+    import experiments
+    import main as daily
+
+    metrics = list(experiments.METRICS)
+    users = synthetic_experiment_users(n_users, seed=seed)
+    t0 = time.perf_counter()
+    result = experiments.analyze(users, n_resamples=n_resamples, seed=seed)
+    batched_s = time.perf_counter() - t0
+    loops = 5
+    t0 = time.perf_counter()
+    _loop_bootstrap(users, metrics, experiments.SEGMENTS, loops, np.random.default_rng(seed))
+    loop_s = (time.perf_counter() - t0) / loops * n_resamples
+    print(f"{n_users:,} users, {result['level'].size // len(metrics)} segments x {len(metrics)} KPIs, "
+          f"{n_resamples:,} resamples: analyze {batched_s:.2f}s vs. ~{loop_s:.0f}s resampling in a loop "
+          f"({loop_s / batched_s:.0f}x)")
+    print(result[result['segment'] == 'all'].drop(columns=['segment', 'level']).round(4).to_string(index=False))
+
+    null = experiments.analyze(synthetic_experiment_users(n_users, lift=False, seed=seed + 1),
+                               n_resamples=n_resamples, seed=seed)
+    covers = (null['ci_low'] <= 0) & (null['ci_high'] >= 0)
+    print(f"A/A split: {null['significant'].mean():.1%} of {len(null)} tests significant at alpha 0.05, "
+          f"{covers.mean():.1%} of bootstrap CIs cover 0")
+
+    experiment = experiments.get('raid_league')
+    returning = [dict(user, user_age_days=7) for user in make_users(sim_users, seed=seed)]
+    events = daily.simulate_returning_users(returning, date(2025, 1, 8), [u['user_pseudo_id'] for u in returning],
+                                            rng=np.random.default_rng(seed), experiment=experiment).to_frame()
+    ids = [u['user_pseudo_id'] for u in returning]
+    arm = pd.Series(np.where(experiment.assign(ids), 'treatment', 'control'), index=ids)
+    user_ids = events['user_pseudo_id'].astype(object)
+    event_arm = arm.reindex(user_ids).to_numpy()
+    counts = pd.crosstab(event_arm, events['event_name'].astype(object))
+    payer_opens = (events['event_name'] == 'app_open') & (events['persona'] != 'Non-Payer')
+    measured = pd.DataFrame({
+        'return_rate': user_ids.groupby(event_arm).nunique() / arm.value_counts(),
+        'spins_per_session': counts['spin_action'] / counts['app_open'],
+        'raids_per_spin': counts['raid_performed'] / counts['spin_action'],
+        'purchases_per_payer_session': counts['purchase_completed'] / pd.Series(event_arm[payer_opens]).value_counts(),
+    })
+    lifts = measured.loc['treatment'] / measured.loc['control']
+    print(f"Simulated day, {sim_users:,} returning users (age 7):")
+    print(pd.DataFrame({'measured_lift': lifts, 'configured_lift': [
+        experiment.retention_lift, experiment.spin_lift, experiment.raid_lift, experiment.purchase_lift]}).round(3))
@@ -0,0 +1,56 @@
+"""Benchmark for the streaming tutorial funnel (tutorial_funnel.py), on synthetic tutorial tables."""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from tests.helpers import TUTORIAL_VERSIONS, exact_funnel, tutorial_chunks
+
+
+def bench_funnel(row_counts, chunk_rows=1_000_000, exact_limit=2_000_000, seed=0):
+    """
+    The streaming tutorial funnel on synthetic tutorial tables of growing
+    size: throughput, peak traced memory (flat once the input outgrows one
+    chunk) and open users at the end. Up to `exact_limit` rows it also
+    reports the error against exact pandas counts (the per-step
+    COUNT(DISTINCT) of tutorial_query.sql) and exact step-time percentiles.
+    """
+    import tutorial_funnel
+
+    steps = tutorial_funnel.TUTORIAL_STEPS
+    rows = []
+    for n_rows in row_counts:
+        funnel = tutorial_funnel.TutorialFunnel()
+        engine_s, open_peak = 0.0, 0
+        tracemalloc.start()
+        for chunk in tutorial_chunks(n_rows, chunk_rows, seed):
+            t0 = time.perf_counter()
+            funnel.update(chunk)
+            engine_s += time.perf_counter() - t0
+            open_peak = max(open_peak, funnel.users_in_progress)
+            del chunk
+        t0 = time.perf_counter()
+        funnel.finish()
+        summary = funnel.summary()
+        engine_s += time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        row = {'rows': n_rows, 'engine_s': engine_s, 'rows_per_s': n_rows / engine_s,
+               'peak_MiB': peak / 2**20, 'open_users_max': open_peak,
+               'completion': funnel.completion_rate()}
+        if n_rows <= exact_limit:
+            # The same table again, whole, for the exact reference
+            frame = pd.concat(list(tutorial_chunks(n_rows, chunk_rows, seed)), ignore_index=True)
+            t0 = time.perf_counter()
+            users, seconds = exact_funnel(frame, steps)
+            frame[frame['step_name'].notna()].groupby(['step_name', 'app_version'], observed=True)['user_id'].nunique()
+            row['pandas_s'] = time.perf_counter() - t0
+            quantile_err = [abs(summary[f"p{round(q * 100)}_seconds"][i] / seconds[step].quantile(q) - 1)
+                            for q in tutorial_funnel.QUANTILES for i, step in enumerate(steps) if i]
+            row.update({'users_max_err': np.max(np.abs(summary['users'] / users - 1)),
+                        'quantile_max_err': np.max(quantile_err)})
+        rows.append(row)
+    print(f"{chunk_rows:,}-row chunks; {len(steps)} steps x {len(TUTORIAL_VERSIONS)} app versions")
+    print(pd.DataFrame(rows).round(4).to_string(index=False))
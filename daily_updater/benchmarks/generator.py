@@ -0,0 +1,275 @@
+"""Benchmarks for the event generator: sessions, memory, encoding, the day loop, returns and social targets."""
+
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+from benchmarks.common import backfill_users
+from event_buffer import EventBuffer
+from social_index import SocialTargetIndex
+from tests.helpers import PERSONAS, make_users, session_plan, synthetic_state
+from tests.legacy import (LEGACY_COLUMNS, legacy_create_event, legacy_generate_session_events,
+                          legacy_returning_sessions, legacy_scan_days, legacy_sessions)
+
+
+def bench_sessions(n_sessions, seed=0):
+    """Throughput of the vectorized engine vs. the per-spin loop, per persona and for a mixed cohort."""
+    pool = [u['user_pseudo_id'] for u in make_users(1000, seed=seed)]
+    rows = []
+    for persona in PERSONAS + [None]:
+        label = persona or 'mixed cohort'
+        users, starts = session_plan(make_users(n_sessions, persona, seed), seed)
+
+        t0 = time.perf_counter()
+        legacy_df = legacy_sessions(users, starts, pool)
+        legacy_s = time.perf_counter() - t0
+
+        users, starts = session_plan(make_users(n_sessions, persona, seed), seed)
+        t0 = time.perf_counter()
+        engine_df = session_engine.simulate_sessions(users, starts, pool, rng=np.random.default_rng(seed),
+                                                     out=EventBuffer(LEGACY_COLUMNS)).to_frame()
+        engine_s = time.perf_counter() - t0
+
+        rows.append({
+            'persona': label,
+            'sessions': n_sessions,
+            'legacy_events_per_s': len(legacy_df) / legacy_s,
+            'engine_events_per_s': len(engine_df) / engine_s,
+            'speedup': legacy_s / engine_s,
+        })
+
+    print(pd.DataFrame(rows).round(1).to_string(index=False))
+
+
+def bench_memory(n_sessions, days=30, seed=0):
+    """
+    Peak traced memory of a backfill-shaped run (one batch of sessions per day):
+    list-of-dicts + DataFrame + dtype pass vs. appending into one EventBuffer.
+    """
+    pool = [u['user_pseudo_id'] for u in make_users(1000, seed=seed)]
+    per_day = max(n_sessions // days, 1)
+    results = {}
+    for label in ('legacy', 'buffer'):
+        users, starts = session_plan(make_users(n_sessions, seed=seed), seed)
+        rng = np.random.default_rng(seed)
+        tracemalloc.start()
+        if label == 'legacy':
+            events = []
+            for lo in range(0, n_sessions, per_day):
+                for user, start in zip(users[lo:lo + per_day], starts[lo:lo + per_day]):
+                    events.append(legacy_create_event(user, str(uuid.uuid4()), 'app_open', start,
+                                                      {'attribution_source': 'organic'}))
+                    events.extend(legacy_generate_session_events(user, start, pool))
+            df = pd.DataFrame(events, columns=LEGACY_COLUMNS)
+            df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
+            for col in ('current_village_level', 'spin_cost', 'spin_outcome_value', 'item_cost'):
+                df[col] = df[col].astype('Int64')
+            df['price_usd'] = df['price_usd'].astype('float')
+        else:
+            buffer = EventBuffer(LEGACY_COLUMNS)
+            for lo in range(0, n_sessions, per_day):
+                session_engine.simulate_sessions(users[lo:lo + per_day], starts[lo:lo + per_day], pool,
+                                                 rng=rng, out=buffer)
+            df = buffer.to_frame()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = (len(df), peak)
+        del df
+
+    for label, (n_events, peak) in results.items():
+        print(f"{label:>7}: {n_events:,} events, peak {peak / 2**20:,.1f} MiB ({peak / n_events:,.0f} B/event)")
+    print(f"peak memory reduction: {results['legacy'][1] / results['buffer'][1]:.1f}x")
+
+
+def bench_encoding(n_users, n_days, seed=0):
+    """
+    Per-event memory and on-disk size of the encoded events: the day buffers
+    held after a backfill (codes + labels, traced), their frames as
+    categoricals vs. decoded to plain strings, and the Parquet files, with
+    the default snappy compression vs. the store's setting.
+    """
+    import io
+
+    import pyarrow.parquet as pq
+
+    import generate_data
+    import storage
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    tracemalloc.start()
+    buffers = [events for _, events in generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed))]
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = sum(len(b) for b in buffers)
+
+    def parquet_bytes(compression):
+        total = 0
+        for buffer in buffers:
+            sink = io.BytesIO()
+            pq.write_table(buffer.to_arrow(), sink, compression=compression)
+            total += sink.tell()
+        return total
+
+    def frame_bytes(decode):
+        frames = (b.to_frame() for b in buffers)  # One per day: concatenating mixed categories decodes them
+        return sum((storage._to_frame(f) if decode else f).memory_usage(deep=True).sum() for f in frames)
+
+    print(f"{n:,} events from {n_users:,} users over {n_days} days (bytes per event)")
+    print(pd.DataFrame([
+        {'measure': 'buffers held (traced)', 'bytes_per_event': held / n},
+        {'measure': 'backfill peak (traced)', 'bytes_per_event': peak / n},
+        {'measure': 'buffers nbytes (codes + labels)', 'bytes_per_event': sum(b.nbytes() for b in buffers) / n},
+        {'measure': 'frames, categorical', 'bytes_per_event': frame_bytes(decode=False) / n},
+        {'measure': 'frames, decoded strings', 'bytes_per_event': frame_bytes(decode=True) / n},
+        {'measure': 'parquet, snappy', 'bytes_per_event': parquet_bytes('snappy') / n},
+        {'measure': f"parquet, {storage.PARQUET_COMPRESSION} (store)",
+         'bytes_per_event': parquet_bytes(storage.PARQUET_COMPRESSION) / n},
+    ]).round(2).to_string(index=False))
+
+
+def bench_dayloop(user_counts, day_counts, seed=0):
+    """
+    Scaling of the day loop's scheduling work (who installs, churns and plays),
+    full scan vs. indexed, with the session engine stubbed out so only the loop
+    itself is timed.
+    """
+    import generate_data
+
+    def stub_engine(session_users, *args, out=None, **kwargs):
+        # Keep some invite state moving so the inviter index is exercised
+        for user in session_users[::50]:
+            user['sent_invites'] += 1
+        return out
+
+    rows = []
+    real_engine = generate_data.session_engine.simulate_sessions
+    generate_data.session_engine.simulate_sessions = stub_engine
+    try:
+        for n_users in user_counts:
+            for n_days in day_counts:
+                users, days = backfill_users(n_users, n_days, seed)
+                ids = [u['user_pseudo_id'] for u in users]
+                t0 = time.perf_counter()
+                legacy_sessions_played = sum(len(s) for _, s in legacy_scan_days(
+                    users, ids, days, np.random.default_rng(seed), lambda s: None))
+                legacy_s = time.perf_counter() - t0
+
+                users, days = backfill_users(n_users, n_days, seed)
+                t0 = time.perf_counter()
+                for _ in generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed)):
+                    pass
+                indexed_s = time.perf_counter() - t0
+                rows.append({'users': n_users, 'days': n_days, 'user_days_played': legacy_sessions_played,
+                             'full_scan_s': legacy_s, 'indexed_s': indexed_s, 'speedup': legacy_s / indexed_s})
+    finally:
+        generate_data.session_engine.simulate_sessions = real_engine
+
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+
+
+def bench_returns(user_counts, seed=0):
+    """
+    The returning users' pre-session stage, from the user state to the
+    sessions to play: the original path (the candidates as dicts, the target
+    index built user by user, the per-user return loop) vs. the columnar one
+    (the candidates frame, the bulk index, main.returning_sessions).
+    """
+    import main as daily
+    import user_state
+
+    day = date(2025, 3, 1)
+    rows = []
+    for n_users in user_counts:
+        state = synthetic_state(n_users, day, seed)
+        t0 = time.perf_counter()
+        candidates = user_state.returning_users(state, day)
+        user_dicts = candidates.astype(object).where(candidates.notna(), None).to_dict('records')
+        t1 = time.perf_counter()
+        SocialTargetIndex.from_users(user_dicts, day)
+        t2 = time.perf_counter()
+        legacy_users, _ = legacy_returning_sessions(user_dicts, day, np.random.default_rng(seed),
+                                                    daily.BASE_RETENTION_CURVE)
+        t3 = time.perf_counter()
+        legacy = {'candidates': t1 - t0, 'index': t2 - t1, 'returns': t3 - t2}
+        del user_dicts
+
+        t0 = time.perf_counter()
+        users = user_state.returning_users(state, day)
+        t1 = time.perf_counter()
+        SocialTargetIndex.from_users(users, day)
+        t2 = time.perf_counter()
+        session_users, _ = daily.returning_sessions(users, day, np.random.default_rng(seed))
+        t3 = time.perf_counter()
+        columnar = {'candidates': t1 - t0, 'index': t2 - t1, 'returns': t3 - t2}
+        for stage in legacy:
+            rows.append({'users': len(users), 'stage': stage, 'legacy_s': legacy[stage],
+                         'columnar_s': columnar[stage], 'speedup': legacy[stage] / columnar[stage]})
+        rows.append({'users': len(users), 'stage': 'total', 'legacy_s': sum(legacy.values()),
+                     'columnar_s': sum(columnar.values()), 'speedup': sum(legacy.values()) / sum(columnar.values())})
+        print(f"{len(users):,} candidates: {len(legacy_users):,} sessions on the original step curve, "
+              f"{len(session_users):,} on the interpolated one")
+    print("Pre-session stage ('candidates': the legacy path turns the state's candidates into dicts):")
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+
+
+def bench_targets(user_counts, n_draws=100_000, days=30, seed=0):
+    """
+    The social target index as the pool grows: building it, one day's
+    incremental updates, and weighted draws, against rebuilding a per-user
+    weight vector for `rng.choice`.
+    """
+    import social_index
+
+    rng = np.random.default_rng(seed)
+    today = date(2025, 1, 31)
+    rows = []
+    for n_users in user_counts:
+        ids = list(session_engine.random_uuid4s(rng, n_users))
+        levels = rng.integers(1, 15, n_users)
+        ages = rng.integers(0, days, n_users)
+        t0 = time.perf_counter()
+        index = SocialTargetIndex(today)
+        for user_id, level, age in zip(ids, levels.tolist(), ages.tolist()):
+            index.add(user_id, level, today - timedelta(days=age))
+        build_s = time.perf_counter() - t0
+
+        # One day's changes: 2% churn out, 30% play (and move to today's bucket)
+        t0 = time.perf_counter()
+        churned, played = n_users // 50, 3 * n_users // 10
+        for user_id in ids[:churned]:
+            index.remove(user_id)
+        for user_id, level in zip(ids[churned:churned + played], levels[churned:churned + played].tolist()):
+            index.add(user_id, level, today)
+        update_s = time.perf_counter() - t0
+        ages[churned:churned + played] = 0
+
+        attackers = rng.integers(1, 15, n_draws)
+        t0 = time.perf_counter()
+        index.draw(rng, n_draws, levels=attackers)
+        draw_s = time.perf_counter() - t0
+
+        # Without an index: a weight per user, rebuilt whenever anyone changes, then rng.choice
+        t0 = time.perf_counter()
+        bands = social_index.level_bands(levels[churned:])
+        attacker_band = int(np.bincount(social_index.level_bands(attackers)).argmax())
+        weights = (social_index.BAND_AFFINITY ** np.abs(bands - attacker_band)
+                   * 0.5 ** (ages[churned:] / social_index.RECENCY_HALF_LIFE_DAYS))
+        rng.choice(n_users - churned, n_draws, p=weights / weights.sum())
+        vector_s = time.perf_counter() - t0
+
+        rows.append({
+            'users': n_users,
+            'build_us_per_user': build_s / n_users * 1e6,
+            'update_us_per_change': update_s / (churned + played) * 1e6,
+            'draw_us': draw_s / n_draws * 1e6,
+            'weight_vector_s': vector_s,
+            'index_draws_s': draw_s,
+        })
+    print(f"{n_draws:,} draws per pool size; ages uniform over {days} days")
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
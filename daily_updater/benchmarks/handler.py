@@ -0,0 +1,171 @@
+"""Benchmarks for the Cloud Function handler: concurrent I/O, catch-ups and cold starts."""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+# --- Concurrent handler I/O against a slow warehouse ---
+# The handler runs against storage.LatencyBackend, an in-memory store that
+# sleeps like a remote warehouse on every query and upload. Before each run the
+# store is reset to the same backfill, so every mode sees the same day.
+
+
+def bench_pipeline(n_users, chunks, query_seconds, upload_seconds, seconds_per_row, repeat=3, seed=0):
+    import logging
+
+    import generate_data
+    import main as daily
+    import storage
+
+    for name in ('generate_data', 'main', 'storage'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    generate_data.TOTAL_USERS, generate_data.SEED, generate_data.WORKERS = n_users, seed, 1
+    generate_data.STORAGE_BACKEND, generate_data.STORAGE_PATH = 'memory', 'pipeline'
+    generate_data.STREAM_DIR = generate_data.USER_STATE_PATH = None
+    generate_data.KPI_SUMMARY_PATH = generate_data.RETENTION_PATH = None
+    generate_data.main()
+    store = storage.MemoryBackend('pipeline')
+    backfill = dict(store.partitions)
+    print(f"Backfill: {n_users:,} users, {len(store):,} events")
+
+    backend = storage.LatencyBackend(store, query_seconds, upload_seconds, seconds_per_row)
+    daily.STORAGE_BACKEND, daily.STORAGE_PATH, daily.SIMULATION_SEED = 'latency', 'pipeline', seed
+    daily.USER_STATE_PATH = daily.KPI_SUMMARY_PATH = daily.RETENTION_PATH = None
+    daily._backends[(daily.STORAGE_BACKEND, daily.STORAGE_PATH)] = backend
+    day = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+
+    rows = []
+    for mode, concurrent, n_chunks in [('sequential', False, 1), ('concurrent', True, 1),
+                                       (f'concurrent x{chunks}', True, chunks)]:
+        daily.CONCURRENT_IO, daily.UPLOAD_CHUNKS = concurrent, n_chunks
+        times = []
+        for _ in range(repeat):
+            store.partitions.clear()
+            store.partitions.update(backfill)
+            t0 = time.perf_counter()
+            _, status = daily.handler(None)
+            times.append(time.perf_counter() - t0)
+            assert status == 200, f"{mode} run failed"
+        rows.append({'mode': mode, 'events': len(store.read(day, day)), 'seconds': np.median(times)})
+    report = pd.DataFrame(rows).set_index('mode')
+    report['speedup'] = report.loc['sequential', 'seconds'] / report['seconds']
+    print(f"Warehouse latency: {query_seconds}s per query, {upload_seconds}s + {seconds_per_row * 1e6:g}us/row "
+          f"per upload; median of {repeat} runs")
+    print(report.round(3).to_string())
+
+
+def bench_catchup(n_users, n_days, query_seconds, upload_seconds, seconds_per_row, seed=0):
+    import logging
+    import tempfile
+
+    import generate_data
+    import main as daily
+    import storage
+    import user_state
+
+    for name in ('generate_data', 'main', 'storage'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    generate_data.TOTAL_USERS, generate_data.SEED, generate_data.WORKERS = n_users, seed, 1
+    generate_data.STORAGE_BACKEND, generate_data.STORAGE_PATH = 'memory', 'catchup'
+    generate_data.STREAM_DIR = generate_data.USER_STATE_PATH = None
+    generate_data.KPI_SUMMARY_PATH = generate_data.RETENTION_PATH = None
+    generate_data.main()
+    # The last `n_days` before today were "missed": drop them and start from the state before them
+    last = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    first = last - pd.Timedelta(days=n_days - 1)
+    store = storage.MemoryBackend('catchup')
+    for day in [day for day in store.partitions if day >= first]:
+        del store.partitions[day]
+    backfill = dict(store.partitions)
+    initial_state = user_state.summarize_events(store.read())
+    print(f"Backfill: {n_users:,} users, {len(store):,} events up to {first - pd.Timedelta(days=1):%Y-%m-%d}")
+
+    backend = storage.LatencyBackend(store, query_seconds, upload_seconds, seconds_per_row)
+    daily.STORAGE_BACKEND, daily.STORAGE_PATH, daily.SIMULATION_SEED = 'latency', 'catchup', seed
+    daily.KPI_SUMMARY_PATH = daily.RETENTION_PATH = None
+    daily.CONCURRENT_IO = False
+    daily._backends[(daily.STORAGE_BACKEND, daily.STORAGE_PATH)] = backend
+    days = pd.date_range(first, last)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        daily.USER_STATE_PATH = os.path.join(tmp, 'user_state.parquet')
+        daily.RAID_LEAGUE_PATH = os.path.join(tmp, 'raid_league.pkl')
+        state_store = user_state.open_store(daily.USER_STATE_PATH)
+        rows = []
+        for mode in ('one day per run', 'catch-up'):
+            store.partitions.clear()
+            store.partitions.update(backfill)
+            state_store.replace(initial_state)
+            if os.path.exists(daily.RAID_LEAGUE_PATH):
+                os.remove(daily.RAID_LEAGUE_PATH)
+            t0 = time.perf_counter()
+            if mode == 'catch-up':
+                results = [daily.catch_up(f"{first:%Y-%m-%d}", f"{last:%Y-%m-%d}")]
+            else:
+                results = [daily.catch_up(f"{day:%Y-%m-%d}", f"{day:%Y-%m-%d}") for day in days]
+            seconds = time.perf_counter() - t0
+            assert all(status == 200 for _, status in results), f"{mode} run failed: {results}"
+            rows.append({'mode': mode, 'runs': len(results), 'events': len(store.read(first, last)),
+                         'seconds': seconds})
+
+    report = pd.DataFrame(rows).set_index('mode')
+    report['speedup'] = report.loc['one day per run', 'seconds'] / report['seconds']
+    print(f"{n_days} missed days; warehouse latency: {query_seconds}s per query, "
+          f"{upload_seconds}s + {seconds_per_row * 1e6:g}us/row per upload")
+    print(report.round(3).to_string())
+
+
+# --- Cold start: import time of the Cloud Function module ---
+# Every run imports the module in a fresh interpreter under `python -X importtime`.
+# The check fails (exit status 1) if the median import is over budget.
+# tests/test_main.py checks that the modules only optional paths need stay unloaded.
+
+STARTUP_BUDGET_MS = 900
+
+
+def _import_profile(module):
+    """
+    (total import µs, {direct import: cumulative µs}, {any import: cumulative µs})
+    for one fresh `import module`.
+    """
+    import subprocess
+
+    run = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True,
+                         text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+    # Imports are listed children first: the depth-1 lines since the previous top-level one belong to `module`
+    total, children, pending, nested, all_pending = 0, {}, {}, {}, {}
+    for line in run.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        all_pending[name.strip()] = int(cumulative)
+        if depth == 1:
+            pending[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                total, children, nested = int(cumulative), pending, all_pending
+            pending, all_pending = {}, {}
+    return total, children, nested
+
+
+def bench_startup(module='main', runs=7, budget_ms=STARTUP_BUDGET_MS):
+    profiles = [_import_profile(module) for _ in range(runs)]
+    total_ms = np.median([total for total, _, _ in profiles]) / 1000
+    children = pd.DataFrame([c for _, c, _ in profiles]).median().sort_values(ascending=False) / 1000
+    print(f"import {module}: median {total_ms:,.0f} ms over {runs} runs (budget {budget_ms:,} ms)")
+    print("Slowest direct imports (ms, cumulative):")
+    print(children.head(10).round(1).to_string())
+    # pandas (which loads pyarrow) is the bulk of it, and every handler path uses it: see main.py's startup comment
+    pandas_ms = np.median([nested.get('pandas', 0) for _, _, nested in profiles]) / 1000
+    print(f"of which pandas (with pyarrow): {pandas_ms:,.0f} ms; without it: {total_ms - pandas_ms:,.0f} ms")
+
+    if total_ms > budget_ms:
+        print(f"FAIL: import time {total_ms:,.0f} ms is over the {budget_ms:,} ms budget")
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,57 @@
+"""Benchmark for the Raid League (raid_league.py)."""
+
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+
+
+def bench_league(player_counts, batches=20, batch_size=500_000, seed=0):
+    """
+    The Raid League as the player base grows: building the divisions,
+    streaming raid batches through the incremental top K against re-sorting
+    every division, the memory per player, and how closely divisions are
+    matched on level.
+    """
+    import raid_league
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_players in player_counts:
+        ids = session_engine.random_uuid4s(rng, n_players)
+        levels = rng.integers(1, 20, n_players)
+        history = rng.poisson(30, n_players)
+        t0 = time.perf_counter()
+        league = raid_league.RaidLeague(date(2025, 1, 6), ids, levels, history)
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(batches):
+            raiders = rng.integers(0, n_players, batch_size)
+            league.record_raids(raiders, raid_league.RAID_COINS_PER_LEVEL * league.levels[raiders])
+        stream_s = time.perf_counter() - t0
+
+        # Reference: sort every division from scratch
+        t0 = time.perf_counter()
+        ref = pd.DataFrame({'division': league.division, 'coins': league.scores, 'position': np.arange(n_players)})
+        ref = ref[ref['coins'] > 0].sort_values(['division', 'coins', 'position'], ascending=[True, False, True])
+        ref = ref[ref.groupby('division').cumcount() < league.top_k]
+        resort_s = time.perf_counter() - t0
+
+        arrays = (league.levels, league.division, league.scores, league.raids)
+        spread = pd.Series(league.levels).groupby(league.division).agg(lambda s: s.max() - s.min())
+        rows.append({
+            'players': n_players,
+            'divisions': league.n_divisions,
+            'build_s': build_s,
+            'raids_per_s': batches * batch_size / stream_s,
+            'full_resort_s': resort_s,
+            'array_bytes_per_player': sum(a.nbytes for a in arrays) / n_players,
+            'mean_level_spread': spread.mean(),
+            'max_level_spread': spread.max(),
+        })
+    print(f"{batches} batches of {batch_size:,} raids per league size")
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
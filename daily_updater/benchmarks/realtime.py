@@ -0,0 +1,42 @@
+"""Benchmark for the real-time emitter (emitter.py)."""
+
+import pandas as pd
+
+
+def bench_emitter(rates, seconds, seconds_per_batch, seconds_per_row, max_pending_batches=2, concurrent_users=1000,
+                  seed=0):
+    import logging
+
+    import emitter
+    import metrics
+
+    logging.getLogger('emitter').setLevel(logging.WARNING)
+    batch_size = emitter.BATCH_SIZE
+    capacity = batch_size / (seconds_per_batch + seconds_per_row * batch_size)
+    print(f"Slow sink: {seconds_per_batch * 1000:g} ms + {seconds_per_row * 1e6:g} us/event per publish, "
+          f"about {capacity:,.0f} events/s in batches of {batch_size:,}; up to {max_pending_batches} batches queued; "
+          f"{seconds:g} s per run")
+
+    runs = [('fast', 'block', rate, None) for rate in rates]
+    runs += [('slow', on_full, rate, None) for rate in rates for on_full in emitter.ON_FULL]
+    runs.append(('fast', 'block', None, concurrent_users))
+    rows = []
+    for sink_name, on_full, rate, users in runs:
+        sink = emitter.QueueSink(*((seconds_per_batch, seconds_per_row) if sink_name == 'slow' else ()))
+        run = emitter.Emitter(sink, rate, users, max_pending_batches=max_pending_batches, on_full=on_full, seed=seed)
+        summary = run.run(seconds)
+        rows.append({
+            'sink': sink_name, 'on_full': on_full,
+            'target': f"{rate:,.0f}/s" if rate else f"{users:,} users",
+            'target_events_s': summary['target_events_per_second'],
+            'released_s': summary['released_events'] / summary['seconds'],
+            'events_s': summary['events_per_second'],
+            'dropped_share': summary['dropped_events'] / max(summary['released_events'], 1),
+            'lag_p50_s': summary['lag_p50_seconds'], 'lag_p99_s': summary['lag_p99_seconds'],
+            'blocked_s': summary['blocked_seconds'],
+            'pending_events': run.pending_events,
+        })
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+    peak = metrics.peak_rss_bytes()
+    if peak is not None:
+        print(f"Peak RSS: {peak / 2 ** 20:,.0f} MiB")
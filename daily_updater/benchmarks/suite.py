@@ -0,0 +1,271 @@
+"""The reproducible benchmark suite (`suite`) and its regression check (`compare`)."""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+from social_index import SocialTargetIndex
+from tests.helpers import PERSONAS, make_users, session_plan
+from tests.legacy import LEGACY_COLUMNS, legacy_create_event, legacy_generate_session_events
+
+
+# --- Benchmark suite: every stage at several scales, results as JSON ---
+# Each (case, scale) runs in a fresh process so its peak RSS is its own. A
+# case builds its inputs from fixed seeds, then its timed part runs `repeat`
+# times (the fastest run counts). A last run under tracemalloc gives the
+# allocation figures, which stay out of the timings:
+#   alloc_bytes_per_event - peak bytes allocated during the run, per event
+#   objects_per_event     - Python heap blocks the run's output holds, per event
+# Every case returns its output (events as dicts, a buffer, a frame...), so
+# the figures include what the stage leaves behind. `compare` lines two
+# result files up and flags regressions.
+
+SUITE_SCALES = [1000, 10000, 100000]
+SUITE_DAYS = 30
+
+
+def _case_create_event(n_users, seed):
+    users = make_users(n_users, seed=seed)
+    start = datetime(2025, 1, 1)
+
+    return lambda: [legacy_create_event(user, 'session', 'spin_action', start, {'spin_cost': 1})
+                    for user in users for _ in range(10)]
+
+
+def _case_generate_session_events(persona):
+    def setup(n_users, seed):
+        users, starts = session_plan(make_users(n_users, persona, seed), seed)
+        pool = [u['user_pseudo_id'] for u in users]
+
+        def run():
+            random.seed(seed)
+            events = []
+            for user, start in zip(users, starts):
+                events.extend(legacy_generate_session_events(user, start, pool))
+            return events
+        return run
+    return setup
+
+
+def _case_simulate_sessions(persona):
+    def setup(n_users, seed):
+        users, starts = session_plan(make_users(n_users, persona, seed), seed)
+        pool = [u['user_pseudo_id'] for u in users]
+        return lambda: session_engine.simulate_sessions(users, starts, pool, rng=np.random.default_rng(seed))
+    return setup
+
+
+def _case_simulate_new_users(n_users, seed):
+    import main as daily
+
+    rng = np.random.default_rng(seed)
+    ids = list(session_engine.random_uuid4s(rng, n_users))
+    targets = SocialTargetIndex.from_users(
+        [{'user_pseudo_id': user_id, 'last_active_date': date(2025, 1, 1)} for user_id in ids[:100]], date(2025, 1, 2))
+    return lambda: daily.simulate_new_users(ids, datetime(2025, 1, 2), targets, rng=np.random.default_rng(seed))
+
+
+def _case_simulate_returning_users(n_users, seed):
+    import main as daily
+
+    rng = np.random.default_rng(seed)
+    users = make_users(n_users, seed=seed)
+    for user, age in zip(users, rng.integers(1, 31, n_users)):
+        user['user_age_days'] = int(age)
+    for user in users:
+        user['last_active_date'] = date(2025, 1, 1)
+    users = pd.DataFrame(users)  # Fetched users come as a frame
+    targets = SocialTargetIndex.from_users(users, date(2025, 1, 2))
+    return lambda: daily.simulate_returning_users(users, datetime(2025, 1, 2).date(), targets,
+                                                  rng=np.random.default_rng(seed))
+
+
+def _session_buffer(n_users, seed):
+    users, starts = session_plan(make_users(n_users, seed=seed), seed)
+    pool = [u['user_pseudo_id'] for u in users]
+    return session_engine.simulate_sessions(users, starts, pool, rng=np.random.default_rng(seed))
+
+
+def _case_legacy_dataframe(n_users, seed):
+    """The original DataFrame construction: a list of dicts, then a dtype pass."""
+    import storage
+
+    frame = storage._to_frame(_session_buffer(n_users, seed)).astype(object)
+    rows = frame.where(frame.notna(), None).to_dict('records')
+
+    def run():
+        df = pd.DataFrame(rows, columns=LEGACY_COLUMNS)
+        df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
+        for col in ('current_village_level', 'spin_cost', 'spin_outcome_value', 'item_cost'):
+            df[col] = df[col].astype('Int64')
+        df['price_usd'] = df['price_usd'].astype('float')
+        return df
+    return run
+
+
+def _case_to_frame(n_users, seed):
+    buffer = _session_buffer(n_users, seed)
+    return buffer.to_frame
+
+
+def _case_to_arrow(n_users, seed):
+    buffer = _session_buffer(n_users, seed)
+    return buffer.to_arrow
+
+
+def _case_generate_data_main(n_users, seed):
+    """The whole `generate_data.main()` backfill on one worker, written to an in-memory backend."""
+    import logging
+
+    import generate_data
+    import storage
+
+    logging.getLogger('generate_data').setLevel(logging.WARNING)
+    generate_data.TOTAL_USERS, generate_data.SEED, generate_data.WORKERS = n_users, seed, 1
+    generate_data.STORAGE_BACKEND, generate_data.STORAGE_PATH = 'memory', 'benchmark'
+    generate_data.STREAM_DIR = generate_data.USER_STATE_PATH = None
+    generate_data.KPI_SUMMARY_PATH = generate_data.RETENTION_PATH = None
+    generate_data.DAYS_BACK = SUITE_DAYS
+    generate_data.START_DATE = datetime(2025, 1, 1)
+    generate_data.NOW = generate_data.START_DATE + timedelta(days=SUITE_DAYS)
+
+    def run():
+        generate_data.main()
+        return storage.MemoryBackend('benchmark')
+    return run
+
+
+# Cases named legacy.* time the reference copies of the original per-event code (tests/legacy.py)
+SUITE_CASES = {
+    'legacy.create_event': _case_create_event,
+    **{f"legacy.generate_session_events:{p}": _case_generate_session_events(p) for p in PERSONAS},
+    **{f"session_engine.simulate_sessions:{p}": _case_simulate_sessions(p) for p in PERSONAS},
+    'main.simulate_new_users': _case_simulate_new_users,
+    'main.simulate_returning_users': _case_simulate_returning_users,
+    'legacy.dataframe_from_dicts': _case_legacy_dataframe,
+    'EventBuffer.to_frame': _case_to_frame,
+    'EventBuffer.to_arrow': _case_to_arrow,
+    'generate_data.main': _case_generate_data_main,
+}
+
+
+def _run_case(case, n_users, seed, repeat):
+    """One (case, scale) measurement. Runs in its own process."""
+    import gc
+
+    import metrics
+
+    run = SUITE_CASES[case](n_users, seed)
+    setup_rss = metrics.peak_rss_bytes(children=False)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = run()
+        times.append(time.perf_counter() - t0)
+        n_events = len(output)
+        del output
+    peak_rss = metrics.peak_rss_bytes(children=False)
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    output = run()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    held_blocks = sys.getallocatedblocks() - blocks
+    del output
+    best = min(times)
+    return {
+        'case': case, 'users': n_users, 'events': n_events,
+        'seconds': best, 'events_per_s': n_events / best if best else None,
+        'peak_rss_mb': peak_rss / 2 ** 20 if peak_rss is not None else None,
+        'setup_rss_mb': setup_rss / 2 ** 20 if setup_rss is not None else None,
+        'alloc_bytes_per_event': traced_peak / max(n_events, 1),
+        'objects_per_event': held_blocks / max(n_events, 1),
+    }
+
+
+def _suite_metadata(seed, repeat):
+    import platform
+    import subprocess
+
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'seed': seed, 'repeat': repeat,
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'machine': platform.machine(), 'cpus': os.cpu_count(),
+    }
+
+
+def bench_suite(scales, cases, output, seed=0, repeat=3):
+    """Runs every case at every scale (each in a fresh process) and writes the results to `output`."""
+    import json
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    unknown = [c for c in cases if c not in SUITE_CASES]
+    if unknown:
+        raise SystemExit(f"Unknown case(s) {unknown}; choose from {list(SUITE_CASES)}")
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n_users in scales:
+        for case in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    row = pool.submit(_run_case, case, n_users, seed, repeat).result()
+                except Exception as e:  # e.g. a worker killed for running out of memory
+                    row = {'case': case, 'users': n_users, 'error': repr(e)}
+            results.append(row)
+            print(' | '.join(f"{k}={v:,.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
+    with open(output, 'w') as f:
+        json.dump({'meta': _suite_metadata(seed, repeat), 'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def bench_compare(baseline, candidate, threshold=0.1):
+    """
+    Lines up two suite result files by (case, users) and flags regressions:
+    throughput down, or peak RSS / allocations up, by more than `threshold`.
+    Exits with status 1 if there are any, so it can gate a CI job.
+    """
+    import json
+
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        frame = pd.DataFrame([r for r in data['results'] if 'error' not in r])
+        return data['meta'], frame.set_index(['case', 'users'])
+
+    (old_meta, old), (new_meta, new) = load(baseline), load(candidate)
+    print(f"baseline:  {old_meta.get('commit')} ({old_meta.get('created')})")
+    print(f"candidate: {new_meta.get('commit')} ({new_meta.get('created')})")
+    joined = old.join(new, how='inner', lsuffix='_old', rsuffix='_new')
+    report = pd.DataFrame({
+        'events_per_s': joined['events_per_s_new'] / joined['events_per_s_old'],
+        'peak_rss_mb': joined['peak_rss_mb_new'] / joined['peak_rss_mb_old'],
+        'alloc_bytes_per_event': joined['alloc_bytes_per_event_new'] / joined['alloc_bytes_per_event_old'],
+    })
+    regressed = ((report['events_per_s'] < 1 - threshold)
+                 | (report['peak_rss_mb'] > 1 + threshold)
+                 | (report['alloc_bytes_per_event'] > 1 + threshold))
+    report['regression'] = np.where(regressed, 'YES', '')
+    print("Ratios are candidate / baseline:")
+    print(report.round(3).to_string())
+    if regressed.any():
+        print(f"{int(regressed.sum())} regression(s) beyond {threshold:.0%}")
+        sys.exit(1)
@@ -0,0 +1,151 @@
+"""Benchmarks for the incremental summaries: daily_kpi_summary, the retention matrix and the DAU sketches."""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import backfill_users
+from tests.helpers import exact_engagement
+
+
+def bench_kpi(n_users, n_days, seed=0):
+    """
+    Cost of the incremental daily_kpi_summary. A backfill is written day by
+    day to a temporary local Parquet store, and the summary is refreshed after
+    every partition, against a full rebuild (a pandas translation of
+    daily_kpi_summary.sql) over every event so far. tests/test_kpi_summary.py
+    checks that both give the same rows.
+    """
+    import tempfile
+
+    import generate_data
+    import kpi_summary
+    import storage
+    import user_state
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    state, summary = user_state.empty_state(), kpi_summary.empty_summary()
+    incremental_s = rebuild_s = 0.0
+    with tempfile.TemporaryDirectory() as root:
+        backend = storage.LocalParquetBackend(root)
+        for day, events in generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed)):
+            frame = events.to_frame()
+            backend.replace_partition(day, events)
+            t0 = time.perf_counter()
+            state = user_state.merge_state(state, user_state.summarize_events(frame))
+            summary = kpi_summary.refresh_partition(summary, backend, day, state, events=frame)
+            incremental_s += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            kpi_summary.full_rebuild(backend.read())
+            rebuild_s += time.perf_counter() - t0
+        n_events = len(backend.read(columns=['event_timestamp']))
+
+    print(f"{n_events:,} events, {len(summary):,} summary rows")
+    print(pd.DataFrame([{
+        'days': n_days,
+        'incremental_s_per_day': incremental_s / n_days,
+        'full_rebuild_s_per_day': rebuild_s / n_days,
+        'speedup': rebuild_s / incremental_s,
+    }]).round(4).to_string(index=False))
+
+
+def bench_retention(n_users, n_days, seed=0):
+    """
+    Cost of the incremental retention matrix: each partition applied once per
+    simulated day vs. retention_cohort.sql (in pandas) over every event, and
+    the cohort rebuild when a day is re-run. tests/test_retention.py checks
+    that the matrix matches the full rebuild.
+    """
+    import generate_data
+    import retention
+    import storage
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    backend = storage.MemoryBackend(f"bench-retention-{seed}")
+    backend.partitions.clear()
+    matrix = retention.RetentionMatrix()
+    frames = []
+    update_s = 0.0
+    for day, events in generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed)):
+        frame = events.to_frame()
+        frames.append(frame)
+        backend.replace_partition(day, frame)
+        t0 = time.perf_counter()
+        matrix.apply_partition(backend, day, frame)
+        update_s += time.perf_counter() - t0
+    all_events = pd.concat(frames, ignore_index=True)
+
+    t0 = time.perf_counter()
+    rebuilt = retention.full_rebuild(all_events)
+    rebuild_s = time.perf_counter() - t0
+
+    # A re-run of the middle day rebuilds the cohorts it can touch
+    t0 = time.perf_counter()
+    matrix.apply_partition(backend, days[len(days) // 2], frames[len(days) // 2])
+    rerun_s = time.perf_counter() - t0
+    backend.partitions.clear()
+
+    print(f"{len(all_events):,} events, {len(matrix):,} users, {len(rebuilt)} cells")
+    print(pd.DataFrame([{
+        'days': n_days,
+        'update_s_per_day': update_s / n_days,
+        'full_rebuild_s': rebuild_s,
+        'rerun_day_s': rerun_s,
+        'lookup_us': _time_lookup(matrix, days) * 1e6,
+    }]).round(4).to_string(index=False))
+
+
+def _time_lookup(matrix, days, repeat=1000):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        matrix.retention(days[0], 7, install_country='US')
+    return (time.perf_counter() - t0) / repeat
+
+
+def bench_sketches(n_users, n_days, errors, seed=0):
+    """
+    Accuracy of the DAU sketches: DAU, WAU and MAU per day (all countries, and
+    a single country) and one whole-range count, estimated from the summary's
+    sketches vs. counted exactly from the events, for each configured error.
+    """
+    import active_users
+    import generate_data
+    import hyperloglog
+    import kpi_summary
+
+    users, days = backfill_users(n_users, n_days, seed)
+    ids = [u['user_pseudo_id'] for u in users]
+    frames = [events.to_frame() for _, events in
+              generate_data.iter_user_days(users, ids, days, np.random.default_rng(seed))]
+    events = pd.concat(frames, ignore_index=True)
+    start, end = days[active_users.MAU_DAYS - 1], days[-1]
+    exact = {None: exact_engagement(events, start, end), ('US',): exact_engagement(events, start, end, ['US'])}
+    exact_range = events['user_pseudo_id'].nunique()
+
+    rows = []
+    for error in errors:
+        precision = hyperloglog.precision_for_error(error)
+        t0 = time.perf_counter()
+        summary = kpi_summary.full_rebuild(events, precision)
+        build_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        estimates = {countries: active_users.engagement(summary, start, end, countries) for countries in exact}
+        query_s = time.perf_counter() - t0
+        relative = np.concatenate([
+            (estimates[c][col] / exact[c][col] - 1).to_numpy() for c in exact for col in ('dau', 'wau', 'mau')])
+        range_estimate = active_users.active_users(summary, days[0], days[-1])
+        sigma = hyperloglog.standard_error(precision)
+        rows.append({
+            'error': error, 'precision': precision, 'sketch_bytes': 2 ** precision,
+            'mean_abs_err': np.mean(np.abs(relative)), 'max_abs_err': np.max(np.abs(relative)),
+            'within_2_sigma': np.mean(np.abs(relative) <= 2 * sigma),
+            'range_err': range_estimate / exact_range - 1,
+            'build_s': build_s, 'query_s': query_s,
+        })
+    print(f"{len(events):,} events, {exact_range:,} users, {len(exact[None])} days compared "
+          f"(DAU/WAU/MAU, overall and US)")
+    print(pd.DataFrame(rows).round(4).to_string(index=False))
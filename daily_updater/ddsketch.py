@@ -0,0 +1,91 @@
+import numpy as np
+
+# --- DDSketch Quantile Sketches ---
+# Percentiles of a stream without keeping its values (Masson et al., VLDB
+# 2019). A positive value v falls in bucket ceil(log_gamma(v)), with
+# gamma = (1 + a) / (1 - a). Every value in a bucket is within a relative
+# error `a` of the bucket's midpoint, so any quantile is returned within
+# that relative error. Buckets are counts in one dense NumPy array, so
+# adding a batch is a bincount and merging two sketches is an addition.
+# When the buckets would exceed MAX_BINS, the lowest are folded together:
+# only the smallest values lose accuracy.
+
+DEFAULT_ACCURACY = 0.01  # relative error of every quantile
+MAX_BINS = 2048
+MIN_VALUE = 1e-9  # values at or below this count as zero
+
+
+class DDSketch:
+    """A mergeable quantile sketch of non-negative values, within `relative_accuracy`."""
+
+    def __init__(self, relative_accuracy=DEFAULT_ACCURACY, max_bins=MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.bins = np.zeros(0, dtype=np.int64)
+        self.offset = 0  # bucket key of bins[0]
+        self.zeros = 0
+        self.count = 0
+
+    def _keys(self, values):
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _add_counts(self, lo, counts):
+        """Adds `counts` for the buckets lo .. lo + len(counts) - 1."""
+        if not len(counts):
+            return
+        if not len(self.bins):
+            self.bins, self.offset = counts.astype(np.int64), lo
+        else:
+            start, stop = min(self.offset, lo), max(self.offset + len(self.bins), lo + len(counts))
+            if start != self.offset or stop != self.offset + len(self.bins):
+                grown = np.zeros(stop - start, dtype=np.int64)
+                grown[self.offset - start:self.offset - start + len(self.bins)] = self.bins
+                self.bins, self.offset = grown, start
+            self.bins[lo - self.offset:lo - self.offset + len(counts)] += counts
+        if len(self.bins) > self.max_bins:
+            # Fold the lowest buckets into the lowest one kept
+            extra = len(self.bins) - self.max_bins
+            self.bins[extra] += self.bins[:extra].sum()
+            self.bins, self.offset = self.bins[extra:], self.offset + extra
+
+    def add(self, values):
+        """Adds a batch of values (negative values are not allowed)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return self
+        if (values < 0).any():
+            raise ValueError("DDSketch only takes non-negative values")
+        positive = values[values > MIN_VALUE]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys = self._keys(positive)
+            lo = int(keys.min())
+            self._add_counts(lo, np.bincount(keys - lo))
+        return self
+
+    def merge(self, other):
+        """Adds another sketch's values (both must share the relative accuracy)."""
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        self.zeros += other.zeros
+        self.count += other.count
+        self._add_counts(other.offset, other.bins)
+        return self
+
+    def __len__(self):
+        return self.count
+
+    def quantile(self, q):
+        """The `q` quantile(s) (0 to 1), NaN while the sketch is empty."""
+        q = np.asarray(q, dtype=np.float64)
+        if not self.count:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        rank = q * (self.count - 1)
+        cumulative = self.zeros + np.cumsum(self.bins)
+        bucket = np.minimum(np.searchsorted(cumulative, rank, side='right'), max(len(self.bins) - 1, 0))
+        values = 2 * self.gamma ** (self.offset + bucket) / (self.gamma + 1)
+        result = np.where(rank < self.zeros, 0.0, values)
+        return result if q.ndim else float(result)
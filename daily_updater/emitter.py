@@ -0,0 +1,649 @@
+import argparse
+import collections
+import logging
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import ddsketch
+import main as daily
+import metrics
+import session_engine
+import storage
+from event_buffer import EventBuffer
+from social_index import SocialTargetIndex
+
+# --- Real-time Event Emitter ---
+# A long-running mode of the generator, for load-testing what reads the
+# events downstream (ingestion, aggregation). The handler writes one batch
+# of backdated events per day. Here sessions of the same personas, played by
+# the same session engine, start continuously at the wall clock. Each event
+# is released when its timestamp comes due, so the stream looks like live
+# traffic: bursts of spins, raids and purchases inside overlapping sessions.
+#
+# The target load is either events per second or concurrent users (players
+# mid-session). Either one becomes a session start rate: the events per
+# session and the mean session length come from a calibration batch, and
+# the events per session are updated as sessions are played. Sessions are
+# planned one TICK_SECONDS ahead, Poisson within each tick. Most are pool
+# users coming back; INSTALL_SHARE are new users' installs, who join the
+# pool. The pool is capped (`max_users`, by default its starting size), so a
+# long run doesn't grow it and the target index without bound: once it is
+# full, each install retires the pool's longest-standing user, as if they
+# had churned, and takes its place. The first tick also plays the sessions that would already be under
+# way (those that started in the last quarter hour or so, keeping only their
+# future events), so the stream starts at full rate.
+#
+# Due events are batched: a batch goes out at `batch_size` events, or once
+# its oldest event has waited `max_latency` seconds. Batches go through a
+# bounded queue to one writer thread that calls the sink. A slow sink fills
+# the queue. Then the emitter either waits for room (`on_full='block'`:
+# events go out late, and the lag shows by how much) or drops the batch
+# (`'drop'`, counted). Either way the throughput it reports levels off at
+# what the sink can take.
+#
+# Sinks have storage.py's `write(event_date, events, part)` interface, with
+# `events` an Arrow table in the storage schema: a Parquet folder
+# (ParquetPartitionSink), a JSON lines file, a TCP socket, or a stand-in
+# message queue with a configurable publish latency (QueueSink).
+#
+# Every `report_seconds` the emitter logs its throughput against the target,
+# the lag from an event's timestamp to the end of its sink write (p50 / p99,
+# from a DDSketch), the batches queued, drops and time spent blocked.
+#
+# Memory: events wait in dictionary-encoded Arrow tables until they are due,
+# a few minutes of events at the target rate (about 100 bytes each).
+
+logger = logging.getLogger(__name__)
+
+# Sessions are planned this far ahead of the clock, one tick at a time
+TICK_SECONDS = 1.0
+BATCH_SIZE = 5000
+MAX_LATENCY_SECONDS = 0.5
+# Batches waiting for the sink before the emitter blocks (or drops)
+MAX_PENDING_BATCHES = 8
+ON_FULL = ('block', 'drop')
+POOL_USERS = 10_000
+# Share of sessions that are a new user's install; the rest are pool users coming back
+INSTALL_SHARE = 0.05
+INSTALL_ATTRIBUTION = [0.4, 0.25, 0.25, 0.1]  # Over ATTRIBUTION_SOURCES, as in main.simulate_new_users
+CALIBRATION_SESSIONS = 2000
+# The warm start plays the sessions that started within the time it takes a session to emit this share of its events
+WARM_START_COVERAGE = 0.99
+WARM_START_SLICE_SECONDS = 10.0  # Played a slice of start times at a time, to bound memory
+# The pending tables are merged into one this often (it frees the released events)
+COMPACT_SECONDS = 30.0
+REPORT_SECONDS = 5.0
+MIN_SLEEP_SECONDS = 0.002
+MAX_SLEEP_SECONDS = 0.05
+SINKS = ['jsonl', 'parquet', 'socket', 'queue']
+
+
+def _decoded(table):
+    """`table` with its dictionary columns decoded to plain strings (the storage schema)."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+
+def _reencoded(table):
+    """`table` with each dictionary column encoded again, so the dictionaries only hold labels still in use."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            values = pc.dictionary_encode(table.column(i).cast(field.type.value_type))
+            table = table.set_column(i, field.name, values.cast(field.type))
+    return table
+
+
+def json_lines(events):
+    """The events as newline-delimited JSON bytes: one object per event, ISO timestamps, NULLs as null."""
+    frame = events.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get) if hasattr(events, 'schema') else events
+    return frame.to_json(orient='records', lines=True, date_format='iso').encode()
+
+
+# --- Sinks ---
+class JsonLinesSink:
+    """Appends each batch to one newline-delimited JSON file, one event per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def write(self, event_date, events, part=None):
+        self._file.write(json_lines(events))
+        self._file.flush()
+        return self.path
+
+    def close(self):
+        self._file.close()
+
+
+class SocketSink:
+    """
+    Sends each batch as newline-delimited JSON over one TCP connection. A
+    reader that doesn't keep up fills the socket buffers and the send waits,
+    which backs the emitter off like any other slow sink.
+    """
+
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+        self._socket = socket.create_connection(self.address, timeout=timeout)
+
+    def write(self, event_date, events, part=None):
+        self._socket.sendall(json_lines(events))
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def close(self):
+        self._socket.close()
+
+
+class QueueSink:
+    """
+    A stand-in for a message queue. Each publish waits `seconds_per_batch`
+    plus `seconds_per_row` for each event, like a broker round trip (as
+    storage.LatencyBackend does for the warehouse), then appends the batch to
+    an in-memory topic that keeps the last `keep` batches.
+    """
+
+    def __init__(self, seconds_per_batch=0.0, seconds_per_row=0.0, keep=16):
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_row = seconds_per_row
+        self.topic = collections.deque(maxlen=keep)
+        self.rows = self.batches = 0
+
+    def write(self, event_date, events, part=None):
+        wait = self.seconds_per_batch + self.seconds_per_row * len(events)
+        if wait > 0:
+            time.sleep(wait)
+        self.topic.append(events)
+        self.rows += len(events)
+        self.batches += 1
+        return part
+
+    def close(self):
+        pass
+
+
+def open_sink(kind, path=None, host='127.0.0.1', port=9000, seconds_per_batch=0.0, seconds_per_row=0.0):
+    """
+    A sink by name (see SINKS): 'jsonl' appends to the file `path`, 'parquet'
+    writes one file per batch under the folder `path`, 'socket' connects to
+    host:port, and 'queue' is a QueueSink with the given latency.
+    """
+    if kind == 'jsonl':
+        return JsonLinesSink(path or 'emitted_events.jsonl')
+    if kind == 'parquet':
+        return storage.ParquetPartitionSink(path or 'emitted_events')
+    if kind == 'socket':
+        return SocketSink(host, port)
+    if kind == 'queue':
+        return QueueSink(seconds_per_batch, seconds_per_row)
+    raise ValueError(f"Unknown sink '{kind}' (known: {', '.join(SINKS)})")
+
+
+# --- User pool ---
+def _user(user_id, persona, country, platform, level):
+    return {
+        'user_pseudo_id': user_id,
+        'persona': persona,
+        'country': country,
+        'platform': platform,
+        'current_village_level': level,
+        'is_churned': False,
+        'sent_invites': 0,
+    }
+
+
+def synthetic_users(n, rng, max_level=10):
+    """`n` new user dicts, personas drawn from PERSONA_DISTRIBUTION, at a level from 1 to `max_level`."""
+    personas = np.array(list(daily.PERSONA_DISTRIBUTION), dtype=object)
+    persona = personas[rng.choice(len(personas), size=n, p=list(daily.PERSONA_DISTRIBUTION.values()))]
+    country = np.array(daily.COUNTRIES, dtype=object)[rng.integers(len(daily.COUNTRIES), size=n)]
+    platform = np.array(daily.PLATFORMS, dtype=object)[rng.integers(len(daily.PLATFORMS), size=n)]
+    level = rng.integers(1, max_level + 1, size=n)
+    return [_user(*row) for row in zip(session_engine.random_uuid4s(rng, n), persona, country, platform,
+                                       level.tolist())]
+
+
+def users_from_state(state, rng):
+    """Pool user dicts for everyone in a user_state.py snapshot, at their last level."""
+    persona = state['persona'].astype(object)
+    persona = persona.where(persona.notna() & (persona != ''), 'Non-Payer').to_numpy()
+    on_record = {}
+    for col, choices in (('country', daily.COUNTRIES), ('platform', daily.PLATFORMS)):
+        values = state[col].to_numpy(dtype=object)
+        missing = pd.isna(values) | (values == '')
+        values[missing] = np.array(choices, dtype=object)[rng.integers(len(choices), size=int(missing.sum()))]
+        on_record[col] = values
+    levels = state['current_village_level'].to_numpy(dtype=np.float64, na_value=np.nan)
+    levels = np.where(np.isnan(levels) | (levels == 0), 1, levels).astype(np.int64)
+    return [_user(*row) for row in zip(state['user_pseudo_id'].to_numpy(dtype=object), persona,
+                                       on_record['country'], on_record['platform'], levels.tolist())]
+
+
+# --- Emitter ---
+class Emitter:
+    """
+    Emits live events to `sink` at `rate` events per second, or with about
+    `concurrent_users` players mid-session (give one of the two). Sessions
+    are played by pool users (`users`, default POOL_USERS synthetic ones)
+    and by new installs, who join the pool of at most `max_users` (default:
+    its starting size). See the module comment for the pool cap, batching,
+    `on_full` and the warm start. `run()` once per emitter.
+    """
+
+    def __init__(self, sink, rate=None, concurrent_users=None, users=None, batch_size=BATCH_SIZE,
+                 max_latency=MAX_LATENCY_SECONDS, max_pending_batches=MAX_PENDING_BATCHES, on_full='block',
+                 warm_start=True, experiment=None, seed=None, report_seconds=REPORT_SECONDS, max_users=None):
+        if (rate is None) == (concurrent_users is None):
+            raise ValueError("Give either a rate (events/s) or a number of concurrent users")
+        if on_full not in ON_FULL:
+            raise ValueError(f"Unknown on_full '{on_full}' (known: {', '.join(ON_FULL)})")
+        self.sink = sink
+        self.rate = rate
+        self.concurrent_users = concurrent_users
+        self.batch_size = batch_size
+        self.max_latency_ns = int(max_latency * 1e9)
+        self.on_full = on_full
+        self.warm_start = warm_start
+        self.experiment = experiment
+        self.report_seconds = report_seconds
+        self.rng = np.random.default_rng(seed)
+        self.users = synthetic_users(POOL_USERS, self.rng) if users is None else list(users)
+        self.max_users = max(max_users or len(self.users), 1)
+        self._oldest = 0      # The pool slot an install retires next, once the pool is full
+        self.retired = 0
+        # The emitter's clock: local time, as the handler's timestamps are, advanced by a monotonic counter
+        self._epoch = np.datetime64(datetime.now(), 'ns').astype(np.int64) - time.perf_counter_ns()
+        self._day = pd.Timestamp(self._clock()).date()
+        self.targets = SocialTargetIndex.from_users(self.users, self._day)
+        self._tick_ns = int(TICK_SECONDS * 1e9)
+        self._planned_until = None
+        self._pending = []    # [Arrow table, its sorted timestamps, events released so far]
+        self._batch = []      # (decoded table, timestamps) due and not yet sent
+        self._batch_rows = 0
+        self._queue = queue.Queue(maxsize=max_pending_batches)
+        self._lock = threading.Lock()  # The writer thread updates the delivery figures
+        self._stop = threading.Event()
+        self._error = None
+        self._lag = ddsketch.DDSketch()
+        self._window_lag = ddsketch.DDSketch()
+        self.released = self.delivered = self.dropped = self.batches = 0
+        self.blocked_seconds = self.sink_seconds = 0.0
+        self.reports = []
+        self._calibrate()
+
+    def _clock(self):
+        return self._epoch + time.perf_counter_ns()
+
+    def _calibrate(self):
+        """Events per session, mean session length and the warm start window, from sample sessions."""
+        rng = np.random.default_rng(self.rng.integers(2 ** 63))
+        sample = [dict(self.users[i]) for i in rng.integers(len(self.users), size=CALIBRATION_SESSIONS)]
+        starts = np.zeros(CALIBRATION_SESSIONS, dtype='datetime64[ns]')
+        frame = session_engine.simulate_sessions(sample, starts, self.targets, rng,
+                                                 out=EventBuffer(daily.COLUMNS)).to_frame()
+        ages = frame['event_timestamp'].to_numpy().astype(np.int64) / 1e9
+        self._sessions, self._events = CALIBRATION_SESSIONS, len(frame)
+        self.mean_session_seconds = float(pd.Series(ages).groupby(frame['session_id'].cat.codes.to_numpy()).max().mean())
+        self.warm_start_seconds = float(np.quantile(ages, WARM_START_COVERAGE))
+
+    @property
+    def events_per_session(self):
+        return self._events / self._sessions
+
+    @property
+    def session_rate(self):
+        """Sessions started per second to meet the target."""
+        if self.rate is not None:
+            return self.rate / self.events_per_session
+        return self.concurrent_users / self.mean_session_seconds  # Little's law
+
+    @property
+    def target_rate(self):
+        """The target in events per second."""
+        return self.session_rate * self.events_per_session
+
+    # --- Sessions ---
+    def _simulate(self, start_ns, end_ns, not_before=None):
+        """Plays the sessions that start in [start_ns, end_ns) and keeps their events (from `not_before`) until due."""
+        rng = self.rng
+        n = int(rng.poisson(self.session_rate * (end_ns - start_ns) / 1e9))
+        if n == 0:
+            return
+        day = pd.Timestamp(end_ns).date()
+        if day != self._day:
+            self._day = day
+            self.targets.set_date(day)
+        starts = rng.integers(start_ns, end_ns, size=n)
+
+        # Installs are new users; everyone else is a pool user coming back
+        installs = rng.random(n) < INSTALL_SHARE
+        n_new = int(installs.sum())
+        user_index = np.empty(n, dtype=np.int64)
+        user_index[~installs] = rng.integers(len(self.users), size=n - n_new)
+        user_index[installs] = len(self.users) + np.arange(n_new)  # Past the pool: the new users below
+        sources = np.full(n, 'organic', dtype=object)
+        inviters = np.full(n, None, dtype=object)
+        new_sources = np.array(daily.ATTRIBUTION_SOURCES, dtype=object)[
+            rng.choice(len(daily.ATTRIBUTION_SOURCES), size=n_new, p=INSTALL_ATTRIBUTION)]
+        new_inviters = np.full(n_new, None, dtype=object)
+        invited = new_sources == 'friend_invite'
+        new_inviters[invited] = self.targets.draw(rng, int(invited.sum()))
+        sources[installs], inviters[installs] = new_sources, new_inviters
+        new_users = synthetic_users(n_new, rng, max_level=1)
+
+        # The engine carries the level over a user's sessions: keep them together, in play order
+        order = np.lexsort((starts, user_index))
+        pool = len(self.users)
+        session_users = [self.users[i] if i < pool else new_users[i - pool] for i in user_index[order].tolist()]
+        with metrics.span('emitter.simulate') as span:
+            events = session_engine.simulate_sessions(
+                session_users, starts[order].astype('datetime64[ns]'), self.targets, rng,
+                attribution_sources=sources[order], inviter_ids=inviters[order],
+                out=EventBuffer(daily.COLUMNS, capacity=max(n * 80, 1)), experiment=self.experiment)
+            span.set(rows=len(events))
+        for user in {id(u): u for u in session_users}.values():
+            self.targets.add(user['user_pseudo_id'], user['current_village_level'], day)
+        self._join(new_users)
+        self._sessions += n
+        self._events += len(events)
+
+        table = events.to_arrow(dictionaries=True)
+        ts = table.column('event_timestamp').to_numpy().astype(np.int64)
+        order = np.argsort(ts, kind='stable')
+        if not_before is not None:
+            order = order[ts[order] >= not_before]
+        if len(order):
+            self._pending.append([table.take(order), ts[order], 0])
+
+    def _join(self, new_users):
+        """Adds installs to the pool; past `max_users`, each one replaces the longest-standing user."""
+        room = max(self.max_users - len(self.users), 0)
+        self.users.extend(new_users[:room])
+        for user in new_users[room:]:
+            self.targets.remove(self.users[self._oldest]['user_pseudo_id'])
+            self.users[self._oldest] = user
+            self._oldest = (self._oldest + 1) % len(self.users)
+            self.retired += 1
+
+    def _start(self):
+        """Plans the first tick, after the warm start: the sessions already under way at the clock."""
+        now = self._clock()
+        if self.warm_start:
+            step = int(WARM_START_SLICE_SECONDS * 1e9)
+            for lo in range(now - int(self.warm_start_seconds * 1e9), now, step):
+                self._simulate(lo, min(lo + step, now), not_before=now)
+            self._compact()
+            # Playing them took a moment: move their events by as much, so they stay ahead of the clock
+            shift = self._clock() - now
+            for chunk in self._pending:
+                table, ts = chunk[0], chunk[1] + shift
+                column = table.schema.get_field_index('event_timestamp')
+                chunk[:2] = table.set_column(column, 'event_timestamp', pa.array(ts, type=pa.timestamp('ns'))), ts
+            now += shift
+        self._planned_until = now
+
+    def _release(self, now):
+        """Moves the events due by `now` (in time order) to the batch being built."""
+        pieces, times = [], []
+        for chunk in self._pending:
+            table, ts, pos = chunk
+            end = int(np.searchsorted(ts, now, side='right'))
+            if end > pos:
+                pieces.append(_decoded(table.slice(pos, end - pos)))
+                times.append(ts[pos:end])
+                chunk[2] = end
+        if not pieces:
+            return
+        self._pending = [chunk for chunk in self._pending if chunk[2] < len(chunk[1])]
+        table, ts = pa.concat_tables(pieces), np.concatenate(times)
+        if len(pieces) > 1:
+            order = np.argsort(ts, kind='stable')
+            table, ts = table.take(order), ts[order]
+        self._batch.append((table, ts))
+        self._batch_rows += len(ts)
+        self.released += len(ts)
+        metrics.count('emitter_events_released', len(ts))
+
+    def _compact(self):
+        """Merges the pending tables into one, dropping the events (and labels) already released."""
+        if len(self._pending) < 2:
+            return
+        with metrics.span('emitter.compact') as span:
+            table = pa.concat_tables([table.slice(pos) for table, _, pos in self._pending])
+            ts = np.concatenate([ts[pos:] for _, ts, pos in self._pending])
+            order = np.argsort(ts, kind='stable')
+            self._pending = [[_reencoded(table.take(order)), ts[order], 0]]
+            span.set(rows=len(ts))
+
+    @property
+    def pending_events(self):
+        return sum(len(ts) - pos for _, ts, pos in self._pending)
+
+    # --- Batches ---
+    def _flush(self, now, force=False):
+        """Sends full batches, or everything due once the oldest event has waited `max_latency` (or `force`)."""
+        if not self._batch_rows:
+            return
+        flush_all = force or now - self._batch[0][1][0] >= self.max_latency_ns
+        if not flush_all and self._batch_rows < self.batch_size:
+            return
+        table = pa.concat_tables([table for table, _ in self._batch])
+        ts = np.concatenate([ts for _, ts in self._batch])
+        end = len(ts) if flush_all else len(ts) - len(ts) % self.batch_size
+        for lo in range(0, end, self.batch_size):
+            hi = min(lo + self.batch_size, end)
+            self._send(table.slice(lo, hi - lo), ts[lo:hi])
+        self._batch = [(table.slice(end), ts[end:])] if end < len(ts) else []
+        self._batch_rows = len(ts) - end
+
+    def _send(self, table, ts):
+        if self.on_full == 'drop':
+            try:
+                self._queue.put_nowait((table, ts))
+            except queue.Full:
+                self.dropped += len(ts)
+                metrics.count('emitter_events_dropped', len(ts))
+            return
+        t0 = time.perf_counter()
+        while True:
+            try:
+                self._queue.put((table, ts), timeout=0.1)
+                break
+            except queue.Full:
+                if self._error is not None:
+                    raise RuntimeError("The sink failed") from self._error
+        self.blocked_seconds += time.perf_counter() - t0
+
+    def _write_loop(self):
+        """The writer thread: sends queued batches to the sink until it gets None."""
+        part = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            table, ts = item
+            t0 = time.perf_counter()
+            try:
+                with metrics.span('emitter.sink_write') as span:
+                    span.set(rows=len(ts))
+                    self.sink.write(pd.Timestamp(int(ts[0])).date(), table, f"emit-{self._run_id}-{part:06d}")
+            except Exception as e:
+                logger.exception("Sink write failed; stopping the emitter")
+                self._error = e
+                return
+            part += 1
+            lag = np.maximum(self._clock() - ts, 0) / 1e9
+            with self._lock:
+                self.delivered += len(ts)
+                self.batches += 1
+                self.sink_seconds += time.perf_counter() - t0
+                self._lag.add(lag)
+                self._window_lag.add(lag)
+            metrics.count('emitter_events_delivered', len(ts))
+
+    # --- Running ---
+    def run(self, duration=None):
+        """
+        Emits for `duration` seconds (or until Ctrl-C or `stop()`), then sends
+        the events already due and waits for the sink. Returns `summary()`.
+        """
+        self._start()
+        self._started = self._planned_until
+        self._run_id = f"{pd.Timestamp(self._started):%Y%m%d%H%M%S}"
+        writer = threading.Thread(target=self._write_loop, name='emitter-sink', daemon=True)
+        writer.start()
+        end = None if duration is None else self._started + int(duration * 1e9)
+        next_report = self._last_report = self._started
+        next_report += int(self.report_seconds * 1e9)
+        next_compact = self._started + int(COMPACT_SECONDS * 1e9)
+        self._last_delivered = 0
+        logger.info("Emitting %.0f events/s (%.1f sessions/s, about %.0f users mid-session) to %s",
+                    self.target_rate, self.session_rate, self.session_rate * self.mean_session_seconds,
+                    type(self.sink).__name__)
+        try:
+            while not self._stop.is_set():
+                now = self._clock()
+                if end is not None and now >= end:
+                    break
+                if self._error is not None:
+                    raise RuntimeError("The sink failed") from self._error
+                if self._planned_until < now + self._tick_ns:
+                    self._simulate(self._planned_until, self._planned_until + self._tick_ns)
+                    self._planned_until += self._tick_ns
+                self._release(now)
+                self._flush(now)
+                if now >= next_compact:
+                    self._compact()
+                    next_compact += int(COMPACT_SECONDS * 1e9)
+                if now >= next_report:
+                    self._report(now)
+                    next_report += int(self.report_seconds * 1e9)
+                time.sleep(self._idle(self._clock()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self._error is None:
+                now = self._clock()
+                self._release(now)
+                self._flush(now, force=True)
+                self._queue.put(None)
+            writer.join()
+            self._stopped = self._clock()
+            getattr(self.sink, 'close', lambda: None)()
+        summary = self.summary()
+        for name in ('events_per_second', 'lag_p99_seconds', 'blocked_seconds'):
+            metrics.gauge(f"emitter_{name}", summary[name])
+        return summary
+
+    def stop(self):
+        """Ends `run()` (from another thread)."""
+        self._stop.set()
+
+    def _idle(self, now):
+        """Seconds to sleep: until the next event is due, the batch times out or the next tick is planned."""
+        wake = [self._planned_until - self._tick_ns]
+        wake.extend(ts[pos] for _, ts, pos in self._pending)
+        if self._batch_rows:
+            wake.append(self._batch[0][1][0] + self.max_latency_ns)
+        return min(max((min(wake) - now) / 1e9, MIN_SLEEP_SECONDS), MAX_SLEEP_SECONDS)
+
+    def _report(self, now):
+        with self._lock:
+            delivered, lag = self.delivered, self._window_lag
+            self._window_lag = ddsketch.DDSketch()
+        row = {
+            'seconds': (now - self._started) / 1e9,
+            'target_events_per_second': self.target_rate,
+            'events_per_second': (delivered - self._last_delivered) / ((now - self._last_report) / 1e9),
+            'lag_p50_seconds': lag.quantile(0.5),
+            'lag_p99_seconds': lag.quantile(0.99),
+            'queued_batches': self._queue.qsize(),
+            'pending_events': self.pending_events,
+            'dropped_events': self.dropped,
+            'blocked_seconds': self.blocked_seconds,
+        }
+        self._last_report, self._last_delivered = now, delivered
+        self.reports.append(row)
+        metrics.gauge('emitter_queued_batches', row['queued_batches'])
+        logger.info("%.0f events/s (target %.0f), lag p50 %.3f s / p99 %.3f s, %d batches queued, "
+                    "%d dropped, %.1f s blocked", row['events_per_second'], row['target_events_per_second'],
+                    row['lag_p50_seconds'], row['lag_p99_seconds'], row['queued_batches'], row['dropped_events'],
+                    row['blocked_seconds'])
+        return row
+
+    def summary(self):
+        """The whole run: throughput against the target, lag percentiles, batches, drops and time blocked."""
+        seconds = (self._stopped - self._started) / 1e9
+        with self._lock:
+            p50, p99, p_max = self._lag.quantile([0.5, 0.99, 1.0]) if len(self._lag) else (np.nan,) * 3
+            return {
+                'seconds': seconds,
+                'target_events_per_second': self.target_rate,
+                'events_per_second': self.delivered / seconds,
+                'released_events': self.released,
+                'delivered_events': self.delivered,
+                'dropped_events': self.dropped,
+                'batches': self.batches,
+                'events_per_batch': self.delivered / self.batches if self.batches else np.nan,
+                'sink_seconds_per_batch': self.sink_seconds / self.batches if self.batches else np.nan,
+                'blocked_seconds': self.blocked_seconds,
+                'lag_p50_seconds': float(p50),
+                'lag_p99_seconds': float(p99),
+                'lag_max_seconds': float(p_max),
+                'pool_users': len(self.users),
+                'retired_users': self.retired,
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emit live simulated events to a file, socket or stand-in queue")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--rate', type=float, help="Target events per second")
+    target.add_argument('--concurrent-users', type=int, help="Target players mid-session")
+    parser.add_argument('--duration', type=float, help="Seconds to run (default: until Ctrl-C)")
+    parser.add_argument('--sink', choices=SINKS, default='jsonl')
+    parser.add_argument('--path', help="Output file (jsonl) or folder (parquet)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--seconds-per-batch', type=float, default=0.0, help="Queue sink publish latency")
+    parser.add_argument('--seconds-per-row', type=float, default=0.0, help="Queue sink latency per event")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-latency', type=float, default=MAX_LATENCY_SECONDS, help="Seconds before a batch is sent")
+    parser.add_argument('--max-pending-batches', type=int, default=MAX_PENDING_BATCHES)
+    parser.add_argument('--on-full', choices=ON_FULL, default='block')
+    parser.add_argument('--users', type=int, default=POOL_USERS, help="Synthetic user pool size")
+    parser.add_argument('--user-state', help="Draw the pool from this user state store instead (user_state.py)")
+    parser.add_argument('--max-users', type=int, help="Most users in the pool (default: its starting size)")
+    parser.add_argument('--experiment', help="Apply this experiment's effects (see experiments.py)")
+    parser.add_argument('--report-seconds', type=float, default=REPORT_SECONDS)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    rng = np.random.default_rng(args.seed)
+    if args.user_state:
+        import user_state
+        users = users_from_state(user_state.open_store(args.user_state).load(), rng)
+    else:
+        users = synthetic_users(args.users, rng)
+    experiment = None
+    if args.experiment:
+        import experiments
+        experiment = experiments.get(args.experiment)
+    sink = open_sink(args.sink, args.path, args.host, args.port, args.seconds_per_batch, args.seconds_per_row)
+    emitter = Emitter(sink, args.rate, args.concurrent_users, users, args.batch_size, args.max_latency,
+                      args.max_pending_batches, args.on_full, experiment=experiment, seed=rng,
+                      report_seconds=args.report_seconds, max_users=args.max_users)
+    summary = emitter.run(args.duration)
+    print(pd.Series(summary).round(4).to_string())
+    metrics.report('emitter')
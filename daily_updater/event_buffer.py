@@ -0,0 +1,249 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+# --- Columnar Event Buffer ---
+# The simulators append events straight into preallocated, typed NumPy columns
+# (one array per column) instead of building a dict per event. `to_frame()`
+# hands pandas the final dtypes directly, so there is no conversion pass.
+#
+# String columns are dictionary-encoded: each one holds integer codes (-1 is
+# NULL) into the buffer's own list of distinct labels. User and session ids
+# are int32 surrogates, and enumerated columns (event_name, country, ...) are
+# int16, instead of one pointer per row to a 36-character uuid string.
+# Frames get them as pandas categoricals. They are decoded back to plain
+# strings (the external schema) only on the way to storage, in `to_arrow()`.
+
+# Storage type of every column we can write
+EVENT_SCHEMA = {
+    'event_timestamp': 'datetime64[ns]',
+    'user_pseudo_id': 'string',
+    'session_id': 'string',
+    'event_name': 'string',
+    'platform': 'string',
+    'app_version': 'string',
+    'country': 'string',
+    'current_village_level': 'Int64',
+    'spin_cost': 'Int64',
+    'spin_outcome_type': 'string',
+    'spin_outcome_value': 'Int64',
+    'item_cost': 'Int64',
+    'entry_point': 'string',
+    'product_id': 'string',
+    'price_usd': 'float64',
+    'attack_target_id': 'string',
+    'raid_target_id': 'string',
+    'invite_method': 'string',
+    'attribution_source': 'string',
+    'inviter_user_id': 'string',
+    'persona': 'string',
+}
+
+# High-cardinality string columns, whose codes need more than 16 bits
+ID_COLUMNS = ('user_pseudo_id', 'session_id', 'attack_target_id', 'raid_target_id', 'inviter_user_id')
+
+
+def _code_dtype(col):
+    return np.int32 if col in ID_COLUMNS else np.int16
+
+
+def _allocate(col, kind, capacity):
+    if kind == 'datetime64[ns]':
+        return np.empty(capacity, dtype='datetime64[ns]')
+    if kind == 'Int64':
+        return np.empty(capacity, dtype=np.int64)
+    if kind == 'float64':
+        return np.empty(capacity, dtype=np.float64)
+    return np.empty(capacity, dtype=_code_dtype(col))
+
+
+def _null(kind):
+    if kind == 'datetime64[ns]':
+        return np.datetime64('NaT')
+    if kind == 'Int64':
+        return 0
+    if kind == 'float64':
+        return np.nan
+    return -1
+
+
+def categorical(codes, labels):
+    """A pandas Categorical from integer codes (-1 is NULL) into `labels`, which may repeat."""
+    inverse, unique = pd.factorize(np.asarray(labels, dtype=object))
+    remap = np.append(inverse, -1)
+    return pd.Categorical.from_codes(remap[np.asarray(codes)], categories=pd.Index(unique, dtype=object))
+
+
+class EventBuffer:
+    """
+    A growable, column-per-array event store.
+
+    `columns` selects (and orders) the output schema; values for any other
+    column are ignored on append. Capacity grows by 1.5x when it runs out,
+    so appending n events costs amortized O(n) copies while keeping the
+    unused tail small.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self.kinds = {col: EVENT_SCHEMA[col] for col in self.columns}
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        self._values = {col: _allocate(col, kind, self._capacity) for col, kind in self.kinds.items()}
+        # True where the value is NULL (only for nullable integer columns)
+        self._nulls = {col: np.empty(self._capacity, dtype=bool)
+                       for col, kind in self.kinds.items() if kind == 'Int64'}
+        # Distinct values of each string column, in code order, and an index over them for lookups
+        self._labels = {col: [] for col, kind in self.kinds.items() if kind == 'string'}
+        self._index = {}
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity = capacity * 3 // 2 + 1
+        for store in (self._values, self._nulls):
+            for col, old in store.items():
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self._size] = old[:self._size]
+                store[col] = new
+        self._capacity = capacity
+
+    def _encode(self, col, values):
+        """Codes of this buffer for a string column given as a Categorical, an array or a scalar."""
+        if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+            values = pd.Categorical(values)
+            codes, labels = values.codes, values.categories
+        elif isinstance(values, str):
+            codes, labels = np.zeros(1, dtype=np.int64), [values]
+        else:
+            codes, labels = pd.factorize(np.asarray(values, dtype=object))
+        known = self._labels[col]
+        if not known:  # The first labels of this column keep their codes
+            known.extend(labels)
+            mapping = None
+        else:
+            if self._index.get(col) is None:
+                self._index[col] = pd.Index(known, dtype=object)
+            mapping = self._index[col].get_indexer(labels)
+            new = mapping < 0
+            if new.any():
+                mapping[new] = len(known) + np.arange(np.count_nonzero(new))
+                known.extend(np.asarray(labels, dtype=object)[new])
+                self._index[col] = None  # Rebuilt on the next append
+        if len(known) > np.iinfo(_code_dtype(col)).max:
+            raise OverflowError(f"Too many distinct values in {col} for {np.dtype(_code_dtype(col))} codes")
+        if mapping is None:
+            return np.asarray(codes, dtype=_code_dtype(col))
+        return np.append(mapping, -1).astype(_code_dtype(col))[codes]
+
+    def append(self, n_rows, values, nulls=None):
+        """
+        Appends `n_rows` events given as whole columns.
+
+        `values` maps column -> array (or scalar) of length `n_rows`; columns
+        that are missing are written as NULL. String columns are best given as
+        pandas Categoricals (see `categorical`), which are re-coded without
+        hashing every row. `nulls` maps a nullable integer column -> boolean
+        array that is True where the value is NULL.
+        """
+        if n_rows == 0:
+            return
+        nulls = nulls or {}
+        self._reserve(n_rows)
+        lo, hi = self._size, self._size + n_rows
+        for col, kind in self.kinds.items():
+            column = values.get(col)
+            if column is None:
+                self._values[col][lo:hi] = _null(kind)
+                if kind == 'Int64':
+                    self._nulls[col][lo:hi] = True
+                continue
+            if kind == 'string':
+                column = self._encode(col, column)
+            self._values[col][lo:hi] = column
+            if kind == 'Int64':
+                self._nulls[col][lo:hi] = nulls[col] if col in nulls else False
+        self._size = hi
+
+    def extend(self, other):
+        """Appends every event of another buffer."""
+        n = len(other)
+        values = {col: other._values[col][:n] for col in other.columns}
+        for col, labels in other._labels.items():
+            values[col] = pd.Categorical.from_codes(values[col], categories=pd.Index(labels, dtype=object))
+        self.append(n, values, {col: other._nulls[col][:n] for col in other._nulls})
+
+    def to_frame(self):
+        """
+        Returns the events as a DataFrame with final dtypes, without copying the
+        column arrays. String columns are categoricals over this buffer's labels.
+        """
+        n = self._size
+        data = {}
+        for col, kind in self.kinds.items():
+            values = self._values[col][:n]
+            if kind == 'Int64':
+                data[col] = pd.arrays.IntegerArray(values, self._nulls[col][:n])
+            elif kind == 'string':
+                data[col] = pd.Categorical.from_codes(values, categories=pd.Index(self._labels[col], dtype=object))
+            else:
+                data[col] = values
+        return pd.DataFrame(data, columns=self.columns, copy=False)
+
+    def to_arrow(self, dictionaries=False):
+        """
+        Returns the events as a pyarrow Table with a fixed schema, whatever the
+        nulls in this chunk. This is the storage boundary: string columns are
+        decoded to plain strings here, inside Arrow. With `dictionaries` they
+        stay dictionary arrays over this buffer's labels (for events held in
+        memory, e.g. by emitter.py, and decoded later).
+        """
+        import pyarrow as pa  # Only needed by the Parquet/Arrow paths
+
+        n = self._size
+        arrays = []
+        for col, kind in self.kinds.items():
+            values = self._values[col][:n]
+            if kind == 'Int64':
+                arrays.append(pa.array(values, type=pa.int64(), mask=self._nulls[col][:n]))
+            elif kind == 'string':
+                codes = pa.array(values, mask=values < 0)
+                labels = pa.array(self._labels[col], type=pa.string())
+                encoded = pa.DictionaryArray.from_arrays(codes, labels)
+                arrays.append(encoded if dictionaries else encoded.dictionary_decode())
+            elif kind == 'datetime64[ns]':
+                arrays.append(pa.array(values, type=pa.timestamp('ns')))
+            else:
+                # NaN prices become NULL, as they do through to_gbq
+                arrays.append(pa.array(values, type=pa.float64(), from_pandas=True))
+        return pa.Table.from_arrays(arrays, names=self.columns)
+
+    def __getstate__(self):
+        # Only ship the used rows when a buffer crosses a process boundary
+        state = self.__dict__.copy()
+        n = self._size
+        state['_values'] = {col: a[:n] for col, a in self._values.items()}
+        state['_nulls'] = {col: a[:n] for col, a in self._nulls.items()}
+        state['_capacity'] = max(n, 1)
+        state['_index'] = {}  # Rebuilt from the labels when needed
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._size == 0:
+            self._values = {col: _allocate(col, kind, 1) for col, kind in self.kinds.items()}
+            self._nulls = {col: np.empty(1, dtype=bool) for col in self._nulls}
+
+    def nbytes(self):
+        """Approximate memory held by the used part of the buffer, string labels included."""
+        n = self._size
+        labels = sum(sys.getsizeof(label) for labels in self._labels.values() for label in labels)
+        return (sum(a[:n].nbytes for a in self._values.values())
+                + sum(a[:n].nbytes for a in self._nulls.values()) + labels)
@@ -1,15 +1,23 @@
 import pandas as pd
 import numpy as np
-import random
-from faker import Faker
+from collections import defaultdict
 from datetime import datetime, timedelta
-import uuid
 from tqdm import tqdm
-import pandas_gbq
 import logging
-from google.cloud import bigquery
 import os  # [!!!] הוספנו את זה
 
+import hyperloglog
+import kpi_summary
+import metrics
+import retention
+import session_engine
+import sharding
+import storage
+import user_state
+from storage import ParquetPartitionSink
+from event_buffer import EventBuffer
+from social_index import SocialTargetIndex
+
 # --- [!!!] התיקון הסופי להרשאות [!!!] ---
 # שתי השורות האלה אומרות לפייתון להשתמש במפורש בקובץ המפתח
 # במקום "לחפש" הרשאות במחשב
@@ -19,13 +27,36 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = SERVICE_ACCOUNT_KEY
 
 
 # --- 1. Global Parameters & Setup ---
-fake = Faker()
 
 # [!!!] FAST VERSION: Reduced parameters for a quick test run [!!!]
 TOTAL_USERS = 1000  # Reduced from 50,000 for a fast run
 DAYS_BACK = 30  # Reduced from 90
 # [!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!]
 
+# Users are sharded across this many processes. The output is reproducible
+# for a fixed SEED and WORKERS (SEED = None draws a fresh seed every run), so
+# parallelism is opt-in: the default doesn't depend on the machine's cores.
+WORKERS = int(os.environ.get("WORKERS", "1"))
+SEED = int(os.environ["SEED"]) if os.environ.get("SEED") else None
+
+# Streaming mode: set STREAM_DIR to write one Parquet partition per day under
+# that folder instead of uploading everything to BigQuery at the end.
+# Re-running with the same folder resumes after the last completed day.
+STREAM_DIR = os.environ.get("STREAM_DIR")
+CHECKPOINT_DIR = "_checkpoints"
+
+# Set USER_STATE_PATH to also write the per-user state snapshot the daily
+# updater reads (a `.db` / `.sqlite` path uses SQLite, anything else Parquet).
+USER_STATE_PATH = os.environ.get("USER_STATE_PATH")
+
+# Set KPI_SUMMARY_PATH to also write the daily_kpi_summary table (as Parquet)
+KPI_SUMMARY_PATH = os.environ.get("KPI_SUMMARY_PATH")
+# Relative error of the summary's DAU sketches (WAU / MAU estimates); later refreshes keep it
+DAU_SKETCH_ERROR = float(os.environ.get("DAU_SKETCH_ERROR", hyperloglog.DEFAULT_ERROR))
+
+# Set RETENTION_PATH to also save the retention cohort matrix the daily updater extends
+RETENTION_PATH = os.environ.get("RETENTION_PATH")
+
 NOW = datetime.now()
 START_DATE = NOW - timedelta(days=DAYS_BACK)
 
@@ -61,159 +92,143 @@ COLUMNS = [
 PROJECT_ID = "ppltx-ba-course-guy"
 TABLE_ID = "coin_master_project.events"
 
+# --- Storage Configuration ---
+# 'bigquery' (default), or the local 'parquet' / 'duckdb' backends at STORAGE_PATH (see storage.py)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "bigquery")
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "events_store")
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def create_user_pool(n_users):
+def create_user_pool(n_users, rng):
+    user_ids = session_engine.random_uuid4s(rng, n_users)
+    personas = rng.choice(list(PERSONA_DISTRIBUTION.keys()), size=n_users, p=list(PERSONA_DISTRIBUTION.values()))
+    countries = rng.choice(COUNTRIES, size=n_users)
+    platforms = rng.choice(PLATFORMS, size=n_users)
+    # Install moments are uniform between START_DATE and NOW
+    install_offsets = rng.random(n_users) * (NOW - START_DATE).total_seconds()
+
     user_pool = []
-    for _ in tqdm(range(n_users), desc="Creating users"):
-        install_date = fake.date_time_between(start_date=START_DATE, end_date=NOW)
+    for i in tqdm(range(n_users), desc="Creating users"):
+        install_date = (START_DATE + timedelta(seconds=float(install_offsets[i]))).date()
         user_pool.append({
-            'user_pseudo_id': str(uuid.uuid4()),
-            'persona': np.random.choice(list(PERSONA_DISTRIBUTION.keys()), p=list(PERSONA_DISTRIBUTION.values())),
-            'country': random.choice(COUNTRIES),
-            'platform': random.choice(PLATFORMS),
-            'install_date': install_date.date(),
+            'user_pseudo_id': user_ids[i],
+            'persona': str(personas[i]),
+            'country': str(countries[i]),
+            'platform': str(platforms[i]),
+            'install_date': install_date,
             'current_village_level': 1,
-            'last_played': install_date.date(),
+            'last_played': install_date,
             'is_churned': False,
             'sent_invites': 0
         })
     return user_pool
 
 
-def create_event(user, session_id, name, timestamp, overrides={}):
-    event_row = {col: None for col in COLUMNS}
-    event_row.update({
-        'user_pseudo_id': user['user_pseudo_id'], 'session_id': session_id,
-        'platform': user['platform'], 'app_version': random.choice(APP_VERSIONS),
-        'country': user['country'], 'current_village_level': user['current_village_level'],
-        'event_timestamp': timestamp, 'event_name': name,
-    })
-    event_row.update(overrides)
-    return event_row
-
-
-def generate_session_events(user, session_timestamp, user_id_list):
-    session_id = str(uuid.uuid4())
-    events_in_session = []
-    current_time = session_timestamp
-    current_time += timedelta(seconds=random.randint(5, 15))
-
-    num_spins = 0
-    if user['persona'] == 'Non-Payer':
-        num_spins = random.randint(10, 40)
-    elif user['persona'] == 'Low-Spender':
-        num_spins = random.randint(50, 100)
-    elif user['persona'] == 'High-Spender':
-        num_spins = random.randint(30, 70)
-
-    for _ in range(num_spins):
-        if len(events_in_session) > 500:
-            break
-
-        spin_cost = random.choice([1, 3, 5, 10])
-        events_in_session.append(create_event(user, session_id, 'spin_action', current_time, {'spin_cost': spin_cost}))
-        current_time += timedelta(seconds=random.randint(2, 5))
-        outcome_type = random.choice(['coins', 'attack', 'raid', 'shield', 'free_spins'])
-        outcome_value = 1
-        if outcome_type == 'coins':
-            outcome_value = random.randint(1000, 100000) * spin_cost
-        elif outcome_type == 'free_spins':
-            outcome_value = random.choice([5, 10, 25])
-        events_in_session.append(create_event(user, session_id, 'spin_outcome_received', current_time,
-                                              {'spin_outcome_type': outcome_type, 'spin_outcome_value': outcome_value}))
-        current_time += timedelta(seconds=random.randint(1, 3))
-        if outcome_type == 'attack':
-            events_in_session.append(create_event(user, session_id, 'attack_performed', current_time,
-                                                  {'attack_target_id': random.choice(user_id_list)}))
-            current_time += timedelta(seconds=random.randint(10, 20))
-        if outcome_type == 'raid':
-            events_in_session.append(create_event(user, session_id, 'raid_performed', current_time,
-                                                  {'raid_target_id': random.choice(user_id_list)}))
-            current_time += timedelta(seconds=random.randint(10, 20))
-        if random.random() < 0.1:
-            cost = random.randint(50000, 500000) * user['current_village_level']
-            events_in_session.append(
-                create_event(user, session_id, 'village_item_upgraded', current_time, {'item_cost': cost}))
-            current_time += timedelta(seconds=random.randint(10, 30))
-
-    if user['persona'] != 'Non-Payer' and random.random() < 0.3:
-        events_in_session.append(create_event(user, session_id, 'leaderboard_viewed', current_time))
-        current_time += timedelta(seconds=random.randint(5, 15))
-    if user['persona'] != 'Non-Payer' and random.random() < 0.1:
-        method = random.choice(INVITE_METHODS)
-        events_in_session.append(
-            create_event(user, session_id, 'friend_invite_sent', current_time, {'invite_method': method}))
-        user['sent_invites'] += 1
-        current_time += timedelta(seconds=random.randint(10, 20))
-    if user['persona'] == 'Low-Spender' and random.random() < 0.05:
-        events_in_session.append(
-            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_spins_popup'}))
-        current_time += timedelta(seconds=random.randint(10, 30))
-        price = 4.99
-        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
-                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
-        current_time += timedelta(seconds=random.randint(5, 10))
-    if user['persona'] == 'High-Spender' and random.random() < 0.40:
-        events_in_session.append(
-            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_coins_popup'}))
-        current_time += timedelta(seconds=random.randint(5, 20))
-        price = random.choice([9.99, 19.99, 49.99])
-        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
-                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
-        current_time += timedelta(seconds=random.randint(5, 10))
-    if random.random() < (0.1 + (0.3 * (user['persona'] == 'High-Spender'))):
-        user['current_village_level'] += 1
-    events_in_session.append(create_event(user, session_id, 'app_close', current_time))
-    return events_in_session
-
-
-def main():
-    logger.info("Starting historical data generation...")
-    logger.info(f"PROJECT_ID: {PROJECT_ID}, TABLE_ID: {TABLE_ID}")
-
-    logger.info("Step 1: Creating user pool with realistic personas...")
-    user_pool = create_user_pool(TOTAL_USERS)
-    user_id_list = [u['user_pseudo_id'] for u in user_pool]
-
-    logger.info(f"Step 2: Running daily simulation for {DAYS_BACK} days...")
-
-    all_events = []  # We use one big list for the 30-day load
-
-    for day in tqdm(pd.to_datetime(pd.date_range(START_DATE, NOW)),
-                    desc=f"Running daily simulation ({DAYS_BACK} days)"):
-
-        inviter_pool = [u['user_pseudo_id'] for u in user_pool if u['sent_invites'] > 0 and not u['is_churned']]
-        if not inviter_pool:
-            inviter_pool = [random.choice(user_id_list)]
-
-        for user in user_pool:
-            if user['install_date'] == day.date():
-                session_id = str(uuid.uuid4())
-                install_time = day + timedelta(hours=random.randint(0, 23), minutes=random.randint(0, 59))
-                attr_source = np.random.choice(ATTRIBUTION_SOURCES, p=[0.4, 0.25, 0.25, 0.1])
-                inviter_id = None
-                if attr_source == 'friend_invite': inviter_id = random.choice(inviter_pool)
-                all_events.append(create_event(user, session_id, 'app_open', install_time,
-                                               {'attribution_source': attr_source, 'inviter_user_id': inviter_id}))
-                all_events.extend(generate_session_events(user, install_time, user_id_list))
-                user['last_played'] = day.date()
-                continue
-
-            if user['install_date'] > day.date() or user['is_churned']:
-                continue
-
-            days_since_install = (day.date() - user['install_date']).days
-            days_since_last_played = (day.date() - user['last_played']).days
+def _index_user(user, targets, inviters):
+    """(Re)files an active user in the target index, and in the inviter index once they have sent invites."""
+    targets.add(user['user_pseudo_id'], user['current_village_level'], user['last_played'])
+    if user['sent_invites'] > 0:
+        inviters.add(user['user_pseudo_id'], user['current_village_level'], user['last_played'])
+
+
+def pool_by_install(user_pool):
+    """
+    Every user ID of the pool sorted by install date, with those dates. Shards
+    of a sharded run draw their social targets and inviters from it, so they
+    can pick users of the other shards.
+    """
+    installs = np.array([u['install_date'] for u in user_pool], dtype='datetime64[D]')
+    order = np.argsort(installs, kind='stable')
+    return np.array([u['user_pseudo_id'] for u in user_pool], dtype=object)[order], installs[order]
+
+
+def day_loop_state(users, first_day):
+    """
+    The day loop's indexes over `users` as of `first_day`: the install-date
+    buckets, the active set (in the order the loop visits it) and the target
+    and inviter indexes. `iter_user_days` updates them in place, so saving
+    them together with the users and the RNG resumes the loop exactly.
+    """
+    installs_by_day = defaultdict(list)
+    active = {}  # position in `users` -> user, for installed users who have not churned
+    targets = SocialTargetIndex(first_day)
+    inviters = SocialTargetIndex(first_day)
+    for i, user in enumerate(users):
+        if user['install_date'] >= first_day:
+            installs_by_day[user['install_date']].append(i)
+        elif not user['is_churned']:
+            active[i] = user
+            _index_user(user, targets, inviters)
+    return {'installs_by_day': installs_by_day, 'active': active, 'targets': targets, 'inviters': inviters}
+
+
+def iter_user_days(users, user_id_list, days, rng, loop_state=None, pool=None):
+    """
+    Runs the day-by-day simulation for `users`, yielding `(day, events)` after every day.
+
+    `events` is a fresh EventBuffer holding only that day's events, so a caller
+    that writes it out and drops it keeps memory bounded by one day's volume.
+    Attack/raid targets are drawn from the installed, unchurned users in
+    `users` by level and recency, and inviters from those of them who have
+    sent invites (see social_index.py). `user_id_list` (every user ID) is the
+    fallback while those are empty.
+
+    When `users` is one shard of several, its indexes would only hold that
+    shard's users and split the social graph into islands. Shards are
+    simulated independently, so they cannot share indexes that change every
+    day. Instead, pass `pool` (from `pool_by_install`): targets are then drawn
+    uniformly from every user installed by the day, and inviters from every
+    user installed before it.
+
+    Instead of scanning every user every day, users wait in install-date
+    buckets, installed users live in an active set that shrinks as they churn,
+    and targets and inviters sit in incrementally maintained indexes. Each
+    day only touches the users who can act on it. They are built from the
+    users' current state unless `loop_state` (from `day_loop_state`, as saved
+    by an interrupted run) is given. Rebuilding them on resume would visit
+    the users and fill the indexes in another order than the first run did.
+    """
+    if len(days) == 0:
+        return
+    if loop_state is None:
+        loop_state = day_loop_state(users, days[0].date())
+    installs_by_day, active = loop_state['installs_by_day'], loop_state['active']
+    targets, inviters = loop_state['targets'], loop_state['inviters']
+
+    for day in days:
+        today = day.date()
+        targets.set_date(today)
+        inviters.set_date(today)
+        events = EventBuffer(COLUMNS)
+        if pool is None:
+            target_pool = targets
+            inviter_pool = inviters
+        else:
+            # Read-only whole-pool draws: every installed user, whichever shard holds them
+            day_index = np.datetime64(today, 'D')
+            target_pool = pool[0][:np.searchsorted(pool[1], day_index, side='right')]
+            inviter_pool = pool[0][:np.searchsorted(pool[1], day_index, side='left')]
+        fallback_inviter = user_id_list[rng.integers(len(user_id_list))] if not len(inviter_pool) else None
+
+        # Decide who plays today, then hand all of the day's sessions to the engine at once.
+        # Session starts are minutes into the day (a random hour and minute).
+        session_users, start_minutes, attribution_sources, inviter_ids = [], [], [], []
+        churned_today = []
+        # Two churn rolls and a play roll per active user, drawn in one call
+        rolls = rng.random((len(active), 3)).tolist()
+
+        for (i, user), (churn_roll, late_churn_roll, play_roll) in zip(active.items(), rolls):
+            days_since_install = (today - user['install_date']).days
+            days_since_last_played = (today - user['last_played']).days
 
             if user['persona'] == 'Non-Payer':
-                if days_since_install > 7 and days_since_last_played > 3 and random.random() < 0.2:
-                    user['is_churned'] = True
+                if days_since_install > 7 and days_since_last_played > 3 and churn_roll < 0.2:
+                    churned_today.append(i)
                     continue
-                if days_since_install > 30 and days_since_last_played > 7 and random.random() < 0.5:
-                    user['is_churned'] = True
+                if days_since_install > 30 and days_since_last_played > 7 and late_churn_roll < 0.5:
+                    churned_today.append(i)
                     continue
 
             play_chance = 0
@@ -224,60 +239,285 @@ def main():
             elif user['persona'] == 'High-Spender':
                 play_chance = 0.9
 
-            if random.random() < play_chance:
+            if play_roll < play_chance:
                 num_sessions = 1
                 if user['persona'] != 'Non-Payer':
-                    num_sessions = random.randint(1, (5 if user['persona'] == 'High-Spender' else 3))
-                for i in range(num_sessions):
-                    session_time = day + timedelta(hours=random.randint(0, 23), minutes=random.randint(0, 59))
-                    session_id = str(uuid.uuid4())
-                    all_events.append(
-                        create_event(user, session_id, 'app_open', session_time, {'attribution_source': 'organic'}))
-                    all_events.extend(generate_session_events(user, session_time, user_id_list))
-                user['last_played'] = day.date()
-
-    logger.info(f"\nStep 3: Creating final DataFrame... (Total events: {len(all_events):,})")
-
-    if not all_events:
-        logger.warning("No events were generated. Exiting.")
+                    num_sessions = rng.integers(1, (5 if user['persona'] == 'High-Spender' else 3) + 1)
+                for _ in range(num_sessions):
+                    session_users.append(user)
+                    start_minutes.append(rng.integers(24 * 60))
+                    attribution_sources.append('organic')
+                    inviter_ids.append(None)
+                user['last_played'] = today
+
+        for i in installs_by_day.pop(today, ()):
+            user = users[i]
+            attr_source = rng.choice(ATTRIBUTION_SOURCES, p=[0.4, 0.25, 0.25, 0.1])
+            inviter_id = None
+            if attr_source == 'friend_invite':
+                if not len(inviter_pool):
+                    inviter_id = fallback_inviter
+                elif pool is None:
+                    inviter_id = inviters.draw(rng, 1)[0]
+                else:
+                    inviter_id = inviter_pool[rng.integers(len(inviter_pool))]
+            session_users.append(user)
+            start_minutes.append(rng.integers(24 * 60))
+            attribution_sources.append(attr_source)
+            inviter_ids.append(inviter_id)
+            user['last_played'] = today
+            active[i] = user  # From tomorrow on they can return or churn
+            targets.add(user['user_pseudo_id'], 1, today)  # Can be attacked on their first day
+
+        session_starts = np.datetime64(today, 'ns') + np.array(start_minutes, dtype='timedelta64[m]')
+        session_engine.simulate_sessions(
+            session_users, session_starts, target_pool if len(target_pool) else user_id_list, rng=rng,
+            attribution_sources=attribution_sources, inviter_ids=inviter_ids, out=events
+        )
+
+        # Today's draws used the start-of-day indexes; apply the day's changes now
+        for user in session_users:
+            _index_user(user, targets, inviters)
+        for i in churned_today:
+            user = active.pop(i)
+            user['is_churned'] = True
+            targets.remove(user['user_pseudo_id'])
+            inviters.remove(user['user_pseudo_id'])
+
+        yield day, events
+
+
+def simulate_user_days(users, user_id_list, days, rng, out=None, pool=None):
+    """Runs the day-by-day simulation for `users` and appends every day's events to `out`."""
+    if out is None:
+        out = EventBuffer(COLUMNS)
+    for _, events in iter_user_days(users, user_id_list, days, rng, pool=pool):
+        out.extend(events)
+    return out
+
+
+def _simulate_shard(users, rng):
+    """Process-pool task: one shard of users over every simulated day."""
+    events = simulate_user_days(users, sharding.shared('user_id_list'), sharding.shared('days'), rng,
+                                pool=sharding.shared('pool'))
+    return events, users
+
+
+def _stream_shard(shard, rng):
+    """
+    Process-pool task (streaming mode): writes one partition file per simulated
+    day for one shard, checkpointing the shard's users, day loop indexes and
+    RNG state after each.
+    """
+    shard_index, users = shard
+    stream_dir = sharding.shared('stream_dir')
+    days = sharding.shared('days')
+    sink = ParquetPartitionSink(stream_dir)
+    part = f"shard-{shard_index:03d}"
+    checkpoint_path = os.path.join(stream_dir, CHECKPOINT_DIR, f"{part}.pkl")
+
+    # Resume right after the last day this shard fully wrote, with the day loop's indexes as they were
+    days_done = 0
+    state = user_state.empty_state()
+    loop_state = None
+    checkpoint = storage.load_pickle(checkpoint_path)
+    if checkpoint is not None:
+        days_done, users, state = checkpoint['days_done'], checkpoint['users'], checkpoint['state']
+        loop_state = checkpoint.get('loop_state')
+        rng.bit_generator.state = checkpoint['rng_state']
+    if loop_state is None and days_done < len(days):
+        loop_state = day_loop_state(users, days[days_done].date())
+
+    n_events = 0
+    for days_done, (day, events) in enumerate(
+            iter_user_days(users, sharding.shared('user_id_list'), days[days_done:], rng, loop_state,
+                           pool=sharding.shared('pool')),
+            start=days_done + 1):
+        sink.write(day, events, part=part)
+        n_events += len(events)
+        if USER_STATE_PATH or KPI_SUMMARY_PATH:
+            state = user_state.merge_state(state, user_state.summarize_events(events.to_frame()))
+        del events
+        # One pickle, so the indexes keep pointing at the same user dicts
+        storage.save_pickle(checkpoint_path, {
+            'days_done': days_done, 'users': users, 'state': state, 'loop_state': loop_state,
+            'rng_state': rng.bit_generator.state
+        })
+    return n_events, users, state
+
+
+def stream_backfill(stream_dir):
+    """
+    Streaming mode: every day's events are written to their own date partition
+    under `stream_dir` and released, so memory is bounded by one day's volume.
+    Re-running with the same `stream_dir` resumes after the last completed day.
+    """
+    manifest_path = os.path.join(stream_dir, CHECKPOINT_DIR, "run.pkl")
+    manifest = storage.load_pickle(manifest_path)
+    if manifest is None:
+        seed_seq = np.random.SeedSequence(SEED)
+        pool_seed, _ = seed_seq.spawn(2)
+        logger.info("Step 1: Creating user pool with realistic personas...")
+        manifest = {
+            'entropy': seed_seq.entropy,
+            'workers': WORKERS,
+            'days': pd.to_datetime(pd.date_range(START_DATE, NOW)),
+            'user_pool': create_user_pool(TOTAL_USERS, np.random.default_rng(pool_seed)),
+        }
+        storage.save_pickle(manifest_path, manifest)
+    else:
+        # The seed, days, users and shard count must match the interrupted run
+        logger.info(f"Resuming the backfill in {stream_dir} (workers: {manifest['workers']})...")
+
+    _, shards_seed = np.random.SeedSequence(manifest['entropy']).spawn(2)
+    user_pool = manifest['user_pool']
+    workers = manifest['workers']
+
+    logger.info(f"Step 2: Streaming {len(manifest['days'])} daily partitions to {stream_dir} "
+                f"on {workers} worker(s)...")
+    shards = list(enumerate(sharding.split_evenly(user_pool, workers)))
+    results = sharding.run_sharded(
+        _stream_shard, shards, seed=shards_seed, workers=workers,
+        shared_inputs={
+            'user_id_list': [u['user_pseudo_id'] for u in user_pool],
+            'days': manifest['days'],
+            'stream_dir': stream_dir,
+            # With several shards, social draws span the whole pool (see iter_user_days)
+            'pool': pool_by_install(user_pool) if workers > 1 else None
+        }
+    )
+    logger.info(f"Success! {sum(n for n, _, _ in results):,} events were written to {stream_dir}")
+    # Shards hold disjoint users, so their states simply stack
+    state = pd.concat([state for _, _, state in results], ignore_index=True)
+    save_user_state(state, [u for _, users, _ in results for u in users])
+
+    if KPI_SUMMARY_PATH:
+        # One partition at a time, so memory stays bounded here too
+        summary = kpi_summary.empty_summary()
+        partitions = storage.LocalParquetBackend(stream_dir)
+        for day in tqdm(manifest['days'], desc="KPI summary"):
+            summary = kpi_summary.refresh_partition(summary, partitions, day, state,
+                                                    precision=hyperloglog.precision_for_error(DAU_SKETCH_ERROR))
+        save_kpi_summary(summary)
+
+    if RETENTION_PATH:
+        matrix = retention.RetentionMatrix()
+        partitions = storage.LocalParquetBackend(stream_dir)
+        for day in tqdm(manifest['days'], desc="Retention matrix"):
+            matrix.update(partitions.read(day, day), dates=[day])
+        save_retention(matrix)
+
+
+def save_user_state(state, users):
+    """
+    Writes the per-user state summarized from the events to USER_STATE_PATH.
+    The backfill schema has no persona column, so personas come from the user pool.
+    """
+    if not USER_STATE_PATH:
+        return
+    state['persona'] = state['user_pseudo_id'].map({u['user_pseudo_id']: u['persona'] for u in users})
+    user_state.open_store(USER_STATE_PATH).replace(state)
+    logger.info(f"User state for {len(state):,} users was written to {USER_STATE_PATH}")
+
+
+def save_kpi_summary(summary):
+    """Writes the daily_kpi_summary rows to KPI_SUMMARY_PATH."""
+    if not KPI_SUMMARY_PATH:
         return
+    kpi_summary.ParquetKpiSummaryStore(KPI_SUMMARY_PATH).replace(summary)
+    logger.info(f"{len(summary):,} KPI summary rows were written to {KPI_SUMMARY_PATH}")
+
 
-    df = pd.DataFrame(all_events, columns=COLUMNS)
+def save_retention(matrix):
+    """Saves the retention cohort matrix to RETENTION_PATH."""
+    matrix.save(RETENTION_PATH)
+    logger.info(f"Retention matrix for {len(matrix):,} users was saved to {RETENTION_PATH}")
 
-    logger.info("Converting data types...")
-    df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
-    df['current_village_level'] = df['current_village_level'].astype('Int64')
-    df['spin_cost'] = df['spin_cost'].astype('Int64')
-    df['spin_outcome_value'] = df['spin_outcome_value'].astype('Int64')
-    df['item_cost'] = df['item_cost'].astype('Int64')
-    df['price_usd'] = df['price_usd'].astype('float')
 
-    logger.info(f"Step 4: Uploading {len(df):,} rows to BigQuery table: {TABLE_ID}...")
+def main():
+    logger.info("Starting historical data generation...")
+    logger.info(f"PROJECT_ID: {PROJECT_ID}, TABLE_ID: {TABLE_ID}")
+    logger.info(f"Seed: {SEED}, workers: {WORKERS}")
 
+    metrics.reset()
     try:
-        # We use the 'google-cloud-bigquery' client to run a query
-        logger.warning(f"Clearing all existing data from {TABLE_ID}...")
-
-        # [!!!] This will now use the 'credentials.json' file [!!!]
-        client = bigquery.Client(project=PROJECT_ID)
-        delete_job = client.query(f"DELETE FROM `{TABLE_ID}` WHERE TRUE")
-        delete_job.result()  # Wait for the delete to finish
-        logger.info("Old data cleared.")
-
-        # Now, upload the new data using pandas_gbq
-        pandas_gbq.to_gbq(
-            df,
-            TABLE_ID,
-            project_id=PROJECT_ID,
-            if_exists='append',  # We append to the (now empty) partitioned table
-            chunksize=50000,
-            progress_bar=True
+        if STREAM_DIR:
+            with metrics.span('backfill.stream'):
+                stream_backfill(STREAM_DIR)
+        else:
+            backfill()
+    finally:
+        metrics.report('backfill')
+
+
+def backfill():
+    """The in-memory backfill: every day is simulated, then the whole table is replaced at once."""
+    # One seed drives the user pool and, through spawned streams, every shard
+    pool_seed, shards_seed = np.random.SeedSequence(SEED).spawn(2)
+
+    logger.info("Step 1: Creating user pool with realistic personas...")
+    with metrics.span('backfill.create_user_pool') as span:
+        user_pool = create_user_pool(TOTAL_USERS, np.random.default_rng(pool_seed))
+        span.set(rows=len(user_pool))
+    user_id_list = [u['user_pseudo_id'] for u in user_pool]
+
+    logger.info(f"Step 2: Running daily simulation for {DAYS_BACK} days on {WORKERS} worker(s)...")
+    days = pd.to_datetime(pd.date_range(START_DATE, NOW))
+
+    # Each shard comes back as a columnar EventBuffer; merge them in shard order
+    shards = sharding.split_evenly(user_pool, WORKERS)
+    with metrics.span('backfill.simulate', workers=WORKERS) as span:
+        results = sharding.run_sharded(
+            _simulate_shard, shards, seed=shards_seed, workers=WORKERS,
+            shared_inputs={'user_id_list': user_id_list, 'days': days,
+                           'pool': pool_by_install(user_pool) if WORKERS > 1 else None}
         )
-        logger.info(f"\nSuccess! Data was uploaded to {TABLE_ID}")
+        span.set(rows=sum(len(events) for events, _ in results))
+    with metrics.span('backfill.merge_shards'):
+        all_events = EventBuffer(COLUMNS, capacity=sum(len(events) for events, _ in results))
+        for events, _ in tqdm(results, desc="Merging shards"):
+            all_events.extend(events)
+    final_users = [u for _, users in results for u in users]
+    del results
+    if metrics.enabled():
+        personas = pd.Series({u['user_pseudo_id']: u['persona'] for u in final_users})
+        for persona, n in all_events.to_frame()['user_pseudo_id'].map(personas).value_counts().items():
+            metrics.count('events_generated', int(n), persona=persona)
+
+    logger.info(f"\nStep 3: Total events: {len(all_events):,}")
+
+    if not len(all_events):
+        logger.warning("No events were generated. Exiting.")
+        return
+
+    target = TABLE_ID if STORAGE_BACKEND == 'bigquery' else STORAGE_PATH
+    logger.info(f"Step 4: Writing {len(all_events):,} rows to {target} ({STORAGE_BACKEND} backend)...")
+
+    try:
+        # [!!!] The BigQuery backend will use the 'credentials.json' file [!!!]
+        backend = storage.open_backend(STORAGE_BACKEND, path=STORAGE_PATH, project_id=PROJECT_ID,
+                                       table_id=TABLE_ID, progress_bar=True)
+        # Every existing event is replaced by the new backfill
+        with metrics.span('backfill.replace_all', backend=STORAGE_BACKEND) as span:
+            span.set(rows=len(all_events))
+            backend.replace_all(all_events)
+        logger.info(f"\nSuccess! Data was written to {target}")
+        df = all_events.to_frame()
+        if USER_STATE_PATH:
+            with metrics.span('backfill.user_state'):
+                save_user_state(user_state.summarize_events(df), final_users)
+        if KPI_SUMMARY_PATH:
+            with metrics.span('backfill.kpi_summary'):
+                save_kpi_summary(kpi_summary.full_rebuild(df, hyperloglog.precision_for_error(DAU_SKETCH_ERROR)))
+        if RETENTION_PATH:
+            with metrics.span('backfill.retention'):
+                save_retention(retention.RetentionMatrix().update(df, dates=days))
 
     except Exception as e:
         logger.error(f"\n--- ERROR ---")
-        logger.error(f"Upload to BigQuery failed. Error details: {e}")
+        logger.error(f"Writing to {target} failed. Error details: {e}")
+        if STORAGE_BACKEND != 'bigquery':
+            return
         logger.error("\n--- Troubleshooting ---")
         logger.error("1. Is the 'credentials.json' file in the same folder as the script?")
         logger.error(f"2. Does the Service Account ('bq-data-loader') have 'BigQuery Admin' permissions?")
@@ -1,17 +1,29 @@
-import pandas as pd
 import numpy as np
-import random
-from faker import Faker
 from datetime import datetime, timedelta
-import uuid
-import pandas_gbq
 import logging
-from google.cloud import bigquery
 import functions_framework
 import os
+import time
+
+import session_engine
+import metrics
+import sharding
+import storage
+from event_buffer import EventBuffer
+from social_index import SocialTargetIndex
+
+# Startup: everything imported above is needed by every invocation. Modules
+# of optional features (user_state, kpi_summary, retention) and of the
+# storage backends (google.cloud.bigquery, pandas_gbq, duckdb) are imported
+# on the paths that use them, so a cold start doesn't pay for them.
+# pandas (with pyarrow, which it loads) is about 160 of the module's 280 ms,
+# through session_engine, event_buffer and storage. It stays at the top:
+# every handler path (a day, a catch-up, an aggregate run) builds frames
+# with it, so deferring it would only move that time into the first request.
+# `python benchmark.py startup` (benchmarks/handler.py) checks the import
+# time against a budget and shows the time with and without pandas.
 
 # --- 1. Global Parameters & Setup ---
-fake = Faker()
 BASE_INSTALLS_PER_DAY = 33
 
 PERSONA_DISTRIBUTION = {
@@ -35,6 +47,27 @@ BASE_RETENTION_CURVE = {
     21: 0.15,
     30: 0.10
 }
+LONG_TAIL_RETENTION = 0.05  # Past the curve's last day
+# Retention multiplier and most sessions a returning user plays in a day, by session_engine persona code
+RETENTION_MULTIPLIERS = np.array([1.0, 1.2, 1.5])
+MAX_RETURNING_SESSIONS = np.array([1, 2, 3])
+# What a fetched user needs to return (a subset of user_state.RETURNING_COLUMNS)
+RETURNING_FIELDS = ['user_pseudo_id', 'persona', 'current_village_level', 'platform', 'country', 'user_age_days']
+
+
+def _return_probs():
+    """
+    The chance to return by (age in days, persona code). Between the curve's
+    days it is interpolated linearly, so retention eases from one to the next.
+    The last row holds every user older than the curve.
+    """
+    days = sorted(BASE_RETENTION_CURVE)
+    base = np.interp(np.arange(days[-1] + 2), days, [BASE_RETENTION_CURVE[day] for day in days])
+    base[0], base[-1] = 0.0, LONG_TAIL_RETENTION  # Users can't return on their install day
+    return base[:, None] * RETENTION_MULTIPLIERS[None, :]
+
+
+RETURN_PROBS = _return_probs()
 
 APP_VERSIONS = ['1.150.0', '1.150.1', '1.150.2', '1.151.0']
 PLATFORMS = ['iOS', 'Android']
@@ -59,13 +92,94 @@ COLUMNS = [
     'persona'  # [!!!] We must save the persona! [!!!]
 ]
 
+# --- Simulation Configuration ---
+# Users are sharded across this many processes. The output is reproducible
+# for a fixed seed and worker count (no seed draws a fresh one every run).
+SIMULATION_WORKERS = int(os.environ.get("SIMULATION_WORKERS", "1"))
+SIMULATION_SEED = int(os.environ["SIMULATION_SEED"]) if os.environ.get("SIMULATION_SEED") else None
+
+# --- Concurrent I/O Configuration ---
+# With CONCURRENT_IO set, the handler overlaps its I/O with its own work: the
+# day's partition is cleared while the returning users are fetched, and the
+# users are simulated in UPLOAD_CHUNKS chunks, each uploaded on an I/O thread
+# while the next one is simulated. Chunks get their own random streams like
+# shards, so for a fixed seed the events depend on the number of chunks.
+# Every upload has a fixed cost, so more chunks only pay off once simulating
+# a chunk takes longer than that: `python benchmark.py pipeline`
+# (benchmarks/handler.py) measures it. With several SIMULATION_WORKERS each
+# shard is already a chunk.
+# Like the BigQuery path's DELETE + append, a run that fails midway can leave
+# the day partly written; re-running the day replaces it.
+CONCURRENT_IO = os.environ.get("CONCURRENT_IO", "").lower() in ('1', 'true', 'yes')
+UPLOAD_CHUNKS = int(os.environ.get("UPLOAD_CHUNKS", "1"))
+
+# --- User State Configuration ---
+# With USER_STATE_PATH set, returning users are read from the per-user state
+# snapshot (see user_state.py) instead of the 30-day events scan, and the
+# snapshot is updated with each day's events after they are written.
+USER_STATE_PATH = os.environ.get("USER_STATE_PATH")
+
+# With KPI_SUMMARY_PATH set (needs USER_STATE_PATH), the daily_kpi_summary
+# rows touched by the run are refreshed in-process into that Parquet file
+# instead of rebuilding the whole table (see kpi_summary.py).
+KPI_SUMMARY_PATH = os.environ.get("KPI_SUMMARY_PATH")
+
+# With RETENTION_PATH set, the day's events are folded into the retention
+# cohort matrix saved there (see retention.py).
+RETENTION_PATH = os.environ.get("RETENTION_PATH")
+
+# With RAID_LEAGUE_PATH set, the day's raids are scored in the weekly Raid
+# League saved there, and last week's winners get their reward events in
+# their first session of the week (see raid_league.py).
+RAID_LEAGUE_PATH = os.environ.get("RAID_LEAGUE_PATH")
+
+# With EXPERIMENT set to an experiment of experiments.py (e.g. 'raid_league'),
+# users are split into control and treatment by a hash of their ID, and the
+# treated users play with the experiment's effects. With a Raid League running
+# too, only the treatment group is placed in it.
+EXPERIMENT = os.environ.get("EXPERIMENT")
+
+# With RESULT_CACHE_PATH set, the cached dashboard results that read a
+# rewritten day are dropped from the result cache in that folder once the
+# day is written (see result_cache.py).
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH")
+
+# --- Aggregate Simulation Configuration ---
+# With AGGREGATE_SIMULATION_PATH set, the handler runs the aggregate
+# simulation instead (see aggregate_sim.py): the population is kept as user
+# counts in that file and each day's daily_kpi_summary rows are written
+# straight to KPI_SUMMARY_PATH. No events are generated or written.
+# AGGREGATE_INSTALL_SCALE multiplies the daily installs, to grow the
+# population to load-test sizes.
+AGGREGATE_SIMULATION_PATH = os.environ.get("AGGREGATE_SIMULATION_PATH")
+AGGREGATE_INSTALL_SCALE = float(os.environ.get("AGGREGATE_INSTALL_SCALE", "1"))
+
 # --- BigQuery Configuration ---
 PROJECT_ID = "ppltx-ba-course-guy"
 TABLE_ID = "coin_master_project.events"
 
+# --- Storage Configuration ---
+# Where events are read from and written to: 'bigquery' (default), or the
+# local 'parquet' / 'duckdb' backends at STORAGE_PATH (see storage.py).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "bigquery")
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "events_store")
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Backends (and the BigQuery client they hold) live as long as the instance,
+# so warm invocations reuse the connection and credentials
+_backends = {}
+
+
+def get_backend():
+    """The storage backend for the configured STORAGE_BACKEND / STORAGE_PATH, opened once per instance."""
+    key = (STORAGE_BACKEND, STORAGE_PATH)
+    if key not in _backends:
+        _backends[key] = storage.open_backend(STORAGE_BACKEND, path=STORAGE_PATH,
+                                              project_id=PROJECT_ID, table_id=TABLE_ID)
+    return _backends[key]
+
 
 # [!!!] This decorator turns our script into a Cloud Function [!!!]
 @functions_framework.http
@@ -76,102 +190,133 @@ def handler(request):
     """
     logger.info("Cloud Function triggered. Starting daily data generation...")
 
+    # Catch-up: `?start_date=YYYY-MM-DD[&end_date=YYYY-MM-DD]` simulates a run of missed days in one go
+    start_date, end_date = _requested_range(request)
+    if AGGREGATE_SIMULATION_PATH:
+        return aggregate_run(start_date or f"{datetime.now() - timedelta(days=1):%Y-%m-%d}", end_date)
+    if start_date is not None:
+        return catch_up(start_date, end_date)
+
     # We'll simulate "yesterday's" data
     YESTERDAY = datetime.now() - timedelta(days=1)
     YESTERDAY_DATE = YESTERDAY.date()
     YESTERDAY_DATE_STR = YESTERDAY.strftime('%Y-%m-%d')
 
-    all_daily_events = []
+    # One seed drives the handler's own draws and, through spawned streams, every shard
+    handler_seed, shards_seed = day_seeds(YESTERDAY_DATE)
+    rng = np.random.default_rng(handler_seed)
+    metrics.reset()  # A warm instance reports every invocation on its own
+    started = time.perf_counter()
+    io = None
 
     try:
-        client = bigquery.Client(project=PROJECT_ID)
+        backend = get_backend()
+
+        # With CONCURRENT_IO, one I/O thread clears the day's partition right away, then uploads chunks in order
+        if CONCURRENT_IO:
+            from concurrent.futures import ThreadPoolExecutor
+            io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='handler-io')
+            io_jobs = [io.submit(_clear_partition, backend, YESTERDAY_DATE)]
 
         # [!!! NEW V12: Phase 1 - Fetch & Simulate RETURNING Users !!!]
         logger.info(f"Phase 1: Fetching returning users for {YESTERDAY_DATE_STR}...")
 
-        # 1a. Fetch active users from BQ
-        returning_user_list = fetch_returning_users(client, YESTERDAY_DATE_STR)
-
-        # 1b. Create the "global pool" of *existing* users for attacks/raids
-        # We will add new users to this pool later
-        global_user_id_pool = [u['user_pseudo_id'] for u in returning_user_list]
-
-        if not global_user_id_pool:
-            global_user_id_pool = ["dummy_user_1"]  # Safety net
+        # 1a. Load active users from the state snapshot, or fetch them from the event store
+        state_store = None
+        if USER_STATE_PATH:
+            import user_state
+            state_store = user_state.open_store(USER_STATE_PATH)
+        source = 'user_state' if state_store is not None else STORAGE_BACKEND
+        with metrics.span('phase1.fetch_returning_users', source=source) as span:
+            if state_store is not None:
+                returning_user_list = user_state.returning_users(state_store.load(), YESTERDAY_DATE)
+            else:
+                returning_user_list = backend.fetch_returning_users(YESTERDAY_DATE_STR)
+            span.set(rows=len(returning_user_list))
 
         logger.info(f"Found {len(returning_user_list)} potential returning users.")
 
-        # 1c. Simulate their sessions
-        returning_events = simulate_returning_users(returning_user_list, YESTERDAY_DATE, global_user_id_pool)
-        all_daily_events.extend(returning_events)
-        logger.info(f"Generated {len(returning_events)} events for returning users.")
-
         # [!!! MODIFIED V12: Phase 2 - Simulate NEW Users !!!]
         logger.info(f"Phase 2: Generating new users for {YESTERDAY_DATE_STR}...")
-
-        # 2a. Decide how many new users to create (Your existing logic)
-        lambda_roll = random.random()
-        if lambda_roll <= 0.80:
-            daily_variance = random.randint(10, 20)
+        targets, new_user_ids = draw_new_users(returning_user_list, YESTERDAY_DATE, rng)
+
+        # 2d. Simulate returning and new users, sharded across SIMULATION_WORKERS processes.
+        # Every shard returns a columnar EventBuffer; we merge them in shard order.
+        if io is not None:
+            # Each chunk is uploaded as soon as it is simulated
+            n_shards = max(SIMULATION_WORKERS, UPLOAD_CHUNKS)
+            shard_args, shared_inputs = _shard_inputs(YESTERDAY, returning_user_list, new_user_ids, targets, n_shards)
+            all_daily_events, returning_event_count = _simulate_and_upload(
+                io, io_jobs, backend, YESTERDAY_DATE, shard_args, shards_seed, shared_inputs)
         else:
-            daily_variance = random.randint(-15, -8)
-        TOTAL_USERS_FOR_THIS_DAY = BASE_INSTALLS_PER_DAY + daily_variance
-        if TOTAL_USERS_FOR_THIS_DAY < 5: TOTAL_USERS_FOR_THIS_DAY = 5
-
-        # 2b. Create a pool of *potential* inviters (can be any active user)
-        inviter_pool = random.sample(global_user_id_pool, k=min(len(global_user_id_pool), 100))
-        if not inviter_pool: inviter_pool = ["dummy_inviter"]
-
-        # 2c. Add new user IDs to the global pool *before* simulation
-        # so they can be attacked/raided on their first day
-        new_user_ids = [str(uuid.uuid4()) for _ in range(TOTAL_USERS_FOR_THIS_DAY)]
-        global_user_id_pool.extend(new_user_ids)
-
-        # 2d. Simulate new user sessions
-        new_user_events = simulate_new_users(
-            new_user_ids,
-            YESTERDAY,
-            global_user_id_pool,
-            inviter_pool
-        )
-        all_daily_events.extend(new_user_events)
-        logger.info(f"Generated {len(new_user_events)} events for {TOTAL_USERS_FOR_THIS_DAY} new users.")
+            n_shards = SIMULATION_WORKERS
+            all_daily_events, returning_event_count = simulate_day(
+                YESTERDAY, returning_user_list, new_user_ids, targets, shards_seed)
+        logger.info(f"Generated {returning_event_count} events for returning users.")
+        new_user_event_count = len(all_daily_events) - returning_event_count
+        logger.info(f"Generated {new_user_event_count} events for {len(new_user_ids)} new users.")
 
-        # [!!! MODIFIED V12: Phase 3 - Write ALL events to BigQuery !!!]
-        logger.info(f"\nPhase 3: Creating DataFrame... (Total events: {len(all_daily_events):,})")
+        # [!!! MODIFIED V12: Phase 3 - Write ALL events to the storage backend !!!]
+        logger.info(f"\nPhase 3: Total events: {len(all_daily_events):,}")
 
-        if not all_daily_events:
+        if not len(all_daily_events):
             logger.warning("No events were generated. Exiting.")
             return "No events generated.", 200
 
-        df = pd.DataFrame(all_daily_events, columns=COLUMNS)
-
-        logger.info("Converting data types...")
-        df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
-        df['current_village_level'] = df['current_village_level'].astype('Int64')
-        df['spin_cost'] = df['spin_cost'].astype('Int64')
-        df['spin_outcome_value'] = df['spin_outcome_value'].astype('Int64')
-        df['item_cost'] = df['item_cost'].astype('Int64')
-        df['price_usd'] = df['price_usd'].astype('float')
-
-        logger.info(f"Phase 4: Appending {len(df):,} rows to BigQuery table: {TABLE_ID}...")
-
-        # [!!!] PROTECTION MECHANISM: 1. DELETE OLD DATA FOR THIS PARTITION [!!!]
-        delete_query = f"DELETE FROM `{TABLE_ID}` WHERE DATE(event_timestamp) = '{YESTERDAY_DATE_STR}'"
-        delete_job = client.query(delete_query)
-        delete_job.result()
-        logger.warning(f"Successfully cleared partition for {YESTERDAY_DATE_STR}.")
-
-        # 2. APPEND the fresh data
-        pandas_gbq.to_gbq(
-            df,
-            TABLE_ID,
-            project_id=PROJECT_ID,
-            if_exists='append',
-            chunksize=50000,
-            progress_bar=False
-        )
-        success_message = f"Success! {len(df):,} new events (returning + new) were appended."
+        with metrics.span('phase3.to_frame'):
+            df = all_daily_events.to_frame()
+
+        # Score the day's raids; last week's Raid League winners get their rewards in today's sessions
+        rewards = None
+        if RAID_LEAGUE_PATH:
+            with metrics.span('phase3.raid_league') as span:
+                rewards = _advance_raid_league(df, YESTERDAY_DATE, returning_user_list)
+                span.set(rows=len(rewards))
+            if len(rewards):
+                all_daily_events.extend(rewards)
+                df = all_daily_events.to_frame()
+        if metrics.enabled():
+            _record_day_metrics(df, returning_user_list, new_user_ids, returning_event_count)
+
+        # The day's partition is swapped for the new events (re-runs replace, never duplicate)
+        if io is not None:
+            if rewards is not None and len(rewards):
+                # The simulated chunks are already uploaded; the rewards go in as one more
+                backend.append_partition(YESTERDAY_DATE, rewards, part='raid-league')
+            logger.info(f"Phase 4: The {YESTERDAY_DATE_STR} partition was cleared and rewritten "
+                        f"in {n_shards} chunks ({STORAGE_BACKEND} backend).")
+        else:
+            logger.info(f"Phase 4: Replacing the {YESTERDAY_DATE_STR} partition ({STORAGE_BACKEND} backend)...")
+            with metrics.span('phase4.replace_partition', backend=STORAGE_BACKEND) as span:
+                span.set(rows=len(all_daily_events))
+                backend.replace_partition(YESTERDAY_DATE, all_daily_events)
+        if RESULT_CACHE_PATH:
+            _invalidate_cached_results([YESTERDAY_DATE])
+
+        # Fold the day into the user state snapshot (only once the events are written)
+        if state_store is not None:
+            with metrics.span('phase4.user_state'):
+                state_store.update(user_state.summarize_events(df))
+
+        # Refresh only the summary rows of the dates this partition touches
+        if KPI_SUMMARY_PATH:
+            if state_store is None:
+                logger.warning("KPI_SUMMARY_PATH is set without USER_STATE_PATH; skipping the KPI summary.")
+            else:
+                import kpi_summary
+                with metrics.span('phase4.kpi_summary'):
+                    summary_store = kpi_summary.ParquetKpiSummaryStore(KPI_SUMMARY_PATH)
+                    summary_store.replace(kpi_summary.refresh_partition(
+                        summary_store.load(), backend, YESTERDAY_DATE, state_store.load(), events=df))
+
+        if RETENTION_PATH:
+            import retention
+            with metrics.span('phase4.retention'):
+                # A re-run of the day rebuilds the cohorts it touches, so the first run's new users don't linger
+                matrix = retention.RetentionMatrix.load(RETENTION_PATH)
+                matrix.apply_partition(backend, YESTERDAY_DATE, df).save(RETENTION_PATH)
+
+        success_message = f"Success! {len(all_daily_events):,} new events (returning + new) were appended."
         logger.info(success_message)
         return success_message, 200  # Return HTTP OK
 
@@ -180,282 +325,523 @@ def handler(request):
         logger.error(error_message, exc_info=True)
         return error_message, 500  # Return HTTP Server Error
 
+    finally:
+        if io is not None:
+            io.shutdown(cancel_futures=True)
+        metrics.gauge('handler_seconds', time.perf_counter() - started)
+        metrics.report('handler')
 
-# --- [!!! NEW V12 !!!] Helper function to fetch returning users ---
-def fetch_returning_users(client, yesterday_str):
+
+def _advance_raid_league(df, day, returning_user_list):
     """
-    Queries BQ to get a list of active users who might return.
-    NOTE: This query scans the last 30 days. On a large dataset,
-    this can be slow/expensive without proper partitioning.
+    Scores the day in the saved Raid League, starting a new week's divisions
+    (from the returning users) when the day starts one. Returns the reward
+    events to add to the day.
     """
-    query = f"""
-    WITH LatestUserData AS (
-      SELECT
-        user_pseudo_id,
-        DATE(MIN(event_timestamp)) AS install_date,
-        -- Use ARRAY_AGG to get the most recent non-null values
-        ARRAY_AGG(persona IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as persona,
-        ARRAY_AGG(current_village_level IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as current_village_level,
-        MAX(DATE(event_timestamp)) as last_active_date
-      FROM
-        `{TABLE_ID}`
-      WHERE
-        -- Scan the last 30 days for active users
-        DATE(event_timestamp) >= DATE_SUB(PARSE_DATE('%Y-%m-%d', @yesterday), INTERVAL 30 DAY)
-      GROUP BY
-        1
-    )
-    SELECT
-      *,
-      DATE_DIFF(PARSE_DATE('%Y-%m-%d', @yesterday), install_date, DAY) AS user_age_days
-    FROM
-      LatestUserData
-    WHERE
-      -- Only get users who installed *before* yesterday
-      install_date < PARSE_DATE('%Y-%m-%d', @yesterday)
-      -- And who were active recently (e.g., in the last 35 days)
-      -- This simulates natural churn.
-      AND DATE_DIFF(PARSE_DATE('%Y-%m-%d', @yesterday), last_active_date, DAY) < 35
+    import raid_league
+
+    league, rewards = raid_league.advance(raid_league.RaidLeague.load(RAID_LEAGUE_PATH), df, day,
+                                          _league_players(returning_user_list))
+    league.save(RAID_LEAGUE_PATH)
+    return rewards
+
+
+def _league_players(returning_user_list):
     """
+    The players who can join the Raid League, as user-state rows: the day's
+    potential returning users (the handler and catch_up both pass
+    `user_state.returning_users` rows), or only the treatment group of EXPERIMENT.
+    """
+    import user_state
+
+    state = user_state.from_returning_users(returning_user_list)
+    experiment = active_experiment()
+    if experiment is None:
+        return state
+    return state[experiment.assign(state['user_pseudo_id'].to_numpy())]
+
+
+def active_experiment():
+    """The experiment named by EXPERIMENT, or None."""
+    if not EXPERIMENT:
+        return None
+    import experiments
+    return experiments.get(EXPERIMENT)
+
+
+def _requested_range(request):
+    """The catch-up range from the request's `start_date` / `end_date` query parameters, or (None, None)."""
+    args = getattr(request, 'args', None) or {}
+    return args.get('start_date'), args.get('end_date')
+
+
+def day_seeds(day):
+    """
+    The (handler, shards) seed sequences for simulating `day`. With
+    SIMULATION_SEED set, every day gets its own reproducible streams (the same
+    streams whether the day runs on its own or in a catch-up).
+    """
+    entropy = None if SIMULATION_SEED is None else [SIMULATION_SEED, day.toordinal()]
+    return np.random.SeedSequence(entropy).spawn(2)
 
-    # Set query parameters
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("yesterday", "STRING", yesterday_str),
-        ]
-    )
 
+def draw_new_users(returning_user_list, yesterday_date, rng):
+    """
+    The day's new user IDs and the social target index: (targets, new_user_ids).
+    The index (attack/raid targets and inviters, see social_index.py) holds
+    the returning users and the new ones.
+    """
+    # 1b. Index the *existing* users for attacks, raids and invites by level and recency
+    # We will add new users to it later
+    targets = SocialTargetIndex.from_users(returning_user_list, yesterday_date)
+
+    if not len(targets):
+        targets.add("dummy_user_1", 1, yesterday_date - timedelta(days=1))  # Safety net
+
+    # 2a. Decide how many new users to create (Your existing logic)
+    lambda_roll = rng.random()
+    if lambda_roll <= 0.80:
+        daily_variance = rng.integers(10, 21)
+    else:
+        daily_variance = rng.integers(-15, -7)
+    TOTAL_USERS_FOR_THIS_DAY = int(BASE_INSTALLS_PER_DAY + daily_variance)
+    if TOTAL_USERS_FOR_THIS_DAY < 5: TOTAL_USERS_FOR_THIS_DAY = 5
+
+    # 2b/2c. Add new user IDs to the index *before* simulation
+    # so they can be attacked/raided on their first day (inviters are drawn among the returning users)
+    new_user_ids = list(session_engine.random_uuid4s(rng, TOTAL_USERS_FOR_THIS_DAY))
+    for user_id in new_user_ids:
+        targets.add(user_id, 1, yesterday_date)
+    return targets, new_user_ids
+
+
+def _shard_inputs(yesterday, returning_user_list, new_user_ids, targets, n_shards):
+    shard_args = list(zip(
+        sharding.split_evenly(returning_user_list, n_shards),
+        sharding.split_evenly(new_user_ids, n_shards)
+    ))
+    shared_inputs = {
+        'yesterday': yesterday,
+        'targets': targets,
+        'experiment': active_experiment()
+    }
+    return shard_args, shared_inputs
+
+
+def simulate_day(yesterday, returning_user_list, new_user_ids, targets, shards_seed):
+    """
+    Simulates one day's returning and new users in SIMULATION_WORKERS shards.
+    Returns the merged events and how many of them belong to returning users.
+    """
+    shard_args, shared_inputs = _shard_inputs(yesterday, returning_user_list, new_user_ids, targets,
+                                              SIMULATION_WORKERS)
+    with metrics.span('phase2.simulate', workers=SIMULATION_WORKERS) as span:
+        results = sharding.run_sharded(
+            _simulate_shard, shard_args, seed=shards_seed, workers=SIMULATION_WORKERS,
+            shared_inputs=shared_inputs
+        )
+        span.set(rows=sum(len(events) for events, _ in results))
+    with metrics.span('phase2.merge_shards'):
+        all_daily_events = EventBuffer(COLUMNS, capacity=sum(len(events) for events, _ in results))
+        returning_event_count = 0
+        for shard_events, shard_returning_count in results:
+            all_daily_events.extend(shard_events)
+            returning_event_count += shard_returning_count
+    return all_daily_events, returning_event_count
+
+
+# --- Catch-up: a run of missed days in one invocation ---
+def catch_up(start_date, end_date=None):
+    """
+    Simulates every day from `start_date` to `end_date` (inclusive; default
+    yesterday) in order, e.g. after missed scheduler runs. The user state is
+    read once (the snapshot, or one returning-user query against the event
+    store) and carried from day to day in memory, so levels, activity and
+    churn evolve as if the handler had run every day. All the days are then
+    written with one bulk replace, and the state, KPI summary, retention
+    matrix and Raid League are saved once. Returns the HTTP (body, status) like `handler`.
+    """
+    import pandas as pd
+    import user_state
+
+    metrics.reset()
+    started = time.perf_counter()
     try:
-        query_job = client.query(query, job_config=job_config)
-        results = query_job.result()
-        # Convert BQ rows to a list of dictionaries
-        user_list = [dict(row.items()) for row in results]
-        return user_list
+        first = pd.Timestamp(start_date).normalize()
+        last = pd.Timestamp(end_date if end_date is not None else datetime.now() - timedelta(days=1)).normalize()
+        days = pd.date_range(first, last)
+        if not len(days):
+            return f"Nothing to catch up: {first:%Y-%m-%d} is after {last:%Y-%m-%d}.", 400
+        logger.info(f"Catch-up: simulating {len(days)} days, {first:%Y-%m-%d} to {last:%Y-%m-%d}...")
+        backend = get_backend()
+
+        # 1. One state read
+        state_store = user_state.open_store(USER_STATE_PATH) if USER_STATE_PATH else None
+        source = 'user_state' if state_store is not None else STORAGE_BACKEND
+        with metrics.span('catch_up.load_state', source=source) as span:
+            if state_store is not None:
+                state = state_store.load()
+            else:
+                state = user_state.from_returning_users(backend.fetch_returning_users(f"{first:%Y-%m-%d}"))
+            span.set(rows=len(state))
+
+        # 2. Every day in order, with the state carried in memory
+        matrix = None
+        if RETENTION_PATH:
+            import retention
+            matrix = retention.RetentionMatrix.load(RETENTION_PATH)
+        league = None
+        if RAID_LEAGUE_PATH:
+            import raid_league
+            league = raid_league.RaidLeague.load(RAID_LEAGUE_PATH)
+        partitions = []
+        for day in days:
+            yesterday = day.to_pydatetime()
+            handler_seed, shards_seed = day_seeds(yesterday.date())
+            rng = np.random.default_rng(handler_seed)
+            returning_user_list = user_state.returning_users(state, day)
+            targets, new_user_ids = draw_new_users(returning_user_list, yesterday.date(), rng)
+            events, _ = simulate_day(yesterday, returning_user_list, new_user_ids, targets, shards_seed)
+            df = events.to_frame()
+            if RAID_LEAGUE_PATH:
+                league, rewards = raid_league.advance(league, df, day, _league_players(returning_user_list))
+                events.extend(rewards)
+            state = user_state.merge_state(state, user_state.summarize_events(df))
+            partitions.append((day, events))
+            logger.info(f"{day:%Y-%m-%d}: {len(returning_user_list)} potential returning users, "
+                        f"{len(new_user_ids)} new users, {len(events):,} events")
+
+        # 3. One bulk write for all the days, then one save of each derived table
+        n_events = sum(len(events) for _, events in partitions)
+        logger.info(f"Writing {n_events:,} events for {len(days)} days ({STORAGE_BACKEND} backend)...")
+        with metrics.span('catch_up.replace_partitions', backend=STORAGE_BACKEND) as span:
+            span.set(rows=n_events)
+            backend.replace_partitions(partitions)
+        if RESULT_CACHE_PATH:
+            _invalidate_cached_results(days)
+        if state_store is not None:
+            with metrics.span('catch_up.user_state'):
+                state_store.replace(state)
+        if KPI_SUMMARY_PATH:
+            import kpi_summary
+            with metrics.span('catch_up.kpi_summary'):
+                summary_store = kpi_summary.ParquetKpiSummaryStore(KPI_SUMMARY_PATH)
+                events = pd.concat([events.to_frame() for _, events in partitions], ignore_index=True)
+                summary_store.replace(kpi_summary.refresh_partitions(
+                    summary_store.load(), backend, first, last, state, events=events))
+        if matrix is not None:
+            with metrics.span('catch_up.retention'):
+                # After the write, so days caught up before can be rebuilt from the new partitions
+                for day, events in partitions:
+                    matrix.apply_partition(backend, day, events.to_frame())
+                matrix.save(RETENTION_PATH)
+        if league is not None:
+            with metrics.span('catch_up.raid_league'):
+                league.save(RAID_LEAGUE_PATH)
+
+        success_message = (f"Success! {n_events:,} events for {len(days)} days "
+                           f"({first:%Y-%m-%d} to {last:%Y-%m-%d}) were written.")
+        logger.info(success_message)
+        return success_message, 200
+
     except Exception as e:
-        logger.error(f"Failed to fetch returning users: {e}")
-        return []
+        error_message = f"Error in catch-up: {e}"
+        logger.error(error_message, exc_info=True)
+        return error_message, 500
 
+    finally:
+        metrics.gauge('handler_seconds', time.perf_counter() - started)
+        metrics.report('catch_up')
 
-# --- [!!! NEW V12 !!!] Helper function to simulate returning users ---
-def simulate_returning_users(user_list, yesterday_date, global_user_id_pool):
-    returning_events = []
-    for user in user_list:
-        # 1. Get user state
-        user_age = user['user_age_days']
-        persona = user['persona'] if user['persona'] else 'Non-Payer'  # Default if missing
-
-        # 2. Get base retention prob from our curve
-        base_prob = BASE_RETENTION_CURVE.get(user_age, 0.05)  # 5% long-tail retention
-
-        # 3. Adjust probability by persona
-        retention_multiplier = 1.0
-        if persona == 'Low-Spender':
-            retention_multiplier = 1.2
-        elif persona == 'High-Spender':
-            retention_multiplier = 1.5
-
-        prob_to_return = base_prob * retention_multiplier
-
-        # 4. Roll the dice
-        if random.random() < prob_to_return:
-            # This user returns!
-
-            # Re-create the 'user' dictionary for generate_session_events
-            # We must update the village level from the BQ query
-            user_state_dict = {
-                'user_pseudo_id': user['user_pseudo_id'],
-                'persona': persona,
-                'country': user.get('country', random.choice(COUNTRIES)),  # BQ might not have this
-                'platform': user.get('platform', random.choice(PLATFORMS)),  # BQ might not have this
-                'current_village_level': user.get('current_village_level', 1),  # Get latest level
-                'is_churned': False,  # They are not churned today
-                'sent_invites': 0  # We don't track this state
-            }
-
-            # Generate 1-3 sessions for this returning user
-            num_sessions = 1
-            if persona == 'Low-Spender': num_sessions = random.randint(1, 2)
-            if persona == 'High-Spender': num_sessions = random.randint(1, 3)
-
-            base_time = datetime.combine(yesterday_date, datetime.min.time())
 
-            for i in range(num_sessions):
-                session_id = str(uuid.uuid4())
-                session_time = base_time + timedelta(
-                    hours=random.randint(0, 23),
-                    minutes=random.randint(0, 59)
-                )
+# --- Aggregate mode: summary rows without events ---
+def aggregate_run(start_date, end_date=None):
+    """
+    Simulates every day from `start_date` to `end_date` (inclusive; default
+    yesterday) as user counts (see aggregate_sim.py) and swaps the days' rows
+    into the KPI summary at KPI_SUMMARY_PATH. The first run builds the
+    population from the user state (the snapshot, or one returning-user
+    query); it is saved to AGGREGATE_SIMULATION_PATH after every run. Days
+    missed since the last run are simulated but not written; days the saved
+    population is already past can't be re-run. Returns the HTTP (body, status) like `handler`.
+    """
+    import pandas as pd
+    import aggregate_sim
+    import kpi_summary
+    import user_state
+
+    metrics.reset()
+    started = time.perf_counter()
+    try:
+        if not KPI_SUMMARY_PATH:
+            return "The aggregate simulation needs KPI_SUMMARY_PATH to write to.", 400
+        first = pd.Timestamp(start_date).normalize()
+        last = pd.Timestamp(end_date if end_date is not None else datetime.now() - timedelta(days=1)).normalize()
+        days = pd.date_range(first, last)
+        if not len(days):
+            return f"Nothing to simulate: {first:%Y-%m-%d} is after {last:%Y-%m-%d}.", 400
+
+        population = aggregate_sim.Population.load(AGGREGATE_SIMULATION_PATH)
+        if population is None:
+            source = 'user_state' if USER_STATE_PATH else STORAGE_BACKEND
+            with metrics.span('aggregate.load_state', source=source) as span:
+                if USER_STATE_PATH:
+                    state = user_state.open_store(USER_STATE_PATH).load()
+                else:
+                    state = user_state.from_returning_users(get_backend().fetch_returning_users(f"{first:%Y-%m-%d}"))
+                population = aggregate_sim.Population.from_state(
+                    state, first, np.random.default_rng(day_seeds(first)[1]))
+                span.set(rows=len(population))
+        if first < population.day:
+            return (f"The aggregate population is already at {population.day:%Y-%m-%d}; "
+                    f"{first:%Y-%m-%d} can't be simulated again.", 400)
+
+        # Each day draws from its own seed, like the per-event days
+        with metrics.span('aggregate.simulate') as span:
+            missed = 0
+            while population.day < first:
+                population.step(np.random.default_rng(day_seeds(population.day)[0]), AGGREGATE_INSTALL_SCALE)
+                missed += 1
+            if missed:
+                logger.warning(f"Aggregate simulation: {missed} missed days were simulated without being written.")
+            cells = pd.concat([population.step(np.random.default_rng(day_seeds(day)[0]), AGGREGATE_INSTALL_SCALE)
+                               for day in days], ignore_index=True)
+            span.set(rows=len(cells))
+        with metrics.span('aggregate.kpi_summary'):
+            summary_store = kpi_summary.ParquetKpiSummaryStore(KPI_SUMMARY_PATH)
+            summary_store.replace(kpi_summary.replace_dates(summary_store.load(), aggregate_sim.to_summary(cells), days))
+        population.save(AGGREGATE_SIMULATION_PATH)
+
+        success_message = (f"Success! Summary rows for {len(days)} days ({first:%Y-%m-%d} to {last:%Y-%m-%d}, "
+                           f"{cells['active_users'].sum():,} user-days) were written.")
+        logger.info(success_message)
+        return success_message, 200
 
-                # Create the 'app_open' event for the new session
-                returning_events.append(create_event(user_state_dict, session_id, 'app_open', session_time,
-                                                     {'attribution_source': 'organic'}))
+    except Exception as e:
+        error_message = f"Error in aggregate simulation: {e}"
+        logger.error(error_message, exc_info=True)
+        return error_message, 500
 
-                # Generate the rest of the session events
-                session_events = generate_session_events(user_state_dict, session_time, global_user_id_pool)
-                returning_events.extend(session_events)
+    finally:
+        metrics.gauge('handler_seconds', time.perf_counter() - started)
+        metrics.report('aggregate')
 
-                # IMPORTANT: The user's village level might have updated *inside* generate_session_events
-                # We update it here so the *next* session (if any) has the correct level
-                user['current_village_level'] = user_state_dict['current_village_level']
 
-    return returning_events
+# --- CONCURRENT_IO mode: the partition is rewritten chunk by chunk ---
+def _invalidate_cached_results(dates):
+    import result_cache
+    with metrics.span('phase4.result_cache') as span:
+        span.set(rows=result_cache.ResultCache(RESULT_CACHE_PATH).invalidate_dates(dates))
+
+
+def _clear_partition(backend, event_date):
+    with metrics.span('phase4.clear_partition', backend=STORAGE_BACKEND):
+        backend.clear_partition(event_date)
+
+
+def _upload_chunk(backend, event_date, events, part):
+    with metrics.span('phase4.upload_chunk', backend=STORAGE_BACKEND) as span:
+        span.set(rows=len(events))
+        backend.append_partition(event_date, events, part=f"part-{part}")
+
+
+def _simulate_and_upload(io, io_jobs, backend, event_date, shard_args, seed, shared_inputs):
+    """
+    Simulates the chunks in order (in SIMULATION_WORKERS processes) and queues
+    each chunk's upload on the I/O thread `io` as soon as it is ready, behind
+    the jobs already in `io_jobs` (the partition clear). Returns the merged
+    events and the returning users' event count once every upload is done.
+    """
+    all_events = EventBuffer(COLUMNS)
+    returning_event_count = 0
+    chunks = sharding.iter_sharded(_simulate_shard, shard_args, seed=seed, workers=SIMULATION_WORKERS,
+                                   shared_inputs=shared_inputs)
+    with metrics.span('phase2.simulate', workers=SIMULATION_WORKERS, chunks=len(shard_args)) as span:
+        for part, (events, chunk_returning_count) in enumerate(chunks):
+            io_jobs.append(io.submit(_upload_chunk, backend, event_date, events, part))
+            all_events.extend(events)
+            returning_event_count += chunk_returning_count
+        span.set(rows=len(all_events))
+    with metrics.span('phase4.wait_for_uploads'):
+        for job in io_jobs:
+            job.result()
+    return all_events, returning_event_count
+
+
+def _record_day_metrics(df, returning_user_list, new_user_ids, returning_event_count):
+    """Counters for the day's events: per persona and source, and how many fetched users came back."""
+    for persona, n in df['persona'].value_counts(dropna=False).items():
+        if n:
+            metrics.count('events_generated', int(n), persona=persona if isinstance(persona, str) else 'unknown')
+    metrics.count('events_generated_by_source', returning_event_count, source='returning')
+    metrics.count('events_generated_by_source', len(df) - returning_event_count, source='new')
+    returned = df['user_pseudo_id'][~df['user_pseudo_id'].isin(new_user_ids)].nunique()
+    metrics.count('returning_users_fetched', len(returning_user_list))
+    metrics.count('returning_users_returned', int(returned))
+    metrics.gauge('returning_user_hit_rate', returned / len(returning_user_list) if len(returning_user_list) else 0.0)
+
+
+# --- Process-pool task: one shard of the day's users ---
+def _simulate_shard(shard, rng):
+    returning_users, new_user_ids = shard
+    yesterday = sharding.shared('yesterday')
+    targets = sharding.shared('targets')
+    experiment = sharding.shared('experiment')
+
+    events = EventBuffer(COLUMNS)
+    simulate_returning_users(returning_users, yesterday.date(), targets, out=events, rng=rng, experiment=experiment)
+    returning_event_count = len(events)
+    simulate_new_users(new_user_ids, yesterday, targets, out=events, rng=rng, experiment=experiment)
+    return events, returning_event_count
+
+
+# --- [!!! NEW V12 !!!] Helper function to simulate returning users ---
+def simulate_returning_users(user_list, yesterday_date, targets, out=None, rng=None, experiment=None):
+    """
+    Rolls which fetched users return and plays all their sessions in one engine call.
+    The return rolls, session counts and start times are drawn for all the
+    users at once (`returning_sessions`); only the users who return become session dicts.
+    `user_list` is the `fetch_returning_users` frame (or a list of its rows as dicts).
+    Attack/raid targets come from `targets` (a SocialTargetIndex, or a list of IDs).
+    Events are appended to the EventBuffer `out` (a new one if omitted), which is returned.
+    All randomness comes from `rng` (a fresh generator if omitted).
+    With an `experiment`, its treated users get its effects.
+    """
+    if out is None:
+        out = EventBuffer(COLUMNS)
+    if rng is None:
+        rng = np.random.default_rng()
+    session_users, session_starts = returning_sessions(user_list, yesterday_date, rng, experiment)
+    # The engine carries the village level from one session to the next
+    return session_engine.simulate_sessions(session_users, session_starts, targets, rng=rng, out=out,
+                                            experiment=experiment)
+
+
+def returning_sessions(users, yesterday_date, rng, experiment=None):
+    """
+    The pre-session stage of `simulate_returning_users`: (one user dict per
+    session, the sessions' start times) for the fetched users who return.
+    `users` is the `fetch_returning_users` frame (or a list of its rows as dicts).
+    """
+    import pandas as pd
+
+    if not hasattr(users, 'columns'):
+        users = pd.DataFrame.from_records(users, columns=RETURNING_FIELDS)
+
+    # 1. The fetched users as columns; missing personas play as Non-Payers
+    n_users = len(users)
+    user_ids = users['user_pseudo_id'].to_numpy(dtype=object)
+    personas = users['persona'].astype(object).where(users['persona'].notna() & (users['persona'] != ''), 'Non-Payer')
+    persona_codes = pd.Categorical(personas, categories=session_engine.PERSONAS).codes.astype(np.int64)
+    persona_codes[persona_codes < 0] = session_engine.NON_PAYER
+    ages = users['user_age_days'].to_numpy(dtype=np.int64)
+
+    # 2. Roll every user's return at once, from the (age, persona) matrix
+    prob_to_return = RETURN_PROBS[np.clip(ages, 0, len(RETURN_PROBS) - 1), persona_codes]
+    if experiment is not None:
+        prob_to_return = prob_to_return * np.where(experiment.assign(user_ids), experiment.retention_lift, 1.0)
+    returned = np.flatnonzero(rng.random(n_users) < prob_to_return)
+
+    # 3. 1 to MAX_RETURNING_SESSIONS sessions each, at a random minute of the day
+    num_sessions = rng.integers(1, MAX_RETURNING_SESSIONS[persona_codes[returned]] + 1)
+    start_minutes = rng.integers(24 * 60, size=int(num_sessions.sum()))
+
+    # Keep the user's own country and platform; only draw one if we have none on record
+    on_record = {}
+    for col, choices in (('country', COUNTRIES), ('platform', PLATFORMS)):
+        values = users[col].to_numpy(dtype=object)[returned]
+        missing = pd.isna(values) | (values == '')
+        values[missing] = np.array(choices, dtype=object)[rng.integers(len(choices), size=int(missing.sum()))]
+        on_record[col] = values
+    levels = users['current_village_level'].to_numpy(dtype=np.float64, na_value=np.nan)[returned]
+    levels = np.where(np.isnan(levels) | (levels == 0), 1, levels).astype(np.int64)  # Get latest level
+
+    # 4. Only the users who return become dicts for the session engine
+    session_users = []
+    for user_id, persona, country, platform, level, n in zip(
+            user_ids[returned], personas.to_numpy()[returned], on_record['country'], on_record['platform'],
+            levels.tolist(), num_sessions.tolist()):
+        user_state_dict = {
+            'user_pseudo_id': user_id,
+            'persona': persona,
+            'country': country,
+            'platform': platform,
+            'current_village_level': level,
+            'is_churned': False,  # They are not churned today
+            'sent_invites': 0  # We don't track this state
+        }
+        session_users.extend([user_state_dict] * n)
+    return session_users, np.datetime64(yesterday_date, 'ns') + start_minutes.astype('timedelta64[m]')
 
 
 # --- [!!! NEW V12 !!!] Refactored function for NEW users ---
-def simulate_new_users(new_user_ids, yesterday_datetime, global_user_id_pool, inviter_pool):
-    new_user_events = []
+def simulate_new_users(new_user_ids, yesterday_datetime, targets, out=None, rng=None, experiment=None):
+    """
+    Creates the new users, then plays their install session (and any extra
+    sessions) in one engine call. Attack/raid targets and inviters come from
+    `targets` (a SocialTargetIndex); inviters are users active before the day. Events are appended to the EventBuffer
+    `out` (a new one if omitted), which is returned.
+    All randomness comes from `rng` (a fresh generator if omitted).
+    With an `experiment`, its treated users get its effects.
+    """
+    if out is None:
+        out = EventBuffer(COLUMNS)
+    if rng is None:
+        rng = np.random.default_rng()
+
+    session_users = []
+    session_starts = []
+    attribution_sources = []
+    inviter_ids = []
+    invited = []  # Positions of the friend-invite installs in `inviter_ids`
 
     for user_id in new_user_ids:
         # Create the new user dict
         user = {
             'user_pseudo_id': user_id,
-            'persona': np.random.choice(list(PERSONA_DISTRIBUTION.keys()), p=list(PERSONA_DISTRIBUTION.values())),
-            'country': random.choice(COUNTRIES),
-            'platform': random.choice(PLATFORMS),
+            'persona': str(rng.choice(list(PERSONA_DISTRIBUTION.keys()), p=list(PERSONA_DISTRIBUTION.values()))),
+            'country': COUNTRIES[rng.integers(len(COUNTRIES))],
+            'platform': PLATFORMS[rng.integers(len(PLATFORMS))],
             'current_village_level': 1,  # All new users start at level 1
             'is_churned': False,
             'sent_invites': 0
         }
 
-        # [This is your existing logic, slightly modified]
-        session_id = str(uuid.uuid4())
         install_time = datetime.combine(yesterday_datetime.date(), datetime.min.time()) + timedelta(
-            hours=random.randint(0, 23),
-            minutes=random.randint(0, 59)
+            minutes=int(rng.integers(24 * 60))  # A random hour and minute of the day
         )
 
         # 1. Determine their attribution source
-        attr_source = np.random.choice(ATTRIBUTION_SOURCES, p=[0.4, 0.25, 0.25, 0.1])  # 10% come from friend invites
+        attr_source = str(rng.choice(ATTRIBUTION_SOURCES, p=[0.4, 0.25, 0.25, 0.1]))  # 10% come from friend invites
         inviter_id = None
         if attr_source == 'friend_invite':
-            inviter_id = random.choice(inviter_pool)
-
-        # 2. Create the FIRST app_open event (The Install)
-        new_user_events.append(create_event(user, session_id, 'app_open', install_time, {
-            'attribution_source': attr_source,
-            'inviter_user_id': inviter_id
-        }))
+            invited.append(len(inviter_ids))  # The inviters are drawn together below
 
-        # 3. Generate their first session's events
-        session_events = generate_session_events(user, install_time, global_user_id_pool)
-        new_user_events.extend(session_events)
+        # 2. The FIRST session (its app_open is The Install)
+        session_users.append(user)
+        session_starts.append(install_time)
+        attribution_sources.append(attr_source)
+        inviter_ids.append(inviter_id)
 
-        # 4. [Optional] Decide if they play *more* sessions today
+        # 3. [Optional] Decide if they play *more* sessions today
         play_chance = 0
         if user['persona'] == 'Low-Spender':
             play_chance = 0.3
         elif user['persona'] == 'High-Spender':
             play_chance = 0.5
 
-        if random.random() < play_chance:
-            num_sessions = random.randint(1, 2)
+        if rng.random() < play_chance:
+            num_sessions = rng.integers(1, 3)
             for i in range(num_sessions):
-                session_time = install_time + timedelta(minutes=random.randint(30, 180))
-                session_id = str(uuid.uuid4())
-                new_user_events.append(
-                    create_event(user, session_id, 'app_open', session_time, {'attribution_source': 'organic'}))
-                session_events = generate_session_events(user, session_time, global_user_id_pool)
-                new_user_events.extend(session_events)
-
-    return new_user_events
-
-
-# --- Helper functions (must be defined for the handler to use) ---
-
-def create_event(user, session_id, name, timestamp, overrides={}):
-    # [!!! MODIFIED V12: Now includes persona !!!]
-    event_row = {col: None for col in COLUMNS}
-    event_row.update({
-        'user_pseudo_id': user['user_pseudo_id'], 'session_id': session_id,
-        'platform': user['platform'], 'app_version': random.choice(APP_VERSIONS),
-        'country': user['country'], 'current_village_level': user['current_village_level'],
-        'event_timestamp': timestamp, 'event_name': name,
-        'persona': user.get('persona', 'Non-Payer')  # Add persona
-    })
-    event_row.update(overrides)
-    return event_row
-
-
-def generate_session_events(user, session_timestamp, user_id_list):
-    # [!!! MODIFIED V12: Ensure user_id_list is not empty !!!]
-    if not user_id_list:
-        user_id_list = ["dummy_target"]  # Safety net
-
-    session_id = str(uuid.uuid4())
-    events_in_session = []
-    current_time = session_timestamp
-    current_time += timedelta(seconds=random.randint(5, 15))
-
-    num_spins = 0
-    if user['persona'] == 'Non-Payer':
-        num_spins = random.randint(10, 40)
-    elif user['persona'] == 'Low-Spender':
-        num_spins = random.randint(50, 100)
-    elif user['persona'] == 'High-Spender':
-        num_spins = random.randint(30, 70)
-
-    # [... rest of your generate_session_events function is unchanged ...]
-    # [... it's good as-is, I am omitting it here for brevity ...]
-    # [... just make sure the user_id_list is passed correctly ...]
-
-    # --- (Your existing logic for spins, attacks, raids...) ---
-    for _ in range(num_spins):
-        if len(events_in_session) > 500: break
-        spin_cost = random.choice([1, 3, 5, 10])
-        events_in_session.append(create_event(user, session_id, 'spin_action', current_time, {'spin_cost': spin_cost}))
-        current_time += timedelta(seconds=random.randint(2, 5))
-        outcome_type = random.choice(['coins', 'attack', 'raid', 'shield', 'free_spins'])
-        outcome_value = 1
-        if outcome_type == 'coins':
-            outcome_value = random.randint(1000, 100000) * spin_cost
-        elif outcome_type == 'free_spins':
-            outcome_value = random.choice([5, 10, 25])
-        events_in_session.append(create_event(user, session_id, 'spin_outcome_received', current_time,
-                                              {'spin_outcome_type': outcome_type, 'spin_outcome_value': outcome_value}))
-        current_time += timedelta(seconds=random.randint(1, 3))
-        if outcome_type == 'attack':
-            events_in_session.append(create_event(user, session_id, 'attack_performed', current_time,
-                                                  {'attack_target_id': random.choice(user_id_list)}))
-            current_time += timedelta(seconds=random.randint(10, 20))
-        if outcome_type == 'raid':
-            events_in_session.append(create_event(user, session_id, 'raid_performed', current_time,
-                                                  {'raid_target_id': random.choice(user_id_list)}))
-            current_time += timedelta(seconds=random.randint(10, 20))
-        if random.random() < 0.1:
-            cost = random.randint(50000, 500000) * user['current_village_level']
-            events_in_session.append(
-                create_event(user, session_id, 'village_item_upgraded', current_time, {'item_cost': cost}))
-            current_time += timedelta(seconds=random.randint(10, 30))
-
-    if user['persona'] != 'Non-Payer' and random.random() < 0.3:
-        events_in_session.append(create_event(user, session_id, 'leaderboard_viewed', current_time))
-        current_time += timedelta(seconds=random.randint(5, 15))
-    if user['persona'] != 'Non-Payer' and random.random() < 0.1:
-        method = random.choice(INVITE_METHODS)
-        events_in_session.append(
-            create_event(user, session_id, 'friend_invite_sent', current_time, {'invite_method': method}))
-        user['sent_invites'] += 1
-        current_time += timedelta(seconds=random.randint(10, 20))
-    if user['persona'] == 'Low-Spender' and random.random() < 0.05:
-        events_in_session.append(
-            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_spins_popup'}))
-        current_time += timedelta(seconds=random.randint(10, 30))
-        price = 4.99
-        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
-                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
-        current_time += timedelta(seconds=random.randint(5, 10))
-    if user['persona'] == 'High-Spender' and random.random() < 0.40:
-        events_in_session.append(
-            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_coins_popup'}))
-        current_time += timedelta(seconds=random.randint(5, 20))
-        price = random.choice([9.99, 19.99, 49.99])
-        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
-                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
-        current_time += timedelta(seconds=random.randint(5, 10))
-
-    # [!!!] IMPORTANT: Update the user's village level state [!!!]
-    if random.random() < (0.1 + (0.3 * (user['persona'] == 'High-Spender'))):
-        user['current_village_level'] += 1
-
-    events_in_session.append(create_event(user, session_id, 'app_close', current_time))
-    return events_in_session
\ No newline at end of file
+                session_users.append(user)
+                session_starts.append(install_time + timedelta(minutes=int(rng.integers(30, 181))))
+                attribution_sources.append('organic')
+                inviter_ids.append(None)
+
+    for i, inviter_id in zip(invited, targets.draw(rng, len(invited), active_before=yesterday_datetime.date())):
+        inviter_ids[i] = inviter_id
+
+    return session_engine.simulate_sessions(
+        session_users, session_starts, targets, rng=rng,
+        attribution_sources=attribution_sources, inviter_ids=inviter_ids, out=out, experiment=experiment
+    )
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+from kpi_summary import sql_round
+
+# --- One-pass KPI Engine ---
+# Every KPI of queries/main_kpis.sql from a single pass over a columnar event
+# frame. Each query there is its own full scan of `events`. Here the string
+# columns are turned into integer codes once and the events are sorted once by
+# (user, time). Every metric is then a reduction over those arrays:
+# run boundaries, bincounts and np.unique on packed integer keys.
+
+# The only columns the KPIs need (what a Parquet read should project to)
+KPI_COLUMNS = [
+    'event_timestamp', 'user_pseudo_id', 'session_id', 'event_name', 'country',
+    'current_village_level', 'price_usd', 'attribution_source'
+]
+# Low-cardinality or repeated string columns that are cheapest read as categoricals
+CATEGORICAL_COLUMNS = ['user_pseudo_id', 'session_id', 'event_name', 'country', 'attribution_source']
+
+CORE_ACTIONS = ['spin_action', 'attack_performed', 'raid_performed', 'village_item_upgraded']
+RETENTION_DAYS = (1, 2, 3, 4, 5, 6, 7, 14, 21, 28)
+
+_NS_PER_DAY = 86_400 * 10**9
+
+
+def _codes(values, sort=False):
+    """
+    Integer codes (-1 for NULL) and the matching labels. With `sort`, code
+    order is label order, so MIN over codes is MIN over the strings.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        if sort and list(values.cat.categories) != sorted(values.cat.categories):
+            values = values.cat.reorder_categories(sorted(values.cat.categories))
+        return values.cat.codes.to_numpy(dtype=np.int64), values.cat.categories
+    codes, labels = pd.factorize(values, sort=sort)
+    return codes.astype(np.int64), labels
+
+
+def _run_starts(*keys):
+    """Start positions of the runs of equal rows in already-sorted key arrays."""
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _dates(day_numbers):
+    return pd.to_datetime(np.asarray(day_numbers, dtype='datetime64[D]'))
+
+
+def compute(events):
+    """
+    All main_kpis.sql results, keyed by KPI name. Each value is a DataFrame
+    shaped like the query's output; 'avg_days_per_level' is a single row.
+    """
+    n = len(events)
+    ts = events['event_timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    day = ts // _NS_PER_DAY
+    user, _ = _codes(events['user_pseudo_id'])
+    session, _ = _codes(events['session_id'])
+    name, names = _codes(events['event_name'])
+    country, countries = _codes(events['country'], sort=True)
+    source, sources = _codes(events['attribution_source'], sort=True)
+    level = events['current_village_level'].to_numpy(dtype='float64', na_value=np.nan)
+    price = events['price_usd'].to_numpy(dtype='float64', na_value=np.nan)
+    n_users = int(user.max()) + 1 if n else 0
+    first_day = int(day.min()) if n else 0
+    day_offset = day - first_day
+    n_days = int(day_offset.max()) + 1 if n else 0
+
+    def event_mask(*event_names):
+        wanted = [i for i, label in enumerate(names) if label in event_names]
+        return np.isin(name, wanted)
+
+    # The one sort: by user, then time (then attribution, so FIRST_VALUE ties resolve to MIN like the SQL)
+    order = np.lexsort((source, ts, user))
+    s_user, s_day = user[order], day[order]
+    user_starts = _run_starts(s_user)
+
+    # --- User dimension: install date, install country (MIN), first attribution ---
+    install_day = s_day[user_starts]
+    country_sorted = np.where(country[order] < 0, np.iinfo(np.int64).max, country[order])
+    install_country = np.minimum.reduceat(country_sorted, user_starts) if n else np.empty(0, np.int64)
+    install_country[install_country == np.iinfo(np.int64).max] = -1
+    with_source = source[order] >= 0
+    source_users, first_source_pos = np.unique(s_user[with_source], return_index=True)
+    install_source = np.full(n_users, -1, dtype=np.int64)
+    install_source[source_users] = source[order][with_source][first_source_pos]
+
+    # --- Distinct (user, day) pairs: runs in the (user, time) order ---
+    pair_starts = _run_starts(s_user, s_day)
+    pair_user, pair_day = s_user[pair_starts], s_day[pair_starts]
+    dau = np.bincount(pair_day - first_day, minlength=n_days)
+    days = _dates(np.arange(n_days) + first_day)
+
+    results = {}
+
+    # DI & viral installs (the SQL inner-joins on the attribution, so users without one drop out)
+    attributed = install_source >= 0
+    viral_code = list(sources).index('friend_invite') if 'friend_invite' in list(sources) else -2
+    di = np.bincount(install_day[attributed] - first_day, minlength=n_days)
+    viral = np.bincount(install_day[attributed & (install_source == viral_code)] - first_day, minlength=n_days)
+    keep = di > 0
+    results['installs'] = pd.DataFrame({'install_dt': days[keep], 'DI': di[keep], 'viral_installs': viral[keep]})
+
+    # Retention: each (user, day) pair against the user's install day
+    day_in_game = pair_day - install_day[pair_user] + 1
+    tracked = np.isin(day_in_game, RETENTION_DAYS)
+    cell = (install_day[pair_user][tracked] - first_day) * 64 + day_in_game[tracked]
+    cells, active_users = np.unique(cell, return_counts=True)
+    cohort_size = np.bincount(install_day - first_day, minlength=n_days)
+    results['retention'] = pd.DataFrame({
+        'install_dt': days[cells // 64],
+        'day_in_game': cells % 64,
+        'retention_rate': sql_round(active_users / cohort_size[cells // 64], 2),
+    })
+
+    # Sessions per DAU: distinct (day, session) keys
+    has_session = session >= 0
+    n_sessions = int(session.max()) + 1 if n else 1
+    session_days = np.unique(day_offset[has_session] * n_sessions + session[has_session])
+    sessions = np.bincount(session_days // n_sessions, minlength=n_days)
+    active = dau > 0
+    results['sessions_per_dau'] = pd.DataFrame({
+        'dt': days[active], 'Avg_sessions_per_dau': sql_round(sessions[active] / dau[active], 2)})
+
+    # Core actions per DAU
+    core = np.bincount(day_offset[event_mask(*CORE_ACTIONS)], minlength=n_days)
+    results['core_actions_per_dau'] = pd.DataFrame({
+        'dt': days[active], 'Avg_core_actions_per_dau': sql_round(core[active] / dau[active], 2)})
+
+    # Level progression: first day at each (user, level), NULL levels included as their own group
+    s_level = level[order]
+    level_key = np.where(np.isnan(s_level), -1, s_level).astype(np.int64)
+    level_runs = np.unique(s_user * (int(level_key.max()) + 2 if n else 1) + level_key + 1, return_index=True)[1]
+    level_user, level_day = s_user[level_runs], s_day[level_runs]
+    level_starts = _run_starts(level_user)
+    final_level = np.fmax.reduceat(s_level, user_starts) if n else np.empty(0)
+    start_dt = np.minimum.reduceat(level_day, level_starts) if n else np.empty(0, np.int64)
+    end_dt = np.maximum.reduceat(level_day, level_starts) if n else np.empty(0, np.int64)
+    progressed = final_level > 1
+    avg_days = sql_round(np.sum(end_dt[progressed] - start_dt[progressed] + 1)
+                         / np.sum(final_level[progressed] - 1), 2) if progressed.any() else np.nan
+    results['avg_days_per_level'] = pd.DataFrame({'avg_days_per_level': [avg_days]})
+
+    # Revenue, depositors, conversion, ARPDAU, ARPPU
+    revenue = np.bincount(day_offset, weights=np.nan_to_num(price), minlength=n_days)
+    revenue[np.bincount(day_offset[~np.isnan(price)], minlength=n_days) == 0] = np.nan  # SUM of only NULLs is NULL
+    purchases = event_mask('purchase_completed')
+    depositor_pairs = np.unique(day_offset[purchases] * max(n_users, 1) + user[purchases])
+    depositors = np.bincount(depositor_pairs // max(n_users, 1), minlength=n_days)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['revenue'] = pd.DataFrame({
+            'dt': days[active],
+            'daily_revenue': revenue[active],
+            'daily_depositors': depositors[active],
+            'conversion_rate': sql_round(depositors[active] / dau[active], 2),
+            'ARPDAU': sql_round(revenue[active] / dau[active], 2),
+            'ARPPU': sql_round(np.where(depositors[active] > 0, revenue[active] / depositors[active], np.nan), 2),
+        })
+
+    # Total installs by country (MIN(country) per user; NULL is its own group)
+    counts = np.bincount(install_country + 1, minlength=len(countries) + 1)
+    labels = np.array([None] + list(countries), dtype=object)
+    keep = counts > 0
+    results['installs_by_country'] = pd.DataFrame({'country': labels[keep], 'total_installs': counts[keep]})
+    return results
+
+
+def compute_from_store(backend, start_date=None, end_date=None):
+    """
+    `compute` over any storage backend, reading only the KPI columns (strings
+    as categoricals). A local Parquet store reads them straight from the files.
+    """
+    events = backend.read(start_date, end_date, columns=KPI_COLUMNS, categorical=CATEGORICAL_COLUMNS)
+    return compute(events)
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# --- Run Metrics ---
+# Timing spans, counters and gauges for the phases of a run (the Cloud
+# Function handler or a backfill). Each closed span is logged as one JSON
+# record: name, labels, seconds, rows and rows/sec when given, and peak RSS.
+# `report()` logs the totals as a last JSON record, and it can also write
+# them in the Prometheus text format.
+#
+# Metrics are off unless METRICS_ENABLED is set (or `enable()` is called).
+# While off, `span()` returns one shared no-op object and `count` / `gauge`
+# return right away, so the hooks can stay in hot paths. Only this process is
+# measured: shard workers don't report, so per-shard figures are derived
+# from their results in the parent.
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ('1', 'true', 'yes')
+# With METRICS_PROMETHEUS_PATH set, `report()` writes the Prometheus text exposition there
+METRICS_PROMETHEUS_PATH = os.environ.get("METRICS_PROMETHEUS_PATH")
+PREFIX = 'daily_updater'
+
+logger = logging.getLogger(__name__)
+
+_enabled = METRICS_ENABLED
+_spans = {}     # (name, labels) -> [calls, seconds, rows]
+_counters = {}  # (name, labels) -> value
+_gauges = {}    # (name, labels) -> value
+_lock = threading.Lock()  # Spans can close on I/O threads
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    """Drops everything recorded so far (one run's metrics per report)."""
+    _spans.clear()
+    _counters.clear()
+    _gauges.clear()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def peak_rss_bytes(children=True):
+    """
+    Peak resident memory of this process (and of its finished children, with
+    `children`), or None where the `resource` module is missing (Windows).
+    macOS reports ru_maxrss in bytes, Linux and the BSDs in KiB.
+    """
+    try:
+        import resource  # Unix only
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _log(record):
+    logger.info(json.dumps(record, default=str))
+
+
+class _NullSpan:
+    """What `span()` returns while metrics are off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.rows = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            totals = _spans.setdefault(_key(self.name, self.labels), [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += self.rows or 0
+        record = {'metric': 'span', 'name': self.name, **self.labels, 'seconds': round(seconds, 6)}
+        if self.rows is not None:
+            record['rows'] = self.rows
+            record['rows_per_second'] = round(self.rows / seconds, 1) if seconds > 0 else None
+        peak = peak_rss_bytes()
+        if peak is not None:
+            record['peak_rss_bytes'] = peak
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _log(record)
+        return False
+
+    def set(self, rows=None):
+        """Attaches the number of rows the span handled (gives rows/sec)."""
+        self.rows = rows
+
+
+def span(name, **labels):
+    """
+    Times a block: `with metrics.span('phase4.upload', backend='bigquery') as s: ...; s.set(rows=n)`.
+    Dotted names group sub-steps under their phase.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+
+def count(name, value=1, **labels):
+    """Adds `value` to a counter."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    """Sets a gauge to its latest value."""
+    if not _enabled:
+        return
+    _gauges[_key(name, labels)] = value
+
+
+def snapshot():
+    """Everything recorded so far, as JSON-ready lists of {name, labels, value...} dicts."""
+    return {
+        'spans': [{'name': name, 'labels': dict(labels), 'calls': calls, 'seconds': round(seconds, 6),
+                   'rows': rows} for (name, labels), (calls, seconds, rows) in _spans.items()],
+        'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                     for (name, labels), value in _counters.items()],
+        'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                   for (name, labels), value in _gauges.items()],
+    }
+
+
+def _metric_name(name):
+    return f"{PREFIX}_" + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escape = {'\\': '\\\\', '"': '\\"', '\n': '\\n'}
+    pairs = ','.join(f'{k}="' + ''.join(escape.get(c, c) for c in v) + '"' for k, v in labels)
+    return '{' + pairs + '}'
+
+
+def prometheus_text():
+    """The recorded metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, samples):
+        if not samples:
+            return
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{_label_text(labels)} {float(value)!r}" for labels, value in samples)
+
+    if _spans:
+        spans = sorted(_spans.items())
+        family(f"{PREFIX}_span_seconds_total", 'counter',
+               [((('span', name),) + labels, seconds) for (name, labels), (_, seconds, _) in spans])
+        family(f"{PREFIX}_span_calls_total", 'counter',
+               [((('span', name),) + labels, calls) for (name, labels), (calls, _, _) in spans])
+        family(f"{PREFIX}_span_rows_total", 'counter',
+               [((('span', name),) + labels, rows) for (name, labels), (_, _, rows) in spans if rows])
+    for kind, values, suffix in (('counter', _counters, '_total'), ('gauge', _gauges, '')):
+        by_name = {}
+        for (name, labels), value in sorted(values.items()):
+            by_name.setdefault(_metric_name(name) + suffix, []).append((labels, value))
+        for name, samples in by_name.items():
+            family(name, kind, samples)
+    return '\n'.join(lines) + '\n'
+
+
+def report(run, prometheus_path=None):
+    """
+    Logs the run's totals as one JSON record (with the final peak RSS) and,
+    with `prometheus_path` (default METRICS_PROMETHEUS_PATH), writes the
+    Prometheus text there. Does nothing while metrics are off.
+    """
+    if not _enabled:
+        return
+    peak = peak_rss_bytes()
+    if peak is not None:
+        gauge('peak_rss_bytes', peak)
+    _log({'metric': 'report', 'run': run, **snapshot()})
+    path = prometheus_path or METRICS_PROMETHEUS_PATH
+    if path:
+        import storage
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                f.write(prometheus_text())
+        storage.atomic_write(path, write)
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+
+import storage
+from event_buffer import EVENT_SCHEMA, EventBuffer, categorical
+
+# --- Raid League ---
+# The weekly tournament of analysis/05_PRODUCT_FEATURE.md. At the start of
+# each week, the players active lately are placed in divisions of 50, matched
+# on village level and last week's raid count. Within a division they compete
+# on the coins they win from raids, and the Top 5 earn the Gold Raider Badge.
+#
+# Matchmaking is one sort, not pairwise matching. Players are ordered by
+# (level, raids last week), with a per-week hash to break ties, and the order
+# is cut into consecutive runs of about DIVISION_SIZE. Players are stored in
+# that order, so a division is a contiguous slice of plain arrays and memory
+# is linear in the number of players.
+#
+# Standings are kept current as raid events stream in. Scores only go up, so
+# a batch can only change the top K of the divisions it touches. The new top
+# K of a division is therefore picked from its old top K plus its players in
+# the batch, and the rest of the division never has to be re-sorted. Each
+# day's coins and raids per player are kept too. When a day is re-run, its
+# old ones are taken back before its new events are scored, and the
+# divisions either run touched are ranked again from all their players.
+#
+# The events table has no raid loot column. A raid is worth
+# RAID_COINS_PER_LEVEL times the raider's village level, since bigger
+# villages loot more. Last week's winners get a `raid_league_reward` event
+# in their first session of the new week. It carries the reward in
+# `spin_outcome_type` / `spin_outcome_value`, like other rewards.
+
+DIVISION_SIZE = 50
+TOP_K = 5  # Winners per division
+# Players active in the last LEAGUE_ACTIVE_DAYS before a week starts are placed in that week's league
+LEAGUE_ACTIVE_DAYS = 14
+RAID_COINS_PER_LEVEL = 25_000
+REWARD_EVENT = 'raid_league_reward'
+REWARD_TYPE = 'gold_raider_badge'
+
+
+def week_start(day):
+    """The Monday that starts the league week of `day`."""
+    day = pd.Timestamp(day).normalize()
+    return day - pd.Timedelta(days=day.weekday())
+
+
+def _positions(index, values):
+    """Positions of `values` in `index` (-1 if absent). Categoricals are looked up once per category."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        lookup = np.append(index.get_indexer(values.cat.categories), -1)
+        return lookup[values.cat.codes.to_numpy()]  # Code -1 (NULL) maps to the appended -1
+    return index.get_indexer(values)
+
+
+def _sorted_unique(values):
+    """np.unique by sorting (faster than its hash path for large integer batches)."""
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+
+class RaidLeague:
+    """
+    One week of the league: the divisions, and each player's raid coins and
+    raid count so far. Feed `update` each day's events in date order.
+    """
+
+    def __init__(self, week, player_ids, levels, raid_history=None,
+                 division_size=DIVISION_SIZE, top_k=TOP_K):
+        self.week_start = week_start(week)
+        self.top_k = top_k
+        ids = np.asarray(player_ids, dtype=object)
+        n = len(ids)
+        levels = np.nan_to_num(np.asarray(levels, dtype=np.float64), nan=1.0).astype(np.int64)
+        history = np.zeros(n, dtype=np.int64) if raid_history is None else np.asarray(raid_history, dtype=np.int64)
+
+        # Matchmaking: one sort by (level, raid history); the hash mixes equal players differently every week
+        tiebreak = pd.util.hash_array(ids, hash_key=f"raidleague{self.week_start:%y%m%d}")
+        order = np.lexsort((tiebreak, history, levels))
+        n_divisions = -(-n // division_size)
+        self.players = pd.Index(ids[order])
+        self.levels = levels[order].astype(np.int32)
+        self.division = (np.arange(n) * n_divisions // max(n, 1)).astype(np.int32)  # Sizes differ by 1 at most
+        self.division_starts = np.searchsorted(self.division, np.arange(n_divisions + 1))
+        self.scores = np.zeros(n, dtype=np.int64)
+        self.raids = np.zeros(n, dtype=np.int32)
+        self.top = np.full((n_divisions, top_k), -1, dtype=np.int64)  # Player positions, best first
+        self.days_done = {}  # Day -> (positions, coins, raids) it scored
+        # Last week's winners, rewarded in their first session of this week
+        self.rewards = pd.DataFrame({'user_pseudo_id': pd.Series(dtype=object), 'rank': pd.Series(dtype='int64'),
+                                     'claimed_on': pd.Series(dtype='datetime64[ns]')})
+
+    @classmethod
+    def from_state(cls, state, week, raid_history=None, **kwargs):
+        """
+        The week's league over user-state rows: players installed before the
+        week who were active in the LEAGUE_ACTIVE_DAYS before it. `raid_history`
+        (raids per user ID, e.g. last week's `raid_history()`) feeds matchmaking.
+        """
+        start = week_start(week)
+        active = state[(state['install_date'] < start)
+                       & (state['last_active_date'] >= start - pd.Timedelta(days=LEAGUE_ACTIVE_DAYS))]
+        history = None
+        if raid_history is not None:
+            history = raid_history.reindex(active['user_pseudo_id']).fillna(0).to_numpy()
+        return cls(start, active['user_pseudo_id'].to_numpy(),
+                   active['current_village_level'].to_numpy(dtype='float64', na_value=np.nan), history, **kwargs)
+
+    def __len__(self):
+        return len(self.players)
+
+    @property
+    def n_divisions(self):
+        return len(self.top)
+
+    # --- Scoring ---
+    def record_raids(self, positions, coins):
+        """Adds raid `coins` to the players at `positions` (-1 entries are ignored) and refreshes the top K."""
+        positions = np.asarray(positions, dtype=np.int64)
+        coins = np.asarray(coins, dtype=np.int64)
+        keep = positions >= 0
+        positions, coins = positions[keep], coins[keep]
+        if not len(positions):
+            return
+        np.add.at(self.scores, positions, coins)
+        np.add.at(self.raids, positions, 1)
+        touched = _sorted_unique(positions)
+        divisions = _sorted_unique(self.division[touched])
+        current = self.top[divisions].ravel()
+        self._rank(divisions, _sorted_unique(np.concatenate([touched, current[current >= 0]])))
+
+    def _rank(self, divisions, candidates):
+        """
+        Sets the top K of `divisions` (sorted) from `candidates`: sorted
+        positions in them that include every player who can make it.
+        """
+        # Rank the candidates within their division: most coins first, ties to the lower position
+        division = self.division[candidates]
+        order = np.lexsort((candidates, -self.scores[candidates], division))
+        candidates, division = candidates[order], division[order]
+        rank = np.arange(len(candidates)) - np.searchsorted(division, division)
+        keep = (rank < self.top_k) & (self.scores[candidates] > 0)
+        self.top[divisions] = -1
+        self.top[division[keep], rank[keep]] = candidates[keep]
+
+    def update(self, events, day=None):
+        """
+        Scores the week's `raid_performed` events of one day's partition
+        (`day`, by default the date of its first event). Feeding a day again
+        (a re-run) replaces what it scored before.
+        """
+        if day is None:
+            if not len(events):
+                return self
+            day = events['event_timestamp'].min()
+        day = pd.Timestamp(day).normalize()
+        week_end = self.week_start + pd.Timedelta(days=7)
+        raids = events[(events['event_name'] == 'raid_performed')
+                       & (events['event_timestamp'] >= self.week_start) & (events['event_timestamp'] < week_end)]
+        coins = RAID_COINS_PER_LEVEL * raids['current_village_level'].to_numpy(dtype='float64', na_value=1.0)
+        positions = _positions(self.players, raids['user_pseudo_id'])
+        keep = positions >= 0
+        touched, inverse = np.unique(positions[keep], return_inverse=True)
+        day_coins = np.zeros(len(touched), dtype=np.int64)
+        np.add.at(day_coins, inverse, coins[keep].astype(np.int64))
+        day_raids = np.bincount(inverse, minlength=len(touched)).astype(np.int32)
+
+        previous = self.days_done.pop(day, None)
+        self.days_done[day] = (touched, day_coins, day_raids)
+        if previous is None:
+            if len(touched):
+                self.scores[touched] += day_coins
+                self.raids[touched] += day_raids
+                divisions = _sorted_unique(self.division[touched])
+                current = self.top[divisions].ravel()
+                self._rank(divisions, _sorted_unique(np.concatenate([touched, current[current >= 0]])))
+            return self
+        # A re-run: scores can go down, so the divisions either run touched are ranked from all their players
+        old, old_coins, old_raids = previous
+        self.scores[old] -= old_coins
+        self.raids[old] -= old_raids
+        self.scores[touched] += day_coins
+        self.raids[touched] += day_raids
+        divisions = _sorted_unique(self.division[np.concatenate([old, touched])])
+        if len(divisions):
+            members = [np.arange(self.division_starts[d], self.division_starts[d + 1]) for d in divisions.tolist()]
+            self._rank(divisions, np.concatenate(members))
+        return self
+
+    # --- Lookups ---
+    def standings(self):
+        """The current top K of every division: division, rank, user, raid coins and raids."""
+        division, rank = np.nonzero(self.top >= 0)
+        positions = self.top[division, rank]
+        return pd.DataFrame({
+            'division': division,
+            'rank': rank + 1,
+            'user_pseudo_id': self.players[positions].to_numpy(),
+            'raid_coins': self.scores[positions],
+            'raids': self.raids[positions],
+        })
+
+    def leaderboard(self, division):
+        """One division's full ranking (sorted on demand: it is only DIVISION_SIZE players)."""
+        lo, hi = self.division_starts[division], self.division_starts[division + 1]
+        positions = np.arange(lo, hi)
+        positions = positions[np.lexsort((positions, -self.scores[lo:hi]))]
+        return pd.DataFrame({
+            'rank': np.arange(1, len(positions) + 1),
+            'user_pseudo_id': self.players[positions].to_numpy(),
+            'current_village_level': self.levels[positions],
+            'raid_coins': self.scores[positions],
+            'raids': self.raids[positions],
+        })
+
+    def division_of(self, user_ids):
+        """The division of each user ID (-1 if not in this week's league)."""
+        positions = self.players.get_indexer(user_ids)
+        return np.where(positions >= 0, self.division[positions], -1)
+
+    def raid_history(self):
+        """Raids per player this week, for next week's matchmaking."""
+        return pd.Series(self.raids.astype(np.int64), index=self.players)
+
+    # --- Rewards ---
+    def claim_rewards(self, events):
+        """
+        Reward events for last week's winners who open the app in `events`:
+        one row in each winner's first session, a second after its `app_open`.
+        Winners who don't play wait for a later day (within this week).
+        """
+        day = events['event_timestamp'].min().normalize() if len(events) else None
+        # A re-run day gives back that day's rewards, to be re-emitted with its new sessions
+        claimable = self.rewards['claimed_on'].isna() | (self.rewards['claimed_on'] == day)
+        opens = events[(events['event_name'] == 'app_open')
+                       & events['user_pseudo_id'].isin(self.rewards.loc[claimable, 'user_pseudo_id'])]
+        opens = opens.sort_values('event_timestamp', kind='stable').drop_duplicates('user_pseudo_id')
+        out = EventBuffer(list(EVENT_SCHEMA), capacity=max(len(opens), 1))
+        if opens.empty:
+            return out
+        ranks = self.rewards.set_index('user_pseudo_id')['rank']
+        values = {col: opens[col].to_numpy() for col in ('user_pseudo_id', 'session_id', 'platform',
+                                                         'app_version', 'country', 'persona')
+                  if col in opens.columns}
+        values['event_timestamp'] = (opens['event_timestamp'] + pd.Timedelta(seconds=1)).to_numpy()
+        values['event_name'] = categorical(np.zeros(len(opens), dtype=np.int64), [REWARD_EVENT])
+        values['spin_outcome_type'] = categorical(np.zeros(len(opens), dtype=np.int64), [REWARD_TYPE])
+        values['spin_outcome_value'] = ranks.reindex(opens['user_pseudo_id'].astype(object)).to_numpy(dtype=np.int64)
+        values['current_village_level'] = opens['current_village_level'].to_numpy(dtype=np.int64, na_value=1)
+        out.append(len(opens), values)
+        claimed = self.rewards['user_pseudo_id'].isin(opens['user_pseudo_id'].astype(object))
+        self.rewards.loc[claimed, 'claimed_on'] = day
+        return out
+
+    # --- Persistence ---
+    def save(self, path):
+        storage.save_pickle(path, self)
+
+    @staticmethod
+    def load(path):
+        """The league saved at `path`, or None if there is none yet."""
+        return storage.load_pickle(path)
+
+
+def advance(league, events, day, players):
+    """
+    Runs one simulated day of the league and returns (league, reward events).
+    When `day` starts a new week (or there is no league yet), last week's
+    winners become this week's rewards and new divisions are built from
+    `players` (user-state rows, see `RaidLeague.from_state`).
+    """
+    start = week_start(day)
+    if league is None or league.week_start != start:
+        previous = league
+        league = RaidLeague.from_state(players, start,
+                                       raid_history=previous.raid_history() if previous is not None else None)
+        if previous is not None and previous.week_start == start - pd.Timedelta(days=7):
+            winners = previous.standings()
+            league.rewards = pd.DataFrame({'user_pseudo_id': winners['user_pseudo_id'].astype(object),
+                                           'rank': winners['rank'].astype('int64'),
+                                           'claimed_on': pd.Series(pd.NaT, index=winners.index,
+                                                                   dtype='datetime64[ns]')})
+    rewards = league.claim_rewards(events)
+    league.update(events, day)
+    return league, rewards
@@ -0,0 +1,268 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+import metrics
+import storage
+
+# --- Partition-Versioned Result Cache ---
+# Dashboard query results kept on local disk and reused while the partitions
+# they read are unchanged. An entry's key is a hash of the normalized query
+# text (comments dropped, whitespace collapsed) and the date range it reads.
+# Next to the result it keeps the version of every partition it depends on
+# (see storage.py's `partition_versions`). A lookup reads the current
+# versions from the backend's metadata and only returns the entry if they
+# all match, so a cached read costs no scan. A day that is rewritten, added
+# or dropped changes the versions and the query runs again.
+#
+# The index is an SQLite table next to the result pickles. Entries are
+# evicted least recently used first once there are more than `max_entries`
+# or they take more than `max_bytes`. The handler also drops the entries
+# whose range covers a date it rewrites (`invalidate_dates`), so stale
+# results don't linger until the next lookup.
+#
+# The versions are read before the query runs. A write that lands while it
+# runs leaves the entry stamped with the older versions, so the next lookup
+# misses rather than returning a result that mixes both.
+
+QUERIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'queries')
+MAX_BYTES = 256 * 2 ** 20
+MAX_ENTRIES = 512
+
+# Strings and quoted names are kept as they are; comments and runs of whitespace become one space
+_SQL_TOKENS = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|--[^\n]*|#[^\n]*|/\*.*?\*/|\s+""", re.S)
+
+
+def normalize_query(sql):
+    """The query text without comments and with whitespace collapsed (outside quotes)."""
+    return _SQL_TOKENS.sub(lambda m: m.group(1) or ' ', sql).strip()
+
+
+def _day(value):
+    """A range bound as 'YYYY-MM-DD', or '' for an open one."""
+    return '' if value is None else f"{pd.Timestamp(value):%Y-%m-%d}"
+
+
+# --- Dashboard queries ---
+# The queries/ file each dashboard result comes from, its pandas engine (a
+# function of the backend and the date range), and whether it needs the
+# history before the range. daily_kpi_summary and retention_cohort take every
+# user's install from their first event ever, so a ranged result is the full
+# table's rows dated in the range (retention cells by the day of the activity),
+# with installs as known at the range's end: read from every partition up to
+# it. Their entries depend on all of those partitions. main_kpis is computed
+# over the range's events.
+def _user_dim(backend, end_date):
+    """Install date, country and source of every user, from every partition up to `end_date`."""
+    import user_state
+    columns = [col for col in user_state.SUMMARY_SOURCE_COLUMNS if col != 'persona']  # The backfill has no persona
+    return user_state.summarize_events(backend.read(None, end_date, columns=columns))
+
+
+def _range_events(backend, start_date, end_date):
+    """
+    The events dated from `start_date` to `end_date`, read from the partitions
+    that can hold them (the day before the range spills into its first day),
+    and those dates.
+    """
+    first = None if start_date is None else pd.Timestamp(start_date).normalize() - pd.Timedelta(days=1)
+    events = backend.read(first, end_date)
+    days = events['event_timestamp'].dt.normalize()
+    keep = pd.Series(True, index=events.index)
+    if start_date is not None:
+        keep &= days >= pd.Timestamp(start_date).normalize()
+    if end_date is not None:
+        keep &= days <= pd.Timestamp(end_date).normalize()
+    return events[keep], days[keep].unique()
+
+
+def _kpi_summary(backend, start_date, end_date):
+    import kpi_summary
+    import user_state
+    events, dates = _range_events(backend, start_date, end_date)
+    user_dim = _user_dim(backend, end_date) if start_date is not None else user_state.summarize_events(events)
+    return kpi_summary.refresh(kpi_summary.empty_summary(), events, user_dim, dates)
+
+
+def _retention_cohort(backend, start_date, end_date):
+    import retention
+    events, _ = _range_events(backend, start_date, end_date)
+    if start_date is None:
+        return retention.full_rebuild(events)
+    return retention.full_rebuild(events, _user_dim(backend, end_date).set_index('user_pseudo_id')['install_date'])
+
+
+def _main_kpis(backend, start_date, end_date):
+    import main_kpis
+    return main_kpis.compute_from_store(backend, start_date, end_date)  # Only the KPI columns
+
+
+DASHBOARD_QUERIES = {
+    'daily_kpi_summary': ('daily_kpi_summary.sql', _kpi_summary, True),
+    'retention_cohort': ('retention_cohort.sql', _retention_cohort, True),
+    'main_kpis': ('main_kpis.sql', _main_kpis, False),
+}
+
+
+class ResultCache:
+    """Query results under `root`, bounded by `max_bytes` and `max_entries` (LRU eviction)."""
+
+    def __init__(self, root, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                  key TEXT PRIMARY KEY,
+                  query TEXT,
+                  start_date TEXT,
+                  end_date TEXT,
+                  versions TEXT,
+                  size INTEGER,
+                  last_used REAL
+                )""")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection for one `with` block: committed (or rolled back) and closed at its end."""
+        with contextlib.closing(sqlite3.connect(os.path.join(self.root, 'index.sqlite'))) as conn, conn:
+            yield conn
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pkl")
+
+    @staticmethod
+    def key(query, start_date=None, end_date=None):
+        text = f"{normalize_query(query)}\n{_day(start_date)}\n{_day(end_date)}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    # --- Lookups ---
+    def get_or_compute(self, backend, query, compute, start_date=None, end_date=None, history=False):
+        """
+        The result of `query` over the partitions between the two dates:
+        from the cache if none of them changed since it was stored, else
+        `compute(backend, start_date, end_date)`, which is then stored. With
+        `history`, the result also depends on every partition before the range.
+        """
+        key = self.key(query, start_date, end_date)
+        reads_from = None if history else start_date  # The partitions it depends on start here
+        with metrics.span('result_cache.versions'):
+            versions = json.dumps(backend.partition_versions(reads_from, end_date), sort_keys=True)
+        result = self._get(key, versions)
+        if result is not None:
+            self.hits += 1
+            metrics.count('result_cache_hits')
+            return result
+        self.misses += 1
+        metrics.count('result_cache_misses')
+        with metrics.span('result_cache.compute'):
+            result = compute(backend, start_date, end_date)
+        self._put(key, normalize_query(query), reads_from, end_date, versions, result)
+        return result
+
+    def dashboard(self, backend, name, start_date=None, end_date=None):
+        """The dashboard query `name` (see DASHBOARD_QUERIES) over the date range, through the cache."""
+        if name not in DASHBOARD_QUERIES:
+            raise ValueError(f"Unknown dashboard query '{name}' (known: {', '.join(DASHBOARD_QUERIES)})")
+        filename, compute, history = DASHBOARD_QUERIES[name]
+        with open(os.path.join(QUERIES_DIR, filename)) as f:
+            query = f.read()
+        return self.get_or_compute(backend, query, compute, start_date, end_date, history)
+
+    def _get(self, key, versions):
+        with self._connect() as conn:
+            row = conn.execute("SELECT versions FROM entries WHERE key = ?", [key]).fetchone()
+            if row is None:
+                return None
+            if row[0] != versions:
+                self._drop(conn, [key])  # Stale: a partition it read has changed
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", [time.time(), key])
+        result = storage.load_pickle(self._path(key))
+        if result is None:  # The file is gone: forget the entry
+            with self._connect() as conn:
+                self._drop(conn, [key])
+        return result
+
+    def _put(self, key, query, start_date, end_date, versions, result):
+        path = self._path(key)
+        storage.save_pickle(path, result)
+        size = os.path.getsize(path)
+        with self._connect() as conn:
+            if size > self.max_bytes:
+                self._drop(conn, [key])
+                return
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [key, query, _day(start_date), _day(end_date), versions, size, time.time()])
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Drops the least recently used entries beyond `max_entries` or `max_bytes`."""
+        rows = conn.execute("SELECT key, size FROM entries ORDER BY last_used DESC").fetchall()
+        total, evicted = 0, []
+        for n, (key, size) in enumerate(rows):
+            total += size
+            if n >= self.max_entries or total > self.max_bytes:
+                evicted.append(key)
+        if evicted:
+            self._drop(conn, evicted)
+            metrics.count('result_cache_evictions', len(evicted))
+
+    def _drop(self, conn, keys):
+        conn.executemany("DELETE FROM entries WHERE key = ?", [[key] for key in keys])
+        for key in keys:
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+
+    # --- Invalidation ---
+    def invalidate_dates(self, dates):
+        """Drops the entries whose date range covers any of `dates`. Returns how many were dropped."""
+        keys = set()
+        with self._connect() as conn:
+            for day in {_day(d) for d in dates}:
+                keys.update(key for key, in conn.execute(
+                    "SELECT key FROM entries WHERE (start_date = '' OR start_date <= ?) "
+                    "AND (end_date = '' OR end_date >= ?)", [day, day]))
+            self._drop(conn, sorted(keys))
+        return len(keys)
+
+    def clear(self):
+        with self._connect() as conn:
+            self._drop(conn, [key for key, in conn.execute("SELECT key FROM entries")])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A dashboard query over the event store, through the result cache")
+    parser.add_argument('query', choices=list(DASHBOARD_QUERIES))
+    parser.add_argument('--cache', required=True, help="Cache directory")
+    parser.add_argument('--backend', choices=storage.BACKENDS[1:], default='parquet')
+    parser.add_argument('--path', default='events_store', help="Event store path")
+    parser.add_argument('--start-date')
+    parser.add_argument('--end-date')
+    args = parser.parse_args()
+    cache = ResultCache(args.cache)
+    t0 = time.perf_counter()
+    result = cache.dashboard(storage.open_backend(args.backend, args.path), args.query, args.start_date, args.end_date)
+    print(f"{'hit' if cache.hits else 'miss'} in {time.perf_counter() - t0:.3f} s")
+    pd.set_option('display.width', 200)
+    for name, table in (result.items() if isinstance(result, dict) else [(args.query, result)]):
+        print(f"\n{name}:\n{table.to_string(index=False)}")
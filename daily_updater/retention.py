@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+
+import kpi_summary
+import storage
+import user_state
+
+# --- Incremental Retention Cohorts ---
+# The cohort x day_in_game matrix of queries/retention_cohort.sql, kept up to
+# date as each day of events is produced instead of joining every event
+# against a full-table `installs_table` on every refresh.
+#
+# Every user gets a dense integer index the first time they are seen. A cohort
+# (install date) is a sorted array of those indexes. Because new users always
+# get larger indexes, adding installs is an append. Each (cohort, day_in_game)
+# cell holds the sorted indexes of its active users. An update only touches
+# the users active in the new events. Segment attributes (persona, country,
+# install source) are small integer codes per user index, so a segmented
+# retention rate is a count over the cell's members.
+#
+# The matrix records which partition dates it has folded in. Re-running a day
+# (without SIMULATION_SEED) writes different new users, so appending again
+# would keep the first run's users as phantoms. Instead, the cohorts that the
+# partition can touch are dropped and replayed from the stored events.
+
+TRACKED_DAYS = (1, 2, 3, 4, 5, 6, 7, 14, 21, 28)
+SEGMENTS = ('persona', 'install_country', 'install_source')
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _day_number(dates):
+    """Dates as int days since the epoch (what the cohort keys use)."""
+    return (np.asarray(dates, dtype='datetime64[D]') - _EPOCH).astype(np.int64)
+
+
+class RetentionMatrix:
+    """
+    Cohort x day_in_game retention, updated incrementally.
+
+    Feed each written partition to `apply_partition` in date order (or raw
+    events to `update`). `retention` and `to_frame` are lookups that never
+    touch the events again.
+    """
+
+    def __init__(self, tracked_days=TRACKED_DAYS):
+        self.tracked_days = tuple(tracked_days)
+        self.user_index = {}  # user_pseudo_id -> dense int index
+        self._size = 0
+        self._install_day = np.empty(1024, dtype=np.int64)
+        self._segments = {name: np.empty(1024, dtype=np.int16) for name in SEGMENTS}
+        self._codes = {name: {} for name in SEGMENTS}  # value -> code, per segment (-1 is NULL)
+        self.cohorts = {}  # install day -> sorted int array of members
+        self.active = {}   # (install day, day_in_game) -> sorted int array of active members
+        self.applied_days = set()  # Partition dates folded in so far, as day numbers
+
+    def __len__(self):
+        return len(self.user_index)
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._install_day)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = capacity * 3 // 2 + 1
+        self._install_day = np.resize(self._install_day, capacity)
+        for name, codes in self._segments.items():
+            self._segments[name] = np.resize(codes, capacity)
+
+    def _encode(self, name, values):
+        codes = self._codes[name]
+        return np.array([-1 if pd.isna(v) else codes.setdefault(v, len(codes)) for v in values], dtype=np.int16)
+
+    def update(self, events, dates=()):
+        """
+        Folds a batch of events (usually one day) into the matrix, and records
+        `dates` as the partitions they came from. Re-feeding the same events
+        changes nothing.
+        """
+        self.applied_days.update(int(day) for day in _day_number(pd.to_datetime(list(dates))))
+        if events.empty:
+            return self
+        summary = user_state.summarize_events(events)
+
+        # 1. New users get the next indexes and join their install cohort
+        is_new = summary['user_pseudo_id'].map(self.user_index).isna().to_numpy()
+        new = summary[is_new]
+        if len(new):
+            self._reserve(len(new))
+            lo, hi = self._size, self._size + len(new)
+            self.user_index.update(zip(new['user_pseudo_id'], range(lo, hi)))
+            self._install_day[lo:hi] = _day_number(new['install_date'].to_numpy())
+            for name in SEGMENTS:
+                self._segments[name][lo:hi] = self._encode(name, new[name].tolist())
+            self._size = hi
+            new_idx = np.arange(lo, hi)
+            new_days = self._install_day[lo:hi]
+            for day in np.unique(new_days):
+                members = new_idx[new_days == day]
+                old = self.cohorts.get(int(day))
+                self.cohorts[int(day)] = members if old is None else np.concatenate([old, members])
+
+        # Backfill events have no persona; keep the latest one we are told about
+        known = summary[~is_new & summary['persona'].notna()]
+        if len(known):
+            idx = np.fromiter((self.user_index[u] for u in known['user_pseudo_id']), dtype=np.int64, count=len(known))
+            self._segments['persona'][idx] = self._encode('persona', known['persona'].tolist())
+
+        # 2. Each (user, active day) pair lands in its cohort's day_in_game cell
+        pairs = pd.DataFrame({
+            'user': events['user_pseudo_id'].map(self.user_index).to_numpy(dtype=np.int64),
+            'day': _day_number(events['event_timestamp'].to_numpy()),
+        }).drop_duplicates()
+        users = pairs['user'].to_numpy()
+        cohort = self._install_day[users]
+        day_in_game = pairs['day'].to_numpy() - cohort + 1
+        tracked = np.isin(day_in_game, self.tracked_days)
+        users, cohort, day_in_game = users[tracked], cohort[tracked], day_in_game[tracked]
+        order = np.lexsort((users, day_in_game, cohort))
+        users, cohort, day_in_game = users[order], cohort[order], day_in_game[order]
+        bounds = np.flatnonzero(np.diff(cohort) | np.diff(day_in_game)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(users)]):
+            if lo == hi:
+                continue
+            key = (int(cohort[lo]), int(day_in_game[lo]))
+            old = self.active.get(key)
+            self.active[key] = users[lo:hi] if old is None else np.union1d(old, users[lo:hi])
+        return self
+
+    def apply_partition(self, backend, partition_date, events):
+        """
+        Folds in the `events` just written to the `partition_date` partition of
+        `backend`. If that date was applied before, the partition was rewritten:
+        the cohorts it can touch are rebuilt from `backend` instead.
+        """
+        day = int(_day_number(pd.Timestamp(partition_date).to_datetime64()))
+        if day in self.applied_days:
+            return self._rebuild_cohorts(backend, day)
+        return self.update(events, dates=[partition_date])
+
+    def _rebuild_cohorts(self, backend, day):
+        """
+        Drops the cohorts with cells that can hold activity from partition
+        `day` (sessions run into the next day) and their users, then replays
+        those users' events from `backend`, one partition at a time.
+        """
+        horizon = max(self.tracked_days)
+        first, last = day - horizon + 1, day + 1
+        dropped = [cohort for cohort in self.cohorts if first <= cohort <= last]
+        stale = set(np.concatenate([self.cohorts.pop(cohort) for cohort in dropped]).tolist()) if dropped else set()
+        self.active = {key: users for key, users in self.active.items() if not first <= key[0] <= last}
+        self.user_index = {user: idx for user, idx in self.user_index.items() if idx not in stale}
+
+        # From `first` on, the users not kept are the dropped ones; their tracked days end a horizon after `last`
+        kept = pd.Index(list(self.user_index))
+        for partition in range(first, last + horizon):
+            date = pd.Timestamp(_EPOCH + np.timedelta64(partition, 'D'))
+            events = backend.read(date, date)
+            self.update(events[~events['user_pseudo_id'].isin(kept)])
+        return self
+
+    def _segment_mask(self, members, filters):
+        mask = np.ones(len(members), dtype=bool)
+        for name, value in filters.items():
+            if value is None:
+                continue
+            code = self._codes[name].get(value)
+            if code is None:
+                return np.zeros(len(members), dtype=bool)
+            mask &= self._segments[name][members] == code
+        return mask
+
+    def counts(self, install_date, day_in_game, persona=None, install_country=None, install_source=None):
+        """(active users, cohort size) for one cell, optionally for one segment."""
+        day = int(_day_number(pd.Timestamp(install_date).to_datetime64()))
+        filters = {'persona': persona, 'install_country': install_country, 'install_source': install_source}
+        members = self.cohorts.get(day, np.empty(0, dtype=np.int64))
+        active = self.active.get((day, int(day_in_game)), np.empty(0, dtype=np.int64))
+        return (int(self._segment_mask(active, filters).sum()),
+                int(self._segment_mask(members, filters).sum()))
+
+    def retention(self, install_date, day_in_game, **segment):
+        """Retention rate of one cohort on one day in game (None for an empty cohort/segment)."""
+        active, size = self.counts(install_date, day_in_game, **segment)
+        return active / size if size else None
+
+    def to_frame(self, by=None):
+        """
+        The retention_cohort.sql result (install_dt, day_in_game, retention_rate),
+        or with `by` (a segment name) one row per segment value as well.
+        """
+        rows = []
+        for (day, day_in_game), active in sorted(self.active.items()):
+            members = self.cohorts[day]
+            install_dt = _EPOCH + np.timedelta64(day, 'D')
+            if by is None:
+                rows.append((install_dt, day_in_game, len(active), len(members)))
+                continue
+            labels = list(self._codes[by]) + [None]
+            codes = list(self._codes[by].values()) + [-1]
+            active_codes = self._segments[by][active]
+            member_codes = self._segments[by][members]
+            for label, code in zip(labels, codes):
+                active_users = int(np.count_nonzero(active_codes == code))
+                if active_users:  # Like the SQL, only cells with active users get a row
+                    rows.append((install_dt, day_in_game, label, active_users,
+                                 int(np.count_nonzero(member_codes == code))))
+        columns = ['install_dt', 'day_in_game'] + ([by] if by else []) + ['active_users', 'cohort_size']
+        frame = pd.DataFrame(rows, columns=columns)
+        frame['install_dt'] = pd.to_datetime(frame['install_dt'])
+        frame['retention_rate'] = kpi_summary.sql_round(frame['active_users'] / frame['cohort_size'], 2)
+        return frame
+
+    def save(self, path):
+        state = self.__dict__.copy()
+        state['_install_day'] = self._install_day[:self._size]
+        state['_segments'] = {name: codes[:self._size] for name, codes in self._segments.items()}
+        storage.save_pickle(path, state)
+
+    @classmethod
+    def load(cls, path):
+        """The matrix saved at `path`, or an empty one if there is none yet."""
+        matrix = cls()
+        state = storage.load_pickle(path)
+        if state is not None:
+            matrix.__dict__.update(state)
+            matrix._reserve(0)
+        return matrix
+
+
+def full_rebuild(events, installs=None):
+    """
+    retention_cohort.sql over every event, in pandas (the reference the matrix
+    must match). `installs` (install date per user ID, over the whole history)
+    replaces each user's first event in `events` when those are only a range.
+    """
+    if installs is None:
+        installs = events.groupby('user_pseudo_id')['event_timestamp'].min().dt.normalize()
+    installs = installs.rename('install_dt')
+    cohort_size = installs.value_counts().rename('cohort_size')
+    active = pd.DataFrame({
+        'user_pseudo_id': events['user_pseudo_id'],
+        'event_date': events['event_timestamp'].dt.normalize(),
+    }).drop_duplicates().join(installs, on='user_pseudo_id')
+    active['day_in_game'] = (active['event_date'] - active['install_dt']).dt.days + 1
+    active = active[active['day_in_game'].isin(TRACKED_DAYS)]
+    daily = active.groupby(['install_dt', 'day_in_game'])['user_pseudo_id'].nunique().rename('active_users')
+    result = daily.reset_index().join(cohort_size, on='install_dt')
+    result['retention_rate'] = kpi_summary.sql_round(result['active_users'] / result['cohort_size'], 2)
+    return result.sort_values(['install_dt', 'day_in_game'], ignore_index=True)
@@ -0,0 +1,337 @@
+import numpy as np
+import pandas as pd
+
+from event_buffer import EventBuffer, EVENT_SCHEMA, categorical
+from social_index import SocialTargetIndex
+
+# --- Vectorized Session Engine ---
+# Draws every spin, outcome, target, upgrade and timestamp of a whole batch of
+# sessions with NumPy arrays, instead of one `random` call per value inside a
+# Python loop, and appends them to an EventBuffer. The rules (spin counts,
+# outcome odds, timings, purchases, level ups and the 500-event cap) are the
+# same as the original per-spin loop.
+
+PERSONAS = ['Non-Payer', 'Low-Spender', 'High-Spender']
+PERSONA_CODES = {name: code for code, name in enumerate(PERSONAS)}
+NON_PAYER, LOW_SPENDER, HIGH_SPENDER = 0, 1, 2
+
+APP_VERSIONS = np.array(['1.150.0', '1.150.1', '1.150.2', '1.151.0'], dtype=object)
+INVITE_METHODS = np.array(['facebook', 'whatsapp', 'sms', 'contact_list'], dtype=object)
+PRODUCT_IDS = {
+    4.99: 'bundle_small_4.99',
+    9.99: 'bundle_medium_9.99',
+    19.99: 'bundle_large_19.99',
+    49.99: 'bundle_whale_49.99'
+}
+
+# Spins per session (inclusive bounds), indexed by persona code
+SPINS_LOW = np.array([10, 50, 30])
+SPINS_HIGH = np.array([40, 100, 70])
+
+SPIN_COSTS = np.array([1, 3, 5, 10])
+OUTCOME_TYPES = np.array(['coins', 'attack', 'raid', 'shield', 'free_spins'], dtype=object)
+OUTCOME_COINS, OUTCOME_ATTACK, OUTCOME_RAID, OUTCOME_SHIELD, OUTCOME_FREE_SPINS = range(5)
+FREE_SPIN_VALUES = np.array([5, 10, 25])
+HIGH_SPENDER_PRICES = np.array([9.99, 19.99, 49.99])
+
+UPGRADE_PROB = 0.1
+LEADERBOARD_PROB = 0.3
+INVITE_PROB = 0.1
+LOW_SPENDER_PURCHASE_PROB = 0.05
+HIGH_SPENDER_PURCHASE_PROB = 0.40
+# Chance to gain a village level at the end of a session, indexed by persona code
+LEVEL_UP_PROB = np.array([0.1, 0.1, 0.4])
+
+MAX_EVENTS_PER_SESSION = 500
+
+EVENT_NAMES = np.array([
+    'app_open', 'spin_action', 'spin_outcome_received', 'attack_performed',
+    'raid_performed', 'village_item_upgraded', 'leaderboard_viewed',
+    'friend_invite_sent', 'store_opened', 'purchase_completed', 'app_close'
+], dtype=object)
+(APP_OPEN, SPIN_ACTION, SPIN_OUTCOME, ATTACK, RAID, UPGRADE, LEADERBOARD,
+ INVITE, STORE, PURCHASE, APP_CLOSE) = range(len(EVENT_NAMES))
+
+NULLABLE_INT_COLUMNS = ('spin_cost', 'spin_outcome_value', 'item_cost')
+STRING_COLUMNS = (
+    'spin_outcome_type', 'entry_point', 'product_id', 'attack_target_id',
+    'raid_target_id', 'invite_method', 'attribution_source', 'inviter_user_id'
+)
+
+# Ordering of events inside a session: the app_open first, then four slots per
+# spin (action, outcome, attack/raid, upgrade), then the end-of-session events.
+_POS_OPEN = -1
+_POS_TAIL = 1_000_000
+_POS_CLOSE = 2_000_000
+
+_rng = np.random.default_rng()
+
+
+def random_uuid4s(rng, n):
+    """Returns `n` random UUID4 strings drawn from `rng`, formatted without a Python loop."""
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40  # version 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80  # RFC 4122 variant
+    hex_chars = np.frombuffer(raw.tobytes().hex().encode('ascii'), dtype=np.uint8).reshape(n, 32)
+    out = np.full((n, 36), ord('-'), dtype=np.uint8)
+    out[:, 0:8] = hex_chars[:, 0:8]
+    out[:, 9:13] = hex_chars[:, 8:12]
+    out[:, 14:18] = hex_chars[:, 12:16]
+    out[:, 19:23] = hex_chars[:, 16:20]
+    out[:, 24:36] = hex_chars[:, 20:32]
+    return out.view('S36').ravel().astype('U36').astype(object)
+
+
+def _group_starts(group_ids):
+    """For a sorted array of group ids, returns the index where each element's group starts."""
+    n = len(group_ids)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = group_ids[1:] != group_ids[:-1]
+    return np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+
+def _grouped_exclusive_cumsum(values, group_ids):
+    """Running total of `values` *before* each element, restarting at every group (sorted ids)."""
+    if len(values) == 0:
+        return values.copy()
+    total = np.cumsum(values) - values
+    return total - total[_group_starts(group_ids)]
+
+
+def _per_event(session_values, event_session):
+    """A per-session string column repeated for each event, coded once per distinct value."""
+    codes, labels = pd.factorize(np.asarray(session_values, dtype=object))
+    return categorical(codes[event_session], labels)
+
+
+def _uniform_seconds(rng, low, high, size):
+    return rng.integers(low, high + 1, size=size)
+
+
+def simulate_sessions(session_users, session_starts, target_pool, rng=None,
+                      attribution_sources=None, inviter_ids=None, out=None, experiment=None):
+    """
+    Simulates a batch of sessions in one pass and appends their events to `out`.
+
+    `session_users` holds one user dict per session. A user playing several
+    sessions appears once per session, in play order and next to each other,
+    so the village level carries over between sessions just like the per-spin
+    loop did. Final levels and `sent_invites` are written back to the dicts.
+    `session_starts` are the `app_open` times; `attribution_sources` and
+    `inviter_ids` fill the `app_open` row (default: 'organic' / None).
+    `target_pool` is a list of IDs to draw attack/raid targets from uniformly,
+    or a SocialTargetIndex to draw them by the attacker's level and by recency.
+    `out` is an EventBuffer; a new one with every column is created if omitted.
+    With an `experiment` (see experiments.py), sessions of its treated users
+    get more spins, raids and purchases by its lifts.
+    Returns the buffer.
+    """
+    rng = _rng if rng is None else rng
+    n_sessions = len(session_users)
+    if out is None:
+        out = EventBuffer(EVENT_SCHEMA, capacity=max(n_sessions * 80, 1))
+    if n_sessions == 0:
+        return out
+
+    if isinstance(target_pool, SocialTargetIndex):
+        target_index, pool = target_pool, None
+    else:
+        target_index, pool = None, np.asarray(target_pool if len(target_pool) else ["dummy_target"], dtype=object)
+
+    # --- 1. Per-session state ---
+    persona = np.array([PERSONA_CODES.get(u.get('persona'), NON_PAYER) for u in session_users], dtype=np.int8)
+    base_level = np.array([u.get('current_village_level') or 1 for u in session_users], dtype=np.int64)
+    user_key = np.array([id(u) for u in session_users])
+    starts_ns = np.asarray(session_starts, dtype='datetime64[ns]').astype(np.int64)
+
+    user_group = np.cumsum(np.r_[True, user_key[1:] != user_key[:-1]])
+    level_up = (rng.random(n_sessions) < LEVEL_UP_PROB[persona]).astype(np.int64)
+    first_session = _group_starts(user_group)
+    level_before = base_level[first_session] + _grouped_exclusive_cumsum(level_up, user_group)
+    level_after = level_before + level_up
+    # Experiment effects (a lift of 1 everywhere without one, and no extra draws)
+    purchase_lift = 1.0
+    treated = None
+    if experiment is not None:
+        treated = experiment.assign([u['user_pseudo_id'] for u in session_users])
+        purchase_lift = np.where(treated, experiment.purchase_lift, 1.0)
+
+    # --- 2. Spins, drawn for every session at once ---
+    num_spins = rng.integers(SPINS_LOW[persona], SPINS_HIGH[persona] + 1)
+    if treated is not None:
+        num_spins = np.where(treated, np.round(num_spins * experiment.spin_lift).astype(np.int64), num_spins)
+    spin_session = np.repeat(np.arange(n_sessions), num_spins)
+    n_spins = len(spin_session)
+    spin_cost = SPIN_COSTS[rng.integers(0, len(SPIN_COSTS), n_spins)]
+    outcome = rng.integers(0, len(OUTCOME_TYPES), n_spins)
+    if treated is not None and experiment.raid_lift != 1.0:
+        # Raids are 1 outcome in 5: turning a share (raid_lift - 1) of the coin outcomes into raids scales them by raid_lift
+        to_raid = (treated[spin_session] & (outcome == OUTCOME_COINS)
+                   & (rng.random(n_spins) < min(max(experiment.raid_lift - 1.0, 0.0), 1.0)))
+        outcome[to_raid] = OUTCOME_RAID
+    outcome_value = np.ones(n_spins, dtype=np.int64)
+    is_coins = outcome == OUTCOME_COINS
+    is_free = outcome == OUTCOME_FREE_SPINS
+    outcome_value[is_coins] = rng.integers(1000, 100001, is_coins.sum()) * spin_cost[is_coins]
+    outcome_value[is_free] = FREE_SPIN_VALUES[rng.integers(0, len(FREE_SPIN_VALUES), is_free.sum())]
+    is_social = (outcome == OUTCOME_ATTACK) | (outcome == OUTCOME_RAID)
+    is_upgrade = rng.random(n_spins) < UPGRADE_PROB
+
+    # The loop stopped starting new spins once a session held more than 500 events
+    events_per_spin = 2 + is_social + is_upgrade
+    keep = _grouped_exclusive_cumsum(events_per_spin, spin_session) <= MAX_EVENTS_PER_SESSION
+    spin_session, spin_cost, outcome, outcome_value, is_social, is_upgrade = (
+        a[keep] for a in (spin_session, spin_cost, outcome, outcome_value, is_social, is_upgrade))
+    n_spins = len(spin_session)
+    spin_index = np.arange(n_spins) - _group_starts(spin_session)
+
+    # --- 3. Assemble event segments (session, position, name, seconds until next event, attributes) ---
+    segments = []
+
+    def add(sessions, positions, names, delays, **attrs):
+        segments.append((sessions, positions, names, delays, attrs))
+
+    all_sessions = np.arange(n_sessions)
+    if attribution_sources is None:
+        attribution_sources = np.full(n_sessions, 'organic', dtype=object)
+    if inviter_ids is None:
+        inviter_ids = np.full(n_sessions, None, dtype=object)
+    # The delay after app_open is the 5-15s before the first spin
+    add(all_sessions, np.full(n_sessions, _POS_OPEN), np.full(n_sessions, APP_OPEN),
+        _uniform_seconds(rng, 5, 15, n_sessions),
+        attribution_source=np.asarray(attribution_sources, dtype=object),
+        inviter_user_id=np.asarray(inviter_ids, dtype=object))
+
+    spin_pos = spin_index * 4
+    add(spin_session, spin_pos, np.full(n_spins, SPIN_ACTION), _uniform_seconds(rng, 2, 5, n_spins),
+        spin_cost=spin_cost)
+    add(spin_session, spin_pos + 1, np.full(n_spins, SPIN_OUTCOME), _uniform_seconds(rng, 1, 3, n_spins),
+        spin_outcome_type=OUTCOME_TYPES[outcome], spin_outcome_value=outcome_value)
+
+    social_session = spin_session[is_social]
+    n_social = len(social_session)
+    is_attack = outcome[is_social] == OUTCOME_ATTACK
+    if target_index is not None:
+        targets = target_index.draw(rng, n_social, levels=level_before[social_session])
+    else:
+        targets = pool[rng.integers(0, len(pool), n_social)]
+    add(social_session, spin_pos[is_social] + 2, np.where(is_attack, ATTACK, RAID),
+        _uniform_seconds(rng, 10, 20, n_social),
+        attack_target_id=np.where(is_attack, targets, None),
+        raid_target_id=np.where(is_attack, None, targets))
+
+    upgrade_session = spin_session[is_upgrade]
+    n_upgrade = len(upgrade_session)
+    add(upgrade_session, spin_pos[is_upgrade] + 3, np.full(n_upgrade, UPGRADE),
+        _uniform_seconds(rng, 10, 30, n_upgrade),
+        item_cost=rng.integers(50000, 500001, n_upgrade) * level_before[upgrade_session])
+
+    # --- 4. End-of-session events ---
+    payer = persona != NON_PAYER
+    leaderboard = np.flatnonzero(payer & (rng.random(n_sessions) < LEADERBOARD_PROB))
+    add(leaderboard, np.full(len(leaderboard), _POS_TAIL), np.full(len(leaderboard), LEADERBOARD),
+        _uniform_seconds(rng, 5, 15, len(leaderboard)))
+
+    invite_sent = payer & (rng.random(n_sessions) < INVITE_PROB)
+    invites = np.flatnonzero(invite_sent)
+    add(invites, np.full(len(invites), _POS_TAIL + 1), np.full(len(invites), INVITE),
+        _uniform_seconds(rng, 10, 20, len(invites)),
+        invite_method=INVITE_METHODS[rng.integers(0, len(INVITE_METHODS), len(invites))])
+
+    low_buy = np.flatnonzero((persona == LOW_SPENDER)
+                             & (rng.random(n_sessions) < LOW_SPENDER_PURCHASE_PROB * purchase_lift))
+    add(low_buy, np.full(len(low_buy), _POS_TAIL + 2), np.full(len(low_buy), STORE),
+        _uniform_seconds(rng, 10, 30, len(low_buy)),
+        entry_point=np.full(len(low_buy), 'out_of_spins_popup', dtype=object))
+    add(low_buy, np.full(len(low_buy), _POS_TAIL + 3), np.full(len(low_buy), PURCHASE),
+        _uniform_seconds(rng, 5, 10, len(low_buy)),
+        product_id=np.full(len(low_buy), PRODUCT_IDS[4.99], dtype=object),
+        price_usd=np.full(len(low_buy), 4.99))
+
+    high_buy = np.flatnonzero((persona == HIGH_SPENDER)
+                              & (rng.random(n_sessions) < HIGH_SPENDER_PURCHASE_PROB * purchase_lift))
+    prices = HIGH_SPENDER_PRICES[rng.integers(0, len(HIGH_SPENDER_PRICES), len(high_buy))]
+    add(high_buy, np.full(len(high_buy), _POS_TAIL + 4), np.full(len(high_buy), STORE),
+        _uniform_seconds(rng, 5, 20, len(high_buy)),
+        entry_point=np.full(len(high_buy), 'out_of_coins_popup', dtype=object))
+    add(high_buy, np.full(len(high_buy), _POS_TAIL + 5), np.full(len(high_buy), PURCHASE),
+        _uniform_seconds(rng, 5, 10, len(high_buy)),
+        product_id=np.array([PRODUCT_IDS[p] for p in prices], dtype=object),
+        price_usd=prices)
+
+    add(all_sessions, np.full(n_sessions, _POS_CLOSE), np.full(n_sessions, APP_CLOSE),
+        np.zeros(n_sessions, dtype=np.int64))
+
+    # --- 5. Order events inside their session and derive timestamps ---
+    event_session = np.concatenate([s[0] for s in segments])
+    event_pos = np.concatenate([s[1] for s in segments])
+    order = np.lexsort((event_pos, event_session))
+    event_session = event_session[order]
+    event_name = np.concatenate([s[2] for s in segments])[order]
+    delays = np.concatenate([s[3] for s in segments]).astype(np.int64)[order]
+    n_events = len(order)
+
+    offset_s = _grouped_exclusive_cumsum(delays, event_session)
+    timestamps = (starts_ns[event_session] + offset_s * 1_000_000_000).astype('datetime64[ns]')
+
+    # The app_open row has always carried its own session_id
+    session_ids = np.concatenate([random_uuid4s(rng, n_sessions), random_uuid4s(rng, n_sessions)])  # then app_open ids
+    is_open = event_name == APP_OPEN
+    session_col = categorical(np.where(is_open, n_sessions + event_session, event_session), session_ids)
+
+    level_col = level_before[event_session]
+    is_close = event_name == APP_CLOSE
+    level_col[is_close] = level_after[event_session[is_close]]
+
+    values = {
+        'event_timestamp': timestamps,
+        'user_pseudo_id': _per_event([u['user_pseudo_id'] for u in session_users], event_session),
+        'session_id': session_col,
+        'event_name': categorical(event_name, EVENT_NAMES),
+        'platform': _per_event([u['platform'] for u in session_users], event_session),
+        'app_version': categorical(rng.integers(0, len(APP_VERSIONS), n_events), APP_VERSIONS),
+        'country': _per_event([u['country'] for u in session_users], event_session),
+        'current_village_level': level_col,
+        'persona': categorical(persona[event_session], PERSONAS),
+    }
+    nulls = {}
+
+    # Sparse attributes: scatter each segment's values (codes, for strings) into full-length columns
+    bounds = np.cumsum([0] + [len(s[0]) for s in segments])
+    inverse = np.empty(n_events, dtype=np.int64)
+    inverse[order] = np.arange(n_events)
+    for col in NULLABLE_INT_COLUMNS + STRING_COLUMNS + ('price_usd',):
+        if col not in out.kinds:
+            continue
+        if col in NULLABLE_INT_COLUMNS:
+            column, is_null = np.zeros(n_events, dtype=np.int64), np.ones(n_events, dtype=bool)
+            nulls[col] = is_null
+        elif col == 'price_usd':
+            column = np.full(n_events, np.nan)
+        else:
+            column, labels = np.full(n_events, -1, dtype=np.int64), []
+        for (_, _, _, _, attrs), lo, hi in zip(segments, bounds[:-1], bounds[1:]):
+            if col not in attrs:
+                continue
+            if col in STRING_COLUMNS:
+                codes, segment_labels = pd.factorize(np.asarray(attrs[col], dtype=object))
+                column[inverse[lo:hi]] = np.where(codes >= 0, codes + len(labels), -1)
+                labels.extend(segment_labels)
+            else:
+                column[inverse[lo:hi]] = attrs[col]
+            if col in nulls:
+                is_null[inverse[lo:hi]] = False
+        values[col] = categorical(column, labels) if col in STRING_COLUMNS else column
+
+    out.append(n_events, values, nulls)
+
+    # --- 6. Write the end-of-batch state back to the user dicts ---
+    last_session = np.r_[user_group[1:] != user_group[:-1], True]
+    invites_per_user = np.add.reduceat(invite_sent.astype(np.int64), np.flatnonzero(first_session == np.arange(n_sessions)))
+    for user, level, invites_sent in zip(
+            (u for u, last in zip(session_users, last_session) if last),
+            level_after[last_session], invites_per_user):
+        user['current_village_level'] = int(level)
+        user['sent_invites'] = user.get('sent_invites', 0) + int(invites_sent)
+
+    return out
@@ -0,0 +1,65 @@
+import numpy as np
+
+# --- Sharded Simulation ---
+# Users are independent apart from whom they pick as attack/raid targets and
+# inviters. So we split the users into shards, give every shard its own RNG
+# stream spawned from one seed, and run the shards in a process pool. Shared,
+# read-only inputs (the day's target index, or the backfill's ID lists) are
+# sent once per worker instead of once per task. The output depends only on the seed and the shard
+# count, not on whether the shards ran in parallel or one after another.
+
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def shared(name):
+    """Returns a read-only input that `run_sharded` made available to every shard."""
+    return _shared[name]
+
+
+def shard_seeds(seed, n_shards):
+    """Independent, reproducible seed sequences, one per shard."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n_shards)
+
+
+def split_evenly(items, n_shards):
+    """Splits a list (or a DataFrame's rows) into `n_shards` contiguous, nearly equal slices (order is kept)."""
+    bounds = np.linspace(0, len(items), n_shards + 1).astype(int)
+    rows = items.iloc if hasattr(items, 'iloc') else items
+    return [rows[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def _run_task(task, args, seed_seq):
+    return task(args, np.random.default_rng(seed_seq))
+
+
+def run_sharded(task, shard_args, seed=None, workers=1, shared_inputs=None):
+    """
+    Calls `task(args, rng)` once per entry of `shard_args` and returns the results in shard order.
+
+    `task` must be a module-level function so it can be sent to worker
+    processes. With `workers <= 1` the shards run in this process.
+    """
+    return list(iter_sharded(task, shard_args, seed, workers, shared_inputs))
+
+
+def iter_sharded(task, shard_args, seed=None, workers=1, shared_inputs=None):
+    """Like `run_sharded`, but yields each result (in shard order) as soon as it is ready."""
+    seeds = shard_seeds(seed, len(shard_args))
+    if workers <= 1 or len(shard_args) <= 1:
+        _init_worker(shared_inputs or {})
+        for args, s in zip(shard_args, seeds):
+            yield _run_task(task, args, s)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor  # Only multi-worker runs need the process machinery
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(shared_inputs or {},)) as executor:
+        yield from executor.map(_run_task, [task] * len(shard_args), shard_args, seeds)
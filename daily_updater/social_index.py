@@ -0,0 +1,201 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# --- Social Target Index ---
+# Who gets attacked, raided or credited with an invite. Targets used to be
+# drawn uniformly from a flat list of IDs. Here users sit in buckets keyed by
+# village-level band and last-active day. A draw weights each bucket by its
+# size, by how close its band is to the attacker's (matchmaking pairs similar
+# villages), and by how recently its users played (the weight halves every
+# RECENCY_HALF_LIFE_DAYS). Everyone in a bucket has the same weight, so a
+# draw is two O(1) steps: an alias-table pick of the bucket (Walker / Vose),
+# then a uniform pick inside it. Users are added, moved and removed in O(1)
+# with swap-remove lists. The alias tables only cover the buckets (a few
+# bands times the days in the window) and are rebuilt lazily after a change.
+
+# Lower bounds of the level bands above band 0 (levels 1-2, 3-5, 6-9, 10+)
+LEVEL_BAND_EDGES = np.array([3, 6, 10])
+N_BANDS = len(LEVEL_BAND_EDGES) + 1
+# Weight of a target `k` bands away from the attacker: BAND_AFFINITY ** k
+BAND_AFFINITY = 0.35
+RECENCY_HALF_LIFE_DAYS = 3.0
+
+_EDGES = LEVEL_BAND_EDGES.tolist()
+_EPOCH_ORDINAL = 719_163  # date(1970, 1, 1).toordinal()
+_DAY_KEYS = 10 ** 7  # bucket key = band * _DAY_KEYS + day ordinal
+
+
+def level_bands(levels):
+    """The band (0 .. N_BANDS - 1) of each village level; missing levels count as level 1."""
+    levels = np.asarray(levels)
+    if levels.dtype == object:
+        levels = np.array([1 if level is None else level for level in levels], dtype=np.float64)
+    return np.searchsorted(LEVEL_BAND_EDGES, np.nan_to_num(levels.astype(np.float64), nan=1.0), side='right')
+
+
+def alias_table(weights):
+    """
+    Vose's alias method: (prob, alias) arrays such that picking a column `i`
+    uniformly and keeping it with probability `prob[i]` (else taking
+    `alias[i]`) draws `i` with probability weights[i] / sum(weights).
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    scaled = weights * (n / weights.sum())
+    prob = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    return prob, alias  # Leftovers keep prob 1 (they only differ from 1 by rounding)
+
+
+def alias_draw(rng, prob, alias, n):
+    """`n` column indices drawn from an alias table."""
+    column = rng.integers(0, len(prob), n)
+    return np.where(rng.random(n) < prob[column], column, alias[column])
+
+
+class SocialTargetIndex:
+    """
+    User IDs bucketed by level band and last-active day, for weighted O(1)
+    draws. `as_of` is the day recency is measured from.
+    """
+
+    def __init__(self, as_of):
+        self._as_of = as_of.toordinal()
+        self._buckets = {}      # (band, day ordinal) -> bucket number
+        self._keys = []         # bucket number -> (band, day ordinal)
+        self._ids = []          # bucket number -> list of user IDs
+        self._positions = {}    # user ID -> (bucket number, position in its list)
+        self._tables = {}       # (attacker band, active_before) -> cached alias table
+
+    @classmethod
+    def from_users(cls, users, as_of):
+        """
+        An index of users with `user_pseudo_id`, `current_village_level` and
+        `last_active_date`: user dicts, or a DataFrame's rows (added in bulk).
+        """
+        if hasattr(users, 'columns'):
+            return cls._from_frame(users, as_of)
+        index = cls(as_of)
+        for user in users:
+            index.add(user['user_pseudo_id'], user.get('current_village_level'),
+                      user.get('last_active_date') or as_of)
+        return index
+
+    @classmethod
+    def _from_frame(cls, users, as_of):
+        """`from_users` for a DataFrame: the same buckets and order as adding its rows one by one."""
+        import pandas as pd
+
+        index = cls(as_of)
+        users = users.drop_duplicates('user_pseudo_id', keep='last')  # add() moves a repeated user
+        if not len(users):
+            return index
+        levels = users['current_village_level'].to_numpy(dtype=np.float64, na_value=np.nan)
+        last_active = pd.to_datetime(users['last_active_date'])
+        days = np.where(last_active.isna(), index._as_of,
+                        (last_active - pd.Timestamp(0)).dt.days.fillna(0).to_numpy(dtype=np.int64)
+                        + _EPOCH_ORDINAL)
+        keys = level_bands(np.where(levels == 0, 1, levels)).astype(np.int64) * _DAY_KEYS + days
+        bucket, unique_keys = pd.factorize(keys)  # Numbered in order of first appearance
+        order = np.argsort(bucket, kind='stable')
+        ids = users['user_pseudo_id'].to_numpy(dtype=object)[order]
+        sorted_bucket = bucket[order]
+        starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+        ends = np.r_[starts[1:], len(ids)]
+        position = np.arange(len(ids)) - np.repeat(starts, ends - starts)
+        index._keys = [(int(key // _DAY_KEYS), int(key % _DAY_KEYS)) for key in unique_keys]
+        index._buckets = {key: n for n, key in enumerate(index._keys)}
+        index._ids = [ids[lo:hi].tolist() for lo, hi in zip(starts, ends)]
+        index._positions = dict(zip(ids.tolist(), zip(sorted_bucket.tolist(), position.tolist())))
+        return index
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def set_date(self, as_of):
+        """Moves the day recency is measured from (e.g. at the start of each simulated day)."""
+        self._as_of = as_of.toordinal()
+        self._tables.clear()
+
+    def add(self, user_id, level, last_active):
+        """Adds a user, or moves one already in the index to its new level and last-active day."""
+        key = (bisect_right(_EDGES, level or 1), last_active.toordinal())
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = len(self._keys)
+            self._keys.append(key)
+            self._ids.append([])
+        current = self._positions.get(user_id)
+        if current is not None:
+            if current[0] == bucket:
+                return
+            self.remove(user_id)
+        self._positions[user_id] = (bucket, len(self._ids[bucket]))
+        self._ids[bucket].append(user_id)
+        self._tables.clear()
+
+    def remove(self, user_id):
+        """Drops a user (e.g. one who churned); unknown IDs are ignored."""
+        current = self._positions.pop(user_id, None)
+        if current is None:
+            return
+        bucket, pos = current
+        ids = self._ids[bucket]
+        last = ids.pop()
+        if pos < len(ids):
+            # Move the last ID into the freed slot
+            ids[pos] = last
+            self._positions[last] = (bucket, pos)
+        self._tables.clear()
+
+    def _table(self, band, active_before):
+        """The alias table over buckets for attackers in `band` (None: any band, e.g. inviters)."""
+        cache_key = (band, active_before)
+        table = self._tables.get(cache_key)
+        if table is None:
+            keys = np.array(self._keys, dtype=np.int64).reshape(-1, 2)
+            sizes = np.array([len(ids) for ids in self._ids], dtype=np.float64)
+            age = np.maximum(self._as_of - keys[:, 1], 0)
+            weights = sizes * 0.5 ** (age / RECENCY_HALF_LIFE_DAYS)
+            if band is not None:
+                weights *= BAND_AFFINITY ** np.abs(keys[:, 0] - band)
+            if active_before is not None:
+                weights[keys[:, 1] >= active_before.toordinal()] = 0.0
+            if not weights.sum() > 0:
+                raise ValueError("No users to draw from")
+            prob, alias = alias_table(weights)
+            table = self._tables[cache_key] = (prob, alias, sizes)
+        return table
+
+    def draw(self, rng, n, levels=None, active_before=None):
+        """
+        `n` user IDs (with replacement) as an object array. With `levels`
+        (the attackers' village levels), each draw favours targets near that
+        level. With `active_before`, only users last active before that day
+        are drawn (e.g. inviters for today's installs).
+        """
+        out = np.empty(n, dtype=object)
+        if n == 0:
+            return out
+        if levels is None:
+            groups = [(None, np.arange(n))]
+        else:
+            bands = level_bands(levels)
+            groups = [(int(band), np.flatnonzero(bands == band)) for band in np.unique(bands)]
+        for band, where in groups:
+            prob, alias, sizes = self._table(band, active_before)
+            bucket = alias_draw(rng, prob, alias, len(where))
+            pos = (rng.random(len(where)) * sizes[bucket]).astype(np.int64)
+            out[where] = [self._ids[b][p] for b, p in zip(bucket.tolist(), pos.tolist())]
+        return out
@@ -0,0 +1,760 @@
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from event_buffer import EVENT_SCHEMA, EventBuffer
+
+# --- Local Storage ---
+# Writes events as date-partitioned Parquet files:
+#   <root>/event_date=YYYY-MM-DD/<part>.parquet
+# Every file is written to a staging name first and then atomically renamed,
+# so a crash never leaves a half-written partition file behind and
+# re-writing the same (date, part) simply replaces it.
+
+logger = logging.getLogger(__name__)
+
+# zstd files are ~20% smaller than the default snappy for our events, for a little more write time
+PARQUET_COMPRESSION = 'zstd'
+
+
+def atomic_write(path, write):
+    """
+    Calls `write(tmp_path)` and then atomically renames the temp file to
+    `path`, so readers see the old file or the new one, never a partial one.
+    The temp name is unique per process and thread.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_pickle(path, obj):
+    """Atomically pickles `obj` to `path` (used for run manifests and checkpoints)."""
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    atomic_write(path, write)
+
+
+def load_pickle(path):
+    """Returns the unpickled object at `path`, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class ParquetPartitionSink:
+    """
+    Event sink that writes each chunk to `<root>/event_date=<date>/<part>.parquet`.
+
+    Any object with the same `write(event_date, events, part)` method can be
+    used as a sink instead, where `events` is an EventBuffer or a DataFrame.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def partition_dir(self, event_date):
+        return os.path.join(self.root, f"event_date={pd.Timestamp(event_date):%Y-%m-%d}")
+
+    def write(self, event_date, events, part='part-0'):
+        import pyarrow.parquet as pq
+
+        # EventBuffers go straight to Arrow with a fixed schema, so every
+        # partition file has the same column types even if a column is all NULL
+        table = events.to_arrow() if hasattr(events, 'to_arrow') else events
+        path = os.path.join(self.partition_dir(event_date), f"{part}.parquet")
+        with metrics.span('storage.upload', backend='parquet') as span:
+            span.set(rows=len(table))
+            if isinstance(table, pd.DataFrame):
+                atomic_write(path, lambda tmp_path: table.to_parquet(
+                    tmp_path, index=False, compression=PARQUET_COMPRESSION))
+            else:
+                atomic_write(path, lambda tmp_path: pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION))
+        return path
+
+    def clear(self):
+        """Removes every partition under the root."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+# --- Storage Backends ---
+# Where the simulators' events end up. Every backend takes events as an
+# EventBuffer or a DataFrame and offers the same operations:
+#   replace_partition(event_date, events) - swap one day's events for new ones
+#   replace_all(events)                   - swap the whole table (the backfill)
+#   read(start_date, end_date, columns=None, categorical=())
+#                                         - the events of the days between the two dates;
+#                                           only `columns` if given, `categorical` ones as
+#                                           pandas categoricals
+#   fetch_returning_users(yesterday_str)  - the users who might return that day (a DataFrame of
+#                                           user_state.RETURNING_COLUMNS)
+# plus, for catching up several days at once (main.py's catch_up):
+#   replace_partitions([(event_date, events), ...]) - swap a run of days in one bulk write
+# and, for writing a day in chunks (main.py's CONCURRENT_IO mode):
+#   clear_partition(event_date)                 - drop one day's events
+#   append_partition(event_date, events, part)  - add a chunk to that day
+# and, for caching query results (result_cache.py):
+#   partition_versions(start_date, end_date)    - {'YYYY-MM-DD': version} of the stored days,
+#                                                 read from metadata only (no scan)
+# A partition's version changes whenever it is written. It is a content hash
+# or write timestamp, depending on what the backend can see cheaply.
+# The returning-user fetch never reads the day being regenerated, so it can
+# run while that partition is cleared. The local backends let the whole
+# pipeline run without cloud access.
+
+
+def _to_arrow(events):
+    import pyarrow as pa
+
+    with metrics.span('storage.to_arrow') as span:
+        span.set(rows=len(events))
+        if hasattr(events, 'to_arrow'):
+            return events.to_arrow()
+        return pa.Table.from_pandas(events, preserve_index=False)
+
+
+def _to_frame(events):
+    """Events as a DataFrame in the external schema: categorical columns are decoded to plain strings."""
+    with metrics.span('storage.to_frame') as span:
+        span.set(rows=len(events))
+        frame = events.to_frame() if hasattr(events, 'to_frame') else events
+        return frame.astype({col: object for col, dtype in frame.dtypes.items()
+                             if isinstance(dtype, pd.CategoricalDtype)})
+
+
+def _empty_events(columns=None):
+    empty = EventBuffer(list(EVENT_SCHEMA), capacity=1).to_frame()
+    return empty[columns] if columns is not None else empty
+
+
+def _projected(frame, columns=None, categorical=()):
+    """`read`'s `columns` and `categorical` applied to a frame a backend read whole."""
+    if columns is not None:
+        frame = frame[columns]
+    return frame.astype({col: 'category' for col in categorical}) if categorical else frame
+
+
+def _select_list(columns=None):
+    return ', '.join(EVENT_SCHEMA if columns is None else columns)
+
+
+def _split_by_date(table):
+    """Yields `(date, rows of that date)` for an Arrow table of events."""
+    days = table.column('event_timestamp').to_numpy().astype('datetime64[D]')
+    order = np.argsort(days, kind='stable')
+    unique_days, starts = np.unique(days[order], return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    for day, lo, hi in zip(unique_days, starts, bounds):
+        yield pd.Timestamp(day), table.take(order[lo:hi])
+
+
+def _returning_users_from_events(backend, yesterday_str):
+    """The `fetch_returning_users` query in pandas, for backends that hold raw events locally."""
+    import user_state
+
+    day = pd.Timestamp(yesterday_str)
+    # Up to the day before: that day's partition is the one being regenerated
+    events = backend.read(start_date=day - pd.Timedelta(days=user_state.RETURNING_WINDOW_DAYS),
+                          end_date=day - pd.Timedelta(days=1))
+    return user_state.returning_users(user_state.summarize_events(events), day)
+
+
+class LocalParquetBackend(ParquetPartitionSink):
+    """
+    Events as date-partitioned Parquet files under `root`. A partition is
+    replaced by writing the complete new `event_date=<date>` directory under
+    a hidden staging name, then renaming it into place: the old directory is
+    renamed aside first (POSIX cannot rename over a non-empty directory), so
+    readers see the old day or the new one, only ever missing it between the
+    two renames, never a half-written day.
+    """
+
+    def _staging_dir(self, event_date, kind):
+        name = os.path.basename(self.partition_dir(event_date))
+        return os.path.join(self.root, f".{kind}-{name}-{os.getpid()}-{threading.get_ident()}")
+
+    def _stage(self, event_date, events, part='part-0'):
+        """Writes the day's events as a complete partition directory under a staging name; returns that directory."""
+        staged = self._staging_dir(event_date, 'staging')
+        shutil.rmtree(staged, ignore_errors=True)
+        ParquetPartitionSink(staged).write(event_date, events, part=part)
+        return ParquetPartitionSink(staged).partition_dir(event_date)
+
+    def _swap_in(self, event_date, staged):
+        """Renames the staged directory over the day's partition."""
+        partition_dir = self.partition_dir(event_date)
+        retired = self._staging_dir(event_date, 'retired')
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.isdir(partition_dir):
+            os.replace(partition_dir, retired)
+        os.replace(staged, partition_dir)
+        shutil.rmtree(os.path.dirname(staged), ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+        return partition_dir
+
+    def replace_partition(self, event_date, events, part='part-0'):
+        staged = self._stage(event_date, events, part=part)
+        return os.path.join(self._swap_in(event_date, staged), f"{part}.parquet")
+
+    def replace_partitions(self, partitions):
+        for event_date, events in partitions:
+            self.replace_partition(event_date, events)
+
+    def clear_partition(self, event_date):
+        partition_dir = self.partition_dir(event_date)
+        if os.path.isdir(partition_dir):
+            for name in os.listdir(partition_dir):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(partition_dir, name))
+
+    def append_partition(self, event_date, events, part):
+        return self.write(event_date, events, part=part)
+
+    def replace_all(self, events):
+        # Every new day is staged before any is swapped in, and the days the new
+        # events do not cover are dropped last, so the table is never empty
+        staged = [(event_date, self._stage(event_date, rows))
+                  for event_date, rows in _split_by_date(_to_arrow(events))]
+        kept = {os.path.basename(self._swap_in(event_date, path)) for event_date, path in staged}
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.startswith('event_date=') and name not in kept:
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def files(self, start_date=None, end_date=None):
+        """Paths of the part files in the partitions between the two dates (inclusive)."""
+        if not os.path.isdir(self.root):
+            return []
+        lo = f"event_date={pd.Timestamp(start_date):%Y-%m-%d}" if start_date is not None else ''
+        hi = f"event_date={pd.Timestamp(end_date):%Y-%m-%d}" if end_date is not None else '~'
+        paths = []
+        for partition in sorted(os.listdir(self.root)):
+            if not partition.startswith('event_date=') or not lo <= partition <= hi:
+                continue
+            partition_dir = os.path.join(self.root, partition)
+            paths.extend(os.path.join(partition_dir, name)
+                         for name in sorted(os.listdir(partition_dir)) if name.endswith('.parquet'))
+        return paths
+
+    def partition_versions(self, start_date=None, end_date=None):
+        """{date: version} of the partitions between the two dates: a hash of each one's part file names, sizes and mtimes."""
+        hashes = {}
+        for path in self.files(start_date, end_date):
+            day = os.path.basename(os.path.dirname(path))[len('event_date='):]
+            stat = os.stat(path)
+            hashes.setdefault(day, hashlib.sha1()).update(
+                f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return {day: digest.hexdigest() for day, digest in hashes.items()}
+
+    def read(self, start_date=None, end_date=None, columns=None, categorical=()):
+        """
+        Every event in the partitions between the two dates (inclusive), as one DataFrame.
+        Only `columns` are read if given; `categorical` columns come back as
+        pandas categoricals straight from the Parquet dictionary pages.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        paths = self.files(start_date, end_date)
+        if not paths:
+            return _projected(_empty_events(columns), categorical=categorical)
+        tables = [pq.read_table(path, columns=columns, read_dictionary=list(categorical) or None)
+                  for path in paths]
+        if len(tables) == 1:
+            return tables[0].to_pandas()
+        if not categorical:
+            return pd.concat([t.to_pandas() for t in tables], ignore_index=True)
+        # Partitions can differ in columns (the backfill has no persona), so line them up first
+        return pa.concat_tables(tables, promote_options='default').unify_dictionaries().to_pandas()
+
+    def fetch_returning_users(self, yesterday_str):
+        return _returning_users_from_events(self, yesterday_str)
+
+
+class DuckDBBackend:
+    """
+    Events in one DuckDB table with an `event_date` partition column, like
+    the Parquet layout (events that spill past midnight stay in the day they
+    were written with). A partition is replaced inside a single transaction,
+    so readers see either the old day or the new one. The same transaction
+    stamps the day's write time in the `<table>_versions` side table. One
+    connection is shared by all threads, so every statement holds the backend's lock.
+    """
+
+    SQL_TYPES = {'datetime64[ns]': 'TIMESTAMP', 'string': 'VARCHAR', 'Int64': 'BIGINT', 'float64': 'DOUBLE'}
+
+    def __init__(self, path, table='events'):
+        import duckdb  # Optional: only needed for this backend
+
+        self.table = table
+        self.versions_table = f"{table}_versions"
+        self.lock = threading.RLock()
+        self.conn = duckdb.connect(path)
+        columns = ', '.join(f"{col} {self.SQL_TYPES[kind]}" for col, kind in EVENT_SCHEMA.items())
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (event_date DATE, {columns})")
+        has_versions = self.conn.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                                         [self.versions_table]).fetchone()[0]
+        if not has_versions:
+            self.conn.execute(f"CREATE TABLE {self.versions_table} (event_date DATE PRIMARY KEY, version BIGINT)")
+            # Days written before the table existed get a version once, from one scan
+            self.conn.execute(f"INSERT INTO {self.versions_table} SELECT DISTINCT event_date, ? FROM {table}",
+                              [time.time_ns()])
+
+    def _swap(self, delete_query, params, partitions, touched=()):
+        """
+        In one transaction: runs `delete_query` (if any), then inserts each
+        (date, Arrow table) partition. The `touched` dates and the inserted
+        ones get a new version; `touched=None` drops every other version too.
+        """
+        with self.lock:
+            self._swap_locked(delete_query, params, partitions, touched)
+
+    def _swap_locked(self, delete_query, params, partitions, touched=()):
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            if delete_query is not None:
+                with metrics.span('storage.delete_partition', backend='duckdb'):
+                    self.conn.execute(delete_query, params)
+            if touched is None:
+                self.conn.execute(f"DELETE FROM {self.versions_table}")
+            written = [f"{pd.Timestamp(event_date):%Y-%m-%d}" for event_date in touched or ()]
+            for event_date, rows in partitions:
+                with metrics.span('storage.upload', backend='duckdb') as span:
+                    span.set(rows=rows.num_rows)
+                    self.conn.register('_incoming', rows)
+                    self.conn.execute(f"INSERT INTO {self.table} BY NAME "
+                                      f"SELECT CAST(? AS DATE) AS event_date, * FROM _incoming",
+                                      [f"{event_date:%Y-%m-%d}"])
+                    self.conn.unregister('_incoming')
+                written.append(f"{event_date:%Y-%m-%d}")
+            version = time.time_ns()
+            self.conn.executemany(f"INSERT OR REPLACE INTO {self.versions_table} VALUES (CAST(? AS DATE), ?)",
+                                  [[day, version] for day in sorted(set(written))])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def replace_partition(self, event_date, events):
+        event_date = pd.Timestamp(event_date)
+        self._swap(f"DELETE FROM {self.table} WHERE event_date = CAST(? AS DATE)",
+                   [f"{event_date:%Y-%m-%d}"], [(event_date, _to_arrow(events))])
+
+    def replace_all(self, events):
+        self._swap(f"DELETE FROM {self.table}", [], _split_by_date(_to_arrow(events)), touched=None)
+
+    def replace_partitions(self, partitions):
+        partitions = [(pd.Timestamp(event_date), _to_arrow(events)) for event_date, events in partitions]
+        dates = [f"{event_date:%Y-%m-%d}" for event_date, _ in partitions]
+        placeholders = ', '.join(['CAST(? AS DATE)'] * len(dates))
+        self._swap(f"DELETE FROM {self.table} WHERE event_date IN ({placeholders})", dates, partitions)
+
+    def clear_partition(self, event_date):
+        self._swap(f"DELETE FROM {self.table} WHERE event_date = CAST(? AS DATE)",
+                   [f"{pd.Timestamp(event_date):%Y-%m-%d}"], [], touched=[event_date])
+
+    def append_partition(self, event_date, events, part=None):
+        self._swap(None, [], [(pd.Timestamp(event_date), _to_arrow(events))])
+
+    def partition_versions(self, start_date=None, end_date=None):
+        """{date: write time in ns} of the partitions between the two dates, from the versions table."""
+        start = f"{pd.Timestamp(start_date):%Y-%m-%d}" if start_date is not None else '0001-01-01'
+        end = f"{pd.Timestamp(end_date):%Y-%m-%d}" if end_date is not None else '9999-12-31'
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT strftime(event_date, '%Y-%m-%d'), version FROM {self.versions_table} "
+                f"WHERE event_date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)", [start, end]).fetchall()
+        return dict(rows)
+
+    def read(self, start_date=None, end_date=None, columns=None, categorical=()):
+        """
+        Every event in the partitions between the two dates (inclusive), as one DataFrame.
+        Only `columns` are returned if given; `categorical` columns come back as
+        pandas categoricals.
+        """
+        start = f"{pd.Timestamp(start_date):%Y-%m-%d}" if start_date is not None else '0001-01-01'
+        end = f"{pd.Timestamp(end_date):%Y-%m-%d}" if end_date is not None else '9999-12-31'
+        with self.lock:
+            frame = self.conn.execute(
+                f"SELECT {_select_list(columns)} FROM {self.table} "
+                f"WHERE event_date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)", [start, end]).df()
+        return _projected(frame, categorical=categorical)
+
+    def fetch_returning_users(self, yesterday_str):
+        return _returning_users_from_events(self, yesterday_str)
+
+
+class MemoryBackend:
+    """
+    Events held in this process as one Arrow table per partition, for tests
+    and benchmarks. Backends opened with the same `name` share their data,
+    like connections to one database. Each write stamps its days with the
+    next number of a process-wide counter: their partition versions.
+    """
+
+    _stores = {}
+    _versions = {}
+    _writes = itertools.count(1)
+
+    def __init__(self, name='default'):
+        self.partitions = MemoryBackend._stores.setdefault(name, {})
+        self.versions = MemoryBackend._versions.setdefault(name, {})
+
+    def __len__(self):
+        return sum(table.num_rows for table in self.partitions.values())
+
+    def _stamp(self, day):
+        self.versions[day] = next(MemoryBackend._writes)
+
+    def replace_partition(self, event_date, events):
+        day = pd.Timestamp(event_date).normalize()
+        self.partitions[day] = _to_arrow(events)
+        self._stamp(day)
+
+    def replace_all(self, events):
+        self.partitions.clear()
+        self.partitions.update(_split_by_date(_to_arrow(events)))
+        self.versions.clear()
+        for day in self.partitions:
+            self._stamp(day)
+
+    def replace_partitions(self, partitions):
+        for event_date, events in partitions:
+            self.replace_partition(event_date, events)
+
+    def clear_partition(self, event_date):
+        day = pd.Timestamp(event_date).normalize()
+        self.partitions.pop(day, None)
+        self._stamp(day)
+
+    def append_partition(self, event_date, events, part=None):
+        import pyarrow as pa
+
+        day = pd.Timestamp(event_date).normalize()
+        tables = [t for t in (self.partitions.get(day), _to_arrow(events)) if t is not None]
+        self.partitions[day] = pa.concat_tables(tables, promote_options='default')
+        self._stamp(day)
+
+    def partition_versions(self, start_date=None, end_date=None):
+        """{date: write number} of the partitions between the two dates (writes through this class only)."""
+        start = pd.Timestamp(start_date).normalize() if start_date is not None else pd.Timestamp.min
+        end = pd.Timestamp(end_date).normalize() if end_date is not None else pd.Timestamp.max
+        return {f"{day:%Y-%m-%d}": self.versions.get(day, 0)
+                for day in sorted(self.partitions) if start <= day <= end}
+
+    def read(self, start_date=None, end_date=None, columns=None, categorical=()):
+        """
+        Every event in the partitions between the two dates (inclusive), as one DataFrame.
+        Only `columns` are returned if given; `categorical` columns come back as
+        pandas categoricals.
+        """
+        import pyarrow as pa
+
+        start = pd.Timestamp(start_date).normalize() if start_date is not None else pd.Timestamp.min
+        end = pd.Timestamp(end_date).normalize() if end_date is not None else pd.Timestamp.max
+        tables = [table for day, table in sorted(self.partitions.items()) if start <= day <= end]
+        if not tables:
+            return _projected(_empty_events(columns), categorical=categorical)
+        # Partitions can differ in columns (the backfill has no persona), so line them up first
+        table = pa.concat_tables(tables, promote_options='default')
+        return _projected((table.select(columns) if columns is not None else table).to_pandas(),
+                          categorical=categorical)
+
+    def fetch_returning_users(self, yesterday_str):
+        return _returning_users_from_events(self, yesterday_str)
+
+
+class BigQueryBackend:
+    """The original target: the partitioned `events` table in BigQuery, written with pandas_gbq."""
+
+    def __init__(self, project_id, table_id, client=None, progress_bar=False):
+        self.project_id = project_id
+        self.table_id = table_id
+        self.progress_bar = progress_bar
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import bigquery
+            self._client = bigquery.Client(project=self.project_id)
+        return self._client
+
+    def _append(self, events):
+        import pandas_gbq
+
+        frame = _to_frame(events)
+        with metrics.span('storage.upload', backend='bigquery') as span:
+            span.set(rows=len(frame))
+            pandas_gbq.to_gbq(
+                frame,
+                self.table_id,
+                project_id=self.project_id,
+                if_exists='append',
+                chunksize=50000,
+                progress_bar=self.progress_bar
+            )
+
+    def _load(self, frame, destination, write_disposition, **config):
+        """
+        One load job of `frame` into `destination` (the table, or one
+        `table$YYYYMMDD` partition); `config` goes to the LoadJobConfig.
+        """
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(write_disposition=write_disposition, **config)
+        with metrics.span('storage.upload', backend='bigquery') as span:
+            span.set(rows=len(frame))
+            self.client.load_table_from_dataframe(frame, destination, job_config=job_config).result()
+
+    def replace_partition(self, event_date, events):
+        self.replace_partitions([(event_date, events)])
+
+    def replace_partitions(self, partitions):
+        """
+        One WRITE_TRUNCATE load per day into its `table$YYYYMMDD` partition, so
+        BigQuery swaps each day atomically (no DELETE-then-append window). The
+        table is partitioned on DATE(event_timestamp), so a day's sessions can
+        spill past midnight into the next partition. When that day is not
+        being replaced too, it is rewritten with its own rows, minus the
+        sessions of the replaced day's previous run, plus the new spill, so a
+        re-run never duplicates them.
+        """
+        frame = pd.concat([_to_frame(events) for _, events in partitions], ignore_index=True)
+        replaced = {f"{pd.Timestamp(event_date):%Y%m%d}" for event_date, _ in partitions}
+        days = frame['event_timestamp'].dt.strftime('%Y%m%d')
+        # Read before any load: the previous run's sessions are those in the partition being replaced
+        next_days = {f"{pd.Timestamp(day) + pd.Timedelta(days=1):%Y%m%d}": day for day in replaced}
+        kept = {day: self._rows_without_sessions_of(day, previous)
+                for day, previous in next_days.items() if day not in replaced}
+        for day in sorted(replaced | set(days.unique()) | set(kept)):
+            rows = frame[days == day]
+            if day in kept:
+                rows = pd.concat([kept[day], rows], ignore_index=True)
+                if rows.empty:
+                    self.clear_partition(pd.Timestamp(day))
+                    continue
+            self._load(rows, f"{self.table_id}${day}", 'WRITE_TRUNCATE')
+        logger.warning(f"Successfully replaced {len(replaced)} partitions.")
+
+    def _rows_without_sessions_of(self, day, previous):
+        """
+        The events of partition `day` (YYYYMMDD) that aren't in a session also
+        found in partition `previous`, with naive timestamps as loads take them.
+        """
+        query = f"""
+        SELECT {_select_list()} FROM `{self.table_id}`
+        WHERE DATE(event_timestamp) = PARSE_DATE('%Y%m%d', '{day}')
+          AND (session_id IS NULL OR session_id NOT IN (
+            SELECT DISTINCT session_id FROM `{self.table_id}`
+            WHERE DATE(event_timestamp) = PARSE_DATE('%Y%m%d', '{previous}') AND session_id IS NOT NULL))
+        """
+        rows = self.client.query(query).to_dataframe()
+        if isinstance(rows['event_timestamp'].dtype, pd.DatetimeTZDtype):
+            rows['event_timestamp'] = rows['event_timestamp'].dt.tz_convert(None)
+        return rows
+
+    def clear_partition(self, event_date):
+        delete_query = f"DELETE FROM `{self.table_id}` WHERE DATE(event_timestamp) = '{pd.Timestamp(event_date):%Y-%m-%d}'"
+        with metrics.span('storage.delete_partition', backend='bigquery'):
+            self.client.query(delete_query).result()
+        logger.warning(f"Successfully cleared partition for {pd.Timestamp(event_date):%Y-%m-%d}.")
+
+    def append_partition(self, event_date, events, part=None):
+        self._append(events)
+
+    def replace_all(self, events):
+        """
+        One WRITE_TRUNCATE load of the whole table: readers see the old table
+        until the job commits. The table stays partitioned by day on
+        `event_timestamp`, as the partition loads and reads expect.
+        """
+        from google.cloud import bigquery
+
+        logger.warning(f"Replacing all existing data in {self.table_id}...")
+        partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field='event_timestamp')
+        self._load(_to_frame(events), self.table_id, 'WRITE_TRUNCATE', time_partitioning=partitioning)
+
+    def read(self, start_date=None, end_date=None, columns=None, categorical=()):
+        """
+        Every event dated between the two dates (inclusive), as one DataFrame.
+        Only `columns` are returned if given; `categorical` columns come back as
+        pandas categoricals.
+        """
+        conditions = ["TRUE"]
+        if start_date is not None:
+            conditions.append(f"DATE(event_timestamp) >= '{pd.Timestamp(start_date):%Y-%m-%d}'")
+        if end_date is not None:
+            conditions.append(f"DATE(event_timestamp) <= '{pd.Timestamp(end_date):%Y-%m-%d}'")
+        select = '*' if columns is None else _select_list(columns)
+        query = f"SELECT {select} FROM `{self.table_id}` WHERE {' AND '.join(conditions)}"
+        return _projected(self.client.query(query).to_dataframe(), categorical=categorical)
+
+    def partition_versions(self, start_date=None, end_date=None):
+        """
+        {date: last modified time in µs} of the daily partitions between the
+        two dates, from INFORMATION_SCHEMA.PARTITIONS (a metadata query, no
+        scan). An unpartitioned table has one version for all dates, under '*'.
+        """
+        dataset, table = self.table_id.rsplit('.', 1)
+        query = f"""
+        SELECT partition_id, UNIX_MICROS(last_modified_time) AS version
+        FROM `{self.project_id}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+        WHERE table_name = '{table}'
+        """
+        rows = list(self.client.query(query).result())
+        lo = f"{pd.Timestamp(start_date):%Y%m%d}" if start_date is not None else ''
+        hi = f"{pd.Timestamp(end_date):%Y%m%d}" if end_date is not None else '~'
+        daily = {row['partition_id']: row['version'] for row in rows
+                 if row['partition_id'] and row['partition_id'].isdigit()}
+        if not daily:
+            return {'*': max((row['version'] for row in rows), default=0)}
+        return {f"{pid[:4]}-{pid[4:6]}-{pid[6:]}": version for pid, version in sorted(daily.items()) if lo <= pid <= hi}
+
+    def fetch_returning_users(self, yesterday_str):
+        """
+        Queries BQ to get a list of active users who might return.
+        NOTE: This query scans the last 30 days. On a large dataset,
+        this can be slow/expensive without proper partitioning.
+        """
+        from google.cloud import bigquery
+
+        query = f"""
+        WITH LatestUserData AS (
+          SELECT
+            user_pseudo_id,
+            DATE(MIN(event_timestamp)) AS install_date,
+            -- Use ARRAY_AGG to get the most recent non-null values
+            ARRAY_AGG(persona IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as persona,
+            ARRAY_AGG(current_village_level IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as current_village_level,
+            ARRAY_AGG(platform IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as platform,
+            ARRAY_AGG(country IGNORE NULLS ORDER BY event_timestamp DESC LIMIT 1)[OFFSET(0)] as country,
+            MAX(DATE(event_timestamp)) as last_active_date
+          FROM
+            `{self.table_id}`
+          WHERE
+            -- Scan the last 30 days for active users (not yesterday itself: that is the partition being regenerated)
+            DATE(event_timestamp) >= DATE_SUB(PARSE_DATE('%Y-%m-%d', @yesterday), INTERVAL 30 DAY)
+            AND DATE(event_timestamp) < PARSE_DATE('%Y-%m-%d', @yesterday)
+          GROUP BY
+            1
+        )
+        SELECT
+          *,
+          DATE_DIFF(PARSE_DATE('%Y-%m-%d', @yesterday), install_date, DAY) AS user_age_days
+        FROM
+          LatestUserData
+        WHERE
+          -- Only get users who installed *before* yesterday
+          install_date < PARSE_DATE('%Y-%m-%d', @yesterday)
+          -- And who were active recently (e.g., in the last 35 days)
+          -- This simulates natural churn.
+          AND DATE_DIFF(PARSE_DATE('%Y-%m-%d', @yesterday), last_active_date, DAY) < 35
+        """
+
+        # Set query parameters
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("yesterday", "STRING", yesterday_str),
+            ]
+        )
+
+        import user_state
+
+        try:
+            query_job = self.client.query(query, job_config=job_config)
+            results = query_job.result()
+            # Convert BQ rows to one column per field
+            users = pd.DataFrame.from_records([dict(row.items()) for row in results],
+                                              columns=user_state.RETURNING_COLUMNS)
+        except Exception as e:
+            logger.error(f"Failed to fetch returning users: {e}")
+            users = pd.DataFrame(columns=user_state.RETURNING_COLUMNS)
+        for col in user_state.DATE_COLUMNS:
+            users[col] = pd.to_datetime(users[col]).astype('datetime64[ns]')
+        return users
+
+
+class LatencyBackend:
+    """
+    A stand-in for a remote warehouse: wraps another backend and sleeps
+    before each call like a network round trip. A query or DELETE job waits
+    `query_seconds`. An upload waits `upload_seconds` plus `seconds_per_row`
+    for each row. Used to measure the handler's end-to-end latency locally.
+    """
+
+    def __init__(self, inner, query_seconds=0.5, upload_seconds=0.2, seconds_per_row=2e-6):
+        self.inner = inner
+        self.query_seconds = query_seconds
+        self.upload_seconds = upload_seconds
+        self.seconds_per_row = seconds_per_row
+
+    def _upload_wait(self, events):
+        time.sleep(self.upload_seconds + self.seconds_per_row * len(events))
+
+    def replace_partition(self, event_date, events):
+        time.sleep(self.query_seconds)
+        self._upload_wait(events)
+        return self.inner.replace_partition(event_date, events)
+
+    def replace_all(self, events):
+        time.sleep(self.query_seconds)
+        self._upload_wait(events)
+        return self.inner.replace_all(events)
+
+    def replace_partitions(self, partitions):
+        time.sleep(self.query_seconds)
+        time.sleep(self.upload_seconds + self.seconds_per_row * sum(len(events) for _, events in partitions))
+        return self.inner.replace_partitions(partitions)
+
+    def clear_partition(self, event_date):
+        time.sleep(self.query_seconds)
+        return self.inner.clear_partition(event_date)
+
+    def append_partition(self, event_date, events, part=None):
+        self._upload_wait(events)
+        return self.inner.append_partition(event_date, events, part)
+
+    def read(self, start_date=None, end_date=None, columns=None, categorical=()):
+        time.sleep(self.query_seconds)
+        return self.inner.read(start_date, end_date, columns, categorical)
+
+    def partition_versions(self, start_date=None, end_date=None):
+        time.sleep(self.query_seconds)
+        return self.inner.partition_versions(start_date, end_date)
+
+    def fetch_returning_users(self, yesterday_str):
+        time.sleep(self.query_seconds)
+        return self.inner.fetch_returning_users(yesterday_str)
+
+
+BACKENDS = ('bigquery', 'parquet', 'duckdb', 'memory')
+
+
+def open_backend(kind, path=None, project_id=None, table_id=None, progress_bar=False):
+    """Builds the backend named `kind` ('bigquery', 'parquet', 'duckdb' or 'memory', which uses `path` as its name)."""
+    if kind == 'bigquery':
+        return BigQueryBackend(project_id, table_id, progress_bar=progress_bar)
+    if kind == 'parquet':
+        return LocalParquetBackend(path)
+    if kind == 'duckdb':
+        return DuckDBBackend(path)
+    if kind == 'memory':
+        return MemoryBackend(path or 'default')
+    raise ValueError(f"Unknown storage backend {kind!r}, expected one of {BACKENDS}")
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The modules under test are flat scripts in daily_updater/, imported by name.
+# Shared inputs and references come from tests.helpers and tests.legacy (also used by the benchmarks)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def backfill_store(tmp_path_factory):
+    """A read-only LocalParquetBackend holding a seeded 300-user streaming backfill (no side outputs)."""
+    import generate_data
+    import storage
+
+    root = str(tmp_path_factory.mktemp('backfill'))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(generate_data, 'TOTAL_USERS', 300)
+        mp.setattr(generate_data, 'SEED', 7)
+        mp.setattr(generate_data, 'WORKERS', 1)
+        for name in ('USER_STATE_PATH', 'KPI_SUMMARY_PATH', 'RETENTION_PATH'):
+            mp.setattr(generate_data, name, None)
+        generate_data.stream_backfill(root)
+    return storage.LocalParquetBackend(root)
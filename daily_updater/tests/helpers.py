@@ -0,0 +1,248 @@
+"""
+Synthetic inputs and exact reference results shared by the tests and the
+benchmarks (which import them from here: the tests don't depend on benchmarks/).
+"""
+
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+
+
+# --- Synthetic users ---
+PERSONAS = ['Non-Payer', 'Low-Spender', 'High-Spender']
+COUNTRIES = ['US', 'IN', 'DE', 'GB', 'FR', 'IL', 'JP', 'BR']
+
+
+def make_users(n_users, persona=None, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'user_pseudo_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'persona': persona or rng.choices(PERSONAS, weights=[0.95, 0.04, 0.01])[0],
+        'country': rng.choice(COUNTRIES),
+        'platform': rng.choice(['iOS', 'Android']),
+        'current_village_level': 1,
+        'is_churned': False,
+        'sent_invites': 0
+    } for _ in range(n_users)]
+
+
+def session_plan(users, seed=0):
+    rng = random.Random(seed)
+    day = datetime(2025, 1, 1)
+    starts = [day + timedelta(hours=rng.randint(0, 23), minutes=rng.randint(0, 59)) for _ in users]
+    return users, starts
+
+
+def synthetic_state(n_users, day, seed=0, persona_probs=None):
+    """
+    A user-state frame of `n_users` installed up to 60 days before `day`, all
+    active in the last 30, with personas drawn from `persona_probs` (by
+    default main.PERSONA_DISTRIBUTION).
+    """
+    import main as daily
+    import user_state
+
+    rng = np.random.default_rng(seed)
+    day = pd.Timestamp(day).normalize()
+    age = rng.integers(1, 61, n_users)
+    lag = rng.integers(1, np.minimum(age, user_state.RETURNING_WINDOW_DAYS) + 1)
+    personas = list(daily.PERSONA_DISTRIBUTION)
+    countries = np.asarray(daily.COUNTRIES, dtype=object)
+    state = pd.DataFrame({
+        'user_pseudo_id': session_engine.random_uuid4s(rng, n_users),
+        'install_date': day - pd.to_timedelta(age, unit='D'),
+        'install_country': countries[rng.integers(0, len(countries), n_users)],
+        'install_source': np.asarray(daily.ATTRIBUTION_SOURCES, dtype=object)[
+            rng.choice(len(daily.ATTRIBUTION_SOURCES), n_users, p=[0.4, 0.25, 0.25, 0.1])],
+        'persona': np.asarray(personas, dtype=object)[
+            rng.choice(len(personas), n_users, p=persona_probs or list(daily.PERSONA_DISTRIBUTION.values()))],
+        'current_village_level': pd.array(rng.integers(1, 11, n_users), dtype='Int64'),
+        'last_active_date': day - pd.to_timedelta(lag, unit='D'),
+        'platform': np.asarray(daily.PLATFORMS, dtype=object)[rng.integers(0, len(daily.PLATFORMS), n_users)],
+    })
+    state['country'] = state['install_country']
+    return state[user_state.STATE_COLUMNS]
+
+
+def synthetic_experiment_users(n_users, lift=True, seed=0):
+    """
+    Per-user KPIs shaped like `experiments.user_metrics`, for `n_users` split
+    50/50: W1 retention 20% in control (22% treated with `lift`), Poisson
+    spins and raids per day, and 3% conversion.
+    """
+    import experiments
+
+    rng = np.random.default_rng(seed)
+    treated = rng.random(n_users) < 0.5
+    up = treated & lift
+    return pd.DataFrame({
+        'user_pseudo_id': [f"user-{i}" for i in range(n_users)],
+        'variant': np.where(treated, 'treatment', 'control'),
+        'country': np.array(COUNTRIES, dtype=object)[rng.integers(0, len(COUNTRIES), n_users)],
+        'persona': np.array(PERSONAS, dtype=object)[rng.choice(3, n_users, p=[0.95, 0.04, 0.01])],
+        'platform': np.array(['iOS', 'Android'], dtype=object)[rng.integers(0, 2, n_users)],
+        'retained_w1': (rng.random(n_users) < np.where(up, 0.22, 0.20)).astype(np.float64),
+        'daily_spins': rng.poisson(np.where(up, 42.0, 40.0)) / 1.0,
+        'daily_raids': rng.poisson(np.where(up, 9.6, 8.0)) / 1.0,
+        'converted': (rng.random(n_users) < np.where(up, 0.0315, 0.03)).astype(np.float64),
+    })[['user_pseudo_id', 'variant'] + experiments.SEGMENTS + list(experiments.METRICS)]
+
+
+# --- Tutorial tables ---
+# A synthetic tutorial table shaped like ppltx-ba-course.final_project.tutorial
+TUTORIAL_VERSIONS = {'1.0.0': 0.965, '1.1.0': 0.970, '1.2.0': 0.975, '1.3.0': 0.980}  # version -> pass rate per step
+TUTORIAL_STEP_MEDIAN_S = [0, 29, 21, 29, 40, 28, 27, 30, 25]
+
+
+def tutorial_chunks(n_rows, chunk_rows=1_000_000, seed=0):
+    """
+    Yields time-ordered chunks of a synthetic tutorial table, `n_rows` rows in
+    all: each user starts the tutorial at a random time of day, passes each step with
+    their version's rate, and takes a lognormal time per step. About 10% of
+    step events are repeated and 22% of the rows have no step, like the real table.
+    """
+    import tutorial_funnel
+
+    rng = np.random.default_rng(seed)
+    steps = np.array(tutorial_funnel.TUTORIAL_STEPS, dtype=object)
+    versions = np.array(list(TUTORIAL_VERSIONS), dtype=object)
+    pass_rate = np.array(list(TUTORIAL_VERSIONS.values()))
+    medians = np.array(TUTORIAL_STEP_MEDIAN_S, dtype=np.float64)
+    # About one chunk of users starts each day
+    block_users, block_ns = max(min(chunk_rows, n_rows) // 12, 1), 86_400 * 10**9
+    start, emitted, user_base = pd.Timestamp('2025-03-01').value, 0, 0
+    while emitted < n_rows:
+        version = rng.integers(0, len(versions), block_users)
+        reached = np.minimum(rng.geometric(1 - pass_rate[version]), len(steps))  # Steps 0 .. reached - 1
+        user = np.repeat(np.arange(block_users), reached)
+        step = np.arange(len(user)) - np.repeat(np.cumsum(reached) - reached, reached)
+        delay = np.where(step > 0, rng.lognormal(np.log(np.maximum(medians[step], 1)), 0.5), 0.0)
+        offset = np.cumsum(delay) - np.repeat(np.cumsum(np.bincount(user, delay, block_users)) -
+                                              np.bincount(user, delay, block_users), reached)
+        times = start + rng.integers(0, block_ns, block_users)[user] + (offset * 1e9).astype(np.int64)
+        repeat = rng.random(len(user)) < 0.1
+        user, step = np.r_[user, user[repeat]], np.r_[step, step[repeat]]
+        times = np.r_[times, times[repeat] + rng.integers(1, 5 * 10**9, repeat.sum())]
+        other = rng.integers(0, len(user), int(len(user) * 0.28))  # Rows without a step
+        user, times = np.r_[user, user[other]], np.r_[times, times[other] + rng.integers(1, 10**9, len(other))]
+        step = np.r_[step, np.full(len(other), -1)]
+        order = np.argsort(times, kind='stable')[:n_rows - emitted]
+        ids = np.array([f"{user_base + u:08x}" for u in range(block_users)], dtype=object)
+        yield pd.DataFrame({
+            'user_id': pd.Categorical.from_codes(user[order], categories=ids),
+            'step_name': pd.Categorical.from_codes(step[order], categories=steps),
+            'timestamp': pd.to_datetime(times[order]),
+            'app_version': pd.Categorical.from_codes(version[user[order]], categories=versions),
+        })
+        emitted += len(order)
+        start += block_ns
+        user_base += block_users
+
+
+# --- Exact references ---
+def exact_funnel(frame, steps):
+    """Distinct users per step and every user's step times, counted exactly with pandas."""
+    frame = frame[frame['step_name'].notna()]
+    users = frame.groupby('step_name', observed=False)['user_id'].nunique().reindex(steps).to_numpy()
+    first = frame.pivot_table(index='user_id', columns='step_name', values='timestamp', aggfunc='min',
+                              observed=True).reindex(columns=steps)
+    seconds = first.diff(axis=1).apply(lambda col: col.dt.total_seconds())
+    return users, seconds
+
+
+def exact_engagement(events, start, end, countries=None):
+    """DAU / WAU / MAU per day counted exactly from the events (what the sketches estimate)."""
+    import active_users
+
+    if countries is not None:
+        events = events[events['country'].isin(countries)]
+    pairs = pd.DataFrame({'day': events['event_timestamp'].dt.normalize(),
+                          'user': events['user_pseudo_id']}).drop_duplicates()
+    rows = []
+    for day in pd.date_range(start, end):
+        row = {'event_date': day}
+        for name, window in (('dau', 1), ('wau', active_users.WAU_DAYS), ('mau', active_users.MAU_DAYS)):
+            in_window = pairs['day'].between(day - pd.Timedelta(days=window - 1), day)
+            row[name] = pairs.loc[in_window, 'user'].nunique()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# main_kpis.sql in DuckDB's dialect (CAST(... AS DATE), date_diff), one entry per
+# query with the event columns it reads
+DUCKDB_KPI_QUERIES = {
+    'installs': (['event_timestamp', 'user_pseudo_id', 'attribution_source'], """
+        WITH installs_table AS (
+          SELECT user_pseudo_id, CAST(MIN(event_timestamp) AS DATE) AS install_dt FROM events GROUP BY 1),
+        user_first_attribution AS (
+          SELECT user_pseudo_id,
+                 FIRST_VALUE(attribution_source) OVER (PARTITION BY user_pseudo_id ORDER BY event_timestamp ASC)
+                   AS install_source
+          FROM events WHERE attribution_source IS NOT NULL),
+        unique_user_first_attribution AS (
+          SELECT user_pseudo_id, MIN(install_source) AS install_source FROM user_first_attribution GROUP BY 1)
+        SELECT a.install_dt, COUNT(a.user_pseudo_id) AS DI,
+               COUNT(CASE WHEN b.install_source = 'friend_invite' THEN user_pseudo_id END) AS viral_installs
+        FROM installs_table AS a JOIN unique_user_first_attribution AS b USING (user_pseudo_id)
+        GROUP BY 1 ORDER BY 1"""),
+    'retention': (['event_timestamp', 'user_pseudo_id'], """
+        WITH installs_table AS (
+          SELECT user_pseudo_id, CAST(MIN(event_timestamp) AS DATE) AS install_dt FROM events GROUP BY 1),
+        cohort_size_table AS (
+          SELECT install_dt, COUNT(user_pseudo_id) AS cohort_size FROM installs_table GROUP BY 1),
+        daily_active_users AS (
+          SELECT b.install_dt,
+                 date_diff('day', b.install_dt, CAST(a.event_timestamp AS DATE)) + 1 AS day_in_game,
+                 COUNT(DISTINCT a.user_pseudo_id) AS active_users
+          FROM events AS a JOIN installs_table AS b ON a.user_pseudo_id = b.user_pseudo_id
+          WHERE date_diff('day', b.install_dt, CAST(a.event_timestamp AS DATE)) + 1 IN (1,2,3,4,5,6,7,14,21,28)
+          GROUP BY 1, 2)
+        SELECT dau.install_dt, dau.day_in_game, ROUND(dau.active_users / cs.cohort_size, 2) AS retention_rate
+        FROM daily_active_users AS dau JOIN cohort_size_table AS cs USING (install_dt)
+        ORDER BY 1, 2"""),
+    'sessions_per_dau': (['event_timestamp', 'session_id', 'user_pseudo_id'], """
+        SELECT CAST(event_timestamp AS DATE) AS dt,
+               ROUND(COUNT(DISTINCT session_id) / COUNT(DISTINCT user_pseudo_id), 2) AS Avg_sessions_per_dau
+        FROM events GROUP BY 1 ORDER BY 1"""),
+    'core_actions_per_dau': (['event_timestamp', 'event_name', 'user_pseudo_id'], """
+        SELECT CAST(event_timestamp AS DATE) AS dt,
+               ROUND(COUNT(CASE WHEN event_name IN ('spin_action', 'attack_performed', 'raid_performed',
+                                                    'village_item_upgraded') THEN 1 END)
+                     / COUNT(DISTINCT user_pseudo_id), 2) AS Avg_core_actions_per_dau
+        FROM events GROUP BY 1 ORDER BY 1"""),
+    'avg_days_per_level': (['event_timestamp', 'user_pseudo_id', 'current_village_level'], """
+        WITH user_max_level AS (
+          SELECT user_pseudo_id, MAX(current_village_level) AS final_level FROM events GROUP BY 1),
+        user_progression_time AS (
+          SELECT user_pseudo_id, current_village_level, CAST(MIN(event_timestamp) AS DATE) AS level_up_dt
+          FROM events GROUP BY 1, 2),
+        user_progression_summary AS (
+          SELECT a.user_pseudo_id, b.final_level, MIN(level_up_dt) AS start_dt, MAX(level_up_dt) AS end_dt
+          FROM user_progression_time AS a JOIN user_max_level AS b USING (user_pseudo_id)
+          WHERE b.final_level > 1 GROUP BY 1, 2)
+        SELECT ROUND(SUM(date_diff('day', start_dt, end_dt) + 1) / SUM(final_level - 1), 2) AS avg_days_per_level
+        FROM user_progression_summary"""),
+    'daily_revenue': (['event_timestamp', 'price_usd', 'event_name', 'user_pseudo_id'], """
+        SELECT CAST(event_timestamp AS DATE) AS dt, SUM(price_usd) AS daily_revenue,
+               COUNT(DISTINCT CASE WHEN event_name = 'purchase_completed' THEN user_pseudo_id END) AS daily_depositors
+        FROM events GROUP BY 1 ORDER BY 1"""),
+    'revenue': (['event_timestamp', 'price_usd', 'event_name', 'user_pseudo_id'], """
+        SELECT CAST(event_timestamp AS DATE) AS dt, SUM(price_usd) AS daily_revenue,
+               COUNT(DISTINCT CASE WHEN event_name = 'purchase_completed' THEN user_pseudo_id END) AS daily_depositors,
+               ROUND(COUNT(DISTINCT CASE WHEN event_name = 'purchase_completed' THEN user_pseudo_id END)
+                     / COUNT(DISTINCT user_pseudo_id), 2) AS conversion_rate,
+               ROUND(SUM(price_usd) / COUNT(DISTINCT user_pseudo_id), 2) AS ARPDAU,
+               ROUND(SUM(price_usd)
+                     / COUNT(DISTINCT CASE WHEN event_name = 'purchase_completed' THEN user_pseudo_id END), 2) AS ARPPU
+        FROM events GROUP BY 1 ORDER BY 1"""),
+    'installs_by_country': (['event_timestamp', 'user_pseudo_id', 'country'], """
+        WITH installs_table AS (
+          SELECT user_pseudo_id, MIN(country) AS country, CAST(MIN(event_timestamp) AS DATE) AS install_dt
+          FROM events GROUP BY 1)
+        SELECT country, COUNT(install_dt) AS total_installs FROM installs_table GROUP BY 1"""),
+}
@@ -0,0 +1,198 @@
+"""
+Reference copies of the original per-event code (kept verbatim for
+comparison): the per-spin session loop, the full-scan day loop and the
+per-user return decision.
+"""
+
+import random
+import uuid
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import session_engine
+
+
+def legacy_create_event(user, session_id, name, timestamp, overrides={}):
+    event_row = {col: None for col in LEGACY_COLUMNS}
+    event_row.update({
+        'user_pseudo_id': user['user_pseudo_id'], 'session_id': session_id,
+        'platform': user['platform'], 'app_version': random.choice(list(session_engine.APP_VERSIONS)),
+        'country': user['country'], 'current_village_level': user['current_village_level'],
+        'event_timestamp': timestamp, 'event_name': name,
+        'persona': user.get('persona', 'Non-Payer')
+    })
+    event_row.update(overrides)
+    return event_row
+
+
+LEGACY_COLUMNS = [
+    'event_timestamp', 'user_pseudo_id', 'session_id', 'event_name', 'platform',
+    'app_version', 'country', 'current_village_level', 'spin_cost',
+    'spin_outcome_type', 'spin_outcome_value', 'item_cost', 'entry_point',
+    'product_id', 'price_usd',
+    'attack_target_id', 'raid_target_id', 'invite_method',
+    'attribution_source', 'inviter_user_id', 'persona'
+]
+
+
+def legacy_generate_session_events(user, session_timestamp, user_id_list):
+    create_event = legacy_create_event
+    PRODUCT_IDS = session_engine.PRODUCT_IDS
+    INVITE_METHODS = list(session_engine.INVITE_METHODS)
+    session_id = str(uuid.uuid4())
+    events_in_session = []
+    current_time = session_timestamp
+    current_time += timedelta(seconds=random.randint(5, 15))
+
+    num_spins = 0
+    if user['persona'] == 'Non-Payer':
+        num_spins = random.randint(10, 40)
+    elif user['persona'] == 'Low-Spender':
+        num_spins = random.randint(50, 100)
+    elif user['persona'] == 'High-Spender':
+        num_spins = random.randint(30, 70)
+
+    for _ in range(num_spins):
+        if len(events_in_session) > 500: break
+        spin_cost = random.choice([1, 3, 5, 10])
+        events_in_session.append(create_event(user, session_id, 'spin_action', current_time, {'spin_cost': spin_cost}))
+        current_time += timedelta(seconds=random.randint(2, 5))
+        outcome_type = random.choice(['coins', 'attack', 'raid', 'shield', 'free_spins'])
+        outcome_value = 1
+        if outcome_type == 'coins':
+            outcome_value = random.randint(1000, 100000) * spin_cost
+        elif outcome_type == 'free_spins':
+            outcome_value = random.choice([5, 10, 25])
+        events_in_session.append(create_event(user, session_id, 'spin_outcome_received', current_time,
+                                              {'spin_outcome_type': outcome_type, 'spin_outcome_value': outcome_value}))
+        current_time += timedelta(seconds=random.randint(1, 3))
+        if outcome_type == 'attack':
+            events_in_session.append(create_event(user, session_id, 'attack_performed', current_time,
+                                                  {'attack_target_id': random.choice(user_id_list)}))
+            current_time += timedelta(seconds=random.randint(10, 20))
+        if outcome_type == 'raid':
+            events_in_session.append(create_event(user, session_id, 'raid_performed', current_time,
+                                                  {'raid_target_id': random.choice(user_id_list)}))
+            current_time += timedelta(seconds=random.randint(10, 20))
+        if random.random() < 0.1:
+            cost = random.randint(50000, 500000) * user['current_village_level']
+            events_in_session.append(
+                create_event(user, session_id, 'village_item_upgraded', current_time, {'item_cost': cost}))
+            current_time += timedelta(seconds=random.randint(10, 30))
+
+    if user['persona'] != 'Non-Payer' and random.random() < 0.3:
+        events_in_session.append(create_event(user, session_id, 'leaderboard_viewed', current_time))
+        current_time += timedelta(seconds=random.randint(5, 15))
+    if user['persona'] != 'Non-Payer' and random.random() < 0.1:
+        method = random.choice(INVITE_METHODS)
+        events_in_session.append(
+            create_event(user, session_id, 'friend_invite_sent', current_time, {'invite_method': method}))
+        user['sent_invites'] += 1
+        current_time += timedelta(seconds=random.randint(10, 20))
+    if user['persona'] == 'Low-Spender' and random.random() < 0.05:
+        events_in_session.append(
+            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_spins_popup'}))
+        current_time += timedelta(seconds=random.randint(10, 30))
+        price = 4.99
+        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
+                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
+        current_time += timedelta(seconds=random.randint(5, 10))
+    if user['persona'] == 'High-Spender' and random.random() < 0.40:
+        events_in_session.append(
+            create_event(user, session_id, 'store_opened', current_time, {'entry_point': 'out_of_coins_popup'}))
+        current_time += timedelta(seconds=random.randint(5, 20))
+        price = random.choice([9.99, 19.99, 49.99])
+        events_in_session.append(create_event(user, session_id, 'purchase_completed', current_time,
+                                              {'product_id': PRODUCT_IDS[price], 'price_usd': price}))
+        current_time += timedelta(seconds=random.randint(5, 10))
+
+    if random.random() < (0.1 + (0.3 * (user['persona'] == 'High-Spender'))):
+        user['current_village_level'] += 1
+
+    events_in_session.append(create_event(user, session_id, 'app_close', current_time))
+    return events_in_session
+
+
+def legacy_sessions(session_users, session_starts, target_pool):
+    """Plays sessions through the original loop, app_open included, and builds the typed frame."""
+    events = []
+    for user, start in zip(session_users, session_starts):
+        events.append(legacy_create_event(user, str(uuid.uuid4()), 'app_open', start,
+                                          {'attribution_source': 'organic'}))
+        events.extend(legacy_generate_session_events(user, start, target_pool))
+    df = pd.DataFrame(events, columns=LEGACY_COLUMNS)
+    df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
+    for col in ('current_village_level', 'spin_cost', 'spin_outcome_value', 'item_cost'):
+        df[col] = df[col].astype('Int64')
+    df['price_usd'] = df['price_usd'].astype('float')
+    return df
+
+
+def legacy_scan_days(users, user_id_list, days, rng, simulate):
+    """The original full-scan day loop: every user and a rebuilt inviter list, every day."""
+    for day in days:
+        inviter_pool = [u['user_pseudo_id'] for u in users if u['sent_invites'] > 0 and not u['is_churned']]
+        if not inviter_pool:
+            inviter_pool = [user_id_list[rng.integers(len(user_id_list))]]
+        session_users = []
+        for user in users:
+            if user['install_date'] == day.date():
+                if rng.random() < 0.1:
+                    inviter_pool[rng.integers(len(inviter_pool))]
+                session_users.append(user)
+                user['last_played'] = day.date()
+                continue
+            if user['install_date'] > day.date() or user['is_churned']:
+                continue
+            days_since_install = (day.date() - user['install_date']).days
+            days_since_last_played = (day.date() - user['last_played']).days
+            if user['persona'] == 'Non-Payer':
+                if days_since_install > 7 and days_since_last_played > 3 and rng.random() < 0.2:
+                    user['is_churned'] = True
+                    continue
+                if days_since_install > 30 and days_since_last_played > 7 and rng.random() < 0.5:
+                    user['is_churned'] = True
+                    continue
+            play_chance = {'Non-Payer': 0.25, 'Low-Spender': 0.7, 'High-Spender': 0.9}[user['persona']]
+            if rng.random() < play_chance:
+                session_users.append(user)
+                user['last_played'] = day.date()
+        simulate(session_users)
+        yield day, session_users
+
+
+def legacy_returning_sessions(user_list, yesterday_date, rng, retention_curve):
+    """The original per-user return decision of simulate_returning_users (its curve passed in), up to the engine call."""
+    import main as daily
+
+    session_users = []
+    start_minutes = []
+    for user in user_list:
+        user_age = user['user_age_days']
+        persona = user['persona'] if user['persona'] else 'Non-Payer'
+        base_prob = retention_curve.get(user_age, 0.05)
+        retention_multiplier = 1.0
+        if persona == 'Low-Spender':
+            retention_multiplier = 1.2
+        elif persona == 'High-Spender':
+            retention_multiplier = 1.5
+        if rng.random() < base_prob * retention_multiplier:
+            user_state_dict = {
+                'user_pseudo_id': user['user_pseudo_id'],
+                'persona': persona,
+                'country': user.get('country') or daily.COUNTRIES[rng.integers(len(daily.COUNTRIES))],
+                'platform': user.get('platform') or daily.PLATFORMS[rng.integers(len(daily.PLATFORMS))],
+                'current_village_level': user.get('current_village_level') or 1,
+                'is_churned': False,
+                'sent_invites': 0
+            }
+            num_sessions = 1
+            if persona == 'Low-Spender': num_sessions = rng.integers(1, 3)
+            if persona == 'High-Spender': num_sessions = rng.integers(1, 4)
+            for i in range(num_sessions):
+                session_users.append(user_state_dict)
+                start_minutes.append(rng.integers(24 * 60))
+    session_starts = np.datetime64(yesterday_date, 'ns') + np.array(start_minutes, dtype='timedelta64[m]')
+    return session_users, session_starts
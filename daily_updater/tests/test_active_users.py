@@ -0,0 +1,25 @@
+import pandas as pd
+
+import active_users
+import hyperloglog
+import kpi_summary
+from tests.helpers import exact_engagement
+
+
+def test_sketched_engagement_is_within_the_sketch_error(backfill_store):
+    events = backfill_store.read()
+    days = sorted(backfill_store.partition_versions())
+    start, end = days[active_users.MAU_DAYS - 1], days[-1]
+    for precision in (hyperloglog.DEFAULT_PRECISION, hyperloglog.precision_for_error(0.05)):
+        summary = kpi_summary.full_rebuild(events, precision)
+        sigma = hyperloglog.standard_error(precision)
+        for countries in (None, ['US']):
+            exact = exact_engagement(events, start, end, countries)
+            estimate = active_users.engagement(summary, start, end, countries)
+            pd.testing.assert_series_equal(estimate['event_date'], exact['event_date'])
+            for name in ('dau', 'wau', 'mau'):
+                relative = estimate[name] / exact[name] - 1
+                assert (relative.abs() <= 4 * sigma).all(), (precision, countries, name, relative.abs().max())
+
+        relative = active_users.active_users(summary, days[0], days[-1]) / events['user_pseudo_id'].nunique() - 1
+        assert abs(relative) <= 4 * sigma
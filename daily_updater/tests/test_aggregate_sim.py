@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregate_sim
+import kpi_summary
+import main as daily
+import storage
+import user_state
+from tests.helpers import synthetic_state
+
+USERS = 4_000
+DAYS = 3
+EVENT_RUNS = 6
+REPLICATES = 300
+METRICS = ['dau', 'daily_installs', 'daily_viral_installs', 'avg_sessions_per_dau', 'total_spins_used',
+           'total_social_actions', 'paying_users', 'daily_revenue']
+
+
+def _totals(summary, purchases, revenue):
+    """
+    Each KPI summed over a run's (date, country) rows, sessions per DAU
+    weighted back to sessions, then purchases and revenue per persona.
+    """
+    summary = summary.astype({name: 'float64' for name in METRICS})
+    totals = summary[METRICS].sum()
+    totals['avg_sessions_per_dau'] = (summary['avg_sessions_per_dau'] * summary['dau']).sum()
+    for name, by_persona in (('purchases', purchases), ('revenue', revenue)):
+        by_persona = by_persona.reindex(aggregate_sim.PERSONAS, fill_value=0)
+        totals = pd.concat([totals, by_persona.rename(lambda persona: f"{name}[{persona}]").astype('float64')])
+    return totals
+
+
+@pytest.fixture
+def catch_up_env(monkeypatch, tmp_path):
+    """main.py catch-ups on an empty memory backend, starting from a snapshot with personas."""
+    path = f"test-aggregate-{tmp_path.name}"
+    store = storage.MemoryBackend(path)
+    monkeypatch.setattr(daily, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(daily, 'STORAGE_PATH', path)
+    monkeypatch.setattr(daily, 'USER_STATE_PATH', str(tmp_path / 'user_state.parquet'))
+    for name in ('KPI_SUMMARY_PATH', 'RETENTION_PATH', 'RAID_LEAGUE_PATH', 'RESULT_CACHE_PATH',
+                 'AGGREGATE_SIMULATION_PATH', 'EXPERIMENT'):
+        monkeypatch.setattr(daily, name, None)
+    monkeypatch.setattr(daily, 'CONCURRENT_IO', False)
+    monkeypatch.setitem(daily._backends, ('memory', path), store)
+    yield store
+    store.partitions.clear()
+
+
+def test_aggregate_simulation_matches_per_event_catch_ups(catch_up_env, monkeypatch):
+    last = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    first = last - pd.Timedelta(days=DAYS - 1)
+    days = pd.date_range(first, last)
+    # A third of the users per persona, so that purchases aren't rare
+    state = synthetic_state(USERS, first, seed=3, persona_probs=[1 / 3] * 3)
+
+    event_totals, prices = [], []
+    for seed in range(EVENT_RUNS):
+        catch_up_env.partitions.clear()
+        user_state.open_store(daily.USER_STATE_PATH).replace(state)
+        monkeypatch.setattr(daily, 'SIMULATION_SEED', seed)
+        _, status = daily.catch_up(f"{first:%Y-%m-%d}", f"{last:%Y-%m-%d}")
+        assert status == 200
+        events = catch_up_env.read(first, last)
+        rows = kpi_summary.refresh(kpi_summary.empty_summary(), events,
+                                   user_state.open_store(daily.USER_STATE_PATH).load(), days)
+        bought = events[events['event_name'] == 'purchase_completed']
+        prices.append(bought[['persona', 'price_usd']])
+        by_persona = bought.groupby('persona')
+        event_totals.append(_totals(rows, by_persona.size(), by_persona['price_usd'].sum()))
+    event_totals = pd.DataFrame(event_totals)
+
+    rng = np.random.default_rng(0)
+    aggregate_totals = []
+    for _ in range(REPLICATES):
+        cells = aggregate_sim.simulate(aggregate_sim.Population.from_state(state, first, rng), DAYS, rng)
+        by_persona = cells.groupby('persona')
+        aggregate_totals.append(_totals(aggregate_sim.to_summary(cells), by_persona['purchases'].sum(),
+                                        by_persona['revenue'].sum()))
+    aggregate_totals = pd.DataFrame(aggregate_totals)
+
+    # The per-event mean against the aggregate mean, in standard errors of their
+    # difference; both paths share one distribution if the models agree
+    sd = aggregate_totals.std(ddof=1)
+    se = sd * np.sqrt(1 / EVENT_RUNS + 1 / REPLICATES)
+    z = (event_totals.mean() - aggregate_totals.mean()) / se
+    assert (sd.drop('purchases[Non-Payer]').drop('revenue[Non-Payer]') > 0).all()
+    assert (event_totals[['purchases[Non-Payer]', 'revenue[Non-Payer]']] == 0).all(axis=None)
+    assert (z.dropna().abs() < 4).all(), z.round(2).to_dict()
+
+    # The price per purchase, per paying persona: within 4 standard errors of the
+    # per-event prices (exactly, for the single low-spender price)
+    prices = pd.concat(prices).astype({'price_usd': 'float64'}).groupby('persona')['price_usd']
+    for persona in ('Low-Spender', 'High-Spender'):
+        event_prices = prices.get_group(persona)
+        aggregate_price = (aggregate_totals[f"revenue[{persona}]"].sum()
+                           / aggregate_totals[f"purchases[{persona}]"].sum())
+        tolerance = 4 * event_prices.std(ddof=1) / np.sqrt(len(event_prices)) + 1e-9
+        assert abs(event_prices.mean() - aggregate_price) <= tolerance, (persona, event_prices.mean(), aggregate_price)
@@ -0,0 +1,54 @@
+import logging
+
+import numpy as np
+import pytest
+
+import emitter
+
+
+@pytest.mark.parametrize('on_full,seconds_per_row', [('block', 0.0), ('drop', 5e-4)])
+def test_every_released_event_is_delivered_or_dropped(on_full, seconds_per_row):
+    logging.getLogger('emitter').setLevel(logging.WARNING)
+    sink = emitter.QueueSink(0.01, seconds_per_row)
+    run = emitter.Emitter(sink, 4000, max_pending_batches=1, on_full=on_full, seed=0)
+    summary = run.run(1.5)
+    assert summary['released_events'] > 0
+    assert sink.rows == summary['delivered_events']
+    assert summary['delivered_events'] + summary['dropped_events'] == summary['released_events']
+    if on_full == 'block':
+        assert summary['dropped_events'] == 0
+    else:
+        # The slow sink takes about 2,000 events/s
+        assert summary['dropped_events'] > 0
+
+
+def test_a_fast_sink_keeps_up_with_the_target_and_reports_it():
+    logging.getLogger('emitter').setLevel(logging.WARNING)
+    run = emitter.Emitter(emitter.QueueSink(), 4000, seed=1, report_seconds=0.5)
+    summary = run.run(3)
+    assert summary['target_events_per_second'] == pytest.approx(4000)
+    assert summary['events_per_second'] == pytest.approx(summary['target_events_per_second'], rel=0.2)
+    assert summary['dropped_events'] == 0 and summary['batches'] > 0
+    # Events go out within a batch timeout or so of coming due
+    assert 0 <= summary['lag_p50_seconds'] <= summary['lag_p99_seconds'] < 2 * emitter.MAX_LATENCY_SECONDS
+    assert len(run.reports) >= 4
+    # The first batch waits out the batch timeout, so the first window may have delivered nothing
+    for row in run.reports[1:]:
+        assert row['target_events_per_second'] == pytest.approx(4000)
+        assert row['events_per_second'] > 0 and row['lag_p99_seconds'] >= row['lag_p50_seconds'] >= 0
+
+
+def test_installs_retire_the_oldest_users_once_the_pool_is_full():
+    logging.getLogger('emitter').setLevel(logging.WARNING)
+    rng = np.random.default_rng(2)
+    users = emitter.synthetic_users(300, rng)
+    run = emitter.Emitter(emitter.QueueSink(), 4000, users=users, max_users=400, seed=rng)
+    summary = run.run(2)
+    assert summary['pool_users'] == 400 and summary['retired_users'] > 0
+    # The first installs past the cap replaced the starting pool's first users, in order
+    kept = {user['user_pseudo_id'] for user in run.users}
+    retired = [user['user_pseudo_id'] for user in users[:summary['retired_users']]]
+    assert not kept & set(retired)
+    assert {user['user_pseudo_id'] for user in users[summary['retired_users']:]} <= kept
+    # The target index holds the pool and nobody else
+    assert len(run.targets) == len(run.users) and all(user_id in run.targets for user_id in kept)
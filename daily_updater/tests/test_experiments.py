@@ -0,0 +1,32 @@
+import math
+
+import pytest
+
+import experiments
+from tests.helpers import synthetic_experiment_users
+
+
+def test_a_a_split_keeps_false_positives_near_alpha():
+    result = experiments.analyze(synthetic_experiment_users(40_000, lift=False, seed=1), n_resamples=400, seed=0)
+    assert len(result) > 40
+    assert result['significant'].mean() <= 0.1
+    covers = (result['ci_low'] <= 0) & (result['ci_high'] >= 0)
+    assert covers.mean() >= 0.9
+
+
+def test_lifts_are_found_overall():
+    result = experiments.analyze(synthetic_experiment_users(40_000, seed=2), n_resamples=400, seed=0)
+    overall = result[result['segment'] == 'all'].set_index('metric')
+    assert overall.loc[['retained_w1', 'daily_spins', 'daily_raids'], 'significant'].all()
+    assert (overall['ci_low'] <= overall['lift']).all() and (overall['lift'] <= overall['ci_high']).all()
+    assert overall.loc['daily_raids', 'relative_lift'] == pytest.approx(0.2, abs=0.02)
+
+
+def test_proportion_z_test_matches_the_write_up():
+    # W1 retention 20,000 vs. 22,000 of 100,000 users
+    z, p = experiments.proportion_z_test(20_000, 100_000, 22_000, 100_000, alternative='greater')
+    assert z == pytest.approx(0.02 / math.sqrt(0.21 * 0.79 * 2 / 100_000))
+    assert z == pytest.approx(10.98, abs=0.01)
+    assert p < 1e-20
+    _, two_sided = experiments.proportion_z_test(22_000, 100_000, 20_000, 100_000)
+    assert two_sided == pytest.approx(2 * p)
@@ -0,0 +1,190 @@
+import os
+import subprocess
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main as daily
+import raid_league
+import session_engine
+import storage
+import user_state
+from tests.helpers import synthetic_state
+
+# Imported only on the paths that need them (see main.py)
+LAZY_MODULES = [
+    'faker', 'tqdm', 'pandas_gbq', 'google.cloud.bigquery', 'duckdb',
+    'user_state', 'kpi_summary', 'retention', 'hyperloglog', 'raid_league', 'experiments',
+    'aggregate_sim', 'result_cache', 'concurrent.futures.process',
+]
+EVENT_ORDER = ['event_timestamp', 'event_name', 'user_pseudo_id']
+
+
+@pytest.fixture
+def handler_env(backfill_store, monkeypatch, tmp_path):
+    """
+    The handler on a memory backend seeded with the backfill, with a user
+    state snapshot and a Raid League. Half of the users were last active long
+    before the returning-user window.
+    """
+    events = backfill_store.read()
+    store = storage.MemoryBackend(f"test-main-{tmp_path.name}")
+    store.replace_all(events)
+    state = user_state.summarize_events(events)
+    stale = state.index % 2 == 0
+    for col in ('install_date', 'last_active_date'):
+        state.loc[stale, col] -= pd.Timedelta(days=90)
+    state_path = str(tmp_path / 'user_state.parquet')
+    user_state.open_store(state_path).replace(state)
+
+    monkeypatch.setattr(daily, 'STORAGE_BACKEND', 'memory')
+    monkeypatch.setattr(daily, 'STORAGE_PATH', f"test-main-{tmp_path.name}")
+    monkeypatch.setattr(daily, 'SIMULATION_SEED', 11)
+    monkeypatch.setattr(daily, 'USER_STATE_PATH', state_path)
+    monkeypatch.setattr(daily, 'RAID_LEAGUE_PATH', str(tmp_path / 'raid_league.pkl'))
+    for name in ('KPI_SUMMARY_PATH', 'RETENTION_PATH', 'RESULT_CACHE_PATH', 'AGGREGATE_SIMULATION_PATH', 'EXPERIMENT'):
+        monkeypatch.setattr(daily, name, None)
+    monkeypatch.setattr(daily, 'CONCURRENT_IO', False)
+    monkeypatch.setitem(daily._backends, ('memory', f"test-main-{tmp_path.name}"), store)
+    yield state
+    store.partitions.clear()
+
+
+def test_catch_up_builds_raid_league_divisions_from_the_handlers_population(handler_env, monkeypatch):
+    # With a league window wider than the returning-user window, the stale users
+    # would qualify if a path built its divisions from the whole state
+    monkeypatch.setattr(raid_league, 'LEAGUE_ACTIVE_DAYS', 120)
+    yesterday = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    returning = user_state.returning_users(handler_env, yesterday)
+    assert 0 < len(returning) < len(handler_env)
+
+    _, status = daily.handler(None)
+    assert status == 200
+    handler_league = raid_league.RaidLeague.load(daily.RAID_LEAGUE_PATH)
+
+    # The same day again as a one-day catch-up, from the same snapshot and no league
+    os.remove(daily.RAID_LEAGUE_PATH)
+    user_state.open_store(daily.USER_STATE_PATH).replace(handler_env)
+    _, status = daily.catch_up(f"{yesterday:%Y-%m-%d}", f"{yesterday:%Y-%m-%d}")
+    assert status == 200
+    catch_up_league = raid_league.RaidLeague.load(daily.RAID_LEAGUE_PATH)
+
+    assert len(handler_league) > 0
+    assert set(handler_league.players) <= set(returning['user_pseudo_id'])
+    assert list(catch_up_league.players) == list(handler_league.players)
+    pd.testing.assert_frame_equal(catch_up_league.standings(), handler_league.standings())
+
+
+@pytest.fixture
+def missed_days(handler_env):
+    """
+    The handler's store without its last 3 days, a snapshot of the users
+    before them and no Raid League: a run of missed days to catch up.
+    """
+    store = daily.get_backend()
+    last = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    first = last - pd.Timedelta(days=2)
+    for day in [day for day in store.partitions if day >= first]:
+        del store.partitions[day]
+    backfill = dict(store.partitions)
+    state = user_state.summarize_events(store.read())
+
+    def reset():
+        store.partitions.clear()
+        store.partitions.update(backfill)
+        user_state.open_store(daily.USER_STATE_PATH).replace(state)
+        if os.path.exists(daily.RAID_LEAGUE_PATH):
+            os.remove(daily.RAID_LEAGUE_PATH)
+    reset()
+    return store, first, last, reset
+
+
+def _written(store, first, last):
+    return store.read(first, last).sort_values(EVENT_ORDER, ignore_index=True)
+
+
+def test_catch_up_matches_one_run_per_missed_day(missed_days):
+    store, first, last, reset = missed_days
+    days = pd.date_range(first, last)
+    results = [daily.catch_up(f"{day:%Y-%m-%d}", f"{day:%Y-%m-%d}") for day in days]
+    assert all(status == 200 for _, status in results), results
+    one_per_day = (_written(store, first, last),
+                   user_state.open_store(daily.USER_STATE_PATH).load().sort_values('user_pseudo_id', ignore_index=True),
+                   raid_league.RaidLeague.load(daily.RAID_LEAGUE_PATH).standings())
+
+    reset()
+    _, status = daily.catch_up(f"{first:%Y-%m-%d}", f"{last:%Y-%m-%d}")
+    assert status == 200
+    events = _written(store, first, last)
+    pd.testing.assert_frame_equal(events, one_per_day[0])
+    pd.testing.assert_frame_equal(
+        user_state.open_store(daily.USER_STATE_PATH).load().sort_values('user_pseudo_id', ignore_index=True),
+        one_per_day[1])
+    pd.testing.assert_frame_equal(raid_league.RaidLeague.load(daily.RAID_LEAGUE_PATH).standings(), one_per_day[2])
+    assert len(one_per_day[2]) > 0
+
+    # Catching up to the day before yesterday, then the daily handler, writes the same yesterday
+    reset()
+    _, status = daily.catch_up(f"{first:%Y-%m-%d}", f"{last - pd.Timedelta(days=1):%Y-%m-%d}")
+    assert status == 200
+    _, status = daily.handler(None)
+    assert status == 200
+    pd.testing.assert_frame_equal(_written(store, last, last),
+                                  events[events['event_timestamp'] >= last].reset_index(drop=True))
+
+
+def test_concurrent_io_writes_the_same_day_as_sequential(handler_env, monkeypatch):
+    store = daily.get_backend()
+    backfill = dict(store.partitions)
+    yesterday = pd.Timestamp(datetime.now() - timedelta(days=1)).normalize()
+    written = []
+    for concurrent in (False, True):
+        # One chunk uses the same random streams as the sequential run
+        store.partitions.clear()
+        store.partitions.update(backfill)
+        user_state.open_store(daily.USER_STATE_PATH).replace(handler_env)
+        if os.path.exists(daily.RAID_LEAGUE_PATH):
+            os.remove(daily.RAID_LEAGUE_PATH)
+        monkeypatch.setattr(daily, 'CONCURRENT_IO', concurrent)
+        monkeypatch.setattr(daily, 'UPLOAD_CHUNKS', 1)
+        _, status = daily.handler(None)
+        assert status == 200
+        written.append(_written(store, yesterday, yesterday))
+    assert len(written[0]) > 0
+    pd.testing.assert_frame_equal(written[1], written[0])
+
+
+def test_returning_users_return_at_the_configured_rates():
+    day = date(2025, 3, 1)
+    users = user_state.returning_users(synthetic_state(200_000, day, seed=0), day)
+    session_users, _ = daily.returning_sessions(users, day, np.random.default_rng(1))
+    returned = users['user_pseudo_id'].isin({u['user_pseudo_id'] for u in session_users}).to_numpy()
+
+    # Every (age, persona) cell against main.RETURN_PROBS
+    ages = np.minimum(users['user_age_days'].to_numpy(), len(daily.RETURN_PROBS) - 1)
+    personas = pd.Categorical(users['persona'], categories=session_engine.PERSONAS).codes
+    cell = ages * len(session_engine.PERSONAS) + personas
+    n = np.bincount(cell, minlength=daily.RETURN_PROBS.size)
+    hits = np.bincount(cell, weights=returned, minlength=daily.RETURN_PROBS.size)
+    p = np.minimum(daily.RETURN_PROBS.ravel(), 1.0)
+    tested = (n > 0) & (p > 0) & (p < 1)
+    z = (hits[tested] - n[tested] * p[tested]) / np.sqrt(n[tested] * p[tested] * (1 - p[tested]))
+    assert tested.sum() > 50
+    assert np.abs(z).max() < 4.5
+    # Pooled over the cells, a small shift in every rate shows too
+    expected = n[tested] * p[tested]
+    pooled = (hits[tested].sum() - expected.sum()) / np.sqrt((expected * (1 - p[tested])).sum())
+    assert abs(pooled) < 4
+    assert (hits[(n > 0) & (p == 0)] == 0).all()
+
+
+def test_importing_main_leaves_the_optional_modules_unloaded():
+    code = "import sys, main; print('\\n'.join(sys.modules))"
+    run = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(daily.__file__)))
+    loaded = set(run.stdout.split())
+    assert 'main' in loaded
+    assert [name for name in LAZY_MODULES if name in loaded] == []
@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import main_kpis
+from tests.helpers import DUCKDB_KPI_QUERIES
+
+duckdb = pytest.importorskip('duckdb')
+
+
+def _normalized(frame):
+    """A result table with sorted rows, plain date columns and lower-case names, for comparison."""
+    frame = frame.rename(columns=str.lower).copy()
+    for col in ('install_dt', 'dt'):
+        if col in frame:
+            frame[col] = pd.to_datetime(frame[col]).astype('datetime64[ns]')
+    if 'country' in frame:
+        frame['country'] = frame['country'].astype(object).where(frame['country'].notna(), None)
+    return frame.sort_values(list(frame.columns[:2]), ignore_index=True, na_position='first')
+
+
+@pytest.mark.parametrize('name', list(DUCKDB_KPI_QUERIES))
+def test_engine_matches_main_kpis_sql(backfill_store, name):
+    results = main_kpis.compute_from_store(backfill_store)
+    con = duckdb.connect()
+    files = ', '.join(f"'{path}'" for path in backfill_store.files())
+    con.execute(f"CREATE VIEW events AS SELECT * FROM read_parquet([{files}], union_by_name=true)")
+    expected = con.execute(DUCKDB_KPI_QUERIES[name][1]).fetchdf()
+    con.close()
+    actual = results['revenue'][expected.columns] if name == 'daily_revenue' else results[name]
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(_normalized(actual), _normalized(expected), check_dtype=False)
@@ -0,0 +1,86 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import raid_league
+import session_engine
+
+PLAYERS = 10_000
+
+
+def _league(seed=0):
+    rng = np.random.default_rng(seed)
+    ids = session_engine.random_uuid4s(rng, PLAYERS)
+    league = raid_league.RaidLeague(date(2025, 1, 6), ids, rng.integers(1, 20, PLAYERS), rng.poisson(30, PLAYERS))
+    return league, rng
+
+
+def _resorted_top_k(league):
+    """Every division sorted from scratch: most coins first, ties to the lower position."""
+    ref = pd.DataFrame({'division': league.division, 'coins': league.scores, 'position': np.arange(len(league))})
+    ref = ref[ref['coins'] > 0].sort_values(['division', 'coins', 'position'], ascending=[True, False, True])
+    return ref[ref.groupby('division').cumcount() < league.top_k]
+
+
+def test_streamed_top_k_matches_a_full_resort():
+    league, rng = _league()
+    for batch in range(30):
+        # Small batches leave some divisions without raids; equal levels give tied coins
+        raiders = rng.integers(-1, PLAYERS, 20 + batch * 200)
+        coins = raid_league.RAID_COINS_PER_LEVEL * np.where(raiders >= 0, league.levels[raiders], 0)
+        league.record_raids(raiders, coins)
+        ref = _resorted_top_k(league)
+        standings = league.standings()
+        np.testing.assert_array_equal(league.players.get_indexer(standings['user_pseudo_id']), ref['position'])
+        np.testing.assert_array_equal(standings['raid_coins'], ref['coins'])
+    assert (league.top >= 0).all()
+
+
+def test_divisions_are_matched_on_level():
+    league, _ = _league(1)
+    sizes = np.bincount(league.division)
+    assert league.n_divisions == -(-PLAYERS // raid_league.DIVISION_SIZE)
+    assert sizes.max() - sizes.min() <= 1
+    spread = pd.Series(league.levels).groupby(league.division).agg(lambda levels: levels.max() - levels.min())
+    assert spread.max() <= 1
+
+
+def _raid_day(league, rng, day, n):
+    """`n` raid events on `day` by random players of `league`, plus some from outside it."""
+    users = league.players[rng.integers(0, len(league), n)].to_numpy().copy()
+    users[:5] = 'not-in-the-league'
+    return pd.DataFrame({
+        'event_name': 'raid_performed',
+        'event_timestamp': pd.Timestamp(day) + pd.to_timedelta(rng.integers(0, 86_400, n), unit='s'),
+        'user_pseudo_id': users,
+        'current_village_level': rng.integers(1, 20, n),
+    })
+
+
+def _assert_same_league(league, ref):
+    pd.testing.assert_frame_equal(league.standings(), ref.standings())
+    pd.testing.assert_series_equal(league.raid_history(), ref.raid_history())
+    np.testing.assert_array_equal(league.scores, ref.scores)
+
+
+def test_a_rerun_day_replaces_what_it_scored():
+    league, rng = _league(2)
+    monday, tuesday = _raid_day(league, rng, '2025-01-06', 3_000), _raid_day(league, rng, '2025-01-07', 3_000)
+    league.update(monday).update(tuesday)
+    # The re-run has fewer raids, so some of Monday's leaders lose coins and drop out
+    rerun = _raid_day(league, rng, '2025-01-06', 1_000)
+    league.update(rerun)
+
+    ref, _ = _league(2)
+    ref.update(rerun).update(tuesday)
+    _assert_same_league(league, ref)
+    ranked = _resorted_top_k(league)
+    np.testing.assert_array_equal(league.players.get_indexer(league.standings()['user_pseudo_id']), ranked['position'])
+
+    # Re-feeding the same events changes nothing; a re-run day without raids takes its raids back
+    league.update(tuesday)
+    _assert_same_league(league, ref)
+    league.update(tuesday.iloc[:0], day='2025-01-07')
+    ref, _ = _league(2)
+    _assert_same_league(league, ref.update(rerun))
@@ -0,0 +1,112 @@
+import shutil
+
+import pandas as pd
+
+import kpi_summary
+import result_cache
+import retention
+import storage
+
+
+def _assert_same_result(left, right):
+    if isinstance(left, dict):
+        assert left.keys() == right.keys()
+        for name in left:
+            _assert_same_result(left[name], right[name])
+        return
+    pd.testing.assert_frame_equal(left.reset_index(drop=True), right.reset_index(drop=True),
+                                  check_dtype=False, rtol=1e-9)
+
+
+def _lookups(dates):
+    """Every dashboard query over the whole store and over each week of it."""
+    ranges = [(None, None)] + [(dates[lo], dates[min(lo + 6, len(dates) - 1)]) for lo in range(0, len(dates), 7)]
+    return [(name, start, end) for name in result_cache.DASHBOARD_QUERIES for start, end in ranges]
+
+
+def _fresh(backend, name, start, end):
+    return result_cache.DASHBOARD_QUERIES[name][1](backend, start, end)
+
+
+def _covers(lookup, day):
+    """Whether the lookup's result depends on the partition of `day`."""
+    name, start, end = lookup
+    reads_history = result_cache.DASHBOARD_QUERIES[name][2]
+    return (start is None or reads_history or start <= day) and (end is None or day <= end)
+
+
+def _cut(frame, column, start, end):
+    days = frame[column] if isinstance(column, str) else column
+    return frame[days.between(start, end)].reset_index(drop=True)
+
+
+def test_ranged_results_match_the_full_tables_cut_to_the_range(backfill_store, tmp_path):
+    events = backfill_store.read()
+    dates = pd.to_datetime(sorted(backfill_store.partition_versions()))
+    summary, cohorts = kpi_summary.full_rebuild(events), retention.full_rebuild(events)
+    activity_date = cohorts['install_dt'] + pd.to_timedelta(cohorts['day_in_game'] - 1, unit='D')
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+    for start, end in [(dates[7], dates[13]), (dates[20], dates[-1]), (dates[1], dates[1])]:
+        ranged = cache.dashboard(backfill_store, 'daily_kpi_summary', start, end)
+        # Returning users installed before the range are neither installs nor cohort members in it
+        assert len(ranged) > 0
+        _assert_same_result(ranged, _cut(summary, 'event_date', start, end))
+        ranged = cache.dashboard(backfill_store, 'retention_cohort', start, end)
+        assert len(ranged) > 0
+        _assert_same_result(ranged, _cut(cohorts, activity_date, start, end))
+
+
+def test_cached_results_follow_partition_rewrites(backfill_store, tmp_path):
+    backend = storage.LocalParquetBackend(str(tmp_path / 'events'))
+    shutil.copytree(backfill_store.root, backend.root)
+    dates = sorted(backend.partition_versions())
+    lookups = _lookups(dates)
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+
+    cached = {lookup: cache.dashboard(backend, *lookup) for lookup in lookups}
+    assert cache.misses == len(lookups)
+    for lookup in lookups:
+        _assert_same_result(cache.dashboard(backend, *lookup), cached[lookup])
+    assert (cache.hits, cache.misses) == (len(lookups), len(lookups))
+
+    # Rewrite a day (the last of the second week: a range bound) without a third of its
+    # users: only the ranges covering it run again
+    rewritten = dates[13]
+    events = backend.read(rewritten, rewritten)
+    backend.replace_partition(rewritten, events[~events['user_pseudo_id'].isin(
+        events['user_pseudo_id'].unique()[::3])])
+    covering = [lookup for lookup in lookups if _covers(lookup, rewritten)]
+    assert cache.invalidate_dates([rewritten]) == len(covering)
+    for lookup in lookups:
+        _assert_same_result(cache.dashboard(backend, *lookup), _fresh(backend, *lookup))
+    assert cache.misses == len(lookups) + len(covering)
+
+    # A rewrite the handler didn't report is caught by the partition versions
+    other = dates[1]
+    events = backend.read(other, other)
+    backend.replace_partition(other, events.iloc[:len(events) // 2])
+    misses = cache.misses
+    for lookup in lookups:
+        _assert_same_result(cache.dashboard(backend, *lookup), _fresh(backend, *lookup))
+    assert cache.misses - misses == sum(_covers(lookup, other) for lookup in lookups)
+
+
+def test_eviction_keeps_within_budget(backfill_store, tmp_path):
+    lookups = _lookups(sorted(backfill_store.partition_versions()))
+    full = result_cache.ResultCache(str(tmp_path / 'full'))
+    for lookup in lookups:
+        full.dashboard(backfill_store, *lookup)
+    budget = full.size_bytes // 3
+
+    small = result_cache.ResultCache(str(tmp_path / 'small'), max_bytes=budget, max_entries=len(lookups))
+    for lookup in lookups:
+        small.dashboard(backfill_store, *lookup)
+    assert 0 < len(small) < len(lookups)
+    assert small.size_bytes <= budget
+    small.dashboard(backfill_store, *lookups[-1])
+    assert small.hits == 1
+
+    few = result_cache.ResultCache(str(tmp_path / 'few'), max_entries=3)
+    for lookup in lookups:
+        few.dashboard(backfill_store, *lookup)
+    assert len(few) == 3
@@ -0,0 +1,40 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import session_engine
+from event_buffer import EventBuffer
+from tests.helpers import PERSONAS, make_users, session_plan
+from tests.legacy import LEGACY_COLUMNS, legacy_sessions
+
+SESSIONS = 2000
+
+
+def _per_user(events):
+    """Events of each name, and revenue, per user: one session each."""
+    users = events['user_pseudo_id'].astype(object)
+    counts = pd.crosstab(users, events['event_name'].astype(object))
+    counts['revenue'] = events['price_usd'].astype('float64').fillna(0.0).groupby(users).sum()
+    return counts
+
+
+@pytest.mark.parametrize('persona', PERSONAS)
+def test_engine_plays_the_same_sessions_as_the_per_spin_loop(persona):
+    pool = [u['user_pseudo_id'] for u in make_users(1000, seed=1)]
+    random.seed(0)
+    users, starts = session_plan(make_users(SESSIONS, persona, seed=0))
+    legacy = _per_user(legacy_sessions(users, starts, pool))
+    users, starts = session_plan(make_users(SESSIONS, persona, seed=0))
+    engine = _per_user(session_engine.simulate_sessions(users, starts, pool, rng=np.random.default_rng(0),
+                                                        out=EventBuffer(LEGACY_COLUMNS)).to_frame())
+    legacy, engine = legacy.align(engine, join='outer', axis=1, fill_value=0)
+    assert len(legacy) == len(engine) == SESSIONS
+
+    # Per-session means, in standard errors of their difference; events every session has are exact
+    se = np.sqrt(legacy.var() / SESSIONS + engine.var() / SESSIONS)
+    difference = engine.mean() - legacy.mean()
+    assert (difference[se == 0] == 0).all()
+    z = difference[se > 0] / se[se > 0]
+    assert (z.abs() < 4).all(), z.round(2).to_dict()
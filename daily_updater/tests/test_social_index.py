@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import social_index
+from social_index import SocialTargetIndex
+
+TODAY = date(2025, 1, 31)
+DRAWS = 200_000
+
+
+def _pool(n_users, days=30, seed=0):
+    rng = np.random.default_rng(seed)
+    users = pd.DataFrame({'user_pseudo_id': [f"user-{i}" for i in range(n_users)],
+                          'level': rng.integers(1, 15, n_users), 'age': rng.integers(0, days, n_users)})
+    index = SocialTargetIndex(TODAY)
+    for user_id, level, age in zip(users['user_pseudo_id'], users['level'].tolist(), users['age'].tolist()):
+        index.add(user_id, level, TODAY - timedelta(days=age))
+    return users.set_index('user_pseudo_id'), index
+
+
+def _assert_drawn_as_weighted(drawn, weights):
+    """Each user's share of the draws against weights / weights.sum(), pooled per weight decile."""
+    expected = weights / weights.sum() * len(drawn)
+    counts = pd.Series(drawn).value_counts().reindex(weights.index, fill_value=0)
+    deciles = pd.qcut(weights.rank(method='first'), 10, labels=False)
+    observed, expected = counts.groupby(deciles).sum(), expected.groupby(deciles).sum()
+    z = (observed - expected) / np.sqrt(expected)
+    assert (z.abs() < 4).all(), z.round(2).to_dict()
+
+
+def test_draws_favour_the_attackers_band_and_recent_players():
+    users, index = _pool(2_000)
+    rng = np.random.default_rng(1)
+    for attacker in (1, 7, 12):
+        drawn = index.draw(rng, DRAWS, levels=np.full(DRAWS, attacker))
+        bands = social_index.level_bands(users['level'].to_numpy())
+        distance = np.abs(bands - social_index.level_bands(np.array([attacker]))[0])
+        weights = pd.Series(social_index.BAND_AFFINITY ** distance
+                            * 0.5 ** (users['age'].to_numpy() / social_index.RECENCY_HALF_LIFE_DAYS),
+                            index=users.index)
+        _assert_drawn_as_weighted(drawn, weights)
+
+
+def test_removed_and_moved_users():
+    users, index = _pool(2_000)
+    churned = users.index[:200]
+    for user_id in churned:
+        index.remove(user_id)
+    index.remove('never-added')
+    # Players of the day move to today's bucket
+    played = users.index[200:800]
+    for user_id in played:
+        index.add(user_id, users.at[user_id, 'level'], TODAY)
+    users.loc[played, 'age'] = 0
+    users = users.drop(churned)
+    assert len(index) == len(users)
+
+    drawn = index.draw(np.random.default_rng(2), DRAWS)
+    assert not set(drawn) & set(churned)
+    _assert_drawn_as_weighted(drawn, 0.5 ** (users['age'] / social_index.RECENCY_HALF_LIFE_DAYS))
+
+    # Inviters for today's installs: nobody who played today
+    inviters = index.draw(np.random.default_rng(3), 10_000, active_before=TODAY)
+    assert (users.loc[inviters, 'age'] > 0).all()
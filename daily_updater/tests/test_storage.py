@@ -0,0 +1,60 @@
+import os
+
+import pandas as pd
+import pytest
+
+import main_kpis
+import storage
+
+
+def _events(*timestamps, user='u1'):
+    return pd.DataFrame({'event_timestamp': pd.to_datetime(list(timestamps)),
+                         'user_pseudo_id': user, 'event_name': 'spin'})
+
+
+def test_replace_partition_swaps_the_whole_day(tmp_path):
+    backend = storage.LocalParquetBackend(str(tmp_path))
+    backend.write('2024-01-02', _events('2024-01-02 10:00', user='old'), part='part-0')
+    backend.append_partition('2024-01-02', _events('2024-01-02 11:00', user='old'), part='part-1')
+
+    backend.replace_partition('2024-01-02', _events('2024-01-02 12:00', user='new'))
+
+    assert backend.read()['user_pseudo_id'].tolist() == ['new']
+    # Nothing is left behind from staging
+    assert os.listdir(tmp_path) == ['event_date=2024-01-02']
+
+
+def test_replace_all_drops_days_not_in_the_new_events(tmp_path):
+    backend = storage.LocalParquetBackend(str(tmp_path))
+    backend.replace_all(_events('2024-01-01 09:00', '2024-01-02 09:00', user='old'))
+
+    backend.replace_all(_events('2024-01-02 10:00', '2024-01-03 10:00', user='new'))
+
+    events = backend.read()
+    assert events['user_pseudo_id'].tolist() == ['new', 'new']
+    assert sorted(os.listdir(tmp_path)) == ['event_date=2024-01-02', 'event_date=2024-01-03']
+
+
+@pytest.mark.parametrize('kind', ['parquet', 'duckdb', 'memory'])
+def test_every_backend_reads_only_the_columns_asked_for(backfill_store, tmp_path, kind):
+    if kind == 'duckdb':
+        pytest.importorskip('duckdb')
+    days = pd.to_datetime(sorted(backfill_store.partition_versions())[:3])
+    backend = storage.open_backend(kind, str(tmp_path / f"events.{kind}"))
+    for day in days:
+        backend.replace_partition(day, backfill_store.read(day, day))
+
+    columns, categorical = ['event_timestamp', 'user_pseudo_id', 'country'], ['user_pseudo_id', 'country']
+    events = backend.read(days[1], days[2], columns=columns, categorical=categorical)
+    expected = backfill_store.read(days[1], days[2], columns=columns)
+    assert list(events.columns) == columns
+    assert all(isinstance(events[col].dtype, pd.CategoricalDtype) for col in categorical)
+    pd.testing.assert_frame_equal(
+        events.astype({col: object for col in categorical}).sort_values(columns, ignore_index=True),
+        expected.sort_values(columns, ignore_index=True), check_dtype=False)
+    assert list(backend.read(days[-1] + pd.Timedelta(days=1), columns=columns).columns) == columns
+
+    # The KPI engine's projected read works on every backend
+    for name, table in main_kpis.compute_from_store(backend).items():
+        pd.testing.assert_frame_equal(table, main_kpis.compute(backfill_store.read(days[0], days[2]))[name],
+                                      check_dtype=False)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+import ddsketch
+import hyperloglog
+import tutorial_funnel
+from tests.helpers import exact_funnel, tutorial_chunks
+
+ROWS = 300_000
+CHUNK_ROWS = 50_000
+FEED_ROWS = 7_001  # Less than a day of tutorials: users straddle chunks
+
+
+def test_streamed_funnel_matches_exact_counts():
+    steps = tutorial_funnel.TUTORIAL_STEPS
+    frame = pd.concat(list(tutorial_chunks(ROWS, CHUNK_ROWS)), ignore_index=True)
+    funnel = tutorial_funnel.TutorialFunnel()
+    for lo in range(0, ROWS, FEED_ROWS):
+        funnel.update(frame.iloc[lo:lo + FEED_ROWS])
+    funnel.finish()
+    assert funnel.users_in_progress == 0
+    summary = funnel.summary()
+
+    users, seconds = exact_funnel(frame, steps)
+    sigma = hyperloglog.standard_error(tutorial_funnel.FUNNEL_PRECISION)
+    assert (np.abs(summary['users'] / users - 1) <= 4 * sigma).all()
+    # Every user's step times are kept exactly until the sketches
+    assert summary['timed_users'][1:].tolist() == seconds.iloc[:, 1:].count().tolist()
+    for q in tutorial_funnel.QUANTILES:
+        for i, step in enumerate(steps[1:], 1):
+            error = summary[f"p{round(q * 100)}_seconds"][i] / seconds[step].quantile(q) - 1
+            assert abs(error) <= 2 * ddsketch.DEFAULT_ACCURACY, (step, q, error)
+
+    # Per app version, against the same counts over each version's users
+    by_version = funnel.by_version()
+    for version, rows in by_version.groupby('app_version'):
+        exact, _ = exact_funnel(frame[frame['app_version'] == version], steps)
+        assert (np.abs(rows['users'].to_numpy() / exact - 1) <= 4 * sigma).all(), version
@@ -0,0 +1,270 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import ddsketch
+import hyperloglog
+
+# --- Streaming Tutorial Funnel ---
+# The tutorial funnel of analysis/01_TUTORIAL_ANALYSIS.md from one pass over
+# the `tutorial` table (user_id, step_name, timestamp, app_version), read
+# from CSV or Parquet in chunks. queries/tutorial_query.sql runs a separate
+# COUNT(DISTINCT user_id) scan per breakdown. Here every chunk feeds:
+#
+# * one HyperLogLog sketch per (app_version, step): distinct users per step,
+#   overall and per version, in memory that doesn't grow with the input.
+#   A user who reaches a step also reached the ones before it, so the step
+#   sketches are nested and their ratios (the conversions) stay consistent.
+# * per-step time to complete: the time from a user's first event of one
+#   step to their first event of the next, added to a DDSketch per step.
+#   Only users seen in the last FUNNEL_TIMEOUT are kept (first time per
+#   step, keyed by a 64-bit hash of the user id). Older ones are closed and
+#   their step times sketched, so memory is bounded by the users in progress.
+#   The input must be in time order up to FUNNEL_TIMEOUT (exports by date are).
+#
+# Steps outside the funnel definition (and NULL steps) are skipped.
+
+TUTORIAL_STEPS = [
+    '0_Welcome_to_the_app', '1_Profile_creation', '2_Navigation_overview', '3_Feature_discovery',
+    '4_Setting_preferences', '5_Connecting_accounts', '6_Creating_first_item', '7_Sharing_content',
+    '8_Tutorial_completion',
+]
+COLUMNS = {'user': 'user_id', 'step': 'step_name', 'time': 'timestamp', 'version': 'app_version'}
+CHUNK_ROWS = 1_000_000
+# Consecutive steps are close together, so step ratios need sharper sketches than DAU (0.4% error, 64 KiB each)
+FUNNEL_PRECISION = 16
+# A user with no tutorial event for this long is done: their step times are final
+FUNNEL_TIMEOUT = pd.Timedelta(hours=24)
+QUANTILES = (0.5, 0.9, 0.99)
+
+_NO_TIME = np.iinfo(np.int64).max
+
+
+def _ns(times):
+    """Event times as int64 ns since the epoch (UTC). Strings may end in ' UTC', as BigQuery exports them."""
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times.astype(str).str.removesuffix(' UTC'), format='ISO8601', utc=True)
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert('UTC').dt.tz_localize(None)
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def _hashes(values):
+    """64-bit hashes of the user ids (categoricals are hashed once per category)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return hyperloglog.hash_ids(values.cat.categories.to_numpy(dtype=object))[values.cat.codes.to_numpy()]
+    return hyperloglog.hash_ids(values.to_numpy(dtype=object))
+
+
+def read_chunks(path, columns=COLUMNS, chunk_rows=CHUNK_ROWS):
+    """
+    DataFrame chunks of about `chunk_rows` rows from a CSV file, or a Parquet
+    file or folder, reading only the funnel's columns (strings as categoricals).
+    """
+    names = list(columns.values())
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        import pyarrow.dataset as ds
+
+        for batch in ds.dataset(path, format='parquet').to_batches(columns=names, batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        strings = {columns[key]: 'category' for key in ('user', 'step', 'version')}
+        yield from pd.read_csv(path, usecols=names, dtype=strings, chunksize=chunk_rows)
+
+
+class TutorialFunnel:
+    """
+    A funnel over an ordered list of `steps`, fed chunk by chunk with `update`.
+    `columns` maps 'user', 'step', 'time' and 'version' to column names.
+    """
+
+    def __init__(self, steps=TUTORIAL_STEPS, columns=COLUMNS, precision=FUNNEL_PRECISION,
+                 relative_accuracy=ddsketch.DEFAULT_ACCURACY, timeout=FUNNEL_TIMEOUT):
+        self.steps = list(steps)
+        self.columns = {**COLUMNS, **columns}
+        self.precision = precision
+        self.relative_accuracy = relative_accuracy
+        self.timeout = pd.Timedelta(timeout).value
+        self.rows = 0
+        self.versions = []          # version code -> label (NaN for a missing version)
+        self._version_codes = {}
+        n = len(self.steps)
+        self._registers = np.zeros((0, n, 2 ** precision), dtype=np.uint8)
+        self._times = []            # version code -> one DDSketch per step (step 0 has no time)
+        # Users in progress: hash, first time per step, last time seen, version of their first event
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._first = np.zeros((0, n), dtype=np.int64)
+        self._last = np.zeros(0, dtype=np.int64)
+        self._version = np.zeros(0, dtype=np.int64)
+        self._watermark = None
+
+    def _version_code(self, labels):
+        codes = []
+        for label in labels:
+            key = None if pd.isna(label) else label
+            if key not in self._version_codes:
+                self._version_codes[key] = len(self.versions)
+                self.versions.append(label)
+                self._times.append([ddsketch.DDSketch(self.relative_accuracy) for _ in self.steps])
+            codes.append(self._version_codes[key])
+        grow = len(self.versions) - len(self._registers)
+        if grow:
+            self._registers = np.concatenate(
+                [self._registers, np.zeros((grow,) + self._registers.shape[1:], dtype=np.uint8)])
+        return np.array(codes, dtype=np.int64)
+
+    # --- Streaming ---
+    def update(self, chunk):
+        """Adds a chunk of tutorial events (any order within FUNNEL_TIMEOUT)."""
+        cols = self.columns
+        self.rows += len(chunk)
+        step = pd.Categorical(chunk[cols['step']], categories=self.steps).codes.astype(np.int64)
+        keep = step >= 0
+        if not keep.any():
+            return self
+        chunk, step = chunk[keep], step[keep]
+        keys = _hashes(chunk[cols['user']])
+        times = _ns(chunk[cols['time']])
+        version_codes, labels = pd.factorize(chunk[cols['version']], use_na_sentinel=False)
+        version = self._version_code(labels)[version_codes]
+
+        # Distinct users per (version, step)
+        m = 2 ** self.precision
+        index, rank = hyperloglog.registers_for(keys, self.precision)
+        np.maximum.at(self._registers.reshape(-1), (version * len(self.steps) + step) * m + index, rank)
+
+        self._track(keys, step, times, version)
+        watermark = int(times.max())
+        self._watermark = watermark if self._watermark is None else max(self._watermark, watermark)
+        self._close(self._last < self._watermark - self.timeout)
+        return self
+
+    def _track(self, keys, step, times, version):
+        """Folds a chunk's first time per (user, step) into the users in progress."""
+        n = len(self.steps)
+        user, new_keys = pd.factorize(keys)
+        chunk_first = np.full(len(new_keys) * n, _NO_TIME, dtype=np.int64)
+        np.minimum.at(chunk_first, user * n + step, times)
+        chunk_first = chunk_first.reshape(-1, n)
+        chunk_last = np.full(len(new_keys), np.iinfo(np.int64).min, dtype=np.int64)
+        np.maximum.at(chunk_last, user, times)
+        # A new user's version is the one on their earliest event
+        chunk_version = np.empty(len(new_keys), dtype=np.int64)
+        earliest = times == chunk_first.min(axis=1)[user]
+        chunk_version[user[earliest]] = version[earliest]
+
+        merged = np.concatenate([self._keys, new_keys])
+        merged.sort()
+        merged = merged[np.r_[True, merged[1:] != merged[:-1]]] if len(merged) else merged
+        old, pos = np.searchsorted(merged, self._keys), np.searchsorted(merged, new_keys)
+        first = np.full((len(merged), n), _NO_TIME, dtype=np.int64)
+        first[old] = self._first
+        first[pos] = np.minimum(first[pos], chunk_first)
+        last = np.full(len(merged), np.iinfo(np.int64).min, dtype=np.int64)
+        last[old] = self._last
+        last[pos] = np.maximum(last[pos], chunk_last)
+        user_version = np.full(len(merged), -1, dtype=np.int64)
+        user_version[old] = self._version
+        fresh = user_version[pos] < 0
+        user_version[pos[fresh]] = chunk_version[fresh]
+        self._keys, self._first, self._last, self._version = merged, first, last, user_version
+
+    def _close(self, done):
+        """Sketches the step times of the users in `done` and forgets them."""
+        if not done.any():
+            return
+        first = self._first[done]
+        version = self._version[done]
+        reached = first != _NO_TIME
+        seconds = (first[:, 1:] - first[:, :-1]) / 1e9
+        valid = reached[:, 1:] & reached[:, :-1] & (seconds >= 0)
+        for code in np.unique(version):
+            mine = version == code
+            for step in range(1, len(self.steps)):
+                rows = mine & valid[:, step - 1]
+                if rows.any():
+                    self._times[code][step].add(seconds[rows, step - 1])
+        keep = ~done
+        self._keys, self._first = self._keys[keep], self._first[keep]
+        self._last, self._version = self._last[keep], self._version[keep]
+
+    def finish(self):
+        """Closes every user still in progress (call once the input is exhausted)."""
+        self._close(np.ones(len(self._keys), dtype=bool))
+        return self
+
+    @property
+    def users_in_progress(self):
+        return len(self._keys)
+
+    # --- Results ---
+    def _table(self, registers, sketches):
+        users = np.round(hyperloglog.estimate(registers)).astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            conversion = np.r_[np.nan, users[1:] / users[:-1]]
+            from_start = users / users[0] if users[0] else np.full(len(users), np.nan)
+        table = pd.DataFrame({
+            'step_name': self.steps,
+            'users': users,
+            'conversion': conversion,
+            'drop_off': 1 - conversion,
+            'from_start': from_start,
+            'timed_users': [len(s) for s in sketches],
+        })
+        for q in QUANTILES:
+            table[f"p{round(q * 100)}_seconds"] = [s.quantile(q) for s in sketches]
+        return table
+
+    def _merged_sketches(self, codes):
+        merged = [ddsketch.DDSketch(self.relative_accuracy) for _ in self.steps]
+        for code in codes:
+            for step, sketch in enumerate(self._times[code]):
+                merged[step].merge(sketch)
+        return merged
+
+    def summary(self):
+        """
+        One row per step: estimated distinct users, conversion from the
+        previous step, drop-off, share of the first step's users, and
+        percentiles of the time to complete the step (from the previous one).
+        """
+        return self._table(self._registers.max(axis=0), self._merged_sketches(range(len(self.versions))))
+
+    def by_version(self):
+        """`summary` per app_version (step times by the version of each user's first event)."""
+        tables = []
+        for code in sorted(range(len(self.versions)), key=lambda c: str(self.versions[c])):
+            table = self._table(self._registers[code], self._merged_sketches([code]))
+            table.insert(0, 'app_version', self.versions[code])
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+    def completion_rate(self):
+        """Share of the users who started the tutorial that completed its last step."""
+        users = hyperloglog.estimate(self._registers.max(axis=0))
+        return users[-1] / users[0] if users[0] else np.nan
+
+
+def run(path, steps=TUTORIAL_STEPS, columns=COLUMNS, chunk_rows=CHUNK_ROWS, **kwargs):
+    """The funnel of the tutorial events in the CSV / Parquet at `path`."""
+    funnel = TutorialFunnel(steps, columns, **kwargs)
+    for chunk in read_chunks(path, funnel.columns, chunk_rows):
+        funnel.update(chunk)
+    return funnel.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tutorial funnel of a CSV / Parquet export of the tutorial table")
+    parser.add_argument('path')
+    parser.add_argument('--steps', nargs='+', default=TUTORIAL_STEPS, help="Funnel steps, in order")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--by-version', action='store_true', help="Also break the funnel down by app_version")
+    args = parser.parse_args()
+    funnel = run(args.path, args.steps, chunk_rows=args.chunk_rows)
+    pd.set_option('display.width', 200)
+    print(f"{funnel.rows:,} rows; completion rate {funnel.completion_rate():.2%}")
+    print(funnel.summary().round(4).to_string(index=False))
+    if args.by_version:
+        print(funnel.by_version().round(4).to_string(index=False))
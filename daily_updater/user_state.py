@@ -0,0 +1,205 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+# --- User State Store ---
+# A compact, one-row-per-user snapshot kept up to date every time a day of
+# events is written. The daily run reads O(users) rows from it instead of
+# aggregating 30 days of raw events in `fetch_returning_users`.
+
+STATE_COLUMNS = [
+    'user_pseudo_id', 'install_date', 'install_country', 'install_source', 'persona',
+    'current_village_level', 'last_active_date', 'platform', 'country'
+]
+DATE_COLUMNS = ['install_date', 'last_active_date']
+
+# The event columns the state is summarized from
+SUMMARY_SOURCE_COLUMNS = [
+    'event_timestamp', 'user_pseudo_id', 'country', 'attribution_source', 'persona',
+    'current_village_level', 'platform'
+]
+
+# Same window the BigQuery query scans: users active in the last 30 days
+RETURNING_WINDOW_DAYS = 30
+# The columns of `fetch_returning_users`: one row per user who might return
+RETURNING_COLUMNS = [
+    'user_pseudo_id', 'install_date', 'persona', 'current_village_level', 'platform', 'country',
+    'last_active_date', 'user_age_days'
+]
+
+
+def empty_state():
+    state = pd.DataFrame({col: pd.Series(dtype=object) for col in STATE_COLUMNS})
+    for col in DATE_COLUMNS:
+        state[col] = pd.Series(dtype='datetime64[ns]')
+    state['current_village_level'] = pd.Series(dtype='Int64')
+    return state
+
+
+def summarize_events(events):
+    """
+    One row per user in `events` (a day's worth, or more): what that data says
+    about install date, country and source, and the latest persona, level,
+    platform and country. Mirrors the `installs_table` / `ARRAY_AGG` logic.
+    """
+    if events.empty:
+        return empty_state()
+    columns = [col for col in SUMMARY_SOURCE_COLUMNS if col in events.columns]
+    events = events[columns].sort_values('event_timestamp', kind='stable')
+    if isinstance(events['country'].dtype, pd.CategoricalDtype):
+        # Categoricals (from an EventBuffer) compare by code: order the codes like the labels for MIN
+        events['country'] = events['country'].cat.reorder_categories(
+            sorted(events['country'].cat.categories), ordered=True)
+    grouped = events.groupby('user_pseudo_id', sort=False)
+    first = grouped.first()  # first non-null value per column
+    last = grouped.last()    # latest non-null value per column
+    rows = pd.DataFrame({
+        'install_date': grouped['event_timestamp'].min().dt.normalize(),
+        'install_country': grouped['country'].min(),  # MIN(country), as in `installs_table`
+        'install_source': first['attribution_source'],
+        'persona': last['persona'] if 'persona' in last else None,
+        'current_village_level': last['current_village_level'].astype('Int64'),
+        'last_active_date': grouped['event_timestamp'].max().dt.normalize(),
+        'platform': last['platform'],
+        'country': last['country'],
+    })
+    rows = rows.rename_axis('user_pseudo_id').reset_index()[STATE_COLUMNS]
+    # The state holds plain strings, one row per user
+    return rows.astype({col: object for col, dtype in rows.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+
+def merge_state(state, rows):
+    """
+    Upserts summarized `rows` into `state`. Install fields are only set for
+    users the state has not seen yet. The latest values replace the rest.
+    Users are never removed: if a partition is rewritten with different users,
+    rebuild the state with `summarize_events` over the stored events.
+    """
+    if rows.empty:
+        return state
+    if state.empty:
+        return rows.reset_index(drop=True)
+    state = state.set_index('user_pseudo_id')
+    rows = rows.set_index('user_pseudo_id')
+    known = rows.index.isin(state.index)
+
+    updates = rows[known]
+    for col in ('current_village_level', 'platform', 'country'):
+        state.loc[updates.index, col] = updates[col]
+    persona = updates['persona'].dropna()
+    state.loc[persona.index, 'persona'] = persona
+    state.loc[updates.index, 'last_active_date'] = np.maximum(
+        state.loc[updates.index, 'last_active_date'], updates['last_active_date'])
+
+    return pd.concat([state, rows[~known]]).rename_axis('user_pseudo_id').reset_index()[STATE_COLUMNS]
+
+
+def returning_users(state, yesterday_date):
+    """
+    The users who might return on `yesterday_date`, as the frame that
+    `fetch_returning_users` returns (plus their install country and source).
+    """
+    day = pd.Timestamp(yesterday_date)
+    candidates = state[(state['install_date'] < day)
+                       & ((day - state['last_active_date']).dt.days <= RETURNING_WINDOW_DAYS)]
+    return candidates.assign(user_age_days=(day - candidates['install_date']).dt.days).reset_index(drop=True)
+
+
+def from_returning_users(rows):
+    """
+    A state frame from `fetch_returning_users` rows, for runs that start from
+    the event store instead of a snapshot. The rows carry no install country
+    or source, so those stay NULL.
+    """
+    if not len(rows):
+        return empty_state()
+    state = pd.DataFrame(rows).reindex(columns=STATE_COLUMNS)
+    for col in DATE_COLUMNS:
+        state[col] = pd.to_datetime(state[col]).astype('datetime64[ns]')
+    state['current_village_level'] = state['current_village_level'].astype('Int64')
+    return state
+
+
+class ParquetUserStateStore:
+    """The whole state in one Parquet file, rewritten atomically on every update."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return empty_state()
+        return pd.read_parquet(self.path)
+
+    def replace(self, state):
+        storage.atomic_write(self.path, lambda tmp_path: state.to_parquet(tmp_path, index=False))
+
+    def update(self, rows):
+        self.replace(merge_state(self.load(), rows))
+
+
+class SQLiteUserStateStore:
+    """The state as an SQLite table. Updates only touch the rows of the users in them."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_state (
+                  user_pseudo_id TEXT PRIMARY KEY,
+                  install_date TEXT,
+                  install_country TEXT,
+                  install_source TEXT,
+                  persona TEXT,
+                  current_village_level INTEGER,
+                  last_active_date TEXT,
+                  platform TEXT,
+                  country TEXT
+                )""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def load(self):
+        with self._connect() as conn:
+            state = pd.read_sql_query(f"SELECT {', '.join(STATE_COLUMNS)} FROM user_state", conn)
+        for col in DATE_COLUMNS:
+            state[col] = pd.to_datetime(state[col])
+        state['current_village_level'] = state['current_village_level'].astype('Int64')
+        return state
+
+    @staticmethod
+    def _records(rows):
+        rows = rows[STATE_COLUMNS].copy()
+        for col in DATE_COLUMNS:
+            rows[col] = rows[col].dt.strftime('%Y-%m-%d')
+        return rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)
+
+    def replace(self, state):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM user_state")
+            conn.executemany(f"INSERT INTO user_state VALUES ({', '.join('?' * len(STATE_COLUMNS))})",
+                             self._records(state))
+
+    def update(self, rows):
+        with self._connect() as conn:
+            conn.executemany(f"""
+                INSERT INTO user_state VALUES ({', '.join('?' * len(STATE_COLUMNS))})
+                ON CONFLICT(user_pseudo_id) DO UPDATE SET
+                  persona = COALESCE(excluded.persona, persona),
+                  current_village_level = excluded.current_village_level,
+                  last_active_date = MAX(last_active_date, excluded.last_active_date),
+                  platform = excluded.platform,
+                  country = excluded.country
+                """, self._records(rows))
+
+
+def open_store(path):
+    """SQLite for `.db` / `.sqlite` paths, a Parquet file otherwise."""
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteUserStateStore(path)
+    return ParquetUserStateStore(path)